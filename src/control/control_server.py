@@ -75,7 +75,7 @@ class ControllerServer(Thread):
 
             # Trying to catch hanging
             try:
-                self.receiver(json.loads(message))
+                self.receiver(json.unpack(message))
             except:
                 info = sys.exc_info()
                 self.logger.exception("Unexpected error in control_server: %s"%info[0])
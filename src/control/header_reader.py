@@ -0,0 +1,194 @@
+"""
+Asynchronous, cached reading of image headers for the control process
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2009-2018 Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+__created__ = "2018-06-14"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import collections
+import copy
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+
+# Constants
+NPROC = 4           # Threads reading headers
+CACHE_SIZE = 256    # Headers kept in the LRU cache
+ATTEMPT_LIMIT = 5   # Tries for an image to appear
+ATTEMPT_PAUSE = 0.2 # Seconds between tries
+
+class HeaderReader(object):
+    """
+    Pool of threads that read image headers, with an LRU cache of the results
+
+    Headers are cached on (fullname, mtime, size), so an image that is still
+    being written is read again, and a second read of a finished image is a
+    dict copy. The beam and site information folded into a cached header is
+    that of the first read.
+
+    Reads submitted with the same order_key are read in parallel, but have
+    their callbacks called one at a time in the order they were submitted.
+    """
+
+    def __init__(self, nproc=NPROC, cache_size=CACHE_SIZE, logger=None):
+        """
+        Keyword arguments
+        nproc -- number of reader threads (default NPROC)
+        cache_size -- number of headers cached (default CACHE_SIZE)
+        logger -- logger instance (default RAPDLogger)
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+        self.cache_size = cache_size
+
+        self.cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+
+        # order_key -> deque of reads in the order submitted, and the lock
+        # held while calling their callbacks
+        self.ordered = {}
+        self.order_locks = {}
+        self.order_lock = threading.Lock()
+
+        self.pool = ThreadPool(processes=nproc)
+
+    def stop(self):
+        """Stop taking requests and let the running reads finish"""
+
+        self.pool.close()
+
+    def get_cached(self, key):
+        """Return a copy of the cached header for key, or None"""
+
+        with self.cache_lock:
+            header = self.cache.pop(key, None)
+            if header is None:
+                return None
+            # Most recently used goes to the end
+            self.cache[key] = header
+            return copy.deepcopy(header)
+
+    def put_cached(self, key, header):
+        """Store a copy of header under key, evicting the least recently used"""
+
+        with self.cache_lock:
+            self.cache.pop(key, None)
+            self.cache[key] = copy.deepcopy(header)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def read(self, fullname, reader, **kwargs):
+        """
+        Read the header of fullname with reader, waiting for the image to
+        appear. Returns the header dict or None if the image cannot be read.
+
+        Keyword arguments
+        fullname -- full path name of the image
+        reader -- function called as reader(fullname, **kwargs), typically
+                  detector.read_header
+        """
+
+        attempt_counter = 0
+        while attempt_counter < ATTEMPT_LIMIT:
+            attempt_counter += 1
+            try:
+                stat = os.stat(fullname)
+            except OSError:
+                time.sleep(ATTEMPT_PAUSE)
+                continue
+
+            key = (fullname, stat.st_mtime, stat.st_size)
+            header = self.get_cached(key)
+            if header is not None:
+                return header
+
+            try:
+                header = reader(fullname, **kwargs)
+            except IOError:
+                self.logger.exception("Unable to access image")
+                time.sleep(ATTEMPT_PAUSE)
+                continue
+
+            self.put_cached(key, header)
+            return header
+
+        self.logger.error("Unable to access image %s after %d tries", fullname, attempt_counter)
+        return None
+
+    def submit(self, fullname, reader, callback, order_key=None, **kwargs):
+        """
+        Read the header of fullname in the pool, then call callback(header)
+        from a reading thread. header is None if the image could not be read.
+        Callbacks of reads with the same order_key are called in the order
+        the reads were submitted.
+        """
+
+        if order_key is None:
+            self.pool.apply_async(self._read_and_call, (fullname, reader, callback, kwargs))
+            return
+
+        entry = {"fullname":fullname, "callback":callback, "done":False, "header":None}
+        with self.order_lock:
+            self.ordered.setdefault(order_key, collections.deque()).append(entry)
+            self.order_locks.setdefault(order_key, threading.Lock())
+        self.pool.apply_async(self._read_in_order, (order_key, entry, reader, kwargs))
+
+    def _read_and_call(self, fullname, reader, callback, kwargs):
+        """Run in the pool - exceptions are logged, as the pool would swallow them"""
+
+        try:
+            callback(self.read(fullname, reader, **kwargs))
+        except:
+            self.logger.exception("Error handling header for %s", fullname)
+
+    def _read_in_order(self, order_key, entry, reader, kwargs):
+        """
+        Run in the pool - read the header of entry, then call the callbacks
+        of the reads of order_key that are done, up to the first still being
+        read. Whichever thread finishes a read calls the callbacks it unblocks.
+        """
+
+        try:
+            header = self.read(entry["fullname"], reader, **kwargs)
+        except:
+            self.logger.exception("Error reading header for %s", entry["fullname"])
+            header = None
+
+        with self.order_lock:
+            entry["header"] = header
+            entry["done"] = True
+
+        with self.order_locks[order_key]:
+            while True:
+                with self.order_lock:
+                    queue = self.ordered[order_key]
+                    if not queue or not queue[0]["done"]:
+                        break
+                    entry = queue.popleft()
+                try:
+                    entry["callback"](entry["header"])
+                except:
+                    self.logger.exception("Error handling header for %s", entry["fullname"])
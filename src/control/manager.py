@@ -52,6 +52,9 @@ from utils.text import json
 # Timer (s) for checking which launchers are alive.
 TIMER = 5
 
+# Most jobs taken off RAPD_JOBS in one round trip
+JOB_BATCH = 100
+
 class Launcher_Manager(Thread):
     """
     Listens to the 'RAPD_JOBS' list and sends jobs to proper
@@ -114,22 +117,21 @@ class Launcher_Manager(Thread):
                         #    self.ow_registrar.update()
 
                         # Check which launchers are running
-                        temp = [l for l in full_job_list if self.redis.get("OW:"+l)]
+                        running = self.redis.mget(["OW:"+l for l in full_job_list])
+                        temp = [l for l, status in zip(full_job_list, running) if status]
 
                         # Determine which launcher(s) went offline
                         offline = [line for line in self.job_list if temp.count(line) == False]
                         if len(offline) > 0:
                             # Pop waiting jobs off their job_lists and push back in RAPD_JOBS for reassignment.
                             for _l in offline:
-                                while self.redis.llen(_l) != 0:
-                                    self.redis.rpoplpush(_l, 'RAPD_JOBS')
+                                self.redis.rpoplpush_all(_l, 'RAPD_JOBS')
 
                         # Determine which launcher(s) came online (Also runs at startup!)
                         online = [line for line in temp if self.job_list.count(line) == False]
                         if len(online) > 0:
                             # Pop jobs off RAPD_JOBS_WAITING and push back onto RAPD_JOBS for reassignment.
-                            while self.redis.llen('RAPD_JOBS_WAITING') != 0:
-                                self.redis.rpoplpush('RAPD_JOBS_WAITING', 'RAPD_JOBS')
+                            self.redis.rpoplpush_all('RAPD_JOBS_WAITING', 'RAPD_JOBS')
 
                         # Update the self.job_list
                         self.job_list = temp
@@ -143,11 +145,13 @@ class Launcher_Manager(Thread):
                 # This will throw a redis.exceptions.ConnectionError if redis is unreachable
                 #command = self.redis.brpop(["RAPD_JOBS",], 5)
                 try:
-                    while self.redis.llen("RAPD_JOBS") != 0:
-                        command = self.redis.rpop("RAPD_JOBS")
-                        # Handle the message
-                        if command:
-                            self.push_command(json.loads(command))
+                    while True:
+                        commands = self.redis.rpop_batch("RAPD_JOBS", JOB_BATCH)
+                        if not commands:
+                            break
+                        # Handle the messages
+                        for command in commands:
+                            self.push_command(json.unpack(command))
                             # Only run 1 command
                             # self.running = False
                             # break
@@ -230,11 +234,11 @@ class Launcher_Manager(Thread):
             message["directories"]["launch_dir"] = launch_dir
 
             # Push the job on the correct launcher job list
-            self.redis.lpush(launcher, json.dumps(message))
+            self.redis.lpush(launcher, json.pack(message))
             if self.logger:
                 self.logger.debug("Command sent channel:%s  message: %s", launcher, message)
         else:
-            self.redis.lpush('RAPD_JOBS_WAITING', json.dumps(message))
+            self.redis.lpush('RAPD_JOBS_WAITING', json.pack(message))
             if self.logger:
                 self.logger.debug("Could not find a running launcher for this job. Putting job on RAPD_JOBS_WAITING list")
 
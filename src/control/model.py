@@ -37,11 +37,14 @@ from pprint import pprint
 # import redis
 # import socket
 import sys
-import time
+import threading
 import types
 
 # RAPD imports
 from control.control_server import LaunchAction, ControllerServer
+from control.header_reader import HeaderReader
+from control.result_writer import ResultWriter
+from control.run_index import RunIndex
 from utils.modules import load_module
 from utils.site import get_ip_address
 from utils.text import json
@@ -69,7 +72,17 @@ class Model(object):
     indexing_active = collections.deque()
 
     # Managing runs and images without going to the db
-    recent_runs = collections.OrderedDict()
+    recent_runs = None
+
+    # place_in_run values held back while a batch of images is handled
+    batch_place_in_run = None
+
+    # Reading image headers off the control thread
+    header_reader = None
+    image_lock = None
+
+    # Saving plugin results off the control thread
+    result_writer = None
 
     data_root_dir = None
     database = None
@@ -119,12 +132,18 @@ class Model(object):
         # Start connection to the core database
         self.connect_to_database()
 
+        # Start the threads saving plugin results
+        self.start_result_writer()
+
         # Start the server for receiving communications
         self.start_server()
 
         # Import the detector
         self.init_detectors()
 
+        # Start the pool for reading image headers
+        self.start_header_reader()
+
         # start the alt_image_path_server
         self.start_image_path_server()
 
@@ -152,6 +171,9 @@ class Model(object):
     def init_site(self):
         """Process the site definitions to set up instance variables"""
 
+        # Index of recent runs, aged out after the site's run window
+        self.recent_runs = RunIndex(window=self.site.RUN_WINDOW)
+
         # Single or multiple IDs
         # A string is input - one tag
         if isinstance(self.site.ID, str):
@@ -198,6 +220,10 @@ class Model(object):
                                               password=site.CONTROL_DATABASE_SETTINGS['DATABASE_PASSWORD'])
         #self.database = database.Database(string=site.CONTROL_DATABASE_SETTINGS['DATABASE_STRING'])
 
+        # Warn of missing indexes, which make runs and files slow to find
+        if hasattr(self.database, "check_indexes"):
+            self.database.check_indexes()
+
     def start_server(self):
         """Start up the listening process for core"""
 
@@ -240,6 +266,32 @@ class Model(object):
                     seek_module=detector,
                     directories=("sites.detectors", "detectors"))
 
+    def start_header_reader(self):
+        """Start the pool of threads reading image headers"""
+
+        self.logger.debug("Starting header reader")
+        self.image_lock = threading.RLock()
+        self.header_reader = HeaderReader(logger=self.logger)
+
+    def stop_header_reader(self):
+        """Stop the header reader"""
+
+        self.logger.debug("Stopping header reader")
+        self.header_reader.stop()
+
+    def start_result_writer(self):
+        """Start the pool of threads saving plugin results"""
+
+        self.logger.debug("Starting result writer")
+        self.result_writer = ResultWriter(save=self.database.save_plugin_results,
+                                          logger=self.logger)
+
+    def stop_result_writer(self):
+        """Save the waiting plugin results and stop the result writer"""
+
+        self.logger.debug("Stopping result writer")
+        self.result_writer.stop(timeout=30)
+
     def start_image_path_server(self):
         """Only start if self.site.ALT_IMAGE_SERVER_NAME is set"""
         # Check if module or class exists to get path of images in RAMDISK
@@ -387,7 +439,7 @@ class Model(object):
         print "send_command"
         pprint(command)
 
-        self.redis.lpush(channel, json.dumps(command))
+        self.redis.lpush(channel, json.pack(command))
         print "Command sent"
 
     def stop(self):
@@ -396,8 +448,10 @@ class Model(object):
 
         self.stop_redis()
         self.stop_server()
+        self.stop_result_writer()
         self.stop_launcher_manager()
         self.stop_image_monitor()
+        self.stop_header_reader()
         self.stop_run_monitor()
         self.stop_request_monitor()
 
@@ -406,8 +460,13 @@ class Model(object):
         Handle a new image being recorded by the site
 
         Keyword argument
-        image_data -- information gathered about the image, primarily from the header
+        image_data -- information gathered about the image, primarily from the header,
+                      or a list of these for a batch of images
         """
+        # A batch of images
+        if isinstance(image_data, list):
+            return self.add_images(image_data)
+
         # Placeholder for site info not in image header
         site_header = {}
 
@@ -445,7 +504,11 @@ class Model(object):
         if isinstance(place_in_run, int):
             # Save the current place_in_run in Redis so integration has reliable signal of whether an image exists.
             # This is a problem on some filesystems (ie. NFS) caching the file attributes.
-            self.redis.set('place_in_run:%s'%site_tag, str(place_in_run))
+            if self.batch_place_in_run is None:
+                self.set_place_in_run({'place_in_run:%s'%site_tag: place_in_run})
+            # In a batch, only the last place_in_run for each site is written
+            else:
+                self.batch_place_in_run['place_in_run:%s'%site_tag] = place_in_run
 
             # Save some typing
             current_run = self.recent_runs[str(run_id)]
@@ -453,8 +516,15 @@ class Model(object):
             # self.logger.debug(current_run)
 
             # If not integrating trigger integration
-
-            if not current_run.get("rapd_status", None) in ("INTEGRATING", "FINISHED"):
+            # PENDING means the first image header is being read - the status
+            # is also written by the header reader threads
+            with self.image_lock:
+                trigger = current_run.get("rapd_status", None) not in \
+                          ("PENDING", "INTEGRATING", "FINISHED")
+                if trigger and place_in_run == 1:
+                    current_run["rapd_status"] = "PENDING"
+
+            if trigger:
             #if True:
                 #print 'run_status: %s'%current_run.get("rapd_status", None)
                 # Right on time
@@ -467,55 +537,14 @@ class Model(object):
                             site_data = self.site_adapter.get_image_data()
                         site_header = site_data
 
-                    # Get all the image information
+                    # Get all the image information off the control thread
                     self.logger.debug("First image in run: %s"%fullname)
-                    attempt_counter = 0
-                    while attempt_counter < 5:
-                        try:
-                            attempt_counter += 1
-                            self.logger.debug("Attempt to read image: %s"%str(attempt_counter))
-                            if os.path.exists(fullname):
-                                header = detector.read_header(
-                                    fullname,
-                                    beam_settings=self.site.BEAM_INFO[site_tag.upper()],
-                                    extra_header=site_header)
-                                break
-                            else:
-                                time.sleep(0.2)
-                        except IOError:
-                            self.logger.exception("Unable to access image")
-                    else:
-                        self.logger.error("Unable to access image after %d tries", attempt_counter)
-                        return False
-
-                    # Put data about run in the header object
-                    header["collect_mode"] = "RUN"
-                    header["run_id"] = str(run_id)
-                    header["run"] = self.recent_runs[str(run_id)].copy()
-                    header["place_in_run"] = 1
-                    header["site_tag"] = site_tag
-                    """
-                    # Save path info for hidden fast storage, if present
-                    header["fast_fullname"] = fast_fullname
-                    if fast_fullname not in (None):
-                        header["fast_directory"] = os.path.dirname(header["fast_fullname"])
-                        header["run"]["fast_directory"] = os.path.dirname(header["fast_fullname"])
-                    """
-                    # Add to the database
-                    image_id = self.database.add_image(data=header, return_type="id")
-
-                    # Add extra stuff to the header
-                    header["_id"] = image_id
-                    header["xdsinp"] = detector.XDSINP
-
-                    # Add the image template to the run information
-                    header["run"]["image_template"] = detector.create_image_template(
-                        image_prefix=header["image_prefix"],
-                        run_number=header["run_number"]
-                        )
-
-                    # Send to be processed
-                    self.new_data_image(image1=header)
+                    self.header_reader.submit(
+                        fullname,
+                        detector.read_header,
+                        lambda header: self.finish_run_image(header, run_id, site_tag),
+                        beam_settings=self.site.BEAM_INFO[site_tag.upper()],
+                        extra_header=site_header)
 
                 # Handle getting to the party late
                 else:
@@ -543,26 +572,89 @@ class Model(object):
                     site_data = self.site_adapter.get_image_data()
                 site_header = site_data
 
-            # Get all the image information
-            attempt_counter = 0
-            while attempt_counter < 5:
-                try:
-                    attempt_counter += 1
-                    if os.path.exists(fullname):
-                        header = detector.read_header(
-                            fullname,
-                            beam_settings=self.site.BEAM_INFO[site_tag.upper()],
-                            extra_header=site_header)
-                        # Break out of loop
-                        break
-                    else:
-                        time.sleep(0.2)
-                except IOError:
-                    self.logger.exception("Unable to access image")
-            else:
-                self.logger.error("Unable to access image after %d tries", attempt_counter)
+            # Get all the image information off the control thread
+            self.header_reader.submit(
+                fullname,
+                detector.read_header,
+                lambda header: self.finish_snap_image(header, site_tag),
+                # Snaps are paired in the order they arrive
+                order_key=site_tag,
+                beam_settings=self.site.BEAM_INFO[site_tag.upper()],
+                extra_header=site_header)
+
+        # No information is findable
+        else:
+            self.logger.debug("Unable to figure out %s", fullname)
+
+    def finish_run_image(self, header, run_id, site_tag):
+        """
+        Record the first image of a run and send it to be processed once its
+        header has been read. Called from the header reader.
+
+        Keyword arguments
+        header -- header of the image, None if it could not be read
+        run_id -- id of the run the image belongs to
+        site_tag -- corresponds to ID in site file
+        """
+
+        with self.image_lock:
+
+            # Image could not be read - let a later image try again
+            if header is None:
+                if str(run_id) in self.recent_runs:
+                    self.recent_runs[str(run_id)]["rapd_status"] = None
                 return False
 
+            # Shortcut to detector
+            detector = self.detectors[site_tag]
+
+            # Put data about run in the header object
+            header["collect_mode"] = "RUN"
+            header["run_id"] = str(run_id)
+            header["run"] = self.recent_runs[str(run_id)].copy()
+            header["place_in_run"] = 1
+            header["site_tag"] = site_tag
+            """
+            # Save path info for hidden fast storage, if present
+            header["fast_fullname"] = fast_fullname
+            if fast_fullname not in (None):
+                header["fast_directory"] = os.path.dirname(header["fast_fullname"])
+                header["run"]["fast_directory"] = os.path.dirname(header["fast_fullname"])
+            """
+            # Add to the database
+            image_id = self.database.add_image(data=header, return_type="id")
+
+            # Add extra stuff to the header
+            header["_id"] = image_id
+            header["xdsinp"] = detector.XDSINP
+
+            # Add the image template to the run information
+            header["run"]["image_template"] = detector.create_image_template(
+                image_prefix=header["image_prefix"],
+                run_number=header["run_number"]
+                )
+
+            # Send to be processed
+            self.new_data_image(image1=header)
+
+            return True
+
+    def finish_snap_image(self, header, site_tag):
+        """
+        Record a snap and send it to be processed once its header has been
+        read. Called from the header reader.
+
+        Keyword arguments
+        header -- header of the image, None if it could not be read
+        site_tag -- corresponds to ID in site file
+        """
+
+        # Image could not be read
+        if header is None:
+            return False
+
+        with self.image_lock:
+
             # Add some data to the header - no run_id for snaps
             header["collect_mode"] = "SNAP"
             header["run_id"] = None
@@ -585,9 +677,44 @@ class Model(object):
             # KBO
             self.new_data_image(image1=header)
 
-        # No information is findable
+            return True
+
+    def add_images(self, images):
+        """
+        Handle a batch of new images, in the order they were collected
+
+        Keyword argument
+        images -- list of image_data dicts as taken by add_image
+        """
+
+        self.logger.debug("Received batch of %d images", len(images))
+
+        self.batch_place_in_run = {}
+        try:
+            for image_data in images:
+                self.add_image(image_data)
+        finally:
+            place_in_run, self.batch_place_in_run = self.batch_place_in_run, None
+            if place_in_run:
+                self.set_place_in_run(place_in_run)
+
+    def set_place_in_run(self, place_in_run):
+        """
+        Store place_in_run values in Redis and publish each on its key, so
+        integration waiting for an image hears about it at once
+
+        Keyword arguments
+        place_in_run -- dict of {'place_in_run:<site_tag>': image number}
+        """
+
+        if len(place_in_run) == 1:
+            key, value = place_in_run.items()[0]
+            self.redis.set(key, str(value))
         else:
-            self.logger.debug("Unable to figure out %s", fullname)
+            self.redis.mset(place_in_run)
+
+        for key, value in place_in_run.iteritems():
+            self.redis.publish(key, str(value))
 
     def query_for_run(self, run_data, boolean=True):
         """
@@ -599,12 +726,12 @@ class Model(object):
         """
 
         # Look in local store of information
-        for run_id, run in self.recent_runs.iteritems():
-            if run_data.get("run_id", 0) == run_id:
-                if boolean:
-                    return True
-                else:
-                    return run
+        run = self.recent_runs.find_run(run_data)
+        if run:
+            if boolean:
+                return True
+            else:
+                return run
 
         # Look in the database since the local attempt has failed
         return self.database.get_run(run_data=run_data,
@@ -638,28 +765,21 @@ class Model(object):
         boolean -- return just True if there is a or False
         """
 
-        # Query local runs in reverse chronological order
-        for run_id, run in self.recent_runs.iteritems():
-            # print 'run_id:%s'%run_id
-            # print 'run: %s'%run
-            #self.logger.debug('run_id:%s'%run_id)
-            #self.logger.debug('run:%s'%run)
-
-            #self.logger.debug("_id:%s run:%s" % (run_id, str(run)))
-
-            if run.get("site_tag", None) == site_tag and \
-               run.get("directory", None) == directory and \
-               run.get("image_prefix", None) == image_prefix and \
-               run.get("run_number", None) == run_number:
-
-                # Check image number
-                run_start = run.get("start_image_number")
-                run_end = run.get("number_images") + run_start - 1
-                if image_number >= run_start and image_number <= run_end:
-                    if return_type == "boolean":
-                        return True
-                    else:
-                        return [run]
+        # Query the local index of runs
+        run = self.recent_runs.find(site_tag=site_tag,
+                                    directory=directory,
+                                    image_prefix=image_prefix,
+                                    run_number=run_number,
+                                    image_number=image_number)
+        if run:
+            if return_type == "boolean":
+                return True
+            else:
+                return [run]
+
+        # This image has recently missed in the database - don't ask again
+        if self.recent_runs.is_miss(site_tag, directory, image_prefix, run_number, image_number):
+            return False
 
         # If no run has been identified in local store, then search database
         identified_runs = self.database.query_in_run(site_tag=site_tag,
@@ -670,6 +790,14 @@ class Model(object):
                                                      minutes=minutes,
                                                      return_type=return_type)
 
+        # Remember the miss
+        if not identified_runs:
+            self.recent_runs.add_miss(site_tag,
+                                      directory,
+                                      image_prefix,
+                                      run_number,
+                                      image_number)
+
         self.logger.debug('identified_runs:%s'%identified_runs)
         # If boolean, just return
         if return_type == "boolean":
@@ -680,9 +808,9 @@ class Model(object):
             elif return_type == "id":
                 return identified_runs
             elif return_type == "dict":
-                # Update the local store
-                for run in identified_runs:
-                    self.recent_runs[str(run["_id"])] = run
+                # Update the local store, oldest first so the newest wins lookups
+                for run in reversed(identified_runs):
+                    self.recent_runs.add(run)
                 # Return runs
                 return identified_runs
 
@@ -719,7 +847,7 @@ class Model(object):
             run_data["run_id"] = run_id
 
             # Save the run_data to local store
-            self.recent_runs[run_id] = run_data
+            self.recent_runs.add(run_data, run_id)
 
             self.logger.debug("run added to database")
             self.logger.debug(run_data)
@@ -1102,11 +1230,11 @@ class Model(object):
         message -- dict of pertinent information.
         """
 
-        # Save the results for the plugin
-        if "results" in message:
+        # Save the results for the plugin - a snapshot or a delta
+        if "results" in message or "delta" in message:
 
-            # Save the result
-            __ = self.database.save_plugin_result(message)
+            # Save the result - off this thread, so images are not held up
+            self.result_writer.submit(message)
 
         else:
 
@@ -1138,7 +1266,7 @@ class Model(object):
         Keyword arguments
         message -- information to be preocessed, a dict
 
-        Types currently handled: NEWIMAGE, NEWRUN
+        Types currently handled: NEWIMAGE, NEWIMAGES, NEWRUN
         """
 
         # self.logger.debug("Received: %s", message)
@@ -1154,6 +1282,10 @@ class Model(object):
         elif message.get("message_type", None) == "NEWIMAGE":
             self.add_image(message)
 
+        # NEWIMAGES - a batch of NEWIMAGE messages
+        elif message.get("message_type", None) == "NEWIMAGES":
+            self.add_image(message.get("images", []))
+
         # NEWRUN
         elif message.get("message_type", None) == "NEWRUN":
             self.add_run(message)
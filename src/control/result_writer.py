@@ -0,0 +1,225 @@
+"""
+Asynchronous, coalescing persistence of plugin results for the control process
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2009-2018 Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+__created__ = "2018-06-28"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import collections
+import itertools
+import logging
+import threading
+import time
+
+# RAPD imports
+from utils import result_delta
+
+# Constants
+NPROC = 2           # Threads writing results
+MAX_PENDING = 500   # Results held before submit() blocks
+BATCH_SIZE = 20     # Most results handed to one save call
+
+# Result entries holding files that are uploaded, then removed from disk
+FILE_TYPES = ("archive_files", "data_produced", "for_display")
+
+def has_files(result):
+    """Return True if saving result uploads files"""
+
+    results = result.get("results", {})
+    if not isinstance(results, dict):
+        return False
+    return any(results.get(file_type) for file_type in FILE_TYPES)
+
+class ResultWriter(object):
+    """
+    Pool of threads that save plugin results off the control thread
+
+    Results waiting to be saved are keyed on process.result_id. A newer
+    result for a key is folded into the waiting one in its place in line -
+    a snapshot replaces it, a delta is merged into it - so a burst of
+    progress updates becomes one write. A waiting result that uploads files
+    is never replaced, as saving it removes the files from disk; the newer
+    result waits behind it. Results for a key are saved in the order received,
+    and never two at once.
+
+    save is called with a list of up to batch_size results for different
+    keys, so the database writes they share can be made in bulk.
+    """
+
+    def __init__(self,
+                 save,
+                 nproc=NPROC,
+                 max_pending=MAX_PENDING,
+                 batch_size=BATCH_SIZE,
+                 logger=None):
+        """
+        Keyword arguments
+        save -- function called as save(results) with a list of results
+        nproc -- number of writer threads (default NPROC)
+        max_pending -- results held before submit() blocks (default MAX_PENDING)
+        batch_size -- most results in one save call (default BATCH_SIZE)
+        logger -- logger instance (default RAPDLogger)
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+
+        self.save = save
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+
+        # key -> list of waiting results, in the order keys were first queued
+        self.pending = collections.OrderedDict()
+        self.npending = 0
+        self.writing = set()
+        self.coalesced = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+
+        # Keys for results without a result_id, which are never coalesced
+        self.anonymous = itertools.count()
+
+        self.threads = []
+        for __ in range(nproc):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def get_key(self, result):
+        """Return the key result is coalesced on"""
+
+        result_id = result.get("process", {}).get("result_id")
+        if result_id:
+            return str(result_id)
+        return ("anonymous", next(self.anonymous))
+
+    def submit(self, result):
+        """
+        Queue a result to be saved. Blocks while max_pending results are
+        waiting, unless the result replaces one.
+        """
+
+        with self.condition:
+            key = self.get_key(result)
+            waiting = self.pending.get(key)
+
+            # Fold into the newest waiting result for the key
+            if waiting and not has_files(waiting[-1]):
+                waiting[-1] = result_delta.coalesce(waiting[-1], result)
+                self.coalesced += 1
+                return
+
+            while self.npending >= self.max_pending and not self.stopped:
+                self.condition.wait()
+
+            if waiting:
+                waiting.append(result)
+            else:
+                # The key may have been taken while waiting for room
+                self.pending.setdefault(key, []).append(result)
+            self.npending += 1
+            self.condition.notify_all()
+
+    def status(self):
+        """Return a dict of results waiting, being written and coalesced"""
+
+        with self.condition:
+            return {"pending":self.npending,
+                    "writing":len(self.writing),
+                    "coalesced":self.coalesced}
+
+    def flush(self, timeout=None):
+        """
+        Wait up to timeout seconds (default forever) for all results to be
+        saved. Returns True if they have been.
+        """
+
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while self.npending or self.writing:
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+            return True
+
+    def stop(self, timeout=None):
+        """
+        Save the waiting results, waiting up to timeout seconds, then stop
+        the threads. Results still waiting are dropped.
+        """
+
+        if not self.flush(timeout):
+            self.logger.error("Stopping with %d results unsaved", self.npending)
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def next_batch(self):
+        """Take up to batch_size results for keys not being written"""
+
+        batch = []
+        for key in list(self.pending.keys()):
+            if key in self.writing:
+                continue
+            waiting = self.pending[key]
+            batch.append((key, waiting.pop(0)))
+            if not waiting:
+                del self.pending[key]
+            self.writing.add(key)
+            if len(batch) >= self.batch_size:
+                break
+
+        self.npending -= len(batch)
+        return batch
+
+    def worker(self):
+        """Save results until stopped"""
+
+        while True:
+            with self.condition:
+                batch = []
+                while not self.stopped:
+                    batch = self.next_batch()
+                    if batch:
+                        break
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                # Room in the queue
+                self.condition.notify_all()
+
+            try:
+                self.save([result for __, result in batch])
+            except:
+                self.logger.exception("Error saving %d results", len(batch))
+            finally:
+                with self.condition:
+                    for key, __ in batch:
+                        self.writing.discard(key)
+                    self.condition.notify_all()
@@ -0,0 +1,254 @@
+"""
+In-memory index of recent runs for the control process
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2009-2018 Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+__created__ = "2018-06-12"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import collections
+import threading
+import time
+
+# Constants
+MAX_RUNS = 1000     # Upper bound on runs held when there is no time window
+MISS_TTL = 30       # Seconds a database miss is remembered
+
+class RunIndex(object):
+    """
+    Recent runs keyed by (site_tag, directory, image_prefix, run_number)
+
+    Runs are held in the order they were last used - added or found - and
+    are evicted once unused for window minutes, least recently used first
+    (or beyond MAX_RUNS if window is 0). Lookups by
+    image are a dict hit followed by a check of the image number interval of
+    the few runs sharing that key. Images that have recently missed in the
+    database are remembered for miss_ttl seconds, or until a run with their
+    key is added.
+
+    Supports the dict access Model uses on recent_runs - index[run_id],
+    index[run_id] = run, run_id in index, iteritems(). All access is under
+    a lock, as Model's header reader threads share the index.
+    """
+
+    def __init__(self, window=0, miss_ttl=MISS_TTL, max_runs=MAX_RUNS):
+        """
+        Keyword arguments
+        window -- minutes a run is kept in the index, 0 for no limit (default 0)
+        miss_ttl -- seconds a database miss is remembered (default MISS_TTL)
+        max_runs -- maximum number of runs held (default MAX_RUNS)
+        """
+
+        self.window = window
+        self.miss_ttl = miss_ttl
+        self.max_runs = max_runs
+
+        # run_id -> run, least recently used first
+        self.runs = collections.OrderedDict()
+
+        # run_id -> time last used
+        self.used = {}
+
+        # key -> list of (start, end, run_id), most recent first
+        self.intervals = {}
+
+        # key -> {image_number -> time of database miss}
+        self.misses = {}
+
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def get_key(run):
+        """Return the index key for a run dict"""
+
+        return (run.get("site_tag", None),
+                run.get("directory", None),
+                run.get("image_prefix", None),
+                run.get("run_number", None))
+
+    @staticmethod
+    def get_interval(run):
+        """Return the first and last image numbers of a run dict"""
+
+        start = run.get("start_image_number", 1)
+        end = start + run.get("number_images", 0) - 1
+        return start, end
+
+    def __len__(self):
+        with self.lock:
+            return len(self.runs)
+
+    def __contains__(self, run_id):
+        with self.lock:
+            return str(run_id) in self.runs
+
+    def __getitem__(self, run_id):
+        with self.lock:
+            return self.touch(str(run_id))
+
+    def __setitem__(self, run_id, run):
+        self.add(run, run_id)
+
+    def iteritems(self):
+        """Iterate over (run_id, run), least recently used first"""
+
+        with self.lock:
+            return iter(self.runs.items())
+
+    def touch(self, run_id):
+        """Mark a run as just used and return it"""
+
+        run = self.runs.pop(run_id)
+        self.runs[run_id] = run
+        self.used[run_id] = time.time()
+        return run
+
+    def add(self, run, run_id=None):
+        """
+        Add a run to the index, replacing any run with the same run_id
+
+        Keyword arguments
+        run -- dict describing the run
+        run_id -- id for the run (default run["_id"])
+        """
+
+        if run_id is None:
+            run_id = run["_id"]
+        run_id = str(run_id)
+
+        with self.lock:
+            # Replacing - drop the old interval
+            if run_id in self.runs:
+                self.remove(run_id)
+
+            key = self.get_key(run)
+            start, end = self.get_interval(run)
+
+            self.runs[run_id] = run
+            self.used[run_id] = time.time()
+            self.intervals.setdefault(key, []).insert(0, (start, end, run_id))
+
+            # A new run invalidates the misses remembered for its key
+            self.misses.pop(key, None)
+
+            self.evict()
+
+    def remove(self, run_id):
+        """Remove a run from the index"""
+
+        run_id = str(run_id)
+
+        with self.lock:
+            run = self.runs.pop(run_id)
+            del self.used[run_id]
+
+            key = self.get_key(run)
+            remaining = [interval for interval in self.intervals.get(key, []) if interval[2] != run_id]
+            if remaining:
+                self.intervals[key] = remaining
+            else:
+                self.intervals.pop(key, None)
+
+    def evict(self, now=None):
+        """Drop runs unused for longer than the window or beyond max_runs"""
+
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            while self.runs:
+                oldest_id = next(iter(self.runs))
+                if len(self.runs) > self.max_runs:
+                    self.remove(oldest_id)
+                elif self.window and (now - self.used[oldest_id]) > (self.window * 60):
+                    self.remove(oldest_id)
+                else:
+                    break
+
+            # Expired misses
+            for key, images in self.misses.items():
+                for image_number, miss_time in images.items():
+                    if (now - miss_time) > self.miss_ttl:
+                        del images[image_number]
+                if not images:
+                    del self.misses[key]
+
+    def find(self, site_tag, directory, image_prefix, run_number, image_number):
+        """
+        Return the most recent run containing the image, or None
+
+        Keyword arguments
+        site_tag -- string describing site
+        directory -- where the image is located
+        image_prefix -- the image prefix
+        run_number -- number for the run
+        image_number -- number for the image
+        """
+
+        with self.lock:
+            self.evict()
+
+            for start, end, run_id in self.intervals.get((site_tag, directory, image_prefix, run_number), ()):
+                if start <= image_number <= end:
+                    return self.touch(run_id)
+            return None
+
+    def find_run(self, run_data):
+        """
+        Return the most recent run matching run_data on key, starting image
+        number and number of images, or None
+        """
+
+        with self.lock:
+            self.evict()
+
+            # Direct hit on id
+            run_id = run_data.get("run_id", None)
+            if run_id and str(run_id) in self.runs:
+                return self.touch(str(run_id))
+
+            target = self.get_interval(run_data)
+            for start, end, run_id in self.intervals.get(self.get_key(run_data), ()):
+                if (start, end) == target:
+                    return self.touch(run_id)
+            return None
+
+    def add_miss(self, site_tag, directory, image_prefix, run_number, image_number):
+        """Remember that the database has no run containing this image"""
+
+        with self.lock:
+            key = (site_tag, directory, image_prefix, run_number)
+            self.misses.setdefault(key, {})[image_number] = time.time()
+
+    def is_miss(self, site_tag, directory, image_prefix, run_number, image_number):
+        """Return True if the database recently had no run containing this image"""
+
+        with self.lock:
+            images = self.misses.get((site_tag, directory, image_prefix, run_number), {})
+            miss_time = images.get(image_number, None)
+            if miss_time is None:
+                return False
+            if (time.time() - miss_time) > self.miss_ttl:
+                del images[image_number]
+                return False
+            return True
@@ -32,12 +32,14 @@ sudo docker run --name mongodb -p 27017:27017 -d mongo:3.4
 """
 
 # Standard imports
-import base64
 import bson.errors
 from bson.objectid import ObjectId
+import collections
 import copy
 import datetime
+import hashlib
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 from pprint import pprint
 # import shutil
@@ -46,10 +48,19 @@ import threading
 import pymongo
 import gridfs
 
+import database.mongodb_indexes as mongodb_indexes
+import utils.artifacts as artifacts
 from utils.text import json
 
 CONNECTION_ATTEMPTS = 30
 
+# Files listed in results that are uploaded to GridFS
+RESULT_FILE_TYPES = ("archive_files", "data_produced", "for_display")
+
+# Threads uploading the files of one result, and bytes read at a time
+UPLOAD_THREADS = 4
+UPLOAD_CHUNK_SIZE = 1048576
+
 #
 # Utility functions
 #
@@ -97,6 +108,9 @@ class Database(object):
 
     client = None
 
+    # Plugin results collections whose indexes have been made by this process
+    indexed_collections = set()
+
     def __init__(self,
                  host=None,
                  port=27017,
@@ -186,6 +200,35 @@ class Database(object):
 
         return db
 
+    def check_indexes(self):
+        """
+        Log the indexes missing from the database, which are made with
+        rapd.mongotool --indexes. Returns the list of those missing.
+        """
+
+        db = self.get_db_connection()
+
+        missing = mongodb_indexes.check_indexes(db)
+        for collection_name, name, keys in missing:
+            self.logger.warning("Index %s on %s %s is missing", name, collection_name, keys)
+        if missing:
+            self.logger.warning("Create missing indexes with rapd.mongotool --indexes")
+
+        return missing
+
+    def ensure_result_indexes(self, collection_name):
+        """Make the indexes for a plugin results collection the first time it is used"""
+
+        if collection_name in self.indexed_collections:
+            return
+
+        db = self.get_db_connection()
+        try:
+            mongodb_indexes.ensure_collection_indexes(db, collection_name, self.logger)
+        except pymongo.errors.OperationFailure:
+            self.logger.exception("Unable to create indexes on %s", collection_name)
+        self.indexed_collections.add(collection_name)
+
     ############################################################################
     # Functions for groups                                                     #
     ############################################################################
@@ -349,12 +392,46 @@ class Database(object):
     ############################################################################
     # Functions for results                                                    #
     ############################################################################
-    def save_plugin_result(self, plugin_result):
+    def save_plugin_results(self, plugin_results):
+        """
+        Add a batch of results from plugins, with one bulk update of the
+        sessions they belong to. Returns a list of the _ids for each result.
+
+        Keyword argument
+        plugin_results -- list of dicts of information from plugins
+        """
+
+        db = self.get_db_connection()
+
+        saved = []
+        last_process = {}
+        for plugin_result in plugin_results:
+            try:
+                saved.append(self.save_plugin_result(plugin_result, update_session=False))
+            except:
+                self.logger.exception("Error saving result for %s", plugin_result.get("process"))
+                saved.append(None)
+                continue
+            session_id = get_object_id(plugin_result["process"]["session_id"])
+            last_process[session_id] = max(plugin_result["timestamp"],
+                                           last_process.get(session_id, plugin_result["timestamp"]))
+
+        # Update the session last_process fields
+        if last_process:
+            db.sessions.bulk_write(
+                [pymongo.UpdateOne({"_id":_id}, {"$set":{"last_process":timestamp}}) \
+                 for _id, timestamp in last_process.iteritems()],
+                ordered=False)
+
+        return saved
+
+    def save_plugin_result(self, plugin_result, update_session=True):
         """
         Add a result from a plugin
 
         Keyword argument
         plugin_result -- dict of information from plugin - must have a process key pointing to entry
+        update_session -- update the session last_process field (default True)
         """
 
         self.logger.debug("save_plugin_result %s:%s", plugin_result["plugin"]["type"], plugin_result["process"])
@@ -365,8 +442,6 @@ class Database(object):
 
         # Connect to the database
         db = self.get_db_connection()
-        grid_fs = gridfs.GridFS(db)
-        grid_bucket = gridfs.GridFSBucket(db)
 
         # Clear _id from plugin_result
         if plugin_result.get("_id"):
@@ -387,158 +462,13 @@ class Database(object):
         #
         # Handle any file storage
         #
-        def remove_files_from_db(files, result_id, file_type):
-            """Remove old files from the db"""
-
-            self.logger.debug("remove_files_from_db files:%s results_id:%s file_type:%s", files, result_id, file_type)
-
-            # Cycle through file list
-            for file_to_remove in files:
-
-                # Find files to remove
-                files_in_database = db.fs.files.find({"metadata.result_id":result_id,
-                                                      "metadata.file_type":file_type,
-                                                      "metadata.description":file_to_remove.get("description")})
-                # self.logger.debug("Looking for %s", {"metadata.result_id":result_id,
-                #                                      "metadata.file_type":file_type,
-                #                                      "metadata.description":file_to_remove.get("description")})
-                
-                # Remove them
-                for file_in_database in files_in_database:
-
-                    # self.logger.debug("file_in_database: %s", file_in_database)
-                    # self.logger.debug(">>> %s %s", file_in_database["metadata"]["hash"], file_to_remove["hash"])
-
-                    # Remove if hashes don't match
-                    if file_in_database["metadata"]["hash"] != file_to_remove["hash"]:
-                        self.logger.debug("Removing file with _id:%s", file_to_remove["_id"])
-                        grid_bucket.delete(file_in_database["_id"])
-
-        def add_raw_file_to_db(path, metadata=None, replace=False):
-            """Add files to MongoDB"""
-
-            self.logger.debug("add_raw_file_to_db path:%s metadata:%s", path, metadata)
-
-            # See if we already have this file
-            file_in_database = db.fs.files.find_one({"metadata.hash":metadata["hash"]})
-
-            # File already saved
-            if file_in_database:
-                # Overwrite
-                if replace:
-                    self.logger.debug("Overwriting file")
-                    # Open the path
-                    with open(path, "r") as input_object:
-                        file_id = grid_bucket.upload_from_stream(filename=os.path.basename(path),
-                                                                 source=input_object,
-                                                                 metadata=metadata)
-                # Do not overwrite
-                else:
-                    self.logger.debug("Not overwriting file")
-                    file_id = file_in_database["_id"]
-            # New file
-            else:
-                self.logger.debug("Writing new file")
-                # Open the path
-                with open(path, "r") as input_object:
-                    file_id = grid_bucket.upload_from_stream(filename=os.path.basename(path),
-                                                             source=input_object,
-                                                             metadata=metadata)
-            
-            return file_id
-
-        def add_archive_file_to_db(path, metadata=None, replace=False):
-            """Add archive files to MongoDB - for use with client download"""
-            
-            self.logger.debug("add_archive_file_to_db path:%s metadata:%s", path, metadata)
-            
-            # See if we already have this file
-            file_in_database = db.fs.files.find_one({"metadata.hash":metadata["hash"]})
-
-            # File already saved
-            if file_in_database:
-                # Overwrite
-                if replace:
-                    self.logger.debug("Overwriting file")
-                    # Encode file in base64
-                    b64_encoded = base64.b64encode(open(path, "r").read())
-                    # Save to MongoDB
-                    file_id = grid_bucket.upload_from_stream(filename=os.path.basename(path),
-                                                             source=b64_encoded,
-                                                             metadata=metadata)
-                # Do not overwrite
-                else:
-                    self.logger.debug("Not overwriting file")
-                    file_id = file_in_database["_id"]
-            # New file
-            else:
-                self.logger.debug("Writing new file")
-                # Encode file in base64
-                b64_encoded = base64.b64encode(open(path, "r").read())
-                # Save to MongoDB
-                file_id = grid_bucket.upload_from_stream(filename=os.path.basename(path),
-                                                         source=b64_encoded,
-                                                         metadata=metadata)
-
-            return file_id
-
-        add_funcs = {
-            "archive_files":add_archive_file_to_db,
-            "data_produced":add_raw_file_to_db,
-            "for_display":add_raw_file_to_db
-        }
-
-        for file_type in ("archive_files", "data_produced", "for_display"):
-            self.logger.debug("Looking for %s", file_type)
-            if plugin_result["results"].get(file_type, False):
-
-                self.logger.debug("Have %s", file_type)
-                self.logger.debug(plugin_result["results"].get(file_type))
-
-                # Erase old files
-                remove_files_from_db(files=plugin_result["results"].get(file_type),
-                                     result_id=_result_id,
-                                     file_type=file_type)
-
-                # Save the new
-                for index in range(len(plugin_result["results"].get(file_type, []))):
-                    
-                    self.logger.debug("Saving the %d file", index)
-
-                    # The file to save
-                    data = plugin_result["results"].get(file_type, [])[index]
-                    self.logger.debug(data)
-
-                    # File exists - save it
-                    if os.path.exists(data["path"]):
-
-                        _file = data["path"]
-
-                        self.logger.debug("Saving %s", _file)
-
-                        # Upload the file to MongoDB
-                        grid_id = add_funcs[file_type](path=_file,
-                                                       metadata={"description":data.get("description", "archive"),
-                                                                 "hash":data.get("hash"),
-                                                                 "result_id":_result_id,
-                                                                 "file_type":file_type})
-
-                        self.logger.debug("Saved %s", grid_id)
-
-                        # This _id is important
-                        plugin_result["results"][file_type][index]["_id"] = grid_id
-
-                        # Remove the file from the system
-                        os.remove(_file)
-
-                        # Create a nicer path now that the original file is gone
-                        plugin_result["results"][file_type][index]["path"] = os.path.basename(_file)
-
-                    # File doesn't exist
-                    else:
-                        plugin_result["results"][file_type][index]["_id"] = None
-
+        if plugin_result.get("results"):
+            self.add_result_files_to_db(plugin_result["results"], _result_id)
 
+        #
+        # Upload the logs and other artifacts the result refers to
+        #
+        self.add_artifacts_to_db(plugin_result)
 
         #
         # Add to plugin-specific results
@@ -549,33 +479,35 @@ class Database(object):
                           collection_name,
                           _result_id)
 
+        self.ensure_result_indexes(collection_name)
+
         # Debugging call to query db
         # debug_result = db[collection_name].find_one({"process.result_id":_result_id})
         # self.logger.debug("Found previous plugin result %s" % debug_result._id)
 
-        # Update the plugin-specific table
-        result1 = db[collection_name].update_one(
-            {"process.result_id":_result_id},
-            {"$set":plugin_result},
-            upsert=True)
+        # Merge a delta into the stored result
+        if "delta" in plugin_result:
+            plugin_result_id = self.save_plugin_delta(collection_name, _result_id, plugin_result)
+            if not plugin_result_id:
+                return None
 
-        # Get the _id from updated entry
-        if result1.raw_result.get("updatedExisting", False):
-            plugin_result_id = db[collection_name].find_one(
-                {"process.result_id":_result_id},
-                {"_id":1})["_id"]
-            self.logger.debug("%s _id from updatedExisting %s", collection_name, plugin_result_id)
-        # upsert
+        # Update the plugin-specific table and get the _id in the same round trip
         else:
-            plugin_result_id = result1.upserted_id
-            self.logger.debug("%s _id  from upserting %s", collection_name, plugin_result_id)
+            plugin_result_id = db[collection_name].find_one_and_update(
+                {"process.result_id":_result_id},
+                {"$set":plugin_result},
+                projection={"_id":1},
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER)["_id"]
+        self.logger.debug("%s _id %s", collection_name, plugin_result_id)
+
         # Add _id to plugin_result
         plugin_result["_id"] = get_object_id(plugin_result_id)
 
         #
         # Update results collection
         #
-        result2 = db.results.update_one(
+        result_id = db.results.find_one_and_update(
             {"_id":_result_id},
             {"$set":{
                 "data_type":plugin_result["plugin"]["data_type"],
@@ -590,35 +522,278 @@ class Database(object):
                 "timestamp":now,
                 }
             },
-            upsert=True)
-
-        # Get the _id from updated entry in results
-        # Upserted
-        if result2.upserted_id:
-            result_id = result2.upserted_id
-
-        # Modified
-        else:
-            result_id = db.results.find_one(
-                {"result_id":get_object_id(plugin_result_id)},
-                {"_id":1})["_id"]
+            projection={"_id":1},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER)["_id"]
 
         # Update parent processes
         if plugin_result.get("process", {}).get("parent_id", False):
             self.updateParentProcess(plugin_result)
 
         # Update the session last_process field
-        db.sessions.update_one(
-            {"_id":get_object_id(plugin_result["process"]["session_id"])},
-            {"$set": {
-                "last_process": now
-            }}
-        )
+        if update_session:
+            db.sessions.update_one(
+                {"_id":get_object_id(plugin_result["process"]["session_id"])},
+                {"$set": {
+                    "last_process": now
+                }}
+            )
 
         # Return the _ids for the two collections
         return {"plugin_results_id":str(plugin_result_id),
                 "result_id":str(result_id)}
 
+    def add_result_files_to_db(self, results, result_id):
+        """
+        Upload the files listed in a result to GridFS, put their _ids in the
+        listing and remove them from disk
+
+        Files are streamed a chunk at a time and hashed as they go. Files
+        whose hash is already in the database are not uploaded again - they
+        are looked up in one query for the whole result - and the uploads of
+        a result run in parallel.
+
+        Keyword arguments
+        results -- the results dict of a plugin result
+        result_id -- the process.result_id of the result
+        """
+
+        db = self.get_db_connection()
+
+        # The files listed as (file_type, record)
+        records = []
+        for file_type in RESULT_FILE_TYPES:
+            for record in results.get(file_type) or []:
+                records.append((file_type, record))
+        if not records:
+            return
+
+        # Files already in the database, by hash - not the compressed artifacts,
+        # which can have the hash of a result file
+        hashes = list(set(record.get("hash") for __, record in records if record.get("hash")))
+        stored = {}
+        if hashes:
+            for file_in_database in db.fs.files.find({"metadata.hash":{"$in":hashes},
+                                                      "metadata.file_type":{"$ne":artifacts.FILE_TYPE}},
+                                                     {"metadata.hash":1}):
+                stored[file_in_database["metadata"]["hash"]] = file_in_database["_id"]
+
+        # Erase old files
+        self.remove_result_files_from_db(records, result_id)
+
+        # Files to upload by hash, so the same file is uploaded once
+        uploads = collections.OrderedDict()
+        for file_type, record in records:
+            if not os.path.exists(record["path"]):
+                record["_id"] = None
+            elif record.get("hash") in stored:
+                self.logger.debug("Not overwriting file %s", record["path"])
+                record["_id"] = stored[record["hash"]]
+            else:
+                key = record.get("hash") or record["path"]
+                uploads.setdefault(key, []).append((file_type, record))
+
+        def upload(key):
+            """Upload the first file for key"""
+            file_type, record = uploads[key][0]
+            return self.upload_file_to_db(record["path"],
+                                          metadata={"description":record.get("description", "archive"),
+                                                    "hash":record.get("hash"),
+                                                    "result_id":result_id,
+                                                    "file_type":file_type,
+                                                    "encoding":"raw"})
+
+        if uploads:
+            pool = ThreadPool(min(UPLOAD_THREADS, len(uploads)))
+            try:
+                uploaded = pool.map(upload, uploads.keys())
+            finally:
+                pool.close()
+
+            for key, (file_id, file_hash) in zip(uploads.keys(), uploaded):
+                self.logger.debug("Saved %s", file_id)
+                for __, record in uploads[key]:
+                    if record.get("hash") and record["hash"] != file_hash:
+                        self.logger.warning("Hash of %s changed from %s to %s",
+                                            record["path"],
+                                            record["hash"],
+                                            file_hash)
+                    record["_id"] = file_id
+                    record["hash"] = file_hash
+
+        # Remove the files from the system
+        for __, record in records:
+            if record["_id"] is not None and os.path.exists(record["path"]):
+                os.remove(record["path"])
+                # Create a nicer path now that the original file is gone
+                record["path"] = os.path.basename(record["path"])
+
+    def remove_result_files_from_db(self, records, result_id):
+        """
+        Remove the files of a result that are replaced by new files - those
+        with the file_type and description of a new file but a hash that is
+        not among the new files
+
+        Keyword arguments
+        records -- list of (file_type, record) for the new files
+        result_id -- the process.result_id of the result
+        """
+
+        self.logger.debug("remove_result_files_from_db result_id:%s", result_id)
+
+        db = self.get_db_connection()
+        grid_bucket = gridfs.GridFSBucket(db)
+
+        keep = set(record.get("hash") for __, record in records)
+        replaced = set((file_type, record.get("description")) for file_type, record in records)
+        file_types = list(set(file_type for file_type, __ in records))
+
+        for file_in_database in db.fs.files.find({"metadata.result_id":result_id,
+                                                  "metadata.file_type":{"$in":file_types}},
+                                                 {"metadata":1}):
+            metadata = file_in_database["metadata"]
+            if (metadata.get("file_type"), metadata.get("description")) in replaced and \
+               metadata.get("hash") not in keep:
+                self.logger.debug("Removing file with _id:%s", file_in_database["_id"])
+                grid_bucket.delete(file_in_database["_id"])
+
+    def upload_file_to_db(self, path, metadata):
+        """
+        Stream a file into GridFS a chunk at a time, hashing it on the way.
+        Returns the _id of the file and its sha1 hash, which is also put in
+        metadata.hash.
+
+        Keyword arguments
+        path -- the file to upload
+        metadata -- dict of metadata for the file
+        """
+
+        self.logger.debug("upload_file_to_db path:%s metadata:%s", path, metadata)
+
+        db = self.get_db_connection()
+        grid_bucket = gridfs.GridFSBucket(db)
+
+        sha1 = hashlib.sha1()
+        grid_in = grid_bucket.open_upload_stream(os.path.basename(path), metadata=metadata)
+        try:
+            with open(path, "rb") as input_object:
+                for chunk in iter(lambda: input_object.read(UPLOAD_CHUNK_SIZE), ""):
+                    sha1.update(chunk)
+                    grid_in.write(chunk)
+            file_hash = sha1.hexdigest()
+            if metadata.get("hash") != file_hash:
+                grid_in.metadata = dict(metadata, hash=file_hash)
+        except:
+            grid_in.abort()
+            raise
+        grid_in.close()
+
+        return grid_in._id, file_hash
+
+    def add_artifacts_to_db(self, plugin_result):
+        """
+        Upload the artifacts plugin_result refers to that are not yet in the
+        database and put their _ids in the references. Artifacts are
+        compressed and named by hash, so each is stored once, and they are
+        left on disk as other results may refer to them.
+
+        Keyword argument
+        plugin_result -- dict of information from plugin, snapshot or delta
+        """
+
+        db = self.get_db_connection()
+        grid_bucket = gridfs.GridFSBucket(db)
+
+        for reference in artifacts.find_references(plugin_result):
+
+            # Already stored
+            if reference.get("_id"):
+                continue
+
+            artifact_hash = reference[artifacts.ARTIFACT_KEY]
+            file_in_database = db.fs.files.find_one({"metadata.hash":artifact_hash,
+                                                     "metadata.file_type":artifacts.FILE_TYPE},
+                                                    {"_id":1})
+            if file_in_database:
+                reference["_id"] = file_in_database["_id"]
+
+            elif os.path.exists(reference["path"]):
+                self.logger.debug("Saving artifact %s", reference["path"])
+                with open(reference["path"], "rb") as input_object:
+                    reference["_id"] = grid_bucket.upload_from_stream(
+                        filename=os.path.basename(reference["path"]),
+                        source=input_object,
+                        metadata={"description":reference.get("description"),
+                                  "hash":artifact_hash,
+                                  "file_type":artifacts.FILE_TYPE,
+                                  "compression":reference.get("compression")})
+
+            # File doesn't exist
+            else:
+                reference["_id"] = None
+
+            # The path means nothing off the plugin's host
+            reference["path"] = os.path.basename(reference["path"])
+
+    def get_artifact_lines(self, artifact_hash):
+        """
+        Return the lines of a stored artifact, or None if there is no such
+        artifact
+
+        Keyword argument
+        artifact_hash -- the hash in the artifact's reference
+        """
+
+        db = self.get_db_connection()
+
+        file_in_database = db.fs.files.find_one({"metadata.hash":artifact_hash,
+                                                 "metadata.file_type":artifacts.FILE_TYPE},
+                                                {"_id":1})
+        if not file_in_database:
+            return None
+
+        grid_bucket = gridfs.GridFSBucket(db)
+        return artifacts.read_lines(grid_bucket.open_download_stream(file_in_database["_id"]))
+
+    def save_plugin_delta(self, collection_name, result_id, plugin_result):
+        """
+        Apply a delta from a plugin to its stored result with targeted $set
+        and $unset paths. The delta only applies to the result at the sequence
+        it was made from - otherwise it is dropped, and the next snapshot,
+        sent at least every result_delta.SNAPSHOT_INTERVAL deltas, brings the
+        result up to date. Returns the _id of the result or None.
+
+        Keyword arguments
+        collection_name -- the plugin-specific results collection
+        result_id -- the process.result_id of the result
+        plugin_result -- delta message from the plugin
+        """
+
+        db = self.get_db_connection()
+
+        delta = plugin_result["delta"]
+
+        update = {"$set":dict(delta["set"])}
+        update["$set"].update({"process":plugin_result["process"],
+                               "timestamp":plugin_result["timestamp"],
+                               "sequence":delta["sequence"]})
+        if delta["unset"]:
+            update["$unset"] = dict((path, "") for path in delta["unset"])
+
+        stored = db[collection_name].find_one_and_update(
+            {"process.result_id":result_id, "sequence":delta["base"]},
+            update,
+            projection={"_id":1})
+
+        if not stored:
+            self.logger.warning("Dropping delta %d for %s - result not at sequence %d",
+                                delta["sequence"],
+                                result_id,
+                                delta["base"])
+            return None
+
+        return stored["_id"]
+
     # def getArrayStats(self, in_array, mode="float"):
     #     """
     #     return the max,min,mean and std_dev of an input array
@@ -831,7 +1006,7 @@ class Database(object):
         # self.logger.debug(projection)
         # self.logger.debug(order_param)
 
-        results = db.runs.find(query).sort("file_ctime", order_param)
+        results = db.runs.find(query, projection or None).sort("file_ctime", order_param)
         # self.logger.debug(results.count())
 
         # Now filter for image_number inclusion
@@ -868,11 +1043,11 @@ class Database(object):
 
         # Connect to the database
         db = self.get_db_connection(read_only=True)
-        grid_fs = gridfs.GridFS(db)
         grid_bucket = gridfs.GridFSBucket(db)
 
         if hash:
-            query = {"metadata.hash":hash}
+            query = {"metadata.hash":hash,
+                     "metadata.file_type":{"$ne":artifacts.FILE_TYPE}}
         elif result_id and description:
             query = {"metadata.result_id":result_id, "metadata.description":description}
         else:
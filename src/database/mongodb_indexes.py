@@ -0,0 +1,368 @@
+"""
+Indexes for the RAPD MongoDB database - the indexes the control process and
+the web services query on, checking and creating them, and a report of the
+queries that are slow
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-05"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import collections
+import logging
+
+import pymongo
+from pymongo import ASCENDING, DESCENDING
+
+# Indexes by collection, each (name, keys). Keys are in the order of the
+# query - fields matched exactly, then the sort, then ranges - and carry the
+# projected fields so the common lookups are covered by the index.
+INDEXES = collections.OrderedDict((
+    # mongodb_adapter.get_run & query_in_run
+    ("runs", [
+        ("run_lookup", [("site_tag", ASCENDING),
+                        ("directory", ASCENDING),
+                        ("image_prefix", ASCENDING),
+                        ("run_number", ASCENDING),
+                        ("file_ctime", DESCENDING),
+                        ("start_image_number", ASCENDING),
+                        ("number_images", ASCENDING),
+                        ("_id", ASCENDING)]),
+        ]),
+    # Image entry
+    ("images", [
+        ("image_fullname", [("fullname", ASCENDING),
+                            ("date", ASCENDING)]),
+        ]),
+    # mongodb_adapter.get_session_id
+    ("sessions", [
+        ("session_data_root_dir", [("data_root_dir", ASCENDING),
+                                   ("_id", ASCENDING)]),
+        ]),
+    # Results for a session, as the web services list them
+    ("results", [
+        ("results_session_type", [("session_id", ASCENDING),
+                                  ("plugin_type", ASCENDING),
+                                  ("timestamp", DESCENDING)]),
+        ("results_session", [("session_id", ASCENDING),
+                             ("timestamp", DESCENDING)]),
+        ]),
+    # Files by hash, files of a result, and artifacts
+    ("fs.files", [
+        ("files_hash", [("metadata.hash", ASCENDING),
+                        ("metadata.file_type", ASCENDING)]),
+        ("files_result", [("metadata.result_id", ASCENDING),
+                          ("metadata.file_type", ASCENDING),
+                          ("metadata.description", ASCENDING)]),
+        ]),
+    ))
+
+# Indexes for each plugin results collection (<data_type>_<type>_results),
+# used by saving results and applying deltas
+RESULT_INDEXES = [
+    ("result_id_sequence", [("process.result_id", ASCENDING),
+                            ("sequence", ASCENDING)]),
+    ]
+
+RESULT_COLLECTION_SUFFIX = "_results"
+
+# Milliseconds for an operation to count as slow
+SLOW_MS = 100
+
+# Examining more documents than this for each one returned is a scan
+SCAN_RATIO = 10
+
+def is_result_collection(collection_name):
+    """Return True if collection_name holds the results of one plugin type"""
+
+    return collection_name.endswith(RESULT_COLLECTION_SUFFIX) and \
+           not collection_name.startswith("system.")
+
+def get_collection_indexes(collection_name):
+    """Return the (name, keys) of the indexes wanted for collection_name"""
+
+    if collection_name in INDEXES:
+        return INDEXES[collection_name]
+    if is_result_collection(collection_name):
+        return RESULT_INDEXES
+    return []
+
+def get_collection_names(db):
+    """Return the names of the collections in db that want indexes"""
+
+    collection_names = INDEXES.keys()
+    for collection_name in sorted(db.list_collection_names()):
+        if is_result_collection(collection_name) and collection_name not in collection_names:
+            collection_names.append(collection_name)
+    return collection_names
+
+def missing_indexes(index_information, indexes):
+    """
+    Return the (name, keys) in indexes that are not in index_information, as
+    returned by Collection.index_information(). Indexes are matched on
+    their keys, so an index made under another name counts.
+    """
+
+    present = set(tuple((field, int(direction)) for field, direction in info["key"]) \
+                  for info in index_information.itervalues())
+    return [(name, keys) for name, keys in indexes if tuple(keys) not in present]
+
+def check_indexes(db):
+    """Return a list of (collection_name, name, keys) missing from db"""
+
+    missing = []
+    for collection_name in get_collection_names(db):
+        indexes = get_collection_indexes(collection_name)
+        for name, keys in missing_indexes(db[collection_name].index_information(), indexes):
+            missing.append((collection_name, name, keys))
+    return missing
+
+def ensure_collection_indexes(db, collection_name, logger=None):
+    """
+    Create the indexes wanted for collection_name that it does not have.
+    Indexes are built in the background. Returns the names of those created.
+    """
+
+    logger = logger or logging.getLogger("RAPDLogger")
+
+    indexes = get_collection_indexes(collection_name)
+    if not indexes:
+        return []
+
+    collection = db[collection_name]
+    missing = missing_indexes(collection.index_information(), indexes)
+    if not missing:
+        return []
+
+    logger.info("Creating indexes %s on %s",
+                ", ".join(name for name, __ in missing),
+                collection_name)
+    return collection.create_indexes([pymongo.IndexModel(keys, name=name, background=True) \
+                                      for name, keys in missing])
+
+def ensure_indexes(db, logger=None):
+    """Create the indexes missing from db. Returns (collection_name, name) created."""
+
+    created = []
+    for collection_name in get_collection_names(db):
+        for name in ensure_collection_indexes(db, collection_name, logger):
+            created.append((collection_name, name))
+    return created
+
+def get_stages(plan):
+    """Return the names of the stages in a query plan, outermost first"""
+
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages.extend(get_stages(plan["inputStage"]))
+    for input_stage in plan.get("inputStages", []):
+        stages.extend(get_stages(input_stage))
+    return stages
+
+def summarize_explain(explain):
+    """
+    Return a dict summarizing the output of Cursor.explain() - the stages of
+    the winning plan, the index used and the work done
+    """
+
+    planner = explain.get("queryPlanner", {})
+    stats = explain.get("executionStats", {})
+    stages = get_stages(planner.get("winningPlan", {}))
+
+    index_name = None
+    plan = planner.get("winningPlan", {})
+    while plan:
+        if plan.get("stage") == "IXSCAN":
+            index_name = plan.get("indexName")
+            break
+        plan = plan.get("inputStage")
+
+    summary = {"namespace":planner.get("namespace"),
+               "stages":stages,
+               "index":index_name,
+               "returned":stats.get("nReturned", 0),
+               "keys_examined":stats.get("totalKeysExamined", 0),
+               "docs_examined":stats.get("totalDocsExamined", 0),
+               "millis":stats.get("executionTimeMillis", 0)}
+    summary["covered"] = "IXSCAN" in stages and "FETCH" not in stages
+    summary["problems"] = get_problems(summary)
+    return summary
+
+def get_problems(summary):
+    """Return a list of the reasons a summarized query is slow"""
+
+    problems = []
+    if "COLLSCAN" in summary["stages"]:
+        problems.append("collection scan")
+    if "SORT" in summary["stages"]:
+        problems.append("sort in memory")
+    if summary["docs_examined"] > SCAN_RATIO * max(summary["returned"], 1):
+        problems.append("%d documents examined for %d returned" % (summary["docs_examined"],
+                                                                  summary["returned"]))
+    return problems
+
+def query_shape(value):
+    """Return value with the values replaced by 1, leaving the operators"""
+
+    if isinstance(value, dict):
+        return dict((key, query_shape(sub_value)) for key, sub_value in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [query_shape(sub_value) for sub_value in value[:1]]
+    return 1
+
+def get_profiled_find(entry):
+    """
+    Return (collection_name, filter, sort, projection) for a find in a
+    system.profile entry, or None if it is not a find
+    """
+
+    command = entry.get("command") or entry.get("query") or {}
+    if "find" in command:
+        return (command["find"],
+                command.get("filter", {}),
+                command.get("sort"),
+                command.get("projection"))
+    if entry.get("op") == "query":
+        collection_name = entry.get("ns", "").split(".", 1)[-1]
+        if "$query" in command:
+            return (collection_name,
+                    command["$query"],
+                    command.get("$orderby"),
+                    None)
+        return (collection_name, command, None, None)
+    return None
+
+def explain_find(db, collection_name, query, sort=None, projection=None):
+    """Run explain on a find and return summarize_explain of it"""
+
+    cursor = db[collection_name].find(query, projection or None)
+    if sort:
+        cursor = cursor.sort(sort.items() if isinstance(sort, dict) else sort)
+    return summarize_explain(cursor.explain())
+
+def get_known_queries(db):
+    """
+    Return (description, collection_name, query, sort, projection) for the
+    queries mongodb_adapter makes, with values from the newest documents
+    """
+
+    queries = []
+
+    run = db.runs.find_one(sort=[("_id", DESCENDING)])
+    if run:
+        lookup = dict((key, run.get(key)) for key in ("site_tag",
+                                                      "directory",
+                                                      "image_prefix",
+                                                      "run_number"))
+        query = dict(lookup)
+        query.update({"start_image_number":run.get("start_image_number"),
+                      "number_images":run.get("number_images")})
+        queries.append(("get_run", "runs", query, [("file_ctime", DESCENDING)], {"_id":1}))
+        query = dict(lookup)
+        query["start_image_number"] = {"$lte":run.get("start_image_number")}
+        queries.append(("query_in_run",
+                        "runs",
+                        query,
+                        [("file_ctime", DESCENDING)],
+                        {"_id":1, "start_image_number":1, "number_images":1}))
+
+    session = db.sessions.find_one(sort=[("_id", DESCENDING)])
+    if session:
+        queries.append(("get_session_id",
+                        "sessions",
+                        {"data_root_dir":session.get("data_root_dir")},
+                        None,
+                        {"_id":1}))
+        queries.append(("results by session",
+                        "results",
+                        {"session_id":session["_id"], "plugin_type":"INDEX"},
+                        [("timestamp", DESCENDING)],
+                        None))
+
+    stored_file = db.fs.files.find_one({"metadata.hash":{"$exists":True}},
+                                       sort=[("_id", DESCENDING)])
+    if stored_file:
+        metadata = stored_file["metadata"]
+        queries.append(("file by hash",
+                        "fs.files",
+                        {"metadata.hash":metadata["hash"]},
+                        None,
+                        None))
+        queries.append(("files of a result",
+                        "fs.files",
+                        {"metadata.result_id":metadata.get("result_id"),
+                         "metadata.file_type":{"$in":[metadata.get("file_type")]}},
+                        None,
+                        {"metadata":1}))
+
+    for collection_name in sorted(db.list_collection_names()):
+        if not is_result_collection(collection_name):
+            continue
+        result = db[collection_name].find_one({"process.result_id":{"$exists":True}},
+                                              {"process.result_id":1, "sequence":1},
+                                              sort=[("_id", DESCENDING)])
+        if result:
+            queries.append(("save_plugin_result",
+                            collection_name,
+                            {"process.result_id":result["process"]["result_id"],
+                             "sequence":result.get("sequence", 0)},
+                            None,
+                            {"_id":1}))
+
+    return queries
+
+def profile_report(db, slow_ms=SLOW_MS, limit=20):
+    """
+    Return a list of dicts describing the slow finds in system.profile,
+    grouped by the shape of the query and slowest first. The slowest of
+    each group is explained again against the current indexes.
+    """
+
+    groups = collections.OrderedDict()
+    for entry in db.system.profile.find({"millis":{"$gte":slow_ms}}).sort("millis", DESCENDING):
+        find = get_profiled_find(entry)
+        if not find:
+            continue
+        collection_name, query, sort, projection = find
+        key = (collection_name, repr(query_shape(query)), repr(sort))
+        if key in groups:
+            groups[key]["count"] += 1
+            groups[key]["total_millis"] += entry.get("millis", 0)
+            continue
+        if len(groups) >= limit:
+            continue
+        groups[key] = {"collection":collection_name,
+                       "shape":query_shape(query),
+                       "sort":sort,
+                       "count":1,
+                       "max_millis":entry.get("millis", 0),
+                       "total_millis":entry.get("millis", 0),
+                       "plan_summary":entry.get("planSummary"),
+                       "explain":explain_find(db, collection_name, query, sort, projection)}
+    return groups.values()
+
+def set_profiling(db, slow_ms=SLOW_MS):
+    """Have MongoDB profile operations slower than slow_ms"""
+
+    return db.command("profile", 1, slowms=slow_ms)
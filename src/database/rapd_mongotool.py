@@ -34,6 +34,7 @@ import sys
 import time
 
 # RAPD imports
+import database.mongodb_indexes as mongodb_indexes
 import utils.text as text
 
 # Constants
@@ -173,6 +174,100 @@ def insert_group(mongouri, new_group):
 
     return result
 
+def check_indexes(mongouri):
+    """
+    Print the indexes missing from the database
+
+    Keyword arguments
+    mongouri -- the MongoDB connection string in URI format
+    """
+
+    print "Checking the RAPD database indexes"
+
+    db = pymongo.MongoClient(mongouri).rapd
+
+    missing = mongodb_indexes.check_indexes(db)
+    if missing:
+        for collection_name, name, keys in missing:
+            print text.red+"  %s is missing %s %s" % (collection_name, name, keys)+text.stop
+    else:
+        print text.green+"  All indexes present"+text.stop
+
+    return missing
+
+def create_indexes(mongouri):
+    """
+    Create the indexes missing from the database. Indexes made under
+    other names are left as they are.
+
+    Keyword arguments
+    mongouri -- the MongoDB connection string in URI format
+    """
+
+    print "Creating the RAPD database indexes"
+
+    db = pymongo.MongoClient(mongouri).rapd
+
+    created = mongodb_indexes.ensure_indexes(db)
+    for collection_name, name in created:
+        print text.green+"  Created %s on %s" % (name, collection_name)+text.stop
+    if not created:
+        print text.green+"  All indexes present"+text.stop
+
+    return created
+
+def print_explain(summary):
+    """Print a summary made by mongodb_indexes.summarize_explain"""
+
+    print "    plan %s  index %s%s" % (" <- ".join(summary["stages"]),
+                                       summary["index"],
+                                       " (covered)" if summary["covered"] else "")
+    print "    %d returned, %d keys and %d documents examined in %d ms" % (
+        summary["returned"],
+        summary["keys_examined"],
+        summary["docs_examined"],
+        summary["millis"])
+    for problem in summary["problems"]:
+        print text.red+"    %s" % problem+text.stop
+
+def report_slow_queries(mongouri, slow_ms, profile=False):
+    """
+    Print the plans of the queries RAPD makes, then of the slow queries
+    recorded by the MongoDB profiler
+
+    Keyword arguments
+    mongouri -- the MongoDB connection string in URI format
+    slow_ms -- milliseconds for a query to count as slow
+    profile -- turn on profiling of slow queries (default False)
+    """
+
+    db = pymongo.MongoClient(mongouri).rapd
+
+    print "Plans for the queries RAPD makes"
+    for description, collection_name, query, sort, projection in \
+        mongodb_indexes.get_known_queries(db):
+        print "  %s on %s" % (description, collection_name)
+        print_explain(mongodb_indexes.explain_find(db, collection_name, query, sort, projection))
+
+    if profile:
+        mongodb_indexes.set_profiling(db, slow_ms)
+        print "Profiling queries slower than %d ms" % slow_ms
+
+    print "Queries slower than %d ms in system.profile" % slow_ms
+    report = mongodb_indexes.profile_report(db, slow_ms)
+    if not report:
+        print "  None - profiling is turned on with --profile"
+    for group in report:
+        print "  %s %s sort %s" % (group["collection"], group["shape"], group["sort"])
+        print "    %d times, slowest %d ms, total %d ms, profiled plan %s" % (
+            group["count"],
+            group["max_millis"],
+            group["total_millis"],
+            group["plan_summary"])
+        print_explain(group["explain"])
+
+    return report
+
 # def create_data_collections(hostname, port, username, password):
 #     """
 #     Create the "data" tables for rapd core functions
@@ -275,6 +370,36 @@ def get_commandline():
                         dest="add_group",
                         help="Add group to database")
 
+    # Check indexes
+    parser.add_argument("-c", "--check-indexes",
+                        action="store_true",
+                        dest="check_indexes",
+                        help="List indexes missing from the database")
+
+    # Create indexes
+    parser.add_argument("-i", "--indexes",
+                        action="store_true",
+                        dest="create_indexes",
+                        help="Create indexes missing from the database")
+
+    # Report slow queries
+    parser.add_argument("-s", "--slow-queries",
+                        action="store_true",
+                        dest="slow_queries",
+                        help="Report the plans of RAPD queries and of slow queries")
+
+    parser.add_argument("--slowms",
+                        action="store",
+                        dest="slow_ms",
+                        default=mongodb_indexes.SLOW_MS,
+                        type=int,
+                        help="Milliseconds for a query to count as slow")
+
+    parser.add_argument("--profile",
+                        action="store_true",
+                        dest="profile",
+                        help="Turn on profiling of slow queries")
+
     # Directory or files
     parser.add_argument(action="store",
                         dest="mongouri",
@@ -319,6 +444,18 @@ def main():
         # For Development
         # perform_naive_install(hostname, port, username, password)
 
+    # Index maintenance
+    if args.check_indexes or args.create_indexes or args.slow_queries:
+        if args.check_indexes:
+            check_indexes(mongouri=MONGO_URI)
+        if args.create_indexes:
+            create_indexes(mongouri=MONGO_URI)
+        if args.slow_queries:
+            report_slow_queries(mongouri=MONGO_URI,
+                                slow_ms=args.slow_ms,
+                                profile=args.profile)
+        sys.exit()
+
     if args.add_group:
         print "Adding a group..."
         groupname = raw_input("  Name: ")
@@ -3,8 +3,8 @@ This is an adapter for RAPD to connect to the results database, when it is a
 REDIS instance.
 
 The connection should be automatically reconnecting, and a disconnection should
-be fully recovered from if the disconnection is shorter than 
-ATTEMPT_LIMIT * ATTEMPT_PAUSE seconds
+be fully recovered from if the disconnection is shorter than RETRY_TIME seconds.
+Connections are drawn from pools shared by every Database in the process.
 """
 
 __license__ = """
@@ -37,10 +37,13 @@ __status__ = "Production"
 
 # Standard imports
 import atexit
+import collections
 import datetime
+import functools
 import logging
 import os
 from pprint import pprint
+import random
 import threading
 import time
 
@@ -52,31 +55,200 @@ import utils.log
 from utils.text import json
 from bson.objectid import ObjectId
 
-ATTEMPT_LIMIT = 3600
-ATTEMPT_PAUSE = 1.0
-CONNECTION_ATTEMPT_LIMIT = 3600
+# Seconds to keep retrying a command or connection before raising
+RETRY_TIME = 3600.0
+
+# Retries back off exponentially from BACKOFF_BASE seconds to at most
+# BACKOFF_MAX seconds, with full jitter so clients do not retry in step
+BACKOFF_BASE = 0.1
+BACKOFF_MAX = 30.0
+
+# Seconds a pooled connection may sit idle before it is pinged on use
+HEALTH_CHECK_INTERVAL = 30
+
+# Commands sent in one round trip by the pipelining helpers
+PIPELINE_BATCH = 100
+
+# Commands that wait for data - their time is not latency
+BLOCKING_COMMANDS = ("blpop", "brpop", "brpoplpush", "get_message")
+
+# Errors that mean the server is unreachable, and the command can be retried
+RETRY_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+def backoff_delay(attempt):
+    """Return the seconds to wait before retry number attempt (from 0)"""
+
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** min(attempt, 20)))
+
+def get_pool_kwargs():
+    """Return the keyword arguments for the connections of a pool"""
+
+    kwargs = {"socket_keepalive":True}
+    # Pooled connections ping themselves after sitting idle in redis-py 3.3+
+    if tuple(int(part) for part in redis.__version__.split(".")[:2]) >= (3, 3):
+        kwargs["health_check_interval"] = HEALTH_CHECK_INTERVAL
+    return kwargs
+
+class Metrics(object):
+    """
+    Counts of Redis commands, their latency, and errors and reconnects, for
+    every Database in the process
+    """
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Zero the metrics"""
+
+        with self.lock:
+            # name -> [calls, total seconds, most seconds]
+            self.commands = collections.defaultdict(lambda: [0, 0.0, 0.0])
+            self.errors = 0
+            self.reconnects = 0
+            self.pools = 0
+
+    def record(self, name, seconds, blocking=False, attempts=0):
+        """Record a command that succeeded after attempts retries"""
+
+        with self.lock:
+            command = self.commands[name]
+            command[0] += 1
+            if not blocking:
+                command[1] += seconds
+                command[2] = max(command[2], seconds)
+            if attempts:
+                self.reconnects += 1
+
+    def error(self):
+        """Record a command or connection that failed"""
+
+        with self.lock:
+            self.errors += 1
+
+    def pool(self):
+        """Record a pool being made"""
+
+        with self.lock:
+            self.pools += 1
+
+    def get(self):
+        """Return a dict of the metrics"""
+
+        with self.lock:
+            commands = {}
+            for name, (calls, total, most) in self.commands.iteritems():
+                commands[name] = {"calls":calls,
+                                  "mean_ms":(1000 * total / calls) if calls else 0,
+                                  "max_ms":1000 * most}
+            return {"commands":commands,
+                    "errors":self.errors,
+                    "reconnects":self.reconnects,
+                    "pools":self.pools}
+
+METRICS = Metrics()
+
+# Pools and sentinel clients shared in the process, by connection settings
+_POOLS = {}
+_SENTINEL_CLIENTS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_client(host="localhost", port=6379, db=0, password=None):
+    """Return a Redis client using the process pool for the server"""
+
+    key = (host, port, db, password)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = redis.ConnectionPool(host=host,
+                                        port=port,
+                                        db=db,
+                                        password=password,
+                                        **get_pool_kwargs())
+            _POOLS[key] = pool
+            METRICS.pool()
+    return redis.Redis(connection_pool=pool)
+
+def get_sentinel_client(sentinels, master, password=None):
+    """
+    Return the Sentinel and the client for its master, shared in the
+    process, for the sentinels and master
+    """
+
+    key = (tuple(tuple(sentinel) for sentinel in sentinels), master, password)
+    with _POOLS_LOCK:
+        if key not in _SENTINEL_CLIENTS:
+            sentinel = Sentinel(sentinels, socket_keepalive=True)
+            _SENTINEL_CLIENTS[key] = (sentinel,
+                                      sentinel.master_for(master,
+                                                          password=password,
+                                                          **get_pool_kwargs()))
+            METRICS.pool()
+        return _SENTINEL_CLIENTS[key]
+
+def get_metrics():
+    """Return a dict of the metrics of Redis use in the process"""
+
+    return METRICS.get()
+
+def disconnect_all():
+    """Close the connections of all the pools in the process"""
+
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.disconnect()
+        for __, client in _SENTINEL_CLIENTS.values():
+            client.connection_pool.disconnect()
+
+atexit.register(disconnect_all)
 
 def connectionErrorWrapper(func):
-    def wrapper(*args, **kwargs):
-        attempts = 0
-        while attempts < ATTEMPT_LIMIT:
+    """
+    Retry a Database method while the server cannot be reached, backing off
+    between attempts, for up to RETRY_TIME seconds. Records the command in
+    METRICS.
+    """
+
+    name = func.__name__
+    blocking = name in BLOCKING_COMMANDS
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        attempt = 0
+        deadline = None
+        while True:
+            start = time.time()
             try:
-                attempts += 1
-                return func(*args, **kwargs)
-                break
-            except redis.exceptions.ConnectionError as e:
-                # Pause for specified time
-                print "try %d" % attempts
-                time.sleep(ATTEMPT_PAUSE)
-        else:
-            args[0]._raise_ConnectionError(error)
+                value = func(self, *args, **kwargs)
+            # Already given up
+            except Database.ConnectionError:
+                raise
+            except RETRY_ERRORS as error:
+                METRICS.error()
+                if deadline is None:
+                    deadline = start + RETRY_TIME
+                if time.time() >= deadline:
+                    self._raise_ConnectionError(error)
+                delay = backoff_delay(attempt)
+                attempt += 1
+                self.get_logger().warning("Redis %s failed (%s) - retry %d in %.1f s",
+                                          name,
+                                          error,
+                                          attempt,
+                                          delay)
+                time.sleep(delay)
+            else:
+                METRICS.record(name, time.time() - start, blocking, attempt)
+                return value
     return wrapper
 
 class Database:
     """
     Provide an interface using which to communicate with a Redis server.
 
-    A new connection to the server is created by each class instance.
+    Instances for the same server share a pool of connections.
 
     Custom exception hierarchy:
     Error
@@ -92,7 +264,7 @@ class Database:
         pass
         # print "Error"
 
-    class ConnectionError(Error):
+    class ConnectionError(Error, redis.exceptions.ConnectionError):
         pass
         # print "ConnectionError"
 
@@ -128,11 +300,13 @@ class Database:
         try:
             # connection = redis.Redis(connection_pool=self._pool)
             state["Server pingable"] = self.redis.ping() # returns True
-        except redis.exceptions.ConnectionError: # as e:
+        except RETRY_ERRORS: # as e:
             #self.logger.error("{} Console Redis ping failure: {}".format(tools.cm_name(), e))
                 # intentionally not self.logger.exception
             state["Server pingable"] = False
 
+        state["Metrics"] = get_metrics()
+
         # # Test availability of a key
         # try:
         #     self["MONO_SV"]
@@ -211,57 +385,46 @@ class Database:
         # Connect to server
         self._connect_lock = threading.Lock()
         self._connect() # "with self._connect_lock:" is not necessary in __init__
-        atexit.register(self._disconnect)
 
     ###############
     # ADMIN Methods
     ###############
 
-    def _connect(self):
-        """Connect to server."""
+    def get_logger(self):
+        """Return the logger, or the RAPD logger if none was passed in"""
 
-        # self.logger.debug(tools.cm_name())
+        return self.logger or logging.getLogger("RAPDLogger")
 
-        socket_timeout = self.socket_timeout
+    def _connect(self):
+        """
+        Get a client from the shared pool for the server, waiting for the
+        server to answer
+        """
 
         # Sentinel connection
         if self.sentinels:
-            self.sentinel = Sentinel(self.sentinels)
-
-            # Assign master connection to self.redis
-            self.redis = self.sentinel.master_for(self.master)
+            self.sentinel, self.redis = get_sentinel_client(self.sentinels,
+                                                            self.master,
+                                                            self.password)
 
         # Standard connection
         else:
-            attempt_count = 0
-            while attempt_count < CONNECTION_ATTEMPT_LIMIT:
-                try:
-                    # Connect
-                    self.redis = redis.Redis(host=self.host,
-                                             port=self.port,
-                                             db=self.db,
-                                             password=self.password)
-                    # self._pool = redis.ConnectionPool(host=self.host, port=self.port, db=0)
-                    
-                    # Make sure redis server is up
-                    _ = self.redis.ping()
-                    break
-                    # self._connection = redis.Redis(host, socket_timeout=socket_timeout)
-                    # redis module reconnects automatically as needed.
-                    # socket_timeout is not set to a higher value because it blocks.
-                except redis.exceptions.ConnectionError as e:
-                    print "except"
-                    if self.logger:
-                        self.logger.debug("Connection error {}".format(e))
-                    time.sleep(1)
-                    attempt_count += 1
-                    # self._raise_ConnectionError(e)
-
-        # # Make sure redis server is up
-        # try:
-        #     _ = self.redis.ping()
-        # except redis.sentinel.MasterNotFoundError as error:
-        #     self._raise_ConnectionError(error)
+            self.redis = get_client(host=self.host,
+                                    port=self.port,
+                                    db=self.db,
+                                    password=self.password)
+            self._pool = self.redis.connection_pool
+
+        # Make sure redis server is up
+        self.check_health()
+
+    @connectionErrorWrapper
+    def check_health(self):
+        """Ping the server, returning the round trip in seconds"""
+
+        start = time.time()
+        self.redis.ping()
+        return time.time() - start
 
     def _disconnect(self):
         """Disconnect from server."""
@@ -300,26 +463,14 @@ class Database:
 
         raise self.ConnectionError(err_msg)
 
+    @connectionErrorWrapper
     def discover_master(self):
         """
         Return the master instance (host, ip)
         """
 
         if self.sentinel and self.master:
-            attempts = 0
-            while attempts < ATTEMPT_LIMIT:
-                try:
-                    attempts += 1
-                    master = self.sentinel.discover_master(self.master)
-                    break
-                except redis.sentinel.MasterNotFoundError as e:
-                    # Pause for specified time
-                    print "try %d" % attempts
-                    time.sleep(ATTEMPT_PAUSE)
-            else:
-                self._raise_ConnectionError(e)
-
-            return master 
+            return self.sentinel.discover_master(self.master)
         else:
             self._raise_ConnectionError("Sentinels not properly defined")
 
@@ -329,30 +480,55 @@ class Database:
         """
 
         if self.sentinel and self.master:
-            attempts = 0
-            while attempts < ATTEMPT_LIMIT:
-                try:
-                    attempts += 1
-                    master = self.sentinel.discover_slaves(self.master)
-                    break
-                except redis.sentinel.SlaveNotFoundError as e:
-                    # Pause for specified time
-                    print "try %d" % attempts
-                    time.sleep(ATTEMPT_PAUSE)
-            else:
-                self._raise_ConnectionError(e)
-
-            return master 
+            return self.sentinel.discover_slaves(self.master)
         else:
             self._raise_ConnectionError("Sentinels not properly defined")
-    
+
     #############
     # PIPELINE Methods
     #############
     
-    def pipeline(self):
+    def pipeline(self, transaction=True):
         """return a pipeline instance"""
-        return self.redis.pipeline()
+        return self.redis.pipeline(transaction=transaction)
+
+    @connectionErrorWrapper
+    def execute_pipeline(self, commands, transaction=False):
+        """
+        Run commands, a list of (method name, args...) tuples, in one round
+        trip and return their values. With transaction, they run as one
+        MULTI/EXEC.
+        """
+        pipe = self.redis.pipeline(transaction=transaction)
+        for command in commands:
+            getattr(pipe, command[0])(*command[1:])
+        return pipe.execute()
+
+    @connectionErrorWrapper
+    def llen_many(self, keys):
+        """
+        LLEN of each of keys in one round trip
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.llen(key)
+        return pipe.execute()
+
+    @connectionErrorWrapper
+    def rpoplpush_all(self, list1, list2, batch_size=PIPELINE_BATCH):
+        """
+        RPOPLPUSH every value from one list onto another, batch_size at a
+        time in each round trip. Returns the number of values moved.
+        """
+        moved = 0
+        while True:
+            pipe = self.redis.pipeline(transaction=False)
+            for __ in xrange(batch_size):
+                pipe.rpoplpush(list1, list2)
+            count = sum(1 for value in pipe.execute() if value is not None)
+            moved += count
+            if count < batch_size:
+                return moved
 
     #############
     # GET Methods
@@ -612,14 +788,59 @@ class Database:
         """
         value = self.redis.rpop(key)
         return value
-    
+
+    @connectionErrorWrapper
+    def rpop_batch(self, key, count):
+        """
+        RPOP up to count values off a given list in one round trip
+
+        Values are returned oldest first, the same order repeated rpop calls
+        would return them.
+        """
+        if count < 1:
+            return []
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(key, -count, -1)
+        pipe.ltrim(key, 0, -(count + 1))
+        values, __ = pipe.execute()
+        values.reverse()
+        return values
+
+    @connectionErrorWrapper
+    def requeue(self, list1, value, list2, new_value):
+        """
+        Remove value from list1 and LPUSH new_value onto list2 in one
+        transaction, so it is on exactly one of them
+        """
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.execute_command("LREM", list1, 1, value)
+        pipe.lpush(list2, new_value)
+        pipe.execute()
+
     @connectionErrorWrapper
     def rpoplpush(self, list1, list2):
         """
         RPOPLPUSH pop a value off a given list and push on another list
         """
         value = self.redis.rpoplpush(list1, list2)
-        #return value
+        return value
+
+    @connectionErrorWrapper
+    def brpoplpush(self, list1, list2, timeout=0):
+        """
+        BRPOPLPUSH pop a value off a given list and push on another list,
+        blocking up to timeout seconds for a value. Returns None on timeout.
+        """
+        value = self.redis.brpoplpush(list1, list2, timeout)
+        return value
+
+    @connectionErrorWrapper
+    def lrem(self, key, value, count=1):
+        """
+        LREM remove count occurrences of value from a given list
+        """
+        # Argument order of lrem differs between redis-py Redis and StrictRedis
+        return self.redis.execute_command("LREM", key, count, value)
                
     ##############
     # HASH Methods
@@ -698,15 +919,27 @@ class Database:
     #         self._raise_ConnectionError(error)
 
     @connectionErrorWrapper
-    def get_message(self, id):
+    def get_message(self, id, timeout=0):
         """
-        Get message on pubsub connection
+        Get message on pubsub connection, waiting up to timeout seconds
         """
 
-        message = self.pubsubs[id].get_message()
+        message = self.pubsubs[id].get_message(timeout=timeout)
 
         return message
 
+    def close_pubsub(self, id):
+        """
+        Unsubscribe and close a pubsub connection
+        """
+
+        ps = self.pubsubs.pop(id, None)
+        if ps:
+            try:
+                ps.close()
+            except redis.exceptions.ConnectionError:
+                pass
+
     # def get_message(self, id):
     #     """
     #     Get message on pubsub connection
@@ -0,0 +1,242 @@
+"""Shared reading and parsing of Dectris miniCBF headers"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-18"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import argparse
+import importlib
+import re
+import time
+import timeit
+
+# Marker for the last line of the header
+HEADER_END = "X-Binary-Size-Padding"
+
+# Bytes read at a time looking for the end of the header
+HEADER_CHUNK = 8192
+
+# No header is larger than this
+HEADER_LIMIT = 131072
+
+def mmorm(x):
+    """Distance in m or mm to mm"""
+    d = float(x)
+    if d < 2:
+        return d*1000
+    else:
+        return d
+
+def read_header_block(image, logger=False, attempts=10):
+    """
+    Return the text of the header of a CBF image, up to and including the
+    X-Binary-Size-Padding line, without reading the binary data
+    """
+
+    count = 0
+    while count < attempts:
+        try:
+            header = ""
+            with open(image, "rb") as raw:
+                while len(header) < HEADER_LIMIT:
+                    chunk = raw.read(HEADER_CHUNK)
+                    if not chunk:
+                        break
+                    header += chunk
+                    end = header.find(HEADER_END)
+                    if end > -1:
+                        # Keep the rest of the marker line
+                        line_end = header.find("\n", end)
+                        if line_end > -1:
+                            return header[:line_end+1]
+            return header
+        except IOError:
+            count += 1
+            if logger:
+                logger.exception("Error opening %s" % image)
+            time.sleep(0.1)
+
+    raise IOError("Unable to read header of %s" % image)
+
+class HeaderParser(object):
+    """
+    Parse a CBF header in one pass over its lines
+
+    Fields are given as {label: (tag, pattern, transform)}. tag is the first
+    word of the line the field is on, after any leading "#" - for example
+    "Beam_xy" or "X-Binary-Size-Fastest-Dimension:". A tag of None is tried
+    against every line that has no field tagged to it. pattern is a regular
+    expression matched against that line, whose first group is passed to
+    transform. As with repeated lines before, the last match wins and
+    fields that are not found are None.
+    """
+
+    def __init__(self, fields):
+
+        self.labels = fields.keys()
+        self.tagged = {}
+        self.untagged = []
+
+        for label, (tag, pattern, transform) in fields.iteritems():
+            entry = (label, re.compile(pattern), transform)
+            if tag is None:
+                self.untagged.append(entry)
+            else:
+                self.tagged.setdefault(tag, []).append(entry)
+
+    def parse(self, header):
+        """Return a dict of all fields found in the header text"""
+
+        parameters = dict.fromkeys(self.labels)
+
+        tagged = self.tagged
+        untagged = self.untagged
+
+        for line in header.splitlines():
+            tokens = line.split(None, 2)
+            if not tokens:
+                continue
+            if tokens[0] == "#":
+                if len(tokens) == 1:
+                    continue
+                tag = tokens[1]
+            else:
+                tag = tokens[0]
+
+            for label, pattern, transform in tagged.get(tag, untagged):
+                match = pattern.search(line)
+                if match:
+                    parameters[label] = transform(match.group(1))
+
+        return parameters
+
+def legacy_parse(header, fields):
+    """
+    Parse the header the way the detector modules used to - recompile each
+    field's pattern and search the whole header. Kept for benchmarking.
+    """
+
+    parameters = {}
+    for label, (__, pattern, transform) in fields.iteritems():
+        matches = re.compile(pattern, re.MULTILINE).findall(header)
+        if len(matches) > 0:
+            parameters[label] = transform(matches[-1])
+        else:
+            parameters[label] = None
+    return parameters
+
+def legacy_read(image):
+    """Read the header the way the detector modules used to"""
+
+    header = ""
+    with open(image, "rb") as raw:
+        for line in raw:
+            header += line
+            if line.count(HEADER_END):
+                break
+    return header
+
+def benchmark(image, detector, repeat=100):
+    """
+    Time reading and parsing the header of image with the legacy and shared
+    parsers, and check that they agree
+
+    Keyword arguments
+    image -- CBF image
+    detector -- detector module with HEADER_ITEMS, e.g. detectors.dectris.dectris_eiger16m
+    repeat -- number of times each is run (default 100)
+    """
+
+    fields = detector.HEADER_ITEMS
+    parser = HeaderParser(fields)
+
+    legacy = legacy_parse(legacy_read(image), fields)
+    shared = parser.parse(read_header_block(image))
+
+    results = {
+        "agree": legacy == shared,
+        "differences": dict((label, (legacy[label], shared[label])) \
+            for label in fields if legacy[label] != shared[label]),
+        "legacy": timeit.timeit(lambda: legacy_parse(legacy_read(image), fields),
+                                number=repeat) / repeat,
+        "shared": timeit.timeit(lambda: parser.parse(read_header_block(image)),
+                                number=repeat) / repeat,
+        }
+
+    return results
+
+def get_commandline():
+    """
+    Grabs the commandline
+    """
+
+    # Parse the commandline arguments
+    commandline_description = "Benchmark the shared CBF header parser against the legacy one"
+    parser = argparse.ArgumentParser(description=commandline_description)
+
+    parser.add_argument("-d", "--detector",
+                        action="store",
+                        dest="detector",
+                        default="dectris_eiger16m",
+                        help="Detector module in detectors.dectris")
+
+    parser.add_argument("-n", "--repeat",
+                        action="store",
+                        dest="repeat",
+                        type=int,
+                        default=100,
+                        help="Number of reads of each image")
+
+    parser.add_argument(action="store",
+                        dest="images",
+                        nargs="+",
+                        help="CBF images")
+
+    return parser.parse_args()
+
+def main(args):
+    """
+    The main process docstring
+    This function is called when this module is invoked from
+    the commandline
+    """
+
+    detector = importlib.import_module("detectors.dectris.%s" % args.detector)
+
+    for image in args.images:
+        results = benchmark(image, detector, args.repeat)
+        print "%s" % image
+        print "  legacy  %8.1f us" % (results["legacy"] * 1e6)
+        print "  shared  %8.1f us" % (results["shared"] * 1e6)
+        print "  speedup %8.1fx" % (results["legacy"] / results["shared"])
+        if not results["agree"]:
+            print "  DISAGREE %s" % results["differences"]
+
+if __name__ == "__main__":
+
+    # Get the commandline args
+    commandline_args = get_commandline()
+
+    # Execute code
+    main(args=commandline_args)
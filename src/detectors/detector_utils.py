@@ -42,6 +42,7 @@ from iotbx.detectors import ImageFactory
 
 # RAPD imports
 import utils.convert_hdf5_cbf as convert_hdf5_cbf
+import utils.hdf5_reader as hdf5_reader
 import utils.text as text
 import detector_list
 
@@ -432,13 +433,11 @@ def print_hdf5_header_info(file_name):
     print ""
 
 def read_hdf5_header(file_name) :
-    """Searched the HDF5 file header for information and returns a dict"""
-    h5_file = h5py.File(file_name, 'r') # open read-only
-    # item = h5_file #["/Configure:0000/Run:0000"]
-    header = {}
-    interrogate_hdf5_item_structure("root", h5_file, header)
-    h5_file.close()
-    return header
+    """
+    Looks up the parameters_to_get in the HDF5 master file by their NeXus
+    paths and returns a dict. The data files are not opened.
+    """
+    return hdf5_reader.read_header(file_name, parameters_to_get)
 
 def interrogate_hdf5_item_structure(key, g, header) :
     """Prints the input file/group/dataset (g) name and begin iterations on its content"""
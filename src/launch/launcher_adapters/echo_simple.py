@@ -128,4 +128,4 @@ class LauncherAdapter(object):
 
         # Pass back result
         self.redis.publish("RAPD_RESULTS", json_message)
-        self.redis.lpush("RAPD_RESULTS", json_message)
+        self.redis.lpush("RAPD_RESULTS", json.pack(self.message, json_message))
@@ -27,7 +27,6 @@ __email__ = "fmurphy@anl.gov"
 __status__ = "Development"
 
 import logging
-import os
 from subprocess import Popen
 
 # RAPD imports
@@ -53,6 +52,7 @@ class LauncherAdapter(object):
         self.site = site
         self.message = message
         self.settings = settings
+        self.process = None
 
         self.run()
 
@@ -67,22 +67,14 @@ class LauncherAdapter(object):
             # send message to simple_echo
             echo.LauncherAdapter(self.site, self.message, self.settings)
         else:
-            # Adjust the message to this site
-            #self.fix_command()
-            self.message = launch_tools.fix_command(self.message)
-    
-            # Put the command into a file
-            #command_file = launch_tools.write_command_file(self.settings["launch_dir"],
-            command_file = launch_tools.write_command_file(os.path.join(self.settings["launch_dir"],'command_files'),
-                                                           self.message["command"],
-                                                           self.message)
-    
-            # Set the site tag from input
-            site_tag = launch_tools.get_site_tag(self.message).split('_')[0]
+            # Adjust the message to this site and put it into a file
+            self.message, site_tag, command_file = launch_tools.prepare_command(self.message,
+                                                                                self.settings)
     
             # Call the launch process on the command file
             self.logger.debug("rapd.launch -s %s %s", site_tag, command_file)
-            Popen(["rapd.launch", "-s",site_tag, command_file])
+            # Kept so the shell executor can wait on the job
+            self.process = Popen(["rapd.launch", "-s",site_tag, command_file])
             # Can use a queue to get the PID of the launched job
             #Process(target=local_subprocess,
             #        kwargs={"command": "rapd.launch -s %s %s" %(site_tag, command_file)
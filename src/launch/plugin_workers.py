@@ -0,0 +1,174 @@
+"""
+Warm plugin workers for the shell launcher - processes forked after the heavy
+imports are done, which run jobs without starting a new interpreter
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-25"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import importlib
+import logging
+import multiprocessing
+import Queue
+import threading
+
+# RAPD imports
+from launch.rapd_launch import Launch
+from utils.modules import load_module
+import utils.site
+
+# Modules imported before the workers are forked
+PRELOAD_MODULES = (
+    "numpy",
+    "cctbx.crystal",
+    "cctbx.miller",
+    "cctbx.sgtbx",
+    "iotbx.cif",
+    "iotbx.mtz",
+    "iotbx.pdb",
+    )
+
+# Plugins imported before the workers are forked, if the launcher takes ALL jobs
+PRELOAD_COMMANDS = ("INDEX", "INTEGRATE")
+
+# Where plugins are found if the site does not say
+PLUGIN_DIRECTORIES = ("sites.plugins", "plugins")
+
+def preload(site, commands=PRELOAD_COMMANDS, modules=PRELOAD_MODULES, logger=None):
+    """
+    Import modules and the plugins for commands, so processes forked
+    afterwards start with them loaded
+    """
+
+    logger = logger or logging.getLogger("RAPDLogger")
+
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            logger.exception("Unable to preload %s", module)
+
+    plugin_directories = getattr(site, "RAPD_PLUGIN_DIRECTORIES", PLUGIN_DIRECTORIES)
+    for command in commands:
+        directories = [directory+".%s" % command.lower() for directory in plugin_directories]
+        try:
+            load_module(seek_module="plugin", directories=directories)
+        except Exception:
+            logger.exception("Unable to preload plugin for %s", command)
+
+def launch_job(site_tag, command_file):
+    """
+    Run a command file as rapd.launch would. Called in a process forked from
+    a worker, so each job starts from the same warm state.
+    """
+
+    # Drop the launcher's log handlers - Launch sets up the job's own
+    logging.getLogger("RAPDLogger").handlers = []
+
+    site = importlib.import_module(utils.site.determine_site(site_arg=site_tag))
+    Launch(site, command_file)
+
+    # Wait for plugin threads, as the interpreter would before exiting.
+    # Plugin processes are joined by multiprocessing.
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join()
+
+def worker_loop(connection):
+    """
+    Run (site_tag, command_file) jobs received on connection, each in its
+    own forked process, and send back the exit code. Stops on None.
+    """
+
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        process = multiprocessing.Process(target=launch_job, args=job)
+        process.start()
+        process.join()
+        connection.send(process.exitcode)
+
+class WorkerPool(object):
+    """
+    Pool of warm worker processes
+
+    The workers are forked when the pool is made, so make it after preload()
+    and before the launcher starts any threads. run() hands a job to an idle
+    worker over a pipe and blocks until it is finished.
+    """
+
+    def __init__(self, size, logger=None):
+        """
+        Keyword arguments
+        size -- number of workers
+        logger -- logger instance (default RAPDLogger)
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+
+        self.workers = []
+        self.idle = Queue.Queue()
+
+        for __ in range(size):
+            parent_connection, child_connection = multiprocessing.Pipe()
+            # Not daemonic - daemonic processes cannot fork the jobs
+            process = multiprocessing.Process(target=worker_loop, args=(child_connection,))
+            process.start()
+            child_connection.close()
+            self.workers.append((process, parent_connection))
+            self.idle.put((process, parent_connection))
+
+    def run(self, site_tag, command_file):
+        """
+        Run command_file in a warm worker and return the exit code of the job.
+        Raises EOFError or IOError if the worker has died - it is not replaced,
+        as forking the threaded launcher is not safe.
+        """
+
+        process, connection = self.idle.get()
+        try:
+            connection.send((site_tag, command_file))
+            exitcode = connection.recv()
+        except (EOFError, IOError):
+            self.logger.exception("Worker %d has died", process.pid)
+            self.workers.remove((process, connection))
+            raise
+
+        self.idle.put((process, connection))
+        return exitcode
+
+    def stop(self):
+        """Stop the workers once their jobs are done"""
+
+        for process, connection in self.workers:
+            try:
+                connection.send(None)
+            except IOError:
+                pass
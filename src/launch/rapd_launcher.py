@@ -30,14 +30,17 @@ __status__ = "Production"
 
 # Standard imports
 import argparse
+import functools
 import importlib
 from pprint import pprint
 import redis.exceptions
+import subprocess
 import sys
 import time
 
 # RAPD imports
 from utils.commandline import base_parser
+import utils.launch_tools as launch_tools
 from utils.lock import lock_file, close_lock_file
 import utils.log
 from utils.modules import load_module
@@ -45,7 +48,9 @@ from utils.overwatch import Registrar
 import utils.site
 import utils.text as text
 from utils.text import json
-from utils.processes import mp_pool, total_nproc
+from utils.processes import total_nproc
+import launch.plugin_workers as plugin_workers
+import launch.shell_executor as shell_executor
 from bson.objectid import ObjectId
 from threading import Thread
 
@@ -54,6 +59,15 @@ from multiprocessing.util import Finalize
 
 BUFFER_SIZE = 8192
 
+# Seconds to block waiting for a job before checking in
+BLOCKING_TIMEOUT = 1
+
+# Seconds between Overwatch updates
+OW_INTERVAL = 1
+
+# Times a job is launched before it is dropped
+MAX_LAUNCH_ATTEMPTS = 3
+
 class Launcher(object):
     """
     Connects to Redis instance, listens for jobs, and spawns new threads using defined
@@ -64,7 +78,8 @@ class Launcher(object):
     ip_address = None
     launcher = None
     tag = None
-    pool = None
+    executor = None
+    workers = None
 
     def __init__(self, site, tag="", logger=None, overwatch_id=False):
         """
@@ -112,34 +127,63 @@ class Launcher(object):
             self.ow_registrar.register({"site_id":json.dumps(self.launcher.get('site_tag')),
                                         "job_list":self.job_list})
 
+        # Jobs taken by an earlier instance of this launcher that were never launched
         try:
-            timer = 0
+            recovered = launch_tools.recover_jobs(self.redis, self.job_list, self.launcher_id)
+            if recovered and self.logger:
+                self.logger.info("Recovered %d unlaunched jobs from %s",
+                                 recovered,
+                                 self.processing_list)
+        except redis.exceptions.ConnectionError:
+            if self.logger:
+                self.logger.exception("Unable to recover jobs from %s", self.processing_list)
+
+        try:
+            ow_time = 0
             # This is the server portion of the code
             while self.running:
-                # Have Registrar update status every second
-                if round(timer%1,1) in (0.0,1.0):
-                    if self.overwatch_id:
-                        #self.ow_registrar.update({"site_id":self.site.ID,
-                        self.ow_registrar.update({"site_id":json.dumps(self.launcher.get('site_tag')),
-                                                  "job_list":self.job_list})
-                        #self.ow_registrar.update({"job_list":self.job_list})
-
-                # Look for a new command
+                # Have Registrar update status every OW_INTERVAL seconds
+                if self.overwatch_id and time.time() - ow_time >= OW_INTERVAL:
+                    #self.ow_registrar.update({"site_id":self.site.ID,
+                    self.ow_registrar.update(self.get_status())
+                    ow_time = time.time()
+
+                # Leave jobs on the job list while the executor is backed up
+                if self.executor and not self.executor.wait_for_room(BLOCKING_TIMEOUT):
+                    continue
+
+                # Block for a new command, which is kept on the processing
+                # list until it has been launched
                 # This will throw a redis.exceptions.ConnectionError if redis is unreachable
-                #command = self.redis.brpop(["RAPD_JOBS",], 5)
                 try:
-                    while self.redis.llen(self.job_list) != 0:
-                        command = self.redis.rpop(self.job_list)
-                        # Handle the message
-                        if command:
-                            self.handle_command(json.loads(command))
-
-                            # Only run 1 command
-                            # self.running = False
-                            # break
-                    # sleep a little when jobs aren't coming in.
-                    time.sleep(0.2)
-                    timer += 0.2
+                    command = self.redis.brpoplpush(self.job_list,
+                                                    self.processing_list,
+                                                    BLOCKING_TIMEOUT)
+                    # Handle the message
+                    if command:
+                        # Acknowledge once launched
+                        ack = functools.partial(self.redis.lrem, self.processing_list, command)
+                        try:
+                            message = json.unpack(command)
+                        except Exception:
+                            # Can never be launched
+                            if self.logger:
+                                self.logger.exception("Dropping unreadable command %s", command)
+                            ack()
+                            continue
+                        try:
+                            self.handle_command(message,
+                                                ack,
+                                                functools.partial(self.retry_command,
+                                                                  command,
+                                                                  message))
+                        except redis.exceptions.ConnectionError:
+                            # Stays on the processing list, recovered on restart
+                            raise
+                        except Exception:
+                            if self.logger:
+                                self.logger.exception("Error launching %s", command)
+                            self.retry_command(command, message)
                 except redis.exceptions.ConnectionError:
                     if self.logger:
                         self.logger.exception("Remote Redis is not up. Waiting for Sentinal to switch to new host")
@@ -153,14 +197,33 @@ class Launcher(object):
         self.running = False
         # Close the file lock handle
         close_lock_file()
-        # Try to close the pool. Python bugs gives errors!
-        if self.pool:
-            self.pool.close()
-            self.pool.join()
+        # Stop starting jobs - those not started stay on the processing list
+        if self.executor:
+            self.executor.stop()
+        if self.workers:
+            self.workers.stop()
         # Tell overwatch it is closing
         if self.overwatch_id:
             self.ow_registrar.stop()
 
+    def retry_command(self, command, message):
+        """
+        Put a command that failed to launch back on the job list, or drop it
+        once it has failed MAX_LAUNCH_ATTEMPTS times
+        """
+
+        retry = launch_tools.get_retry(message, MAX_LAUNCH_ATTEMPTS)
+        if retry:
+            self.redis.requeue(self.processing_list, command, self.job_list, json.pack(retry))
+            # Give whatever stopped it a moment to clear
+            time.sleep(BLOCKING_TIMEOUT)
+        else:
+            if self.logger:
+                self.logger.error("Dropping %s after %d failed launches",
+                                  command,
+                                  MAX_LAUNCH_ATTEMPTS)
+            self.redis.lrem(self.processing_list, command)
+
     def connect_to_redis(self):
         """Connect to the redis instance"""
         redis_database = importlib.import_module('database.redis_adapter')
@@ -168,12 +231,14 @@ class Launcher(object):
         self.redis = redis_database.Database(settings=self.site.CONTROL_DATABASE_SETTINGS, 
                                              logger=self.logger)
 
-    def handle_command(self, command):
+    def handle_command(self, command, ack=False, retry=False):
         """
         Handle an incoming command
 
         Keyword arguments:
         command -- command from redis
+        ack -- called with no arguments once the command is launched
+        retry -- called with no arguments if the executor fails to launch it
         """
         print "handle_command"
         pprint(command)
@@ -184,16 +249,53 @@ class Launcher(object):
             self.logger.debug("Command received channel:%s  message: %s", self.job_list, message)
 
         # Use the adapter to launch
-        #self.adapter(self.site, message, self.launcher)
         # If running thru a shell limit the number of running processes
-        if self.pool:
+        if self.executor:
             if self.logger:
-                self.logger.debug("Launching using apply_async")
-            self.pool.apply_async(self.adapter(self.site, message, self.launcher))
+                self.logger.debug("Queueing in the shell executor")
+            self.executor.submit(message, on_start=ack, on_error=retry)
         else:
             if self.logger:
                 self.logger.debug("Launching directly")
             self.adapter(self.site, message, self.launcher)
+            if ack:
+                ack()
+
+    def run_job(self, message, started):
+        """
+        Launch message with the adapter, call started() once it is launched
+        and wait for the job to finish
+        """
+
+        # Warm workers take everything but ECHO
+        if self.workers and self.workers.workers and message.get("command") != "ECHO":
+            message, site_tag, command_file = launch_tools.prepare_command(message,
+                                                                           self.launcher)
+            if self.logger:
+                self.logger.debug("Running %s in a warm worker", command_file)
+            started()
+            try:
+                self.workers.run(site_tag, command_file)
+            except (EOFError, IOError):
+                # The worker died - fall back to a new interpreter
+                subprocess.call(["rapd.launch", "-s", site_tag, command_file])
+            return
+
+        adapter = self.adapter(self.site, message, self.launcher)
+        started()
+        # Adapters that start a process leave it on the instance
+        process = getattr(adapter, "process", None)
+        if process:
+            process.wait()
+
+    def get_status(self):
+        """Return the launcher status for the Overwatch Registrar"""
+
+        status = {"site_id":json.dumps(self.launcher.get('site_tag')),
+                  "job_list":self.job_list}
+        if self.executor:
+            status["jobs"] = json.dumps(self.executor.status())
+        return status
 
     def get_settings(self):
         """
@@ -239,17 +341,44 @@ s IP address (%s), but not for the input tag (%s)" % (self.ip_address, self.tag)
         else:
             # Get the job_list to watch for this launcher
             self.job_list = self.launcher.get('job_list')
+            # Jobs taken off job_list by this launcher that are not yet launched -
+            # the launcher lock makes this ip_address and tag unique
+            self.launcher_id = "%s_%s" % (self.ip_address, self.tag)
+            self.processing_list = launch_tools.get_processing_list(self.job_list,
+                                                                    self.launcher_id)
 
     def check_settings(self):
         """Check if additional params in self.launcher need setup."""
-        # Check if a multiprocessing.Pool needs to be setup for launcher adapter.
+        # Check if an executor needs to be setup for launcher adapter.
         if self.tag == 'shell':
             if self.launcher.get('pool_size', False):
                 size = self.launcher.get('pool_size')
             else:
-                size = total_nproc()-1
+                size = max(1, total_nproc()-1)
+
+            # Warm workers are forked before the executor starts its threads
+            warm_workers = self.launcher.get('warm_workers', False)
+            if warm_workers:
+                if warm_workers is True:
+                    warm_workers = size
+                commands = [job_type for job_type in self.launcher.get('job_types', ()) \
+                            if job_type != 'ALL']
+                plugin_workers.preload(site=self.site,
+                                       commands=commands or plugin_workers.PRELOAD_COMMANDS,
+                                       modules=self.launcher.get('warm_modules',
+                                                                 plugin_workers.PRELOAD_MODULES),
+                                       logger=self.logger)
+                self.workers = plugin_workers.WorkerPool(size=int(warm_workers),
+                                                         logger=self.logger)
+
             # Make sure its an integer
-            self.pool = mp_pool(int(size))
+            self.executor = shell_executor.ShellExecutor(run_job=self.run_job,
+                                                        pool_size=int(size),
+                                                        job_limits=self.launcher.get('job_limits'),
+                                                        job_priorities=self.launcher.get('job_priorities'),
+                                                        max_queued=self.launcher.get('max_queued',
+                                                                                     shell_executor.MAX_QUEUED),
+                                                        logger=self.logger)
 
     def load_adapter(self):
         """Find and load the adapter"""
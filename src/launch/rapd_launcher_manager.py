@@ -50,6 +50,15 @@ from utils.text import json
 # Timer (s) for checking which launchers are alive.
 TIMER = 5
 
+# Seconds to block waiting for a job before checking in
+BLOCKING_TIMEOUT = 1
+
+# Times a job is tried before it is dropped
+MAX_ASSIGN_ATTEMPTS = 3
+
+# Launcher id of the manager's own processing list
+PROCESSING_ID = "launch_manager"
+
 class Launcher_Manager(Thread):
     """
     Listens to the 'RAPD_JOBS'list and sends jobs to proper
@@ -80,9 +89,11 @@ class Launcher_Manager(Thread):
         self.overwatch_id = overwatch_id
 
         self.running = True
-        self.timer = 0
         self.job_list = []
 
+        # Jobs taken off RAPD_JOBS that are not yet pushed to a launcher
+        self.processing_list = launch_tools.get_processing_list("RAPD_JOBS", PROCESSING_ID)
+
         self.connect_to_redis()
 
         self.start()
@@ -100,34 +111,45 @@ class Launcher_Manager(Thread):
         # Get the initial possible jobs lists
         full_job_list = [x.get('job_list') for x in self.site.LAUNCHER_SETTINGS["LAUNCHER_SPECIFICATIONS"]]
 
+        # Jobs taken by an earlier instance that were never pushed to a launcher
+        try:
+            recovered = launch_tools.recover_jobs(self.redis, "RAPD_JOBS", PROCESSING_ID)
+            if recovered:
+                self.logger.info("Recovered %d unassigned jobs", recovered)
+        except redis.exceptions.ConnectionError:
+            self.logger.exception("Unable to recover jobs from %s", self.processing_list)
+
+        check_time = 0
         try:
             # This is the server portion of the code
             while self.running:
                 # Get updated job list by checking which launchers are running
                 # Reassign jobs if launcher(s) status changes
-                if round(self.timer%TIMER,1) == 1.0:
+                if time.time() - check_time >= TIMER:
+                    check_time = time.time()
                     try:
                         # Have Registrar update status
                         if self.overwatch_id:
                             self.ow_registrar.update()
 
                         # Check which launchers are running
-                        temp = [l for l in full_job_list if self.redis.get("OW:"+l)]
+                        running = self.redis.mget(["OW:"+l for l in full_job_list])
+                        temp = [l for l, status in zip(full_job_list, running) if status]
 
                         # Determine which launcher(s) went offline
                         offline = [line for line in self.job_list if temp.count(line) == False]
                         if len(offline) > 0:
-                            # Pop waiting jobs off their job_lists and push back in RAPD_JOBS for reassignment.
+                            # Pop waiting jobs off their job_lists, and any their launchers had
+                            # taken but not launched, and push back in RAPD_JOBS for reassignment.
                             for _l in offline:
-                                while self.redis.llen(_l) != 0:
-                                    self.redis.rpoplpush(_l, 'RAPD_JOBS')
+                                self.redis.rpoplpush_all(_l, 'RAPD_JOBS')
+                                launch_tools.recover_all_jobs(self.redis, _l, 'RAPD_JOBS')
 
                         # Determine which launcher(s) came online (Also runs at startup!)
                         online = [line for line in temp if self.job_list.count(line) == False]
                         if len(online) > 0:
                             # Pop jobs off RAPD_JOBS_WAITING and push back onto RAPD_JOBS for reassignment.
-                            while self.redis.llen('RAPD_JOBS_WAITING') != 0:
-                                self.redis.rpoplpush('RAPD_JOBS_WAITING', 'RAPD_JOBS')
+                            self.redis.rpoplpush_all('RAPD_JOBS_WAITING', 'RAPD_JOBS')
 
                         # Update the self.job_list
                         self.job_list = temp
@@ -137,21 +159,33 @@ class Launcher_Manager(Thread):
                             self.logger.exception("Remote Redis is not up. Waiting for Sentinal to switch to new host")
                         time.sleep(1)
 
-                # Look for a new command
+                # Block for a new command, which is kept on the processing
+                # list until it has been pushed to a launcher
                 # This will throw a redis.exceptions.ConnectionError if redis is unreachable
-                #command = self.redis.brpop(["RAPD_JOBS",], 5)
                 try:
-                    while self.redis.llen("RAPD_JOBS") != 0:
-                        command = self.redis.rpop("RAPD_JOBS")
-                        # Handle the message
-                        if command:
-                            self.push_command(json.loads(command))
-                            # Only run 1 command
-                            # self.running = False
-                            # break
-                    # sleep a little when jobs aren't coming in.
-                    time.sleep(0.2)
-                    self.timer += 0.2
+                    command = self.redis.brpoplpush("RAPD_JOBS",
+                                                    self.processing_list,
+                                                    BLOCKING_TIMEOUT)
+                    # Handle the message
+                    if command:
+                        try:
+                            message = json.unpack(command)
+                        except:
+                            # Unreadable - it will never be assigned
+                            self.logger.exception("Unable to read %s", command)
+                            self.redis.lrem(self.processing_list, command)
+                            continue
+                        try:
+                            self.push_command(message)
+                        except redis.exceptions.ConnectionError:
+                            # Left on the processing list for recovery
+                            raise
+                        except:
+                            self.logger.exception("Error assigning %s", command)
+                            self.retry_command(command, message)
+                        else:
+                            # Assigned - acknowledge
+                            self.redis.lrem(self.processing_list, command)
                 except redis.exceptions.ConnectionError:
                     if self.logger:
                         self.logger.exception("Remote Redis is not up. Waiting for Sentinal to switch to new host")
@@ -167,6 +201,24 @@ class Launcher_Manager(Thread):
         if self.overwatch_id:
             self.ow_registrar.stop()
 
+    def retry_command(self, command, message):
+        """
+        Put a command that failed to be assigned back on RAPD_JOBS, or drop
+        it once it has failed MAX_ASSIGN_ATTEMPTS times
+        """
+
+        retry = launch_tools.get_retry(message, MAX_ASSIGN_ATTEMPTS)
+        if retry:
+            self.redis.requeue(self.processing_list, command, "RAPD_JOBS", json.pack(retry))
+            # Give whatever stopped it a moment to clear
+            time.sleep(BLOCKING_TIMEOUT)
+        else:
+            if self.logger:
+                self.logger.error("Dropping %s after %d failed assignments",
+                                  command,
+                                  MAX_ASSIGN_ATTEMPTS)
+            self.redis.lrem(self.processing_list, command)
+
     def set_launcher(self, command=False, site_tag=False):
         """Find the correct running launcher to launch a specific job COMMAND"""
         # list of commands to look for in the 'job_types'
@@ -228,11 +280,11 @@ class Launcher_Manager(Thread):
             message["directories"]["launch_dir"] = launch_dir
 
             # Push the job on the correct launcher job list
-            self.redis.lpush(launcher, json.dumps(message))
+            self.redis.lpush(launcher, json.pack(message))
             if self.logger:
                 self.logger.debug("Command sent channel:%s  message: %s", launcher, message)
         else:
-            self.redis.lpush('RAPD_JOBS_WAITING', json.dumps(message))
+            self.redis.lpush('RAPD_JOBS_WAITING', json.pack(message))
             if self.logger:
                 self.logger.debug("Could not find a running launcher for this job. Putting job on RAPD_JOBS_WAITING list")
 
@@ -0,0 +1,215 @@
+"""
+Runs jobs for the shell launcher on the local machine, with limits on how many
+of each command run at once and an order in which waiting jobs are started
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-22"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import collections
+import itertools
+import logging
+import threading
+
+# Most of each command that may run at once. Commands not listed are only
+# limited by the pool size.
+JOB_LIMITS = {
+    "INTEGRATE": 2,
+    "XDS": 2,
+    "MR": 1,
+    "PDBQUERY": 1,
+    }
+
+# Order in which waiting jobs are started, lowest first. Snaps are indexed
+# ahead of everything, background molecular replacement goes last.
+JOB_PRIORITIES = {
+    "ECHO": 0,
+    "INDEX": 0,
+    "INTEGRATE": 1,
+    "XDS": 1,
+    "ANALYSIS": 2,
+    "MR": 4,
+    "PDBQUERY": 4,
+    }
+DEFAULT_PRIORITY = 3
+
+# Jobs held waiting before the launcher stops taking more
+MAX_QUEUED = 50
+
+class ShellExecutor(object):
+    """
+    Pool of threads that run jobs, pool_size at a time and at most
+    job_limits[command] of a command at a time. The next job started is the
+    waiting one with the lowest job_priorities value whose command is below
+    its limit, oldest first.
+
+    run_job is called as run_job(message, started). It calls started() once
+    the job is launched, and should return when the job has finished, so
+    that the job counts against the limits while it runs.
+
+    The launcher settings may override the defaults with "pool_size",
+    "job_limits", "job_priorities" and "max_queued".
+    """
+
+    def __init__(self,
+                 run_job,
+                 pool_size,
+                 job_limits=None,
+                 job_priorities=None,
+                 max_queued=MAX_QUEUED,
+                 logger=None):
+        """
+        Keyword arguments
+        run_job -- function called as run_job(message, started) to run a job
+        pool_size -- most jobs running at once
+        job_limits -- dict of most jobs running at once per command (default JOB_LIMITS)
+        job_priorities -- dict of start order per command (default JOB_PRIORITIES)
+        max_queued -- jobs held waiting before full() (default MAX_QUEUED)
+        logger -- logger instance (default RAPDLogger)
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+
+        self.run_job = run_job
+        self.pool_size = pool_size
+        self.job_limits = job_limits or JOB_LIMITS
+        self.job_priorities = job_priorities or JOB_PRIORITIES
+        self.max_queued = max_queued
+
+        # Waiting jobs as (priority, sequence, command, message, on_start, on_error)
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.running = collections.Counter()
+        self.stopped = False
+        self.condition = threading.Condition()
+
+        self.threads = []
+        for __ in range(pool_size):
+            thread = threading.Thread(target=self.worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, message, on_start=None, on_error=None):
+        """
+        Queue a job. on_start is called with no arguments once run_job has
+        launched the job, or run_job has returned. on_error is called with no
+        arguments if run_job fails before launching it.
+        """
+
+        command = message.get("command")
+        priority = self.job_priorities.get(command, DEFAULT_PRIORITY)
+
+        with self.condition:
+            self.waiting.append((priority, next(self.sequence), command, message, on_start, on_error))
+            self.condition.notify_all()
+
+    def full(self):
+        """Return True if no more jobs should be submitted for now"""
+
+        return len(self.waiting) >= self.max_queued
+
+    def wait_for_room(self, timeout):
+        """Wait up to timeout seconds for the queue not to be full. Returns not full()"""
+
+        with self.condition:
+            if self.full():
+                self.condition.wait(timeout)
+            return not self.full()
+
+    def status(self):
+        """Return a dict of jobs running and waiting by command"""
+
+        with self.condition:
+            waiting = collections.Counter(job[2] for job in self.waiting)
+            return {"running": dict(self.running),
+                    "waiting": dict(waiting),
+                    "saturated": self.full()}
+
+    def stop(self):
+        """
+        Stop starting jobs. Running jobs finish, waiting jobs are dropped -
+        their on_start has not been called.
+        """
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def next_job(self):
+        """Take the next job that may start off waiting, or return None"""
+
+        if sum(self.running.values()) >= self.pool_size:
+            return None
+
+        runnable = [job for job in self.waiting \
+                    if self.running[job[2]] < self.job_limits.get(job[2], self.pool_size)]
+        if not runnable:
+            return None
+
+        job = min(runnable)
+        self.waiting.remove(job)
+        return job
+
+    def worker(self):
+        """Run jobs until stopped"""
+
+        while True:
+            with self.condition:
+                job = None
+                while not self.stopped:
+                    job = self.next_job()
+                    if job:
+                        break
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                __, __, command, message, on_start, on_error = job
+                self.running[command] += 1
+                # Room in the queue
+                self.condition.notify_all()
+
+            launched = []
+            def started():
+                """Note the job is launched, once"""
+                if not launched:
+                    launched.append(True)
+                    if on_start:
+                        on_start()
+
+            try:
+                self.run_job(message, started)
+                started()
+            except:
+                self.logger.exception("Error running %s job", command)
+                if not launched and on_error:
+                    try:
+                        on_error()
+                    except:
+                        self.logger.exception("Error handling failed %s job", command)
+            finally:
+                with self.condition:
+                    self.running[command] -= 1
+                    self.condition.notify_all()
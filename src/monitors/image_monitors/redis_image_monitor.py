@@ -26,6 +26,7 @@ __email__ = "fmurphy@anl.gov"
 __status__ = "Development"
 
 # Standard imports
+import collections
 import logging
 # import redis
 from threading import Thread
@@ -41,6 +42,9 @@ import database.redis_adapter as redis_database
 # Constants
 #POLLING_REST = 0.1      # Time to rest between checks for new image
 POLLING_REST = 0.01      # Time to rest between checks for new image
+BLOCKING_TIMEOUT = 1     # Seconds to block waiting for an image before housekeeping
+BATCH_SIZE = 100         # Maximum number of images handed off at a time
+OW_INTERVAL = 5          # Seconds between overwatch updates
 
 class Monitor(Thread):
     """Monitor for new data collection images to be submitted to a redis instance"""
@@ -83,6 +87,11 @@ class Monitor(Thread):
         self.notify = notify
         self.overwatch_id = overwatch_id
 
+        # Intake mode
+        settings = self.site.IMAGE_MONITOR_SETTINGS
+        self.blocking = settings.get("BLOCKING_INTAKE", True)
+        self.batch_size = max(1, int(settings.get("BATCH_SIZE", BATCH_SIZE)))
+
         # Figure out tag(s)
         self.get_tags()
 
@@ -133,14 +142,66 @@ class Monitor(Thread):
             # Register
             self.ow_registrar.register()
 
-        # Determine interval for overwatch update
-        ow_round_interval = 50 # int((5 * len(self.image_lists)) / POLLING_REST)
-
         # If we are starting clean
         if self.clean_start:
             for tag in self.tags:
                 self.redis.delete("images_collected:%s" % tag)
 
+        if self.blocking:
+            self.run_blocking()
+        else:
+            self.run_polling()
+
+        self.logger.debug("Exit image monitor loop")
+
+    def run_blocking(self):
+        """
+        Wait on all the image lists at once and hand off images in batches
+
+        A single BRPOP blocks on every tag's list, then whatever else has
+        accumulated on that list is drained in one pipelined round trip.
+        """
+
+        self.logger.debug("Blocking intake, batch size %d", self.batch_size)
+
+        # Keys to block on - rotated so that one busy tag cannot starve others
+        keys = collections.deque(["images_collected:%s" % tag for tag in self.tags])
+
+        last_ow_update = time.time()
+
+        while self.running:
+
+            popped = self.redis.brpop(list(keys), timeout=BLOCKING_TIMEOUT)
+
+            # Have new image(s)
+            if popped:
+                key, new_image = popped
+                tag = key.split(":", 1)[1]
+
+                # Grab the rest of the burst
+                new_images = [new_image] + self.redis.rpop_batch(key, self.batch_size - 1)
+
+                # Notify core thread that images have been collected
+                self.notify({"message_type":"NEWIMAGES",
+                             "images":[{"message_type":"NEWIMAGE",
+                                        "fullname":fullname,
+                                        "site_tag":tag} for fullname in new_images]})
+
+                # Move the served key to the back of the line
+                keys.remove(key)
+                keys.append(key)
+
+            # Have Registrar update status
+            if self.overwatch_id and (time.time() - last_ow_update) > OW_INTERVAL:
+                self.ow_registrar.update()
+                last_ow_update = time.time()
+
+    def run_polling(self):
+        """Poll each image list in turn for new images"""
+
+        # Determine interval for overwatch update
+        ow_round_interval = 50 # int((5 * len(self.image_lists)) / POLLING_REST)
+
         while self.running:
 
             # ~5 seconds between overwatch updates
@@ -187,5 +248,3 @@ class Monitor(Thread):
             # Have Registrar update status
             if self.overwatch_id:
                 self.ow_registrar.update()
-
-        self.logger.debug("Exit image monitor loop")
@@ -350,7 +350,7 @@ calculation",
                 self.connect_to_redis()
 
             # Send results back
-            self.redis.lpush("RAPD_RESULTS", json_results)
+            self.redis.lpush("RAPD_RESULTS", json.pack(self.results, json_results))
             self.redis.publish("RAPD_RESULTS", json_results)
 
     
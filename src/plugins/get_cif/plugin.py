@@ -40,7 +40,6 @@ import argparse
 import logging
 import multiprocessing
 import os
-import shutil
 import subprocess
 import time
 import urllib2
@@ -53,9 +52,9 @@ from mysolr import Solr
 # import utils
 import utils.credits as rcredits
 import utils.global_vars as rglobals
+import utils.structure_cache as structure_cache
 from utils.text import json
 from bson.objectid import ObjectId
-from utils.processes import local_subprocess
 
 # Cache of CIF files
 #CIF_CACHE = rglobals.CIF_CACHE
@@ -65,6 +64,10 @@ from utils.processes import local_subprocess
 # USed for PDBe search server
 UNLIMITED_ROWS = 10000000
 
+# Divided mmCIF and PDB files of the PDB at PDBe, by middle letters and code
+EBI_CIF_URL = "ftp://ftp.ebi.ac.uk/pub/databases/rcsb/pdb/data/structures/divided/mmCIF/%s/%s.cif.gz"
+EBI_PDB_URL = "ftp://ftp.ebi.ac.uk/pub/databases/rcsb/pdb/data/structures/divided/pdb/%s/pdb%s.ent.gz"
+
 # Software dependencies
 VERSIONS = {
     "gnuplot": (
@@ -216,6 +219,9 @@ class RapdPlugin(multiprocessing.Process):
                     level=30,
                     color="blue")
 
+        # Fetch the files not in the structure cache at once
+        prefetch_structures(self.repository, self.pdbs_to_download)
+
         for pdb_code in self.pdbs_to_download:
 
             # self.tprint("    %s" % pdb_code,
@@ -228,7 +234,7 @@ class RapdPlugin(multiprocessing.Process):
 
             # Get the gzipped cif file from the PDBQ server
             self.tprint("      Fetching %s" % cif_file, level=10, color="white")
-            download_cif(pdb_code, cif_file, self.tprint)
+            self.repository.download_cif(pdb_code, cif_file)
 
             # Convert from cif to pdb
             if self.command["preferences"]["pdb"]:
@@ -358,33 +364,17 @@ class NECATRepository():
 
         return output_dict
     
+    def fetch_cif(self, pdb_code):
+        """Return the gzipped CIF file of pdb_code"""
+
+        return fetch_url("%s/entry/get_cif/%s" % (self.server, pdb_code.lower()),
+                         pdb_code,
+                         self.tprint)
+
     def download_cif(self, pdb_code, fname):
         """Download the CIF file to fname"""
-        
-        if os.path.exists(fname):
-            return fname
-        else:
-            try:
-                response = urllib2.urlopen(urllib2.Request(\
-                            "%s/entry/get_cif/%s" % \
-                            (self.server, pdb_code.lower()))\
-                            , timeout=60).read()
-                # Write the  gzip file
-                with open('%s.gz'%fname, "wb") as outfile:
-                    outfile.write(response)
-                    outfile.close()
-                # Unzip the file and pass back path
-                local_subprocess(command = ['gunzip', '%s.gz'%fname])
-                #subprocess.Popen(["gunzip", '%s.gz'%fname]).wait()
-                
-                return fname
-    
-            except urllib2.HTTPError as http_error:
-                if self.tprint:
-                    self.tprint("      %s when fetching %s" % (http_error, pdb_code),
-                                level=50,
-                                color="red")
-                return False
+
+        return download_structure(self, pdb_code, fname)
 
     def cell_search(self, search_params):
         """search for PDBs within unit cell range."""
@@ -465,23 +455,18 @@ class RCSBRepository():
         # Return results
         return output_dict
 
+    def fetch_cif(self, pdb_code):
+        """Return the gzipped CIF file of pdb_code"""
+
+        # PDBe is more reliable
+        return fetch_url(EBI_CIF_URL % (pdb_code.lower()[1:-1], pdb_code.lower()),
+                         pdb_code,
+                         self.tprint)
+
     def download_cif(self, pdb_code, fname):
         """Download the CIF file to fname"""
-        if os.path.exists(fname):
-            return fname
-        else:
-            try:
-                # PDBe is more reliable
-                wget = ['wget', 'ftp://ftp.ebi.ac.uk/pub/databases/rcsb/pdb/data/structures/divided/mmCIF/%s/%s.cif.gz'%(pdb_code.lower()[1:-1], pdb_code.lower())]
-                local_subprocess(command = wget)
-                local_subprocess(command = ['gunzip', '%s.gz'%fname])
-                return fname
-            except:
-                if self.tprint:
-                    self.tprint("     Error when fetching %s" % (pdb_code),
-                                level=50,
-                                color="red")
-                return False
+
+        return download_structure(self, pdb_code, fname)
 
     def cell_search(self, search_params):
         """search for PDBs within unit cell range."""
@@ -557,40 +542,29 @@ class PDBERepository():
         output_dict.update(self.solr_search(query))
         return output_dict
 
+    def fetch_cif(self, pdb_code):
+        """Return the gzipped CIF file of pdb_code"""
+
+        return fetch_url(EBI_CIF_URL % (pdb_code.lower()[1:-1], pdb_code.lower()),
+                         pdb_code,
+                         self.tprint)
+
+    def fetch_pdb(self, pdb_code):
+        """Return the gzipped PDB file of pdb_code"""
+
+        return fetch_url(EBI_PDB_URL % (pdb_code.lower()[1:-1], pdb_code.lower()),
+                         pdb_code,
+                         self.tprint)
+
     def download_cif(self, pdb_code, fname):
         """Download the CIF file to fname"""
-        if os.path.exists(fname):
-            return fname
-        else:
-            try:
-                wget = ['wget', 'ftp://ftp.ebi.ac.uk/pub/databases/rcsb/pdb/data/structures/divided/mmCIF/%s/%s.cif.gz'%(pdb_code.lower()[1:-1], pdb_code.lower())]
-                local_subprocess(command = wget)
-                local_subprocess(command = ['gunzip', '%s.gz'%fname])
-                return fname
-            except:
-                if self.tprint:
-                    self.tprint("     Error when fetching %s" % (pdb_code),
-                                level=50,
-                                color="red")
-                return False
-    
+
+        return download_structure(self, pdb_code, fname)
+
     def download_pdb(self, pdb_code, fname):
         """Download the PDB file to fname"""
-        if os.path.exists(fname):
-            return fname
-        else:
-            try:
-                wget = ['wget', 'ftp://ftp.ebi.ac.uk/pub/databases/rcsb/pdb/data/structures/divided/pdb/%s/pdb%s.ent.gz'%(pdb_code.lower()[1:-1], pdb_code.lower())]
-                local_subprocess(command = wget)
-                shutil.move('pdb%s.ent.gz'%pdb_code.lower(), '%s.gz'%os.path.basename(fname))
-                local_subprocess(command = ['gunzip', '%s.gz'%fname])
-                return fname
-            except:
-                if self.tprint:
-                    self.tprint("     Error when fetching %s" % (pdb_code),
-                                level=50,
-                                color="red")
-                return False
+
+        return download_structure(self, pdb_code, fname, kind="pdb")
  
     def cell_search(self, search_params):
         """search for PDBs within unit cell range."""
@@ -624,6 +598,37 @@ class PDBERepository():
             output_dict[pdb.get('pdb_id').upper()] = {'description': pdb.get('molecule_name')[0]}
         return output_dict
 
+def fetch_url(url, pdb_code, tprint=False):
+    """Return the contents of url, or False if it cannot be read"""
+
+    try:
+        return urllib2.urlopen(urllib2.Request(url), timeout=60).read()
+    except (urllib2.URLError, IOError) as error:
+        if tprint:
+            tprint("      %s when fetching %s" % (error, pdb_code),
+                   level=50,
+                   color="red")
+        return False
+
+def download_structure(repository, pdb_code, fname, kind="cif"):
+    """
+    Write the CIF or PDB file of pdb_code to fname, through the structure
+    cache so it is only downloaded once for all jobs. Returns fname, or
+    False if it could not be had.
+    """
+
+    if os.path.exists(fname):
+        return fname
+
+    cache = structure_cache.get_cache(repository.logger)
+    return cache.get(pdb_code, getattr(repository, "fetch_%s" % kind), fname, kind)
+
+def prefetch_structures(repository, pdb_codes, kind="cif"):
+    """Fetch the files of pdb_codes into the structure cache, several at once"""
+
+    cache = structure_cache.get_cache(repository.logger)
+    return cache.prefetch(pdb_codes, getattr(repository, "fetch_%s" % kind), kind)
+
 def check_pdbq(tprint=False, logger=False):
     """Check the PDBQ server and return which one is working"""
     if rglobals.PDBQ_SERVER:
@@ -45,7 +45,7 @@ import functools
 import logging
 from multiprocessing import Process, Event, Pool
 from multiprocessing import Queue as mp_Queue
-from Queue import Queue
+from Queue import Empty, Queue
 from threading import Thread
 import numpy
 import os
@@ -68,6 +68,7 @@ import plugins.subcontractors.labelit as labelit
 import plugins.subcontractors.mosflm as mosflm
 import plugins.subcontractors.distl as distl
 from plugins.subcontractors.xoalign import RunXOalign
+import plugins.index.strategy_scheduler as strategy_scheduler
 import utils.credits as rcredits
 from utils.r_numbers import try_int, try_float
 #from utils.communicate import rapd_send
@@ -95,6 +96,9 @@ VERSIONS = {
     "raddose": (),
 }
 
+# Seconds between looks at strategy jobs that have not reported finishing
+STRATEGY_POLL = 5.0
+
 class RapdPlugin(Process):
     """
     command format
@@ -195,6 +199,10 @@ class RapdPlugin(Process):
     iso_B = False
     # Dicts for running the Queues
     jobs = {}
+    # Strategy jobs report on strategy_queue as they finish
+    strategy_queue = False
+    strategy_started = {}
+    best_version = "3.2.0"
 
     # The results of the plugin
     results = {"_id":str(ObjectId())}
@@ -459,7 +467,7 @@ class RapdPlugin(Process):
         """Let everyone know we are working on this"""
         self.logger.debug("Sending back on redis")
         json_results = json.dumps(self.results)
-        self.redis.lpush("RAPD_RESULTS", json_results)
+        self.redis.lpush("RAPD_RESULTS", json.pack(self.results, json_results))
         self.redis.publish("RAPD_RESULTS", json_results)
 
     def preprocess(self):
@@ -1240,7 +1248,7 @@ class RapdPlugin(Process):
             else:
                 # Only check best info if we are going to use best
                 # Get the Best version for this machine
-                best_version = xutils.get_best_version()
+                self.best_version = xutils.get_best_version()
                 # Make sure that the BEST install has the detector
                 detector_found = best.check_best_detector(info.DETECTOR_TO_BEST.get(self.image1.get("detector"), None), self.tprint)
                 # No detector in best param file - bail on best
@@ -1252,6 +1260,10 @@ class RapdPlugin(Process):
             if self.multiproc == False:
                 end = st+1
 
+        if not self.strategy_queue:
+            self.strategy_queue = mp_Queue()
+            self.strategy_started = {}
+
         for i in range(st, end):
             # Print for 1st BEST run
             if i == 1:
@@ -1259,13 +1271,29 @@ class RapdPlugin(Process):
             # Run Mosflm for strategy
             if i == 4:
                 self.tprint(arg="  Starting Mosflm runs", level=98, color="white")
-                job = Process(target=self.process_mosflm, name="mosflm%s" % i)
+                job = Process(target=self.run_strategy_job,
+                              name="mosflm%s" % i,
+                              args=(i, self.process_mosflm, ()))
             # Run BEST
             else:
                 # Reduces resolution and reruns Mosflm to calc new files, then runs Best.
-                job = Process(target=self.check_best, name="best%s" % i, args=(i, best_version))
+                job = Process(target=self.run_strategy_job,
+                              name="best%s" % i,
+                              args=(i, self.check_best, (i, self.best_version)))
             job.start()
             self.jobs[str(i)] = job
+            self.strategy_started[i] = time.time()
+
+    def run_strategy_job(self, iteration, target, args):
+        """
+        Run a strategy calculation, then report its iteration on
+        strategy_queue so run_queue can collect it at once
+        """
+
+        try:
+            target(*args)
+        finally:
+            self.strategy_queue.put(iteration)
 
     def process_xoalign(self):
         """
@@ -1547,90 +1575,95 @@ Distance | % Transmission", level=98, color="white")
     def run_queue(self):
         """
         run_queue for strategy.
+
+        Strategy jobs are collected as they finish, whatever their order,
+        with strategy_scheduler deciding what to take from each. Jobs no
+        longer needed for either kind of strategy are stopped.
         """
 
         self.logger.debug("AutoindexingStrategy::run_queue")
         self.tprint(arg="\nStarting strategy calculations", level=98, color="blue")
         self.tprint(90, level="progress")
 
-        # try:
-        def set_best_results(i, x):
-            # Set Best output if it failed after 3 tries
-            if i == 3:
-                if x == 0:
-                    self.best_results = {"best_results_norm":"FAILED"}
-                    self.best_failed = True
-                else:
-                    self.best_anom_results = {"best_results_anom":"FAILED"}
-                    self.best_anom_failed = True
+        st = 0
+        if self.strategy == "mosflm":
+            st = strategy_scheduler.MOSFLM_ITERATION
+        scheduler = strategy_scheduler.StrategyScheduler(first_iteration=st,
+                                                         logger=self.logger)
+        first_print = False
+
+        def best_ok(iteration, kind):
+            """Return True if BEST gave a strategy of kind in iteration"""
+            log = os.path.join(self.labelit_dir, str(iteration), "best%s.log" % kind)
+            return os.path.exists(log) and self.postprocess_best(log) == "OK"
+
+        def collect(iteration, timed_out=False):
+            """Take the results of a finished job"""
+            if timed_out:
+                self.tprint(arg="  Strategy calculation timed out", level=30, color="red")
+            actions = scheduler.job_finished(iteration,
+                                             functools.partial(best_ok, iteration),
+                                             timed_out)
+            for action, kind in actions:
+                if action == "best_failed":
+                    if kind:
+                        self.best_anom_results = {"best_results_anom":"FAILED"}
+                        self.best_anom_failed = True
+                    else:
+                        self.best_results = {"best_results_norm":"FAILED"}
+                        self.best_failed = True
+                elif action == "mosflm":
+                    self.postprocess_mosflm(os.path.join(self.labelit_dir,
+                                                         "mosflm_strat%s.out" % kind))
 
         try:
-            st = 0
-            if self.strategy == "mosflm":
-                st = 4
-            # dict = {}
-            # Run twice for regular(0) and anomalous(1) strategies
-            l = ["", "_anom"]
-            first_print = False
-            for x in range(0, 2):
-                for i in range(st, 5):
-                    timed_out = False
-                    timer = 0
-                    job = self.jobs[str(i)]
-                    while 1:
-                        # print i, ">>>", job
-
-                        if job.is_alive() == False:
-                            if i == 4:
-                                log = os.path.join(self.labelit_dir, "mosflm_strat%s.out" % l[x])
-                            else:
-                                log = os.path.join(self.labelit_dir, str(i))+"/best%s.log" % l[x]
-                            break
-                        time.sleep(1)
-                        timer += 1
-                        if self.verbose and self.logger:
-                            number = round(timer % 1, 1)
-                            if number in (0.0, 1.0):
-                                if first_print:
-                                    self.tprint(arg=".",
-                                                level=10,
-                                                color="white",
-                                                newline=False)
-                                else:
-                                    first_print = True
-                                    self.tprint(arg="    Waiting for strategy to finish",
-                                                level=10,
-                                                color="white",
-                                                newline=False)
-                        if global_vars.STRATEGY_TIMEOUT:
-                            if timer >= global_vars.STRATEGY_TIMEOUT:
-                                timed_out = True
-                                # print "Timed out"
-                                job.terminate()
-                                break
-                    if timed_out:
-                        self.tprint(arg="  Strategy calculation timed out", level=30, color="red")
-                        set_best_results(i, x)
-                        if i < 4:
-                            if self.multiproc == False:
-                                self.process_strategy(i+1)
-                    else:
-                        if i == 4:
-                            self.postprocess_mosflm(log)
+            while not scheduler.is_done():
+
+                # Without multiprocessing, the next iteration starts when the last fails
+                if self.multiproc == False:
+                    iteration = scheduler.next_iteration(self.strategy_started)
+                    if iteration is not None:
+                        self.process_strategy(iteration)
+
+                running = [i for i in self.strategy_started if i not in scheduler.finished]
+                if not running:
+                    break
+
+                # Wait for the next job to finish, or the first to time out
+                wait = STRATEGY_POLL
+                if global_vars.STRATEGY_TIMEOUT:
+                    first_deadline = min(self.strategy_started[i] for i in running) + \
+                                     global_vars.STRATEGY_TIMEOUT
+                    wait = max(0, min(wait, first_deadline - time.time()))
+                try:
+                    collect(self.strategy_queue.get(timeout=wait))
+                except Empty:
+                    if self.verbose and self.logger:
+                        if first_print:
+                            self.tprint(arg=".", level=10, color="white", newline=False)
                         else:
-                            self.jobs[str(i)].join()
-                            # print "Looking at %s" % log
-                            job1 = self.postprocess_best(log)
-                            # print "  job=%s" % job1
-                            if job1 == "OK":
-                                # print "  OK"
-                                break
-                            # If Best failed...
-                            else:
-                                print "  failed"
-                                if self.multiproc == False:
-                                    self.process_strategy(i+1)
-                                set_best_results(i, x)
+                            first_print = True
+                            self.tprint(arg="    Waiting for strategy to finish",
+                                        level=10,
+                                        color="white",
+                                        newline=False)
+
+                # Jobs that died without reporting, or have run too long
+                for iteration in running:
+                    if iteration in scheduler.finished:
+                        continue
+                    job = self.jobs[str(iteration)]
+                    if global_vars.STRATEGY_TIMEOUT and \
+                       time.time() - self.strategy_started[iteration] >= global_vars.STRATEGY_TIMEOUT:
+                        self.stop_strategy_job(iteration)
+                        collect(iteration, timed_out=True)
+                    elif not job.is_alive():
+                        collect(iteration)
+
+                # Stop the jobs no one is waiting for
+                for iteration in scheduler.get_unneeded(self.strategy_started):
+                    self.stop_strategy_job(iteration)
+                    scheduler.job_stopped(iteration)
 
         except KeyboardInterrupt:
             pass
@@ -1642,16 +1675,23 @@ Distance | % Transmission", level=98, color="white")
                     # turn off multiprocessing.event so any jobs still running on cluster are terminated.
                     self.running.clear()
                 else:
-                    #pass
                     # kill all the remaining running jobs
-                    # self.Pool.terminate()
-                    for i in range(st, 5):
-                        if self.jobs[str(i)].is_alive():
-                            if self.verbose and self.logger:
-                                self.logger.debug("terminating job: %s" % self.jobs[str(i)])
-                            # print "Terminating %d" % i
-                            self.jobs[str(i)].terminate()
-                            #xutils.kill_children(self.jobs[str(i)].pid, self.logger)
+                    for iteration in self.strategy_started:
+                        self.stop_strategy_job(iteration)
+
+    def stop_strategy_job(self, iteration):
+        """
+        Stop a strategy job and the programs it runs. Jobs on a cluster are
+        left, as killing them there causes errors - they are stopped with
+        the rest at the end.
+        """
+
+        job = self.jobs[str(iteration)]
+        if job.is_alive() and not self.cluster_use:
+            if self.verbose and self.logger:
+                self.logger.debug("terminating job: %s" % job)
+            xutils.kill_children(job.pid, self.logger)
+            job.join(1)
 
     def labelit_cell_sym(self):
       """
@@ -0,0 +1,168 @@
+"""
+Collecting the strategy jobs of the index plugin as they finish, and
+deciding which are still needed
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-20"
+__maintainer__ = "Jon Schuermann"
+__email__ = "schuerjp@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import logging
+
+# Kinds of strategy - normal and anomalous - by the suffix of their logs
+STRATEGY_KINDS = ("", "_anom")
+
+# The iteration of strategy jobs that runs Mosflm, after those running BEST
+MOSFLM_ITERATION = 4
+
+class StrategyScheduler(object):
+    """
+    Tracks the strategy jobs - BEST iterations, then Mosflm - whatever the
+    order they finish in
+
+    The normal and anomalous strategies are collected together. Each takes
+    the first BEST iteration to give a strategy, and Mosflm once every BEST
+    iteration has failed.
+    """
+
+    def __init__(self,
+                 first_iteration=0,
+                 mosflm_iteration=MOSFLM_ITERATION,
+                 kinds=STRATEGY_KINDS,
+                 logger=None):
+        """
+        Keyword arguments
+        first_iteration -- first strategy iteration run, mosflm_iteration for Mosflm only
+        mosflm_iteration -- iteration that runs Mosflm
+        kinds -- kinds of strategy wanted
+        logger -- logger instance
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+
+        self.mosflm_iteration = mosflm_iteration
+        self.kinds = kinds
+        self.best_iterations = range(first_iteration, mosflm_iteration)
+        self.iterations = range(first_iteration, mosflm_iteration + 1)
+
+        # Kinds still wanting a strategy, and the BEST iterations failed for each
+        self.wanted = dict((kind, True) for kind in kinds)
+        self.failed = dict((kind, set()) for kind in kinds)
+
+        # Iterations finished or stopped, and those that ran out of time
+        self.finished = set()
+        self.timed_out = set()
+
+    def is_done(self):
+        """Return True once every kind of strategy is settled"""
+
+        return not any(self.wanted.values())
+
+    def best_exhausted(self, kind):
+        """Return True if every BEST iteration has failed for kind"""
+
+        return self.failed[kind].issuperset(self.best_iterations)
+
+    def is_needed(self, iteration):
+        """Return True if the job of iteration may still give a wanted strategy"""
+
+        if iteration in self.finished:
+            return False
+        if iteration == self.mosflm_iteration:
+            return not self.is_done()
+        return any(self.wanted[kind] and iteration not in self.failed[kind] \
+                   for kind in self.kinds)
+
+    def next_iteration(self, started):
+        """
+        Return the next iteration to run one at a time, or None - the first
+        needed and not started, once those started have all finished
+        """
+
+        if [iteration for iteration in started if iteration not in self.finished]:
+            return None
+        for iteration in self.iterations:
+            if iteration not in started and self.is_needed(iteration):
+                return iteration
+        return None
+
+    def get_unneeded(self, started):
+        """Return the iterations started and still running that are no longer needed"""
+
+        return [iteration for iteration in started \
+                if iteration not in self.finished and not self.is_needed(iteration)]
+
+    def job_finished(self, iteration, best_ok, timed_out=False):
+        """
+        Note that the job of iteration has finished and return what to take
+        from it, a list of (action, kind) in order:
+            ("best", kind) -- BEST gave the strategy
+            ("best_failed", kind) -- the last BEST iteration has failed
+            ("mosflm", kind) -- take the Mosflm strategy
+
+        Keyword arguments
+        iteration -- the strategy iteration
+        best_ok -- called with a kind, returns True if BEST gave a strategy for it
+        timed_out -- the job was stopped for running too long
+        """
+
+        if iteration in self.finished:
+            return []
+        self.finished.add(iteration)
+        if timed_out:
+            self.timed_out.add(iteration)
+
+        actions = []
+        for kind in self.kinds:
+            if not self.wanted[kind]:
+                continue
+            if iteration == self.mosflm_iteration:
+                actions.extend(self.collect_mosflm(kind))
+            elif not timed_out and best_ok(kind):
+                self.wanted[kind] = False
+                actions.append(("best", kind))
+            else:
+                self.failed[kind].add(iteration)
+                if self.best_iterations and self.best_exhausted(kind):
+                    self.logger.debug("All BEST iterations failed for strategy%s", kind)
+                    actions.append(("best_failed", kind))
+                actions.extend(self.collect_mosflm(kind))
+        return actions
+
+    def job_stopped(self, iteration):
+        """Note that the job of iteration has been stopped as it was not needed"""
+
+        self.finished.add(iteration)
+
+    def collect_mosflm(self, kind):
+        """Return the actions for the Mosflm strategy of kind, if it is time for it"""
+
+        if not self.wanted[kind] or not self.best_exhausted(kind) or \
+           self.mosflm_iteration not in self.finished:
+            return []
+
+        self.wanted[kind] = False
+        if self.mosflm_iteration in self.timed_out:
+            return []
+        return [("mosflm", kind)]
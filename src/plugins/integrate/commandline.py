@@ -40,6 +40,7 @@ from utils.modules import load_module
 import utils.text as text
 import utils.commandline_utils as commandline_utils
 import detectors.detector_utils as detector_utils
+import utils.hdf5_reader as hdf5_reader
 
 # Time to wait for first image to appear in seconds
 TIME_TO_WAIT = 30
@@ -339,12 +340,16 @@ def main():
         commandline_utils.print_detectors(left_buffer="  ")
         sys.exit()
 
+    # XDS can read HDF5 directly if it has a plugin for it
+    xds_hdf5_lib = hdf5_reader.get_xds_plugin()
+
     # Look for data based on the input template
     data_files = commandline_utils.analyze_data_sources(
         commandline_args.template,
         mode="integrate",
         start_image=commandline_args.start_image,
-        end_image=commandline_args.end_image)
+        end_image=commandline_args.end_image,
+        convert_hdf5=not xds_hdf5_lib)
 
     # Change hdf5 to cbf
     if "hdf5_files" in data_files:
@@ -466,6 +471,11 @@ def main():
                                 commandline_args,
                                 detector_module)
 
+    # Frames are read from the HDF5 files by XDS
+    if "hdf5_files" in data_files and xds_hdf5_lib:
+        command["preferences"]["hdf5_master"] = data_files["hdf5_files"][0]
+        command["preferences"]["xds_hdf5_lib"] = xds_hdf5_lib
+
     # Load the plugin
     plugin = load_module(seek_module="plugin",
                          directories=["plugins.integrate"],
@@ -10,5 +10,6 @@ DEFAULT_PREFERENCES = {'multiprocessing': False, # Should be False for non-qsub
                        "progress": False, # progress bar for command line
                        "spacegroup_decider": 'auto', # choices=["auto", "pointless", "xds"],
                        "computer_cluster": True,
+                       "xds_incremental": True, # wedges carry on from the last wedge
                        #"rounds_polishing": 1, # not used yet...
                        }
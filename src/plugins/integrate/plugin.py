@@ -46,6 +46,7 @@ import multiprocessing
 from multiprocessing import Process, Queue
 import os
 from pprint import pprint
+from Queue import Empty
 import re
 import shutil
 import stat
@@ -64,10 +65,15 @@ import numpy
 from plugins.subcontractors.xdsme.xds2mos import Xds2Mosflm
 from plugins.subcontractors.aimless import parse_aimless
 from plugins.subcontractors.xds import get_avg_mosaicity_from_integratelp, get_isa_from_correctlp
+import plugins.subcontractors.xds as xds
 import utils.archive as archive
+import utils.artifacts as artifacts
 from utils.communicate import rapd_send
 import utils.credits as rcredits
 import utils.exceptions as exceptions
+import utils.file_watcher as file_watcher
+import utils.hdf5_reader as hdf5_reader
+import utils.result_delta as result_delta
 # from utils.r_numbers import try_int, try_float
 from utils.processes import local_subprocess
 import utils.text as text
@@ -77,6 +83,7 @@ import utils.spacegroup as spacegroup
 
 # Import RAPD plugins
 import plugins.analysis.commandline
+import plugins.integrate.wedge_scheduler as wedge_scheduler
 import plugins.analysis.plugin
 import plugins.pdbquery.commandline
 import plugins.pdbquery.plugin
@@ -116,6 +123,9 @@ VERSIONS = {
         ),
 }
 
+# Seconds between looks at place_in_run while waiting on its updates
+RECHECK_INTERVAL = 5.0
+
 class RapdPlugin(Process):
     """
     classdocs
@@ -144,11 +154,17 @@ class RapdPlugin(Process):
     # Dict for holding results
     results = {"_id": str(ObjectId())}
 
+    # Turns results into snapshots and deltas for sending
+    result_sender = None
+
     # Store archive directory for internal use
     archive_dir = False
     
     # Setup default for using compute_cluster
     computer_cluster = False
+
+    # Queue xds_run passes the PID or cluster job ID of XDS back on, in a wedge
+    xds_pid_queue = False
     
     # analysis process
     analysis_process = False
@@ -415,6 +431,8 @@ class RapdPlugin(Process):
         partial_integration_results = False
         full_integration_results = False
         xds_input = self.xds_default
+        # The wedge the full integration can carry on from
+        partial_dir = False
 
         # If all images are present, then process all
         if self.preferences.get("end_frame", False):
@@ -437,6 +455,7 @@ class RapdPlugin(Process):
                 self.tprint("  Have more than threshold degrees of data, running prliminary integration for frames to %d" % last, level=10, color="white")
                 partial_integration_results = self.xds_partial(xdsinput=xds_input,
                                                                end=last)
+                partial_dir = self.get_wedge_dir(last)
 
             # Have less than threshold degrees, but expect more than threshold
             elif final_image * self.image_data["osc_range"] > 10:
@@ -448,6 +467,7 @@ class RapdPlugin(Process):
                     self.tprint("\n  Launching integration for frames to %d" % last, level=10, color="white")
                     partial_integration_results = self.xds_partial(xdsinput=xds_input,
                                                                    end=last)
+                    partial_dir = self.get_wedge_dir(last)
                 # Timeout
                 else:
                     self.tprint("\n  Seems that data collection has stalled. Integrating what data there is", level=10, color="white")
@@ -487,12 +507,14 @@ class RapdPlugin(Process):
             result = self.wait_for_image(final_image)
             # Image now exists
             if result:
-                full_integration_results = self.xds_total(xds_input)
+                full_integration_results = self.xds_total(xds_input, previous=partial_dir)
             # Timeout
             else:
                 first, last = self.get_current_images()
                 self.tprint("\n  Seems that data collection has stalled. Integrating data to frame %d" % last, level=10, color="white")
-                full_integration_results = self.xds_total(xds_input, last=last)
+                full_integration_results = self.xds_total(xds_input,
+                                                          last=last,
+                                                          previous=partial_dir)
 
         # Finish up with the data
         final_results = self.finish_data(full_integration_results)
@@ -546,38 +568,58 @@ class RapdPlugin(Process):
     def wait_for_image_redis(self, image_number):
         """
         Watch for an image to be recorded. Return True if is does, False if timed out
+
+        Model publishes place_in_run on its key as images arrive, so this
+        waits on the subscription, looking at the key itself every
+        RECHECK_INTERVAL seconds in case a message is missed.
         """
         #self.logger.debug("wait_for_image  image_number:%d", image_number)
 
-        # Get a bead on where we are now (Last image may not be accurate!!)
-        #first, last = self.get_current_images()
-        # Get first frame from run_data
-        first = self.run_data.get('start_image_number')
-        # Check Redis for current frame number
-        last = self.get_place_in_run()
-        self.logger.debug('first: %s last: %s'%(first, last))
-        if image_number <= last:
-            self.logger.debug("Image %d already present", image_number)
-            return True
+        # Get redis instance
+        if not self.redis:
+            self.connect_to_redis()
 
-        # Estimate max time to get to target_image
-        max_time = (image_number - last) * (self.image_data["time"]) * 4
-        self.logger.debug('max_time: %s'%str(max_time))
-        
-        # Look for images in cycle
-        start_time = time.time()
-        self.tprint("  Watching for image number %s " % image_number, level=10, color="white", newline=False)
-        while (time.time() - start_time) < max_time:
-            self.tprint(".", level=10, color="white", newline=False)
-            if self.get_place_in_run() >= image_number:
-                self.tprint(".", level=10, color="white")
+        # Subscribe before looking, so no update is missed in between
+        channel = 'place_in_run:%s'%self.image_data.get('site_tag',self.run_data.get("site_tag"))
+        pubsub_id = self.redis.subscribe(channel=channel)
+
+        try:
+            # Get first frame from run_data
+            first = self.run_data.get('start_image_number')
+            # Check Redis for current frame number
+            last = self.get_place_in_run()
+            self.logger.debug('first: %s last: %s'%(first, last))
+            if image_number <= last:
+                self.logger.debug("Image %d already present", image_number)
                 return True
-            time.sleep(1)
 
-        self.tprint(".", level=10, color="white")
-        self.logger.debug('Timed out waiting for image to appear')
-        return False
-    
+            # Estimate max time to get to target_image
+            max_time = (image_number - last) * (self.image_data["time"]) * 4
+            self.logger.debug('max_time: %s'%str(max_time))
+
+            # Wait for place_in_run to reach the image
+            deadline = time.time() + max_time
+            self.tprint("  Watching for image number %s " % image_number, level=10, color="white", newline=False)
+            while time.time() < deadline:
+                self.tprint(".", level=10, color="white", newline=False)
+                message = self.redis.get_message(pubsub_id,
+                                                 timeout=min(RECHECK_INTERVAL,
+                                                             deadline - time.time()))
+                if message and message.get("type") == "message":
+                    last = int(message["data"])
+                elif not message:
+                    last = self.get_place_in_run()
+                if last >= image_number:
+                    self.tprint(".", level=10, color="white")
+                    return True
+
+            self.tprint(".", level=10, color="white")
+            self.logger.debug('Timed out waiting for image to appear')
+            return False
+
+        finally:
+            self.redis.close_pubsub(pubsub_id)
+
     def wait_for_image(self, image_number):
         """
         Watch for an image to be recorded. Return True if is does, False if timed out
@@ -603,16 +645,11 @@ class RapdPlugin(Process):
             max_time = (image_number - last) * (self.image_data["time"]) * 4
             self.logger.debug('max_time: %s'%str(max_time))
     
-            # Look for images in cycle
-            start_time = time.time()
+            # Watch the directory for the image
             self.tprint("  Watching for %s " % target_image, level=10, color="white", newline=False)
-            while (time.time() - start_time) < max_time:
-                self.tprint(".", level=10, color="white", newline=False)
-                #if os.path.exists(target_image):
-                if os.path.isfile(target_image):
-                    self.tprint(".", level=10, color="white")
-                    return True
-                time.sleep(1)
+            if file_watcher.wait_for_file(target_image, max_time):
+                self.tprint(".", level=10, color="white")
+                return True
     
             self.tprint(".", level=10, color="white")
             self.logger.debug('Timed out waiting for image to appear')
@@ -675,15 +712,19 @@ class RapdPlugin(Process):
             #    if results['results'].get('data_produced', False):
             #        pprint(results['results'].get('data_produced'))
 
-            # Transcribe results
-            json_results = json.dumps(results)
+            # Transcribe results - only what has changed since the last
+            # message, unless the status has changed
+            if not self.result_sender:
+                self.result_sender = result_delta.ResultSender()
+            message = self.result_sender.prepare(results)
+            json_results = json.dumps(message)
 
             # Get redis instance
             if not self.redis:
                 self.connect_to_redis()
 
             # Send results back
-            self.redis.lpush("RAPD_RESULTS", json_results)
+            self.redis.lpush("RAPD_RESULTS", json.pack(message, json_results))
             self.redis.publish("RAPD_RESULTS", json_results)
 
     def postprocess(self):
@@ -980,12 +1021,14 @@ class RapdPlugin(Process):
 
         return xds_output
 
-    def xds_total(self, xdsinput, last=False):
+    def xds_total(self, xdsinput, last=False, previous=False):
         """
         This function controls processing by XDS when the complete data
         set is already present on the computer system.
 
-        If last is set, this will override the run info
+        If last is set, this will override the run info. If previous is the
+        directory of a wedge of the same run, the first pass carries on from
+        it instead of searching for spots and indexing again.
         """
         self.logger.debug('Fastintegration::xds_total')
         self.tprint(arg="\nXDS processing", level=99, color="blue")
@@ -1025,65 +1068,20 @@ class RapdPlugin(Process):
         xdsinp = self.change_xds_inp(
             xdsinp,
             "MAXIMUM_NUMBER_OF_JOBS=%s\n" % self.jobs)
-        xdsinp = self.change_xds_inp(xdsinp, "JOB=XYCORR INIT COLSPOT \n\n")
-        xdsinp = self.change_xds_inp(xdsinp, "DATA_RANGE=%s %s\n" %(self.image_data['start'],
-                                                                    last) )
         xdsfile = os.path.join(xdsdir, 'XDS.INP')
-        self.write_file(xdsfile, xdsinp)
-        self.tprint(arg="  Searching for peaks",
-                    level=99,
-                    color="white",
-                    newline=False)
-        self.xds_run(xdsdir)
-
-        # Index
-        #xdsinp[-2] = ("JOB=IDXREF \n\n")
-        xdsinp = self.change_xds_inp(
-            xdsinp,
-            "JOB=IDXREF\n")
-        self.write_file(xdsfile, xdsinp)
-        self.tprint(arg="  Indexing",
-                    level=99,
-                    color="white",
-                    newline=False)
-        self.xds_run(xdsdir)
 
-        # If known indexing error occurs, catch them and take corrective action
-        if not os.path.exists("XPARM.XDS"):
-            self.logger.exception("Initial indexing has failed - retrying with first half of images")
-            self.tprint(arg="\n  Initial indexing has failed - retrying with first half of images",
-                        level=30,
-                        color="red")
-            # Try indexing with first half of images
-            number_images = last - self.image_data["start"] + 1
-            xdsinp = self.change_xds_inp(xdsinp, "SPOT_RANGE=%s %s\n" %(self.image_data["start"],
-                                                                        self.image_data["start"]+int(number_images/2)))
-            self.write_file(xdsfile, xdsinp)
-            self.tprint(arg="  Indexing again",
-                    level=99,
-                    color="white",
-                    newline=False)
-            self.xds_run(xdsdir)
+        # Carry on from an earlier wedge
+        newinp = False
+        if self.xds_increment(xdsdir, previous, last, xdsinp):
+            # Without errors, this only checks that CORRECT finished. Any rerun
+            # for a resolution cutoff integrates the whole range again.
+            newinp = self.change_xds_inp(xdsinp, "JOB=DEFPIX INTEGRATE CORRECT \n\n")
+            newinp = self.change_xds_inp(newinp, "DATA_RANGE=%s %s\n" %(self.image_data['start'],
+                                                                        last) )
+            newinp = self.check_for_xds_errors(xdsdir, newinp)
+        if not newinp:
+            newinp = self.xds_first_pass(xdsdir, xdsfile, xdsinp, last)
 
-        # Integrate
-        # Override spacegroup?
-        if self.spacegroup != False:
-            # Check consistency of spacegroup, and modify if necessary.
-            xdsinp = self.find_xds_symm(xdsdir, xdsinp)
-        else:
-            xdsinp = self.change_xds_inp(
-                xdsinp,
-                "JOB=DEFPIX INTEGRATE CORRECT \n\n")
-
-        self.write_file(xdsfile, xdsinp)
-        self.tprint(arg="  Integrating",
-                    level=99,
-                    color="white",
-                    newline=False)
-        self.xds_run(xdsdir)
-
-        # If known xds_errors occur, catch them and take corrective action
-        newinp = self.check_for_xds_errors(xdsdir, xdsinp)
         if newinp == False:
             self.logger.exception('Unknown xds error occurred. Please check for cause!')
             self.tprint(arg="\nXDS error unknown to RAPD has occurred. Please check for cause!",
@@ -1207,20 +1205,167 @@ class RapdPlugin(Process):
         # final_results['status'] = 'ANALYSIS'
         return final_results
 
+    def xds_first_pass(self, xdsdir, xdsfile, xdsinp, last):
+        """
+        Search for spots, index and integrate the data to frame last from
+        scratch. Returns the XDS input for reintegration, or False if XDS
+        failed in a way RAPD does not know.
+        """
+
+        xdsinp = self.change_xds_inp(xdsinp, "JOB=XYCORR INIT COLSPOT \n\n")
+        xdsinp = self.change_xds_inp(xdsinp, "DATA_RANGE=%s %s\n" %(self.image_data['start'],
+                                                                    last) )
+        self.write_file(xdsfile, xdsinp)
+        self.tprint(arg="  Searching for peaks",
+                    level=99,
+                    color="white",
+                    newline=False)
+        self.xds_run(xdsdir)
+
+        # Index
+        #xdsinp[-2] = ("JOB=IDXREF \n\n")
+        xdsinp = self.change_xds_inp(
+            xdsinp,
+            "JOB=IDXREF\n")
+        self.write_file(xdsfile, xdsinp)
+        self.tprint(arg="  Indexing",
+                    level=99,
+                    color="white",
+                    newline=False)
+        self.xds_run(xdsdir)
+
+        # If known indexing error occurs, catch them and take corrective action
+        if not os.path.exists("XPARM.XDS"):
+            self.logger.exception("Initial indexing has failed - retrying with first half of images")
+            self.tprint(arg="\n  Initial indexing has failed - retrying with first half of images",
+                        level=30,
+                        color="red")
+            # Try indexing with first half of images
+            number_images = last - self.image_data["start"] + 1
+            xdsinp = self.change_xds_inp(xdsinp, "SPOT_RANGE=%s %s\n" %(self.image_data["start"],
+                                                                        self.image_data["start"]+int(number_images/2)))
+            self.write_file(xdsfile, xdsinp)
+            self.tprint(arg="  Indexing again",
+                    level=99,
+                    color="white",
+                    newline=False)
+            self.xds_run(xdsdir)
+
+        # Integrate
+        # Override spacegroup?
+        if self.spacegroup != False:
+            # Check consistency of spacegroup, and modify if necessary.
+            xdsinp = self.find_xds_symm(xdsdir, xdsinp)
+        else:
+            xdsinp = self.change_xds_inp(
+                xdsinp,
+                "JOB=DEFPIX INTEGRATE CORRECT \n\n")
+
+        self.write_file(xdsfile, xdsinp)
+        self.tprint(arg="  Integrating",
+                    level=99,
+                    color="white",
+                    newline=False)
+        self.xds_run(xdsdir)
+
+        # If known xds_errors occur, catch them and take corrective action
+        newinp = self.check_for_xds_errors(xdsdir, xdsinp)
+
+        return newinp
+
+    def xds_increment(self, xdsdir, previous, last, xdsinput):
+        """
+        Carry on from the wedge processed in the directory previous -
+        integrate only the frames after it up to last, then scale the
+        reflections of both with CORRECT. The geometry, background and spots
+        of previous are used as they are.
+
+        Returns the XDS input CORRECT was last run with if the data to last
+        have been integrated and scaled without errors, or False if previous
+        cannot be carried on from and the wedge needs processing from
+        scratch. XDS errors are not fixed here, as the fixes of
+        check_for_xds_errors are for a full pass.
+        """
+
+        if not previous or \
+           not self.preferences.get("xds_incremental", True) or \
+           self.spacegroup != False:
+            return False
+
+        previous = os.path.join(self.dirs['work'], previous)
+        if not xds.can_seed(previous):
+            self.logger.debug("Cannot carry on from %s", previous)
+            return False
+
+        first = int(self.image_data['start'])
+        previous_hkl = os.path.join(previous, 'INTEGRATE.HKL')
+        previous_range = xds.get_integrated_range(previous_hkl)
+        if not previous_range or previous_range[0] != first or previous_range[1] >= last:
+            self.logger.debug("Cannot carry on from %s with range %s", previous, previous_range)
+            return False
+
+        self.logger.debug("Carrying on from %s frames %d-%d", previous, previous_range[0], previous_range[1])
+        xds.seed_wedge(previous, xdsdir)
+
+        # Integrate the new frames
+        xdsinp = self.change_xds_inp(xdsinput, "JOB=INTEGRATE\n")
+        xdsinp = self.change_xds_inp(xdsinp, "DATA_RANGE=%d %d\n" % (previous_range[1]+1, last))
+        xdsfile = os.path.join(xdsdir, 'XDS.INP')
+        self.write_file(xdsfile, xdsinp)
+        self.tprint(arg="  Integrating frames %d to %d" % (previous_range[1]+1, last),
+                    level=99,
+                    color="white",
+                    newline=False)
+        self.xds_run(xdsdir)
+
+        new_hkl = os.path.join(xdsdir, 'INTEGRATE.HKL')
+        errors = xds.get_log_errors(xdsdir)
+        if errors or not os.path.exists(new_hkl):
+            self.logger.debug("Integration of frames %d-%d failed %s",
+                              previous_range[1]+1,
+                              last,
+                              errors)
+            return False
+        os.rename(new_hkl, new_hkl+".new")
+        xds.merge_integrate_hkl(previous_hkl, new_hkl+".new", new_hkl)
+
+        # Scale all the frames to last
+        xdsinp = self.change_xds_inp(xdsinp, "JOB=CORRECT\n")
+        xdsinp = self.change_xds_inp(xdsinp, "DATA_RANGE=%d %d\n" % (first, last))
+        self.write_file(xdsfile, xdsinp)
+        self.tprint(arg="  Scaling frames %d to %d" % (first, last),
+                    level=99,
+                    color="white",
+                    newline=False)
+        self.xds_run(xdsdir)
+
+        errors = xds.get_log_errors(xdsdir)
+        if errors or not os.path.exists(os.path.join(xdsdir, 'CORRECT.LP')):
+            self.logger.debug("Scaling frames %d-%d failed %s", first, last, errors)
+            return False
+
+        return xdsinp
+
+    def get_wedge_dir(self, last):
+        """Return the name of the directory for processing frames to last"""
+
+        return 'wedge_%s_%s' % (self.image_data['start'], last)
+
     def xds_partial(self, xdsinput, end):
         """
         Executes a partial XDS processing on the
         """
         self.logger.debug("xds_partial end: %d" % end)
 
-        proc_dir = 'wedge_%s_%s' % (self.image_data['start'], end)
+        proc_dir = self.get_wedge_dir(end)
         return(self.xds_wedge(proc_dir, end, xdsinput))
 
     def xds_split(self, xdsinput):
         """
         Controls xds processing for unibinned ADSC data
-        Launches XDS when half the data set has been collected and again once
-        the complete data set has been collected.
+        Launches XDS when half the data set has been collected, if it can
+        finish before the rest is, and again once the complete data set has
+        been collected.
         """
         self.logger.debug("FastIntegration::xds_split")
 
@@ -1229,6 +1374,12 @@ class RapdPlugin(Process):
         last_frame = int(self.image_data['start']) + int(self.image_data['total']) - 1
         frame_count = first_frame + 1
 
+        # The one wedge is the first half
+        osc_range = float(self.image_data['osc_range'])
+        scheduler = self.get_wedge_scheduler(
+            first_wedge_degrees=(half_set - first_frame + 1) * osc_range,
+            min_step_degrees=int(self.image_data['total']) * osc_range)
+
         file_template = os.path.join(self.image_data['directory'], self.image_template)
         # Figure out how many digits needed to pad image number.
         # First split off the <image number>.<extension> portion of the file_template.
@@ -1247,59 +1398,53 @@ class RapdPlugin(Process):
         # Maximum wait time for next image is exposure time + 30 seconds.
         wait_time = int(math.ceil(float(self.image_data['time']))) + 30
 
-        timer = Process(target=time.sleep, args=(wait_time,))
-        timer.start()
-
-        while frame_count < last_frame:
-            if os.path.isfile(look_for_file) == True:
-                if timer.is_alive():
-                    timer.terminate()
-                timer = Process(target=time.sleep, args=(wait_time,))
-                timer.start()
-                if frame_count == half_set:
-                    proc_dir = 'wedge_%s_%s' % (first_frame, frame_count)
-                    xds_job = Process(target=self.xds_wedge,
-                                      args=(proc_dir, frame_count, xdsinput))
-                    xds_job.start()
-                frame_count += 1
-                look_for_file = file_template.replace(replace_string,
-                                                      '%0*d' %(pad, frame_count))
-            elif timer.is_alive() == False:
-                self.logger.debug('     Image %s not found after waiting %s seconds.',
-                                  look_for_file,
-                                  wait_time)
-                self.logger.debug('     RAPD assumes the data collection has been aborted.')
-                self.logger.debug('         Launching a final xds job with last image detected.')
+        # Woken as images are written rather than polling
+        watcher = file_watcher.FileWatcher(self.image_data['directory'])
+        wedge = self.get_wedge_state()
+
+        try:
+            while frame_count < last_frame:
+                if watcher.wait_for(look_for_file, wait_time):
+                    self.schedule_wedge(scheduler, wedge, frame_count, xdsinput)
+                    frame_count += 1
+                    look_for_file = file_template.replace(replace_string,
+                                                          '%0*d' %(pad, frame_count))
+                else:
+                    self.logger.debug('     Image %s not found after waiting %s seconds.',
+                                      look_for_file,
+                                      wait_time)
+                    self.logger.debug('     RAPD assumes the data collection has been aborted.')
+                    self.logger.debug('         Launching a final xds job with last image detected.')
+                    self.image_data['last'] = frame_count - 1
+                    self.stop_wedges(scheduler, wedge)
+                    results = self.xds_total(xdsinput)
+                    return results
+
+            # If you reach here, frame_count equals the last frame, so look for the
+            # last frame and then launch xds_total.
+            if watcher.wait_for(self.last_image, wait_time):
+                previous_dir = self.stop_wedges(scheduler, wedge)
+                results = self.xds_total(xdsinput, previous=previous_dir)
+
+            # If the wait expires and last frame has not been detected, launch
+            # xds_total with last detected image.
+            else:
+                self.stop_wedges(scheduler, wedge)
                 self.image_data['last'] = frame_count - 1
                 results = self.xds_total(xdsinput)
-                return results
-
-        # If you reach here, frame_count equals the last frame, so look for the
-        # last frame and then launch xds_total.
-        while timer.is_alive():
-            if os.path.isfile(self.last_image):
-                if xds_job.is_alive():
-                    xds_job.terminate()
-                results = self.xds_total(xdsinput)
-                timer.terminate()
-                break
 
-        # If timer expires (ending the above loop) and last frame has not been
-        # detected, launch xds_total with last detected image.
-        if os.path.isfile(self.last_image) == False:
-            if xds_job.is_alive():
-                xds_job.terminate()
-            self.image_data['last'] = frame_count - 1
-            results = self.xds_total(xdsinput)
+        finally:
+            watcher.close()
 
         return results
 
     def xds_processing(self, xdsinput):
         """
         Controls processing of data on disks (i.e. not stored in RAM)
-        by xds.  Attempts to process every 10 images up to 100 and then
-        every 20 images after that. This function should be used for NE-CAT
-        data collected on ADSC in binned mode
+        by xds. Wedges are integrated as the data arrive, as often as
+        XDS keeps up with the frame rate (see wedge_scheduler). This
+        function should be used for NE-CAT data collected on ADSC in
+        binned mode
         """
 
         """
@@ -1326,12 +1471,8 @@ class RapdPlugin(Process):
             wait_time = int(math.ceil(float(self.image_data['time']))) + 15
         else:
             wait_time = int(math.ceil(float(self.image_data['time']))) + 60
-        try:
-            wedge_size = int(10 // float(self.image_data['osc_range']))
-        except:
-            self.logger.debug('xds_processing:: dynamic wedge size allocation failed!')
-            self.logger.debug('                 Setting wedge size to 10.')
-            wedge_size = 10
+        # When to integrate wedges
+        scheduler = self.get_wedge_scheduler()
 
         file_template = os.path.join(self.image_data['directory'], self.image_template)
         # Figure out how many digits needed to pad image number.
@@ -1348,108 +1489,174 @@ class RapdPlugin(Process):
         look_for_file = file_template.replace(replace_string,
                                               '%0*d' % (pad, frame_count))
 
-        timer = Process(target=time.sleep, args=(wait_time,))
-        timer.start()
-        # Create the process xds_job (runs a timer with no delay).
-        # This is so xds_job exists when it is checked for later on.
-        # Eventually xds_job is replaced by the actual integration jobs.
-        xds_job = Process(target=time.sleep, args=(0,))
-        xds_job.start()
-
-        while frame_count < last_frame:
-            # Look for next look_for_file to see if it exists.
-            # If it does, check to see if it is a tenth image.
-            # If it is a tenth image, launch an xds job.
-            # If it isn't a tenth image, index the look_for_file
-            # If it doesn't exist, keep checking until time_process expires.
-            if os.path.isfile(look_for_file) == True:
-                # Reset the timer process
-                if timer.is_alive():
-                    timer.terminate()
-                timer = Process(target=time.sleep, args=(wait_time,))
-                timer.start()
-                # If frame_count is a tenth image, launch and xds job
-                # remainder = ((frame_count + 1) - first_frame) % wedge_size
-                # self.logger.debug('	remainder = %s' % remainder)
-                if xds_job.is_alive == True:
-                    self.logger.debug('		xds_job.is_alive = True')
-                if (((frame_count + 1) - first_frame) % wedge_size == 0 and
-                        xds_job.is_alive() == False):
-                    proc_dir = 'wedge_%s_%s' %(first_frame, frame_count)
-                    xds_job = Process(target=self.xds_wedge,
-                                      args=(proc_dir, frame_count, xdsinput))
-                    xds_job.start()
-                # Increment the frame count to look for next image
-                frame_count += 1
-                look_for_file = file_template.replace(replace_string,
-                                                      '%0*d' % (pad, frame_count))
-            # If next frame does not exist, check to see if timer has expired.
-            # If timer has expired, assume an abort has occurred.
-            elif timer.is_alive() == False:
-                self.logger.debug('     Image %s not found after waiting %s seconds.',
-                                  look_for_file,
-                                  wait_time)
-                # There have been a few cases, particularly with Pilatus's
-                # Furka file transfer has failed to copy an image to disk.
-                # So check for the next two files before assuming there has
-                # been an abort.
-                self.logger.debug('     RAPD assumes the data collection has been aborted.')
-                self.logger.debug('     RAPD checking for next two subsequent images to be sure.')
-                frame_count += 1
-                look_for_file = file_template.replace(replace_string, '%0*d' % (pad, frame_count))
-                if os.path.isfile(look_for_file) == True:
-                    timer = Process(target=time.sleep, args=(wait_time,))
-                    timer.start()
+        # Woken as images are written rather than polling
+        watcher = file_watcher.FileWatcher(self.image_data['directory'])
+        # The running wedge, and the newest finished to carry on from
+        wedge = self.get_wedge_state()
+
+        try:
+            while frame_count < last_frame:
+                # Wait for next look_for_file to exist.
+                # If it does, launch an xds job if the scheduler says so.
+                # If it doesn't appear in wait_time, check for an abort.
+                if watcher.wait_for(look_for_file, wait_time):
+                    self.schedule_wedge(scheduler, wedge, frame_count, xdsinput)
                     # Increment the frame count to look for next image
                     frame_count += 1
                     look_for_file = file_template.replace(replace_string,
-                                                          '%0*d' %(pad, frame_count))
+                                                          '%0*d' % (pad, frame_count))
+                # If next frame does not appear in time, assume an abort has occurred.
                 else:
-                    self.logger.debug(
-                        '    RAPD did not fine the next image, checking for one more.')
+                    self.logger.debug('     Image %s not found after waiting %s seconds.',
+                                      look_for_file,
+                                      wait_time)
+                    # There have been a few cases, particularly with Pilatus's
+                    # Furka file transfer has failed to copy an image to disk.
+                    # So check for the next two files before assuming there has
+                    # been an abort.
+                    self.logger.debug('     RAPD assumes the data collection has been aborted.')
+                    self.logger.debug('     RAPD checking for next two subsequent images to be sure.')
                     frame_count += 1
-                    look_for_file = file_template.replace(replace_string,
-                                                          '%0*d' % (pad, frame_count))
+                    look_for_file = file_template.replace(replace_string, '%0*d' % (pad, frame_count))
                     if os.path.isfile(look_for_file) == True:
-                        timer = Process(target=time.sleep, args=(wait_time,))
-                        timer.start()
+                        # Increment the frame count to look for next image
                         frame_count += 1
-                        look_for_file = file_template.replace(
-                            replace_string,
-                            '%0*d' % (pad, frame_count))
+                        look_for_file = file_template.replace(replace_string,
+                                                              '%0*d' %(pad, frame_count))
                     else:
-                        self.logger.debug('         RAPD did not find the next image either.')
                         self.logger.debug(
-                            '         Launching a final xds job with last image detected.')
-                        self.image_data['total'] = frame_count - 2 - first_frame
-                        results = self.xds_total(xdsinput)
-                        return results
-
-        # If you reach here, frame_count equals the last frame, so look for the
-        # last frame and then launch xds_total.
-        while timer.is_alive():
-            if os.path.isfile(self.last_image):
-                if xds_job.is_alive():
-                    xds_job.terminate()
+                            '    RAPD did not fine the next image, checking for one more.')
+                        frame_count += 1
+                        look_for_file = file_template.replace(replace_string,
+                                                              '%0*d' % (pad, frame_count))
+                        if os.path.isfile(look_for_file) == True:
+                            frame_count += 1
+                            look_for_file = file_template.replace(
+                                replace_string,
+                                '%0*d' % (pad, frame_count))
+                        else:
+                            self.logger.debug('         RAPD did not find the next image either.')
+                            self.logger.debug(
+                                '         Launching a final xds job with last image detected.')
+                            self.image_data['total'] = frame_count - 2 - first_frame
+                            self.stop_wedges(scheduler, wedge)
+                            results = self.xds_total(xdsinput)
+                            return results
+
+            # If you reach here, frame_count equals the last frame, so look for the
+            # last frame and then launch xds_total.
+            if watcher.wait_for(self.last_image, wait_time):
+                previous_dir = self.stop_wedges(scheduler, wedge)
+                results = self.xds_total(xdsinput, previous=previous_dir)
+
+            # If the wait expires and last frame has not been detected, launch
+            # xds_total with last detected image.
+            else:
+                self.stop_wedges(scheduler, wedge)
+                self.image_data['total'] = frame_count - first_frame
                 results = self.xds_total(xdsinput)
-                timer.terminate()
-                break
 
-        # If timer expires (ending the above loop) and last frame has not been
-        # detected, launch xds_total with last detected image.
-        if os.path.isfile(self.last_image) == False:
-            if xds_job.is_alive():
-                xds_job.terminate()
-            self.image_data['total'] = frame_count - first_frame
-            results = self.xds_total(xdsinput)
+        finally:
+            watcher.close()
 
         return results
 
-    def xds_wedge(self, directory, last, xdsinput):
+    def get_wedge_scheduler(self, **kwargs):
+        """Return a WedgeScheduler for the data set, taking its keyword arguments"""
+
+        first = int(self.image_data['start'])
+        return wedge_scheduler.WedgeScheduler(
+            first_frame=first,
+            last_frame=first + int(self.image_data['total']) - 1,
+            osc_range=self.image_data['osc_range'],
+            frame_time=self.image_data.get('period') or self.image_data.get('time'),
+            logger=self.logger,
+            **kwargs)
+
+    def get_wedge_state(self):
+        """Return a dict of the running wedge and the newest finished"""
+
+        return {"job":None, "dir":None, "completed":False, "pid_queue":None}
+
+    def collect_wedge(self, scheduler, wedge):
+        """Tell scheduler about the running wedge if it has finished"""
+
+        if wedge["job"] and not wedge["job"].is_alive():
+            xdsdir = os.path.join(self.dirs['work'], wedge["dir"])
+            succeeded = wedge["job"].exitcode == 0 and xds.can_seed(xdsdir)
+            scheduler.wedge_finished(xds.get_stage_times(xdsdir), succeeded)
+            if succeeded:
+                wedge["completed"] = wedge["dir"]
+            wedge["job"] = None
+
+    def schedule_wedge(self, scheduler, wedge, frame, xdsinput):
+        """
+        Launch a wedge to frame if scheduler says so. A running wedge that
+        has gone stale is stopped first.
+        """
+
+        scheduler.frame_arrived(frame)
+        self.collect_wedge(scheduler, wedge)
+        if not scheduler.should_launch(frame):
+            return
+        if wedge["job"]:
+            self.logger.debug("Stopping stale wedge %s", wedge["dir"])
+            self.kill_wedge(scheduler, wedge)
+        scheduler.wedge_started(frame)
+        wedge["dir"] = self.get_wedge_dir(frame)
+        wedge["pid_queue"] = Queue()
+        wedge["job"] = Process(target=self.xds_wedge,
+                               args=(wedge["dir"], frame, xdsinput, wedge["completed"]),
+                               kwargs={"pid_queue":wedge["pid_queue"]})
+        wedge["job"].start()
+
+    def kill_wedge(self, scheduler, wedge):
+        """
+        Kill the running wedge and the XDS it has started, locally or on the
+        computer cluster, and tell scheduler it failed
+        """
+
+        job = wedge["job"]
+        if job.is_alive():
+            # XDS runs in a process of its own or on the cluster, so stopping
+            # the wedge alone would leave it running
+            xds_ids = []
+            try:
+                while True:
+                    xds_ids.append(wedge["pid_queue"].get_nowait())
+            except Empty:
+                pass
+            for xds_id in xds_ids[-1:]:
+                if self.computer_cluster:
+                    self.computer_cluster.kill_job(xds_id)
+                else:
+                    xutils.kill_children(xds_id, self.logger)
+            xutils.kill_children(job.pid, self.logger)
+            job.join(1)
+        scheduler.wedge_finished(succeeded=False)
+        wedge["job"] = None
+
+    def stop_wedges(self, scheduler, wedge):
         """
-        This function controls processing by XDS for an intermediate wedge
+        Stop the running wedge, as the whole data set is being integrated.
+        Returns the directory of the newest finished wedge, or False.
+        """
+
+        self.collect_wedge(scheduler, wedge)
+        if wedge["job"]:
+            self.kill_wedge(scheduler, wedge)
+        return wedge["completed"]
+
+    def xds_wedge(self, directory, last, xdsinput, previous=False, pid_queue=False):
+        """
+        This function controls processing by XDS for an intermediate wedge.
+        If previous is the directory of an earlier wedge, only the frames
+        after it are integrated. The PID or cluster job ID of each XDS run
+        is put on pid_queue, so the wedge can be stopped.
         """
         self.logger.debug('Fastintegration::xds_wedge')
+        # Runs in a process of its own, so this is only seen by its xds_run
+        self.xds_pid_queue = pid_queue
         self.tprint(arg="\nXDS processing", level=99, color="blue")
 
         first = int(self.image_data['start'])
@@ -1462,6 +1669,28 @@ class RapdPlugin(Process):
         #xdsinp = self.find_spot_range(first, last, self.image_data['osc_range'], xdsinput[:])
         xdsinp.append('MAXIMUM_NUMBER_OF_PROCESSORS=%s\n' % self.procs)
         xdsinp.append('MAXIMUM_NUMBER_OF_JOBS=%s\n' % self.jobs)
+
+        # Carry on from the earlier wedge
+        increment_inp = self.xds_increment(xdsdir, previous, last, xdsinp)
+        if increment_inp:
+            # Without errors, this only checks that CORRECT finished
+            newinp = self.check_for_xds_errors(xdsdir, increment_inp)
+            if newinp:
+                new_rescut = self.find_correct_res(xdsdir, 1.0)
+                if new_rescut != False:
+                    os.rename('%s/CORRECT.LP' %xdsdir, '%s/CORRECT.LP.nocutoff' %xdsdir)
+                    os.rename('%s/XDS.LOG' %xdsdir, '%s/XDS.LOG.nocutoff' %xdsdir)
+                    # Only CORRECT is rerun - the reflections are already integrated
+                    newinp = self.change_xds_inp(newinp, 'JOB=CORRECT\n')
+                    newinp = self.change_xds_inp(newinp, 'DATA_RANGE=%s\n' % data_range)
+                    newinp = self.change_xds_inp(newinp, 'INCLUDE_RESOLUTION_RANGE=200.0 %.2f\n' % new_rescut)
+                    self.write_file(os.path.join(xdsdir, 'XDS.INP'), newinp)
+                    self.tprint(arg="  Rescaling", level=99, color="white", newline=False)
+                    self.xds_run(xdsdir)
+                return self.run_results(xdsdir)
+            self.logger.debug('  Carrying on from %s failed - processing %s from scratch',
+                              previous,
+                              directory)
         #xdsinp.append('MAXIMUM_NUMBER_OF_JOBS=1\n')
         xdsinp.append('JOB=XYCORR INIT COLSPOT !IDXREF DEFPIX INTEGRATE CORRECT\n\n')
         xdsinp.append('DATA_RANGE=%s\n' % data_range)
@@ -1549,6 +1778,13 @@ class RapdPlugin(Process):
         #self.first_image = file_template.replace('?', str(self.image_data["start"]).zfill(pad), 1)
         #self.first_image = self.first_image.replace('?', '')
 
+        # HDF5 data sets are read by XDS through its plugin, not as CBF
+        hdf5_input = []
+        if self.preferences.get("hdf5_master") and self.preferences.get("xds_hdf5_lib"):
+            hdf5_input = hdf5_reader.xds_input(self.preferences["hdf5_master"],
+                                               self.preferences["xds_hdf5_lib"])
+            file_template = hdf5_input[0][1]
+
     	# Begin constructing the list that will represent the XDS.INP file.
         xds_input = ['!===== DATA SET DEPENDENT PARAMETERS =====\n',
                      'ORGX=%.2f ORGY=%.2f ! Beam Center (pixels)\n' % (x_beam, y_beam),
@@ -1561,6 +1797,8 @@ class RapdPlugin(Process):
                      'NAME_TEMPLATE_OF_DATA_FRAMES=%s\n\n' % file_template,
                      'BACKGROUND_RANGE=%s\n\n' % background_range,
                      '!===== DETECTOR_PARAMETERS =====\n']
+        for line in hdf5_input[1:]:
+            xds_input.append("%s%s"%('='.join(line), '\n'))
 
         # Regions that are excluded are defined with
         # various keyword containing the word UNTRUSTED.
@@ -1662,9 +1900,12 @@ class RapdPlugin(Process):
         os.chdir(directory)
         # TODO skip processing for now
 
+        xds_kwargs = {"command": xds_command,
+                      "logfile": "XDS.LOG"}
+        if self.xds_pid_queue:
+            xds_kwargs["pid_queue"] = self.xds_pid_queue
         xds_proc = Process(target=self.launcher,
-                           kwargs={"command": xds_command,
-                                   "logfile": "XDS.LOG"})
+                           kwargs=xds_kwargs)
 
         """
         if self.cluster_use == True:
@@ -2173,10 +2414,11 @@ class RapdPlugin(Process):
                 self.logger.debug('    Please check logs and files in %s', self.dirs['work'])
                 return 'Failed'
 
-        # Open up xds log files for saving
-        xds_idxref_log = open("IDXREF.LP", "r").readlines()
-        xds_integrate_log = open("INTEGRATE.LP", "r").readlines()
-        xds_correct_log = open("CORRECT.LP", "r").readlines()
+        # Store xds log files - results only carry references to them
+        artifact_dir = os.path.join(self.dirs["work"], "artifacts")
+        xds_idxref_log = artifacts.store_file("IDXREF.LP", artifact_dir, "xds_idxref")
+        xds_integrate_log = artifacts.store_file("INTEGRATE.LP", artifact_dir, "xds_integrate")
+        xds_correct_log = artifacts.store_file("CORRECT.LP", artifact_dir, "xds_correct")
 
         # Open up the GXPARM for info
         xparm = self.parse_xparm()
@@ -2247,8 +2489,8 @@ class RapdPlugin(Process):
             "plots": graphs,
             "summary": summary,
             "logs": {
-                "aimless": aimlog,
-                "pointless": pointless_log,
+                "aimless": artifacts.store_lines(aimlog, artifact_dir, "aimless"),
+                "pointless": artifacts.store_lines(pointless_log, artifact_dir, "pointless"),
                 "xds_idxref": xds_idxref_log,
                 "xds_integrate": xds_integrate_log,
                 "xds_correct": xds_correct_log
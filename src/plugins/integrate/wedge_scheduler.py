@@ -0,0 +1,255 @@
+"""
+Choosing when to integrate wedges of a data set that is still being
+collected, from the rate frames arrive and how long XDS takes
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-10"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import collections
+import logging
+import math
+import time
+
+# Degrees of data for the first wedge, which has to index
+FIRST_WEDGE_DEGREES = 10.0
+
+# Fewest degrees between wedges
+MIN_STEP_DEGREES = 2.0
+
+# Steps of XDS run once per wedge carried on from scratch
+SETUP_STAGES = ("XYCORR", "INIT", "COLSPOT", "IDXREF", "DEFPIX")
+
+# Guesses of the seconds XDS takes, until a wedge has been timed -
+# the steps run once, INTEGRATE for each new frame, CORRECT for each frame
+SETUP_TIME = 30.0
+INTEGRATE_TIME = 0.2
+CORRECT_TIME = 0.02
+
+# Weight of the newest timing in the averages
+SMOOTHING = 0.5
+
+# Seconds frame arrivals are remembered for, and the fewest seconds they
+# have to span to give a rate
+ARRIVAL_WINDOW = 60.0
+MIN_ARRIVAL_SPAN = 1.0
+
+# A running wedge taking this many times longer than expected is stale
+STALE_FACTOR = 2.0
+
+class WedgeScheduler(object):
+    """
+    Decides the frames at which wedges are integrated during collection
+
+    The next checkpoint is the frame expected to arrive as the running
+    wedge finishes, so a new wedge starts as soon as there is a node for it
+    and never queues behind the last. Wedges that could not finish before
+    the last frame arrives, when the whole data set is integrated, are not
+    started.
+    """
+
+    def __init__(self,
+                 first_frame,
+                 last_frame,
+                 osc_range,
+                 frame_time=None,
+                 first_wedge_degrees=FIRST_WEDGE_DEGREES,
+                 min_step_degrees=MIN_STEP_DEGREES,
+                 logger=None):
+        """
+        Keyword arguments
+        first_frame -- number of the first frame of the data set
+        last_frame -- number of the last frame of the data set
+        osc_range -- degrees per frame
+        frame_time -- expected seconds between frames, such as the exposure
+                      period, until the frames arriving give a rate
+        first_wedge_degrees -- degrees of data for the first wedge
+        min_step_degrees -- fewest degrees between wedges
+        logger -- logger instance
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+
+        self.first_frame = int(first_frame)
+        self.last_frame = int(last_frame)
+        try:
+            osc_range = float(osc_range)
+        except (TypeError, ValueError):
+            osc_range = 0
+        if osc_range <= 0:
+            osc_range = 1.0
+        self.first_wedge = max(1, int(math.ceil(first_wedge_degrees / osc_range)))
+        self.min_step = max(1, int(math.ceil(min_step_degrees / osc_range)))
+        self.frame_time = frame_time or None
+
+        self.arrivals = collections.deque()
+
+        # Model of XDS times
+        self.setup_time = SETUP_TIME
+        self.integrate_time = INTEGRATE_TIME
+        self.correct_time = CORRECT_TIME
+
+        # The running wedge
+        self.running = None
+
+        # The last frame of the newest wedge finished, and the next checkpoint
+        self.completed = None
+        self.checkpoint = self.first_frame + self.first_wedge - 1
+
+    def frame_arrived(self, frame, now=None):
+        """Note that frame has been written"""
+
+        if now is None:
+            now = time.time()
+        self.arrivals.append((frame, now))
+        while len(self.arrivals) > 2 and now - self.arrivals[0][1] > ARRIVAL_WINDOW:
+            self.arrivals.popleft()
+
+    def get_period(self):
+        """Return the seconds between frames, or None if not known yet"""
+
+        if len(self.arrivals) > 1:
+            first_frame, first_time = self.arrivals[0]
+            last_frame, last_time = self.arrivals[-1]
+            if last_frame > first_frame and last_time - first_time >= MIN_ARRIVAL_SPAN:
+                return (last_time - first_time) / (last_frame - first_frame)
+        return self.frame_time
+
+    def predict_runtime(self, last, previous=None):
+        """
+        Return the seconds expected to integrate the frames to last,
+        carrying on from the wedge ending at frame previous if there is one
+        """
+
+        frames = last - self.first_frame + 1
+        if previous:
+            return self.integrate_time * (last - previous) + self.correct_time * frames
+        return self.setup_time + self.integrate_time * frames + self.correct_time * frames
+
+    def get_arrival(self, seconds):
+        """Return the frames expected to arrive in seconds"""
+
+        period = self.get_period()
+        if not period:
+            return 0
+        return int(math.ceil(seconds / period))
+
+    def is_useful(self, frame, now=None):
+        """Return True if a wedge to frame is expected to finish before the last frame"""
+
+        if frame >= self.last_frame:
+            return False
+        period = self.get_period()
+        if not period:
+            return True
+        runtime = self.predict_runtime(frame, self.completed)
+        return frame + runtime / period < self.last_frame
+
+    def is_stale(self, now=None):
+        """Return True if the running wedge is taking far longer than expected"""
+
+        if not self.running:
+            return False
+        if now is None:
+            now = time.time()
+        return now - self.running["started"] > STALE_FACTOR * self.running["expected"]
+
+    def should_launch(self, frame, now=None):
+        """
+        Return True if a wedge to frame should be started now. A running
+        wedge is waited for, unless it has gone stale.
+        """
+
+        if frame < self.checkpoint or not self.is_useful(frame, now):
+            return False
+        if self.running and not self.is_stale(now):
+            return False
+        return True
+
+    def wedge_started(self, frame, now=None):
+        """Note that a wedge to frame has started, and set the next checkpoint"""
+
+        if now is None:
+            now = time.time()
+        if self.running:
+            self.logger.debug("Wedge to %d is stale after %.1f s",
+                              self.running["last"],
+                              now - self.running["started"])
+        expected = self.predict_runtime(frame, self.completed)
+        self.running = {"last":frame,
+                        "previous":self.completed,
+                        "started":now,
+                        "expected":expected}
+        self.checkpoint = frame + max(self.min_step, self.get_arrival(expected))
+        self.logger.debug("Wedge to %d expected to take %.1f s, next at frame %d",
+                          frame,
+                          expected,
+                          self.checkpoint)
+
+    def wedge_finished(self, stage_times=None, succeeded=True, now=None):
+        """
+        Note that the running wedge has finished, updating the model of XDS
+        with the seconds each step took
+
+        Keyword arguments
+        stage_times -- seconds each step of XDS took, as from
+                       plugins.subcontractors.xds.get_stage_times
+        succeeded -- the wedge can be carried on from
+        """
+
+        if not self.running:
+            return
+        wedge, self.running = self.running, None
+        if not succeeded:
+            return
+        self.completed = wedge["last"]
+
+        stage_times = stage_times or {}
+        frames = wedge["last"] - self.first_frame + 1
+        if "XYCORR" in stage_times:
+            self.setup_time = self.smooth(self.setup_time,
+                                          sum(stage_times.get(stage, 0) \
+                                              for stage in SETUP_STAGES))
+            integrated = frames
+        else:
+            integrated = wedge["last"] - (wedge["previous"] or self.first_frame - 1)
+        if "INTEGRATE" in stage_times and integrated > 0:
+            self.integrate_time = self.smooth(self.integrate_time,
+                                              stage_times["INTEGRATE"] / integrated)
+        if "CORRECT" in stage_times:
+            self.correct_time = self.smooth(self.correct_time, stage_times["CORRECT"] / frames)
+
+        if now is None:
+            now = time.time()
+        self.logger.debug("Wedge to %d took %.1f s, expected %.1f s",
+                          wedge["last"],
+                          now - wedge["started"],
+                          wedge["expected"])
+
+    @staticmethod
+    def smooth(average, value):
+        """Return the average moved towards value"""
+
+        return (1 - SMOOTHING) * average + SMOOTHING * value
@@ -0,0 +1,221 @@
+"""
+Pairwise correlation of many data sets at once, with each data set held
+once in a Miller index space common to all of them
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-17"
+__maintainer__ = "Kay Perry"
+__email__ = "kperry@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+# Miller indices are packed into one integer, each offset by INDEX_OFFSET
+INDEX_OFFSET = 512
+INDEX_RANGE = 2 * INDEX_OFFSET
+
+# Fewest reflections in common to calculate a CC from
+MIN_COMMON = 3
+
+# Data sets correlated at a time by each thread
+BLOCK_SIZE = 64
+
+# Reflections correlated at a time
+COLUMN_BLOCK = 8192
+
+# Tolerances of cctbx is_similar_symmetry
+RELATIVE_LENGTH_TOLERANCE = 0.01
+ABSOLUTE_ANGLE_TOLERANCE = 1.0
+
+def pack_indices(indices):
+    """Return an array of one integer for each row of Miller indices"""
+
+    indices = numpy.asarray(indices, dtype=numpy.int64).reshape(-1, 3) + INDEX_OFFSET
+    return (indices[:, 0] * INDEX_RANGE + indices[:, 1]) * INDEX_RANGE + indices[:, 2]
+
+def merge_observations(indices, data):
+    """
+    Return the packed unique Miller indices of the observations of a data
+    set, and the mean of the observations of each
+    """
+
+    keys, inverse = numpy.unique(pack_indices(indices), return_inverse=True)
+    counts = numpy.bincount(inverse)
+    sums = numpy.bincount(inverse, weights=numpy.asarray(data, dtype=numpy.float64))
+    return keys, sums / counts
+
+def build_index_space(datasets):
+    """
+    Place data sets in one Miller index space. Returns a float32 array of
+    the values of each data set by reflection, 0 where it is not measured,
+    and a boolean array of where it is measured. Only reflections measured
+    in at least two data sets are kept, as no others can be correlated.
+
+    The two take 5 bytes per data set per kept reflection - 500 data sets
+    sharing 200,000 reflections take 500 MB.
+
+    Keyword arguments
+    datasets -- list of (indices, data) of each data set, the indices
+                already reduced to the asymmetric unit
+    """
+
+    merged = [merge_observations(indices, data) for indices, data in datasets]
+    if not merged:
+        return numpy.zeros((0, 0), dtype=numpy.float32), numpy.zeros((0, 0), dtype=bool)
+
+    all_keys, inverse = numpy.unique(numpy.concatenate([keys for keys, __ in merged]),
+                                     return_inverse=True)
+
+    # Columns of the reflections of each data set
+    columns = []
+    start = 0
+    for keys, __ in merged:
+        columns.append(inverse[start:start + len(keys)])
+        start += len(keys)
+
+    # Only keep reflections in more than one data set
+    shared = numpy.bincount(inverse, minlength=len(all_keys)) > 1
+    new_column = numpy.cumsum(shared) - 1
+
+    values = numpy.zeros((len(merged), int(shared.sum())), dtype=numpy.float32)
+    mask = numpy.zeros(values.shape, dtype=bool)
+    for row, (column, (__, means)) in enumerate(zip(columns, merged)):
+        keep = shared[column]
+        values[row, new_column[column[keep]]] = means[keep]
+        mask[row, new_column[column[keep]]] = True
+
+    return values, mask
+
+def _correlate_block(values, squares, weights, start, stop):
+    """Return the sums for the CCs of data sets start to stop with all the others"""
+
+    block_values = values[start:stop]
+    return (numpy.dot(weights[start:stop], weights.T),
+            numpy.dot(block_values, weights.T),
+            numpy.dot(squares[start:stop], weights.T),
+            numpy.dot(block_values, values.T))
+
+def correlation_matrix(values, mask, min_common=MIN_COMMON, threads=None):
+    """
+    Return the matrix of the linear correlation coefficients of each pair
+    of data sets over the reflections they have in common, 0 for pairs
+    with fewer than min_common of them. Blocks of data sets are correlated
+    in threads, numpy releasing the GIL for the matrix products.
+
+    Reflections are taken COLUMN_BLOCK at a time and summed in float64, so
+    beyond values and mask this needs about 24 * nsets * COLUMN_BLOCK
+    bytes and 40 * nsets * nsets bytes for the sums and result - 100 MB
+    and 10 MB for 500 data sets.
+
+    Keyword arguments
+    values -- values of the data sets, as made by build_index_space
+    mask -- where the data sets are measured
+    min_common -- fewest reflections in common to calculate a CC from
+    threads -- threads to use (default the number of processors)
+    """
+
+    nsets, nrefl = values.shape
+    blocks = [(start, min(start + BLOCK_SIZE, nsets)) for start in range(0, nsets, BLOCK_SIZE)]
+    if not blocks:
+        return numpy.zeros((0, 0))
+
+    count, sum_x, sum_xx, sum_xy = [numpy.zeros((nsets, nsets)) for __ in range(4)]
+
+    pool = ThreadPool(max(1, min(threads or cpu_count(), len(blocks))))
+    try:
+        for column in range(0, nrefl, COLUMN_BLOCK):
+            columns = slice(column, column + COLUMN_BLOCK)
+            weights = mask[:, columns].astype(numpy.float64)
+            column_values = values[:, columns] * weights
+            squares = column_values * column_values
+            sums = pool.map(lambda block: _correlate_block(column_values, squares, weights, *block),
+                            blocks)
+            for i, total in enumerate((count, sum_x, sum_xx, sum_xy)):
+                total += numpy.vstack([block[i] for block in sums])
+    finally:
+        pool.close()
+        pool.join()
+
+    # Sums over the second of each pair are those over the first, transposed
+    sum_y = sum_x.T
+    sum_yy = sum_xx.T
+
+    # Pearson CC from the sums over the reflections each pair has in common
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        covariance = count * sum_xy - sum_x * sum_y
+        variance = (count * sum_xx - sum_x * sum_x) * (count * sum_yy - sum_y * sum_y)
+        ccs = covariance / numpy.sqrt(variance)
+    ccs[(count < min_common) | ~numpy.isfinite(ccs)] = 0
+    numpy.fill_diagonal(ccs, 1)
+
+    return numpy.clip(ccs, -1, 1)
+
+def cell_matrix(cells, strict=False):
+    """
+    Return the matrix of the correlation of each pair of unit cells - 1
+    minus the mean of the relative difference of their cell lengths. In
+    strict mode pairs whose angles differ have 0.
+
+    Keyword arguments
+    cells -- unit cell parameters of each data set
+    strict -- require the same cell angles
+    """
+
+    cells = numpy.asarray(cells, dtype=numpy.float64).reshape(-1, 6)
+    lengths = cells[:, :3]
+    difference = numpy.abs(lengths[:, None, :] - lengths[None, :, :])
+    smaller = numpy.minimum(lengths[:, None, :], lengths[None, :, :])
+    ccs = 1 - (difference / smaller).mean(axis=2)
+
+    if strict:
+        angles = cells[:, 3:]
+        same_angles = (angles[:, None, :] == angles[None, :, :]).all(axis=2)
+        ccs[~same_angles] = 0
+
+    return ccs
+
+def similar_symmetry_matrix(cells, spacegroups):
+    """
+    Return a boolean matrix of the pairs of data sets with similar
+    symmetry - the same spacegroup and cells within the tolerances of
+    cctbx is_similar_symmetry
+
+    Keyword arguments
+    cells -- unit cell parameters of each data set
+    spacegroups -- spacegroup number of each data set
+    """
+
+    cells = numpy.asarray(cells, dtype=numpy.float64).reshape(-1, 6)
+    spacegroups = numpy.asarray(spacegroups)
+
+    lengths = cells[:, :3]
+    similar_lengths = (numpy.abs(lengths[:, None, :] - lengths[None, :, :]) <= \
+                       RELATIVE_LENGTH_TOLERANCE * lengths[:, None, :]).all(axis=2)
+    similar_angles = (numpy.abs(cells[:, None, 3:] - cells[None, :, 3:]) <= \
+                      ABSOLUTE_ANGLE_TOLERANCE).all(axis=2)
+    same_spacegroup = spacegroups[:, None] == spacegroups[None, :]
+
+    return similar_lengths & similar_lengths.T & similar_angles & same_spacegroup
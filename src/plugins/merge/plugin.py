@@ -72,6 +72,7 @@ from cctbx import miller
 from cctbx.array_family import flex
 from cctbx.sgtbx import space_group_symbols
 from scipy.cluster.hierarchy import linkage, dendrogram, to_tree
+import numpy
 #from hcluster import linkage, dendrogram
 
 import cPickle as pickle  # For storing dicts as pickle files for later use
@@ -79,11 +80,13 @@ import cPickle as pickle  # For storing dicts as pickle files for later use
 # RAPD imports
 #import plugins.assess_integrated_data.plugin as assess_integrated_data_plugin
 #import plugins.assess_integrated_data.commandline as assess_integrated_data_commandline
+import plugins.merge.cc_matrix as cc_matrix
 import plugins.subcontractors.aimless as aimless
 import utils.commandline_utils as commandline_utils
 # import detectors.detector_utils as detector_utils
 # import utils
 import utils.credits as credits
+import utils.result_delta as result_delta
 import utils.text as rtext
 import info
 
@@ -260,6 +263,24 @@ def combine(in_files, out_file, cmd_prefix, strict, force, user_spacegroup):
                                      stdout=subprocess.PIPE,
                                      stderr=subprocess.PIPE).communicate()
 
+def load_reflections(in_file):
+    """
+    Read the intensities of a reflection file once for correlating with the
+    others, reduced to the asymmetric unit with Friedel mates together.
+    Returns (indices, intensities, unit cell, spacegroup number).
+    """
+
+    reflection_file = reflection_file_reader.any_reflection_file(file_name=in_file)
+    # ma[2] has I and SIGI for mtz, ma[0] has I and SIGI for hkl
+    intensities = reflection_file.as_miller_arrays(merge_equivalents=False)[0]
+    reduced = intensities.as_non_anomalous_array().map_to_asu()
+
+    indices = reduced.indices().as_vec3_double().as_double().as_numpy_array()
+    return (indices.reshape(-1, 3).astype(numpy.int64),
+            reduced.data().as_numpy_array(),
+            reduced.unit_cell().parameters(),
+            reduced.space_group().type().number())
+
 
 class RapdPlugin(multiprocessing.Process):
     """
@@ -280,6 +301,9 @@ class RapdPlugin(multiprocessing.Process):
 
     results = {}
 
+    # Turns results into snapshots and deltas for sending
+    result_sender = None
+
     def __init__(self, site, command, tprint=False, logger=False):
         """Initialize the merging processing using agglomerative hierachical clustering process"""
 
@@ -655,17 +679,17 @@ class RapdPlugin(multiprocessing.Process):
                         self.logger.error(
                             'HCMerge::%s_pointless.mtz has only one run. CC defaults to 0.' % pair)
                         self.results[pair]['CC'] = 0
-        if self.metric == 'UC':
-            for pair in self.id_list.keys():
-                self.results[pair] = {}
-                self.results[pair]['CC'] = self.get_cc_cell(self.id_list[pair])
-                self.logger.debug('Correlation by Unit Cell Variation of %s: %s' % (pair, str(self.results[pair]['CC'])))
-        else:
-            for pair in self.id_list.keys():
-                self.results[pair] = {}
-                int_array1,int_array2 = self.get_int(self.id_list[pair])
-                self.results[pair]['CC'] = self.get_cc(int_array1, int_array2)
-                self.logger.debug('Correlation Coefficient of %s: %s' % (pair, str(self.results[pair]['CC'])))
+
+        # Read each file once, and correlate all the pairs at once
+        ccs = self.get_cc_matrix(pool.map(load_reflections, self.data_files))
+        pool.close()
+        pool.join()
+        positions = dict((data_file, position) for position, data_file in enumerate(self.data_files))
+        for pair in self.id_list.keys():
+            self.results[pair] = {}
+            first, second = [positions[data_file] for data_file in self.id_list[pair]]
+            self.results[pair]['CC'] = float(ccs[first, second])
+            self.logger.debug('Correlation Coefficient of %s: %s' % (pair, str(self.results[pair]['CC'])))
 
         # for pair in self.id_list.keys():
         #     self.results[pair] = {}
@@ -851,22 +875,32 @@ class RapdPlugin(multiprocessing.Process):
             cc=0
         return(cc)                                      
 
-    def get_int(self, pair):
+    def get_cc_matrix(self, reflections):
         """
-        Get the intensity arrays from a pair (of files)
+        Calculate the correlation of every pair of datasets at once from the
+        reflections of each, as read by load_reflections. Returns a matrix
+        of the CCs by position in self.data_files.
         """
 
-        # Read in reflection files    
-        file1 = reflection_file_reader.any_reflection_file(file_name=pair[0])
-        file2 = reflection_file_reader.any_reflection_file(file_name=pair[1])
-        
-        # Convert to miller arrays
-        # ma[2] has I and SIGI for mtz, ma[0] has I and SIGI for hkl
-        ma1 = file1.as_miller_arrays(merge_equivalents=False)
-        ma2 = file2.as_miller_arrays(merge_equivalents=False)
+        cells = [cell for __, __, cell, __ in reflections]
+
+        if self.metric == 'UC':
+            # Correlation by the variation in cell lengths
+            self.logger.debug('MERGE::Using Unit Cell to Determine Isomorphism')
+            return cc_matrix.cell_matrix(cells, self.strict)
 
-        # return the intensity arrays
-        return(ma1[0], ma2[0])
+        # Intensities of all the datasets in one Miller index space
+        values, mask = cc_matrix.build_index_space(
+            [(indices, data) for indices, data, __, __ in reflections])
+        self.logger.debug('HCMerge::Correlating %d datasets over %d reflections' % values.shape)
+        ccs = cc_matrix.correlation_matrix(values, mask, threads=self.nproc)
+
+        # The two datasets must be in the same spacegroup and unit cell in strict mode
+        if self.strict:
+            spacegroups = [spacegroup for __, __, __, spacegroup in reflections]
+            ccs[~cc_matrix.similar_symmetry_matrix(cells, spacegroups)] = 0
+
+        return ccs
 
     def get_int_pointless(self, in_file, batches):
         """
@@ -923,46 +957,6 @@ class RapdPlugin(multiprocessing.Process):
         #         str(in_file), str(cc.coefficient())))
         #     return(cc.coefficient())
 
-    def get_cc_cell(self, pair):
-        """
-        Calculate a correlation based on unit cell length from a pair of files.
-        """
-
-        self.logger.debug('MERGE::Using Unit Cell to Determine Isomorphism')
-
-        # Read in reflection files    
-        file1 = reflection_file_reader.any_reflection_file(file_name=pair[0])
-        file2 = reflection_file_reader.any_reflection_file(file_name=pair[1])
-
-        # Convert to miller arrays
-        # ma[2] has I and SIGI for mtz, ma[0] has I and SIGI for hkl
-        ma1 = file1.as_miller_arrays(merge_equivalents=False)
-        ma2 = file2.as_miller_arrays(merge_equivalents=False)
-
-        # Get Unit Cells from each miller array
-        uc1 = ma1[0].unit_cell().parameters()
-        uc2 = ma2[0].unit_cell().parameters()
-
-        # Correlation as the average of the variation in cell lengths.  Does not account for angle variations.
-        a1, b1, c1 = uc1[0], uc1[1], uc1[2]
-        a2, b2, c2 = uc2[0], uc2[1], uc2[2]
-        variation = [abs(a1-a2)/min(a1,a2),abs(b1-b2)/min(b1,b2),abs(c1-c2)/min(c1, c2)]
-        average = 1 - (sum(variation)/len(variation))
-
-        try:
-            if self.strict:
-                alpha1, beta1, gamma1 = uc1[3], uc1[4], uc1[5]
-                alpha2, beta2, gamma2 = uc2[3], uc2[4], uc2[5]
-                if (alpha1 == alpha2) and (beta1 == beta2) and (gamma1 == gamma2):
-                    cc = average
-                else:
-                    cc = 0
-            else:
-                cc = average
-        except:
-            cc = 0
-        return(cc)
-
     def scale(self, in_file, out_file, VERBOSE=False):
         """
         Scaling files using AIMLESS
@@ -1467,8 +1461,11 @@ class RapdPlugin(multiprocessing.Process):
 
             self.logger.debug("Sending back on redis")
 
-            # Transcribe results
-            json_results = json.dumps(results)
+            # Transcribe results - only what has changed since the last
+            # message, unless the status has changed
+            if not self.result_sender:
+                self.result_sender = result_delta.ResultSender()
+            json_results = json.dumps(self.result_sender.prepare(results))
 
             # Get redis instance
             if not self.redis:
@@ -28,6 +28,8 @@ __status__ = "Development"
 # Get the default preferences setup
 DEFAULT_PREFERENCES = {"pdb_limit": 5, #DEFAULT:40
                        "cell_limit": 25,
+                       # Stop the other Phaser jobs once one has a definitive solution
+                       "stop_on_solution": True,
                        
   }
 
@@ -0,0 +1,172 @@
+"""
+Choosing the order Phaser is run on the candidate models of a PDB query,
+and when the rest are not needed any more
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-16"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import logging
+
+# Where candidates come from, in the order they are run - models given by
+# the user, then those found by cell, then the contaminants, which are
+# tried whatever the cell
+SOURCES = ("custom_structures", "search_results", "common_contaminants")
+
+# Phaser TFZ and LLG gain of a solution that is certainly right
+DEFINITIVE_TFZ = 8.0
+DEFINITIVE_LLG = 120.0
+
+# Cell distance of candidates found without one
+UNKNOWN_CELL_DISTANCE = 1.0
+
+# eLLG target resolution of models it could not be worked out for
+UNKNOWN_RESOLUTION = 99.0
+
+def is_definitive(result):
+    """Return True if a Phaser result has a solution that is certainly right"""
+
+    if not result or not result.get("solution"):
+        return False
+    try:
+        tfz = float(result.get("tfz"))
+        gain = float(result.get("gain"))
+    except (TypeError, ValueError):
+        # Not computed (NC) or arbitrary
+        return False
+    return tfz >= DEFINITIVE_TFZ and gain >= DEFINITIVE_LLG
+
+def get_priority(source, cell_distance=None, resolution=None):
+    """
+    Return a key to sort candidates by, most likely to succeed first -
+    by where they came from, then how close their cell is, then the
+    resolution Phaser expects to need (lower is a more informative model)
+    """
+
+    if source in SOURCES:
+        rank = SOURCES.index(source)
+    else:
+        rank = len(SOURCES)
+    if cell_distance is None:
+        cell_distance = UNKNOWN_CELL_DISTANCE
+    if not resolution:
+        resolution = UNKNOWN_RESOLUTION
+    return (rank, cell_distance, resolution)
+
+class MRScheduler(object):
+    """
+    Hands out Phaser jobs best first, no more than max_running at a time,
+    and once one has a definitive solution hands out no more
+    """
+
+    def __init__(self, max_running=None, stop_on_solution=True, logger=None):
+        """
+        Keyword arguments
+        max_running -- most jobs running at once (default no limit)
+        stop_on_solution -- stop once a job has a definitive solution
+        logger -- logger instance
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+
+        self.max_running = max_running
+        self.stop_on_solution = stop_on_solution
+
+        # (priority, order added, name, description) of the jobs not started
+        self.pending = []
+        self.running = set()
+
+        # Name of the job with a definitive solution
+        self.solution = None
+
+    def add(self, name, description, priority):
+        """Add a job to be run"""
+
+        self.pending.append((priority, len(self.pending), name, description))
+        self.pending.sort()
+
+    def next_jobs(self):
+        """Return a list of (name, description) of the jobs to start now"""
+
+        if self.is_stopped():
+            return []
+
+        if self.max_running:
+            free = max(0, self.max_running - len(self.running))
+        else:
+            free = len(self.pending)
+
+        starting, self.pending = self.pending[:free], self.pending[free:]
+        for __, __, name, __ in starting:
+            self.running.add(name)
+        return [(name, description) for __, __, name, description in starting]
+
+    def job_finished(self, name, result):
+        """Note that a job has finished, returning True if its solution is definitive"""
+
+        self.running.discard(name)
+        if not is_definitive(result):
+            return False
+
+        if self.solution is None:
+            self.solution = name
+            self.logger.debug("Definitive solution with %s - TFZ %s, LLG %s",
+                              name,
+                              result.get("tfz"),
+                              result.get("gain"))
+        return True
+
+    def job_stopped(self, name):
+        """Note that a job has been stopped before finishing"""
+
+        self.running.discard(name)
+
+    def is_stopped(self):
+        """Return True if no more jobs are needed"""
+
+        return bool(self.stop_on_solution and self.solution)
+
+    def get_unneeded(self):
+        """
+        Return a list of (name, description) of the jobs not started and a
+        list of the names of the jobs running that are not needed any more,
+        forgetting those not started
+        """
+
+        if not self.is_stopped():
+            return [], []
+        return self.get_pending(), sorted(self.running)
+
+    def get_pending(self):
+        """Return a list of (name, description) of the jobs not started, and forget them"""
+
+        not_started = [(name, description) for __, __, name, description in self.pending]
+        self.pending = []
+        return not_started
+
+    def is_done(self):
+        """Return True if there are no jobs left to run or wait for"""
+
+        return not self.running and (not self.pending or self.is_stopped())
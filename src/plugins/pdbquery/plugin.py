@@ -45,20 +45,22 @@ from multiprocessing import cpu_count
 from threading import Thread
 import os
 from pprint import pprint
-import random
+from Queue import Empty, Queue
 import shutil
 import sys
 import time
 import importlib
-import random
 
 # RAPD 
 from bson.objectid import ObjectId
-from plugins.subcontractors.rapd_phaser import run_phaser
+from plugins.subcontractors.rapd_phaser import get_script_result, new_output_id, prepare_data, \
+                                              run_phaser
 from plugins.subcontractors.rapd_cctbx import get_pdb_info, get_mtz_info, get_res, get_spacegroup_info
-from plugins.get_cif.plugin import check_pdbq
+from plugins.get_cif.plugin import check_pdbq, prefetch_structures
+import plugins.pdbquery.mr_scheduler as mr_scheduler
 # from plugins.subcontractors.parse import parse_phaser_output, set_phaser_failed
 from utils import archive
+import utils.cell_index as cell_index
 import utils.credits as rcredits
 import utils.exceptions as exceptions
 import utils.global_vars as rglobals
@@ -71,6 +73,13 @@ import info
 # NE-CAT REST PDB server
 PDBQ_SERVER = rglobals.PDBQ_SERVER
 
+# Cell distance within which entries are kept beyond the limit, as the two
+# narrowest server searches did
+CLOSE_CELL_DISTANCE = 0.02
+
+# Most seconds to wait for a Phaser job to finish before checking the time
+COMPLETION_WAIT = 60.0
+
 # Software dependencies
 VERSIONS = {
     "gnuplot": (
@@ -121,6 +130,12 @@ class RapdPlugin(Thread):
     # Holders for launched Phaser jobs
     cell_output = {}
     jobs = {}
+    # Order the Phaser jobs are run in, and when the rest are not needed
+    scheduler = False
+    # Keys of the Phaser jobs as they finish
+    completed = False
+    # Reflections read once for all the Phaser jobs
+    prepared_data = False
 
     # Holders for pdb ids
     custom_structures = []
@@ -386,7 +401,7 @@ class RapdPlugin(Thread):
                 self.connect_to_redis()
 
             # Send results back
-            self.redis.lpush("RAPD_RESULTS", json_results)
+            self.redis.lpush("RAPD_RESULTS", json.pack(self.results, json_results))
             self.redis.publish("RAPD_RESULTS", json_results)
 
     def process(self):
@@ -493,41 +508,48 @@ class RapdPlugin(Thread):
             #limit = 8
             limit = self.preferences.get("pdb_limit", 20)
 
-        # Limit the unit cell difference to 25%. Also stops it if errors are received.
-        pdbq_results = {}
-        counter = 0
-        #while counter < 25:
-        while counter < self.preferences.get("cell_limit", 25):
-            self.tprint("  Querying server at %s" % PDBQ_SERVER,
-                        level=20,
-                        color="white")
+        # Search the local index of PDB cells, if there is one
+        index = cell_index.get_cell_index()
+        if index:
+            pdbq_results = self.query_cell_index(index, limit, no_limit)
 
-            # Connect to and query the PDBQ server
-            pdbq_results = connect_pdbq(pdbq_results, permutations, end)
-
-            # Handle results
-            if pdbq_results:
-                for line in pdbq_results.keys():
-                    # Remove anything bigger than 4 letters
-                    if len(line) > 4:
-                        del pdbq_results[line]
-
-                # Do not limit number of results if many models come out really close in cell
-                # dimensions.
-                if counter in (0, 1):
-                    # Limit output
-                    if no_limit == False:
+        else:
+            pdbq_results = {}
+            counter = 0
+
+            # Limit the unit cell difference to 25%. Also stops it if errors are received.
+            #while counter < 25:
+            while counter < self.preferences.get("cell_limit", 25):
+                self.tprint("  Querying server at %s" % PDBQ_SERVER,
+                            level=20,
+                            color="white")
+
+                # Connect to and query the PDBQ server
+                pdbq_results = connect_pdbq(pdbq_results, permutations, end)
+
+                # Handle results
+                if pdbq_results:
+                    for line in pdbq_results.keys():
+                        # Remove anything bigger than 4 letters
+                        if len(line) > 4:
+                            del pdbq_results[line]
+
+                    # Do not limit number of results if many models come out really close in cell
+                    # dimensions.
+                    if counter in (0, 1):
+                        # Limit output
+                        if no_limit == False:
+                            pdbq_results = limit_pdbq_results(pdbq_results, limit)
+                    else:
                         pdbq_results = limit_pdbq_results(pdbq_results, limit)
-                else:
-                    pdbq_results = limit_pdbq_results(pdbq_results, limit)
 
-            # Not enough results
-            if len(pdbq_results) < limit:
-                counter += 1
-                self.percent += 0.01
-                self.logger.debug("Not enough PDB results. Going for more...")
-            else:
-                break
+                # Not enough results
+                if len(pdbq_results) < limit:
+                    counter += 1
+                    self.percent += 0.01
+                    self.logger.debug("Not enough PDB results. Going for more...")
+                else:
+                    break
 
         # There will be results!
         if pdbq_results:
@@ -552,6 +574,29 @@ class RapdPlugin(Thread):
                         level=50,
                         color="red")
 
+    def query_cell_index(self, index, limit, no_limit):
+        """
+        Return the entries like self.cell in the local index of PDB cells,
+        as connect_pdbq returns them. All orders of the axes are searched,
+        out to the cell_limit percent of the server search.
+        """
+
+        self.tprint("  Searching %d cells in the local index" % len(index),
+                    level=20,
+                    color="white")
+
+        hits = index.nearest(self.cell,
+                             max_distance=self.preferences.get("cell_limit", 25) * 0.01)
+
+        # Do not limit number of results if many models come out really close in cell
+        keep = limit
+        if no_limit:
+            keep = max(limit,
+                       len([1 for __, distance in hits if distance <= CLOSE_CELL_DISTANCE]))
+
+        return dict((str(index.codes[position]), index.get_entry(position, distance)) \
+                    for position, distance in hits[:keep])
+
     def add_contaminants(self):
         """
         Add common PDB contaminants to the search list.
@@ -596,35 +641,31 @@ class RapdPlugin(Thread):
 
         self.tprint("  Assembling Phaser runs", level=10, color="white")
 
-        def launch_job(inp):
-            """Launch the Phaser job"""
-            #self.logger.debug("process_phaser Launching %s"%inp['name'])
-            tag = 'Phaser_%d' % random.randint(0, 10000)
-            if self.computer_cluster:
-                # Create a unique identifier for Phaser results
-                inp['tag'] = tag
-                # Send Redis settings so results can be sent thru redis
-                #inp['db_settings'] = self.site.CONTROL_DATABASE_SETTINGS
-                # Don't need result queue since results will be sent via Redis
-                queue = False
-            else:
-                inp['pool'] = self.pool
-                # Add result queue
-                queue = self.manager.Queue()
-                inp['result_queue'] = queue
-            
-            #if self.pool:
-            #    inp['pool'] = self.pool
-            #else:
-            #    inp['tag'] = tag
-            #job, pid, tag = run_phaser(**inp)
-            job, pid = run_phaser(**inp)
-            self.jobs[job] = {'name': inp['name'],
-                              'pid' : pid,
-                              'tag' : tag,
-                              'result_queue': queue,
-                              'spacegroup': inp['spacegroup'] # Need for jobs that timeout.
-                              }
+        def add_job(inp, resolution):
+            """Queue the Phaser job, to be launched best first"""
+            pdb_code = inp["name"].split("_")[0]
+            priority = mr_scheduler.get_priority(self.get_source(pdb_code),
+                                                 self.cell_output[pdb_code].get("cell_distance"),
+                                                 resolution)
+            self.scheduler.add(inp["name"], inp.copy(), priority)
+
+        # Run at most as many jobs at once as the pool has processes
+        if self.computer_cluster:
+            max_running = None
+        else:
+            max_running = self.preferences.get("nproc", cpu_count()-1)
+        self.scheduler = mr_scheduler.MRScheduler(
+            max_running=max_running,
+            stop_on_solution=self.preferences.get("stop_on_solution", True),
+            logger=self.logger)
+        self.completed = Queue()
+
+        # Read the reflections once for all the jobs
+        self.prepared_data = prepare_data(self.data_file, self.working_dir)
+
+        # Fetch the structures not in the structure cache at once
+        if not self.test:
+            prefetch_structures(self.repository, self.cell_output.keys())
 
         # Run through the pdbs
         for pdb_code in self.cell_output.keys():
@@ -721,10 +762,11 @@ class RapdPlugin(Thread):
                     "db_settings": self.db_settings,  #
                     "tag": False,  #
                     "batch_queue": self.batch_queue, #
-                    "rapd_python": self.rapd_python}
+                    "rapd_python": self.rapd_python,
+                    "prepared_data": self.prepared_data}
     
                 if not l:
-                    launch_job(job_description)
+                    add_job(job_description, pdb_info["all"]["res"])
                 else:
                     for chain in l:
                         new_code = "%s_%s" % (pdb_code, chain)
@@ -738,7 +780,48 @@ class RapdPlugin(Thread):
                             "resolution":xutils.set_phaser_res(pdb_info[chain]["res"],
                                                         self.large_cell,
                                                         self.dres)})
-                        launch_job(job_description)
+                        add_job(job_description, pdb_info[chain]["res"])
+
+        self.launch_jobs()
+
+    def get_source(self, job_name):
+        """Return where the PDB of a job came from"""
+
+        pdb_code = job_name.split("_")[0]
+        for source in mr_scheduler.SOURCES:
+            if pdb_code in getattr(self, source):
+                return source
+        return None
+
+    def launch_jobs(self):
+        """Launch the Phaser jobs the scheduler has room for"""
+
+        for name, inp in self.scheduler.next_jobs():
+            self.logger.debug("process_phaser Launching %s", name)
+            # Key of the job, and of its results in Redis
+            tag = new_output_id()
+            inp["tag"] = tag
+            # Put the key on self.completed when the job has finished
+            inp["callback"] = self.completed.put
+            if self.computer_cluster:
+                # Don't need result queue since results will be sent via Redis
+                result_queue = False
+                pid_queue = False
+            else:
+                inp["pool"] = self.pool
+                result_queue = self.manager.Queue()
+                pid_queue = self.manager.Queue()
+                inp["result_queue"] = result_queue
+                inp["pid_queue"] = pid_queue
+
+            job, pid = run_phaser(**inp)
+            self.jobs[tag] = {"job": job,
+                              "name": name,
+                              "pid": pid,
+                              "pid_queue": pid_queue,
+                              "result_queue": result_queue,
+                              "spacegroup": inp["spacegroup"] # Need for jobs that timeout.
+                             }
 
     def postprocess_phaser(self, job_name, results):
         """fix Phaser results and pass back"""
@@ -931,101 +1014,139 @@ class RapdPlugin(Thread):
         # Passback new results to RAPD
         self.send_results()
 
-    def jobs_monitor(self):
-        """Monitor running jobs and finsh them when they complete."""
+    def finish_job(self, tag):
+        """Finish a job and send its results to postprocess_phaser"""
+
+        job_info = self.jobs.pop(tag)
+        self.tprint("    Finished Phaser on %s" % job_info["name"], level=30, color="white")
+        self.logger.debug("Finished Phaser on %s with id: %s", job_info["name"], tag)
 
-        def finish_job(job):
-            """Finish the jobs and send to postprocess_phaser"""
-            info = self.jobs.pop(job)
-            self.tprint('    Finished Phaser on %s with id: %s'%(info['name'], info['tag']), level=30, color="white")
-            self.logger.debug('Finished Phaser on %s'%info['name'])
+        results = False
+        if self.computer_cluster:
+            results_json = self.redis.get(tag)
+            if results_json:
+                results = json.loads(results_json)
+            self.redis.delete(tag)
+        else:
+            try:
+                output = job_info["result_queue"].get(timeout=1)
+                results = get_script_result(output.get("stdout"))
+            except Empty:
+                pass
+        if not results:
+            results = {"ID": job_info["name"],
+                       "solution": False,
+                       "spacegroup": job_info["spacegroup"],
+                       "message": "Error launching job"}
+
+        if self.scheduler.job_finished(job_info["name"], results):
+            self.tprint("    Definitive solution with %s" % job_info["name"],
+                        level=30,
+                        color="white")
+        self.postprocess_phaser(job_info["name"], results)
+
+    def stop_job(self, tag, message):
+        """Stop a running job and send message to postprocess_phaser as its result"""
+
+        job_info = self.jobs.pop(tag)
+        self.logger.debug("Stopping Phaser on %s - %s", job_info["name"], message)
+        if self.computer_cluster:
+            # Kill job on cluster:
+            self.computer_cluster.kill_job(job_info["pid"])
+        else:
+            # Kill the subprocess running the script
+            try:
+                xutils.kill_children(job_info["pid_queue"].get(timeout=1), self.logger)
+            except Empty:
+                pass
+        self.scheduler.job_stopped(job_info["name"])
+        self.postprocess_phaser(job_info["name"], {"ID": job_info["name"],
+                                                   "solution": False,
+                                                   "spacegroup": job_info["spacegroup"],
+                                                   "message": message})
+        # Delete the Redis key
+        if self.redis:
+            self.redis.delete(tag)
+
+    def skip_jobs(self, jobs, message):
+        """Send message to postprocess_phaser as the result of jobs not started"""
+
+        for name, inp in jobs:
+            self.logger.debug("Not running Phaser on %s - %s", name, message)
+            self.postprocess_phaser(name, {"ID": name,
+                                           "solution": False,
+                                           "spacegroup": inp["spacegroup"],
+                                           "message": message})
+
+    def stop_unneeded_jobs(self):
+        """Stop the jobs not needed once one has a definitive solution"""
+
+        not_started, running = self.scheduler.get_unneeded()
+        if not (not_started or running):
+            return
+
+        message = "Not needed - definitive solution with %s" % self.scheduler.solution
+        for tag, job_info in self.jobs.items():
+            if job_info["name"] in running:
+                self.stop_job(tag, message)
+        self.skip_jobs(not_started, message)
+
+    def get_finished_jobs(self):
+        """Return the keys of the jobs that have finished, whether or not they called back"""
+
+        finished = []
+        for tag, job_info in self.jobs.items():
             if self.computer_cluster:
-                results_json = self.redis.get(info['tag'])
-                #self.logger.debug('results_json_type: %s results_json: %s'%(type(results_json), results_json))
-                if not results_json:
-                    self.postprocess_phaser(info['name'], {"ID": info['name'],
-                                                           "solution": False,
-                                                           "spacegroup": info['spacegroup'],
-                                                           "message": "Error launching job"})
-                else:
-                    results = json.loads(results_json)
-                    self.postprocess_phaser(info['name'], results)
-                self.redis.delete(info['tag'])
-                """
-                # This try/except is for when results aren't in Redis in time.
-                try:
-                    results = json.loads(results_json)
-                    self.postprocess_phaser(info['name'], results)
-                    self.redis.delete(info['tag'])
-                except Exception as e:
-                    self.logger.error('Error: '+ str(e))
-                    self.logger.error('results_json: %s'%results_json)
-                    #print 'PROBLEM: %s %s'%(info['name'], info['output_id'])
-                    #print results_json
-                """
+                done = not job_info["job"].is_alive()
             else:
-                results = info['result_queue'].get()
-                # pprint(results.get('stdout', " "))
-                # pprint(json.loads(results.get('stdout'," ")))
-                # if results["stderr"]:
-                #     print results["stderr"]
-                self.postprocess_phaser(info['name'], json.loads(results.get('stdout', " ")))
-            jobs.remove(job)
-
-        # Signal to the pool that no more processes will be added
-        if self.pool:
-            self.pool.close()
+                done = job_info["job"].ready()
+            if done:
+                finished.append(tag)
+        return finished
+
+    def jobs_monitor(self):
+        """Finish jobs as they complete, launching the next ones, until all are done"""
+
+        if self.phaser_timer:
+            deadline = time.time() + self.phaser_timer
+        else:
+            deadline = None
 
         timed_out = False
-        timer = 0
-        jobs = self.jobs.keys()
-
-        # Run loop to see when jobs finish
-        while len(jobs):
-            for job in jobs:
-                if self.pool:
-                    if job.ready():
-                        finish_job(job)
-                elif job.is_alive() == False:
-                    finish_job(job)
-            time.sleep(1)
-            timer += 1
-            """
-            if self.verbose:
-              if round(timer%1,1) in (0.0,1.0):
-                  print 'Waiting for AutoStat jobs to finish '+str(timer)+' seconds'
-            """
-            if self.phaser_timer:
-                if timer >= self.phaser_timer:
+        while self.scheduler and not self.scheduler.is_done():
+            wait = COMPLETION_WAIT
+            if deadline:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
                     timed_out = True
                     break
+            # Jobs put their key on self.completed when they finish
+            try:
+                tags = [self.completed.get(timeout=wait)]
+            except Empty:
+                # A job whose launcher failed never calls back
+                tags = self.get_finished_jobs()
+            for tag in tags:
+                # Stopped before it finished
+                if tag not in self.jobs:
+                    continue
+                self.finish_job(tag)
+                self.stop_unneeded_jobs()
+            self.launch_jobs()
+
         if timed_out:
-            if self.verbose:
-                self.logger.debug('PDBQuery timed out.')
-            for job in self.jobs.keys():
-                if self.computer_cluster:
-                    # Kill job on cluster:
-                    self.computer_cluster.kill_job(self.jobs[job].get('pid'))
-                else:
-                    # terminate the job
-                    job.terminate()
-                # Get the job info
-                info = self.jobs.pop(job)
-                self.logger.debug('Timeout Phaser on %s'%info['name'])
-                # Send timeout result to postprocess
-                self.postprocess_phaser(info['name'], {"ID": info['name'],
-                                                       "solution": False,
-                                                       "spacegroup": info['spacegroup'],
-                                                       "message": "Timed out"})
-                # Delete the Redis key
-                self.redis.delete(info['tag'])
+            self.logger.debug("PDBQuery timed out.")
+            for tag in self.jobs.keys():
+                self.stop_job(tag, "Timed out")
+            self.skip_jobs(self.scheduler.get_pending(), "Timed out")
 
         # Join the self.pool if used
         if self.pool:
+            self.pool.close()
             self.pool.join()
 
         if self.verbose and self.logger:
-            self.logger.debug('PDBQuery.jobs_monitor finished.')
+            self.logger.debug("PDBQuery.jobs_monitor finished.")
 
     def postprocess(self):
         """Clean up after plugin action"""
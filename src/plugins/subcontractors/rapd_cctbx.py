@@ -34,9 +34,10 @@ import os
 
 #from utils.text import json
 #from bson.objectid import ObjectId
-from utils.xutils import convert_unicode, fix_R3_sg
+import utils.model_cache as model_cache
+from utils.xutils import convert_unicode, fix_R3_sg, sg_to_nsymops
 
-from plugins.subcontractors.rapd_phaser import run_phaser, run_phaser_module
+from plugins.subcontractors.rapd_phaser import get_target_resolution, run_phaser
 #import plugins.subcontractors.rapd_phaser as rapd_phaser
 
 
@@ -78,12 +79,8 @@ def get_res(data_file):
 
     return float(data.max_min_resolution()[-1])
 
-def get_spacegroup_info(struct_file):
-    """Get info from PDB of mmCIF file"""
-
-    # print "get_spacegroup_info", struct_file, os.getcwd()
-
-    struct_file = convert_unicode(struct_file)
+def read_spacegroup(struct_file):
+    """Read the spacegroup from a PDB or mmCIF file"""
 
     if struct_file[-3:].lower() == "cif":
         fail = False
@@ -107,45 +104,46 @@ def get_spacegroup_info(struct_file):
     else:
         return str(iotbx_pdb.input(struct_file).crystal_symmetry().space_group_info()).upper().replace(" ", "")
 
-def get_pdb_info(struct_file,
-                 data_file,
-                 dres,
-                 matthews=True,
-                 chains=True):
-    """Get info from PDB or mmCIF file"""
-
-    # Get rid of ligands and water so Phenix won't error.
-    np = 0
-    na = 0
-    nmol = 1
-    sc = 0.55
-    nchains = 0
-    res1 = 0.0
-    d = {}
-    l = []
+def get_spacegroup_info(struct_file):
+    """Get info from PDB of mmCIF file"""
+
+    # print "get_spacegroup_info", struct_file, os.getcwd()
 
-    # Read in the file
     struct_file = convert_unicode(struct_file)
+
+    # Models analyzed before have it in the model cache
+    analysis = model_cache.get_cache().lookup(struct_file)
+    if analysis:
+        return analysis["spacegroup"]
+
+    return read_spacegroup(struct_file)
+
+def analyze_model(struct_file, directory):
+    """
+    Return the spacegroup, chains and residue counts of a PDB or mmCIF file,
+    for the model cache. The chains with residues are written to directory
+    as mmCIF files.
+    """
+
+    analysis = {"spacegroup": read_spacegroup(struct_file),
+                "chains": [],
+                "np": 0,
+                "na": 0}
+
+    # Read in the file
     if struct_file[-3:].lower() == 'cif':
         root = iotbx_mmcif.cif_input(file_name=struct_file).construct_hierarchy()
     else:
         root = iotbx_pdb.input(struct_file).construct_hierarchy()
 
     # Go through the chains
+    chain_ids = []
     for chain in root.models()[0].chains():
         # Number of protein residues
         np1 = 0
         # Number of nucleic acid residues
         na1 = 0
 
-        # Sometimes Hetatoms are AA with same segid.
-        if l.count(chain.id) == 0:
-            l.append(chain.id)
-            repeat = False
-            nchains += 1
-        else:
-            repeat = True
-
         # Count the number of AA and NA in pdb file.
         for rg in chain.residue_groups():
             if rg.atoms()[0].parent().resname in iotbx_pdb.common_residue_names_amino_acid:
@@ -156,103 +154,85 @@ def get_pdb_info(struct_file,
             if rg.atoms()[0].parent().resname in \
                iotbx_pdb.common_residue_names_ccp4_mon_lib_rna_dna:
                 na1 += 1
-        # Limit to 10 chains?!?
-        if nchains < 10:
-            # Do not split up PDB if run from cell analysis
-            if chains and not repeat:
-
-                # Save info for each chain.
-                if np1 or na1:
-
-                    # Write new pdb files for each chain.
-                    temp = iotbx_pdb.hierarchy.new_hierarchy_from_chain(chain)
-
-                    # Long was of making sure that user does not have directory named '.pdb' or
-                    # '.cif'
-                    #n = os.path.join(os.path.dirname(struct_file), "%s_%s.pdb" % \
-                    n = os.path.join(os.path.dirname(struct_file), "%s_%s.cif" % \
-                        (os.path.basename(struct_file)[:os.path.basename(struct_file).find('.')], \
-                        chain.id))
-                    #temp.write_pdb_file(file_name=n)
-                    # Write chain as mmCIF file.
-                    temp.write_mmcif_file(file_name=n)
-                    
-                    d[chain.id] = {'file': n,
-                                   'NRes': np1+na1,
-                                   'MWna': na1*330,
-                                   'MWaa': np1*110,
-                                   'MW': na1*330+np1*110}
-                    if matthews:
-                        # Run Matthews Calc. on chain
-                        #phaser_return = run_phaser_module((np1, na1, dres, n, data_file))
-                        #phaser_return = run_phaser_module(data_file, (np1, na1, dres, n))
-                        phaser_return = run_phaser_module(data_file=data_file,
-                                                          ellg=True,
-                                                          cca=True,
-                                                          struct_file=n,
-                                                          dres=dres,
-                                                          np=np1,
-                                                          na=na1)
-                        d[chain.id].update({'NMol': phaser_return.get("z", nmol),
-                                            'SC': phaser_return.get("solvent_content", sc),
-                                            'res': phaser_return.get("target_resolution", res1)})
-                    else:
-                        #res1 = run_phaser_module(n)
-                        phaser_return = run_phaser_module(data_file=data_file,
-                                                          ellg=True, 
-                                                          struct_file=n)
-                        d[chain.id].update({'res': phaser_return.get("target_resolution", res1)})
-                    """
-                    d[chain.id] = {'file': n,
-                                   'NRes': np1+na1,
-                                   'MWna': na1*330,
-                                   'MWaa': np1*110,
-                                   'MW': na1*330+np1*110,
-                                   'NMol': phaser_return.get("z", nmol),
-                                   'SC': phaser_return.get("solvent_content", sc),
-                                   'res': phaser_return.get("target_resolution", res1)}
-                    """
+
+        # Sometimes Hetatoms are AA with same segid.
+        if chain.id not in chain_ids:
+            chain_ids.append(chain.id)
+            # Limit to 10 chains?!?
+            if len(chain_ids) < 10 and (np1 or na1):
+                # Write chain as mmCIF file.
+                file_name = "%s.cif" % chain.id
+                temp = iotbx_pdb.hierarchy.new_hierarchy_from_chain(chain)
+                temp.write_mmcif_file(file_name=os.path.join(directory, file_name))
+                analysis["chains"].append({"id": chain.id,
+                                           "np": np1,
+                                           "na": na1,
+                                           "file": file_name})
+
         # Add up residue count
-        np += np1
-        na += na1
-
-    d['all'] = {'file': struct_file,
-                'NRes': np+na,
-                'MWna': na*330,
-                'MWaa': np*110,
-                'MW': na*330+np*110}
-    # Run on entire PDB
-    if matthews:
-        #phaser_return = run_phaser_module((np, na, dres, struct_file, data_file))
-        #phaser_return = run_phaser_module(data_file, (np, na, dres, struct_file))
-        phaser_return = run_phaser_module(data_file=data_file,
-                                          ellg=True,
-                                          cca=True,
-                                          struct_file=struct_file,
-                                          dres=dres,
-                                          np=np,
-                                          na=na)
-        d['all'].update({'NMol': phaser_return.get("z", nmol),
-                         'SC': phaser_return.get("solvent_content", sc),
-                         'res': phaser_return.get("target_resolution", res1)})
-    else:
-        #phaser_return = run_phaser_module((np, na, dres, struct_file, data_file))
-        #phaser_return = run_phaser_module(data_file, (np, na, dres, struct_file))
-        # phaser_return = run_phaser_module(data_file=data_file,
-        #                                   ellg=True, 
-        #                                   struct_file=struct_file)
-        phaser_return = run_phaser_module(data_file=data_file,
-                                          ellg=True, 
-                                          struct_file=struct_file)
-        d['all'].update({'res': phaser_return.get("target_resolution", res1)})
+        analysis["np"] += np1
+        analysis["na"] += na1
+
+    return analysis
+
+def get_composition(struct_file, np, na):
+    """Return the description of a model with np protein and na nucleic acid residues"""
+
+    return {'file': struct_file,
+            'NRes': np+na,
+            'MWna': na*model_cache.NUCLEIC_RESIDUE_MW,
+            'MWaa': np*model_cache.PROTEIN_RESIDUE_MW,
+            'MW': na*model_cache.NUCLEIC_RESIDUE_MW+np*model_cache.PROTEIN_RESIDUE_MW}
+
+def get_pdb_info(struct_file,
+                 data_file,
+                 dres,
+                 matthews=True,
+                 chains=True):
     """
-    d['all'] = {'file': struct_file,
-                'NRes': np+na,
-                'MWna': na*330,
-                'MWaa': np*110,
-                'MW': na*330+np*110,
-                'NMol': phaser_return.get("z", nmol),
-                'SC': phaser_return.get("solvent_content", sc),
-                'res': phaser_return.get("target_resolution", res1)}
+    Get info from PDB or mmCIF file
+
+    The chains and residues of the model come from the model cache, so only
+    the number of molecules, solvent content (Matthews) and Phaser target
+    resolution, which depend on the data, are worked out for each data set.
+
+    struct_file - search model in PDB or mmCIF format
+    data_file - input data as mtz
+    dres - resolution of the data
+    matthews - work out the number of molecules and solvent content
+    chains - split the model into chains, written next to struct_file
     """
+
+    d = {}
+
+    struct_file = convert_unicode(struct_file)
+    cache = model_cache.get_cache()
+    analysis = cache.get(struct_file, analyze_model)
+
+    # Do not split up PDB if run from cell analysis
+    if chains:
+        root_name = os.path.basename(struct_file).split(".")[0]
+        for chain in analysis["chains"]:
+            chain_file = os.path.join(os.path.dirname(struct_file),
+                                      "%s_%s.cif" % (root_name, chain["id"]))
+            cache.copy_file(struct_file, chain["file"], chain_file)
+            d[chain["id"]] = get_composition(chain_file, chain["np"], chain["na"])
+
+    d['all'] = get_composition(struct_file, analysis["np"], analysis["na"])
+
+    # Matthews for the whole model and every chain at once
+    if matthews:
+        spacegroup, _, volume = get_mtz_info(data_file)
+        models = d.keys()
+        nmol, solvent_content = model_cache.matthews([d[model]['MW'] for model in models],
+                                                     volume,
+                                                     sg_to_nsymops(spacegroup))
+        for model, z, sc in zip(models, nmol, solvent_content):
+            d[model].update({'NMol': int(z),
+                             'SC': float(sc)})
+
+    # Resolution for Phaser
+    for model in d:
+        d[model]['res'] = get_target_resolution(data_file, d[model]['file'])
+
     return d
@@ -25,6 +25,7 @@ __email__ = "fmurphy@anl.gov"
 __status__ = "Development"
 
 # Standard imports
+import cPickle
 from functools import wraps
 import importlib
 import json
@@ -33,13 +34,14 @@ from multiprocessing import Process, Queue
 from Queue import Queue as tqueue
 import os
 from pprint import pprint
-import random
 import shutil
 import signal
 import stat
 import subprocess
 import tarfile
+from threading import Thread
 import time
+import uuid
 
 # Phaser import
 try:
@@ -52,6 +54,12 @@ from utils import archive
 from utils.xutils import convert_unicode
 import utils.xray_importer as xray_importer 
 
+# Reflections read once for all the Phaser jobs of a data set
+PREPARED_DATA = "phaser_data.pickle"
+
+# Start of the line of output of a Phaser script with its result
+RESULT_MARKER = "RAPD_PHASER_RESULT "
+
 # DECORATORS
 def moduleOrShellWrapper(func):
     """
@@ -342,59 +350,158 @@ def parse_phaser_output(phaser_log):
     return phaser_result
 
 
+def new_output_id():
+    """Return a key for the result of a Phaser job that no other job has"""
+
+    return "Phaser_%s" % uuid.uuid4().hex
+
+def read_data(data_file):
+    """
+    Return the reflections and cell of data_file as read by Phaser MR_DAT,
+    or False if it cannot be read
+    """
+
+    i = phaser.InputMR_DAT()
+    i.setHKLI(convert_unicode(data_file))
+    i.setLABI_F_SIGF('F', 'SIGF')
+    i.setMUTE(True)
+    r = phaser.runMR_DAT(i)
+    if not r.Success():
+        return False
+    return {"miller": r.getMiller(),
+            "fobs": r.getFobs(),
+            "sigfobs": r.getSigFobs(),
+            "cell": r.getUnitCell()}
+
+def prepare_data(data_file, work_dir):
+    """
+    Read data_file once for all the Phaser jobs of a data set, saving what
+    Phaser makes of it in work_dir. Returns the path of the saved data, or
+    False if there is no Phaser module here to read it with.
+    """
+
+    if not phaser:
+        return False
+
+    data = read_data(data_file)
+    if not data:
+        return False
+
+    path = os.path.join(work_dir, PREPARED_DATA)
+    with open(path, "wb") as output_file:
+        cPickle.dump(data, output_file, cPickle.HIGHEST_PROTOCOL)
+    return path
+
+def load_prepared_data(prepared_data):
+    """Return the data saved by prepare_data, or False if there is none"""
+
+    if not prepared_data:
+        return False
+    try:
+        with open(prepared_data, "rb") as input_file:
+            return cPickle.load(input_file)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return False
+
+def print_result(phaser_result):
+    """Print the result of a Phaser script, to be read by get_script_result"""
+
+    print RESULT_MARKER + json.dumps(phaser_result)
+
+def get_script_result(stdout):
+    """Return the result printed by a Phaser script, or False if there is none"""
+
+    for line in reversed((stdout or "").splitlines()):
+        if line.startswith(RESULT_MARKER):
+            try:
+                return json.loads(line[len(RESULT_MARKER):])
+            except ValueError:
+                return False
+    return False
+
 def mp_job(func):
     """
     wrapper to write command script and launch by multiprocessing.Process or Pool.
     Will use the following input keys and remove them before launching:
        'script' - signal to say the script has been written
-       'computer_cluster' - signal to launch on computer cluster
+       'launcher' - function running the script, locally or on a computer cluster
+       'batch_queue' - batch queue of the computer cluster
+       'rapd_python' - python to run the script with
        'pool' - The multiprocessing.Pool if launched on local machine
+       'result_queue' - Queue for the output of a script run in the pool
+       'pid_queue' - Queue for the PID of a script run in the pool
+       'tag' - key for the results of the job (default a new unique one)
+       'callback' - called with the key of the results once the job has finished
        'test' - run in test mode (used for debugging)
+    Returns the job and its PID ('junk' in the pool, which passes it on pid_queue)
     """
 
     def write_script(inp):
         # write Phaser command script.
         fo = os.path.join(inp.get('work_dir'), 'phaser_script.py')
         with open(fo, 'w') as f:
-            f.write('from plugins.subcontractors.rapd_phaser import run_phaser\n')
+            f.write('from plugins.subcontractors.rapd_phaser import run_phaser, print_result\n')
             f.write('input = %s\n' % str(inp))
-            f.write('run_phaser(**input)\n')
+            f.write('print_result(run_phaser(**input))\n')
             f.close()
         return fo
 
+    def watch(proc, callback, output_id):
+        # Tell the caller when a job launched by Process has finished
+        proc.join()
+        callback(output_id)
+
     @wraps(func)
     def wrapper(**kwargs):
         os.chdir(kwargs.get('work_dir', os.getcwd()))
         if not kwargs.get('script', False):
-            # Pop out the launcher
+            # Pop out what is used to launch the job
             launcher = kwargs.pop('launcher', None)
-            # Pop out the batch_queue
             batch_queue = kwargs.pop('batch_queue', None)
-            # Create a unique identifier for Phaser results
-            kwargs['output_id'] = 'Phaser_%d' % random.randint(0, 10000)
+            rapd_python = kwargs.pop('rapd_python', None) or 'rapd2.python'
+            pool = kwargs.pop('pool', False)
+            result_queue = kwargs.pop('result_queue', False)
+            pid_queue = kwargs.pop('pid_queue', False)
+            callback = kwargs.pop('callback', False)
+            # Unique identifier for the Phaser results, so jobs never read each other's
+            output_id = kwargs.pop('tag', False) or new_output_id()
+            kwargs['output_id'] = output_id
             # Signal to launch run
             kwargs['script'] = True
-            if kwargs.get('pool', False):
+            f = write_script(kwargs)
+            command = "%s %s" % (rapd_python, f)
+            logfile = os.path.join(convert_unicode(kwargs.get('work_dir', os.getcwd())),
+                                   'rapd_phaser.log')
+            if pool:
                 # If running on local machine
-                pool = kwargs.pop('pool')
-                f = write_script(kwargs)
-                new_kwargs = {"command": "rapd2.python %s" % f,
-                              "logfile": os.path.join(convert_unicode(kwargs.get('work_dir')), 'rapd_phaser.log'),
+                new_kwargs = {"command": command,
+                              "logfile": logfile,
+                              "pid_queue": pid_queue,
+                              "result_queue": result_queue,
+                              "tag": output_id,
                               }
-                proc = pool.apply_async(launcher, kwds=new_kwargs,)
-                return (proc, 'junk', kwargs['output_id'])
+                if callback:
+                    proc = pool.apply_async(launcher,
+                                            kwds=new_kwargs,
+                                            callback=lambda _: callback(output_id))
+                else:
+                    proc = pool.apply_async(launcher, kwds=new_kwargs)
+                return (proc, 'junk')
             else:
                 # If running on computer cluster
-                f = write_script(kwargs)
                 pid_queue = Queue()
                 proc = Process(target=launcher,
-                               kwargs={"command": "rapd2.python %s" % f,
+                               kwargs={"command": command,
                                        "pid_queue": pid_queue,
                                        "batch_queue": batch_queue,
-                                       "logfile": os.path.join(kwargs.get('work_dir'), 'rapd_phaser.log'),
+                                       "logfile": logfile,
                                        })
                 proc.start()
-                return (proc, pid_queue.get(), kwargs['output_id'])
+                if callback:
+                    watcher = Thread(target=watch, args=(proc, callback, output_id))
+                    watcher.daemon = True
+                    watcher.start()
+                return (proc, pid_queue.get())
         else:
             # Remove extra input params used to setup job
             l = ['script', 'test']
@@ -639,6 +746,8 @@ def run_phaser_module(data_file,
                work_dir=False,
                cif=False,
                pdb=False,
+               struct_file=False,
+               prepared_data=False,
                name=False,
                ncopy=1,
                cell_analysis=False,
@@ -657,6 +766,8 @@ def run_phaser_module(data_file,
     work_dir - working directory
     cif - input search model path in mmCIF format (do not use with 'pdb')
     pdb -  input search model path in PDB format (do not use with 'cif')
+    struct_file - input search model path, mmCIF or PDB by its extension
+    prepared_data - data_file as saved by prepare_data, read instead of data_file
     name - root name for output files
     ncopy - number of molecules to search for
     cell_analysis - internal RAPD signal so all possible SG's are searched
@@ -679,21 +790,21 @@ def run_phaser_module(data_file,
     if not name:
         name = spacegroup
 
-    # Connect to Redis
-    redis = connect_to_redis(db_settings)
+    # Search model
+    if struct_file:
+        if struct_file[-3:].lower() == "cif":
+            cif = struct_file
+        else:
+            pdb = struct_file
 
-    # Read the dataset
-    i = phaser.InputMR_DAT()
-    i.setHKLI(convert_unicode(data_file))
-    i.setLABI_F_SIGF('F', 'SIGF')
-    i.setMUTE(True)
-    r = phaser.runMR_DAT(i)
-    if r.Success():
+    # Read the dataset, unless it has been prepared for all the jobs
+    data = load_prepared_data(prepared_data) or read_data(data_file)
+    if data:
         i = phaser.InputMR_AUTO()
         # i.setREFL_DATA(r.getREFL_DATA())
         # i.setREFL_DATA(r.DATA_REFL())
-        i.setREFL_F_SIGF(r.getMiller(), r.getFobs(), r.getSigFobs())
-        i.setCELL6(r.getUnitCell())
+        i.setREFL_F_SIGF(data["miller"], data["fobs"], data["sigfobs"])
+        i.setCELL6(data["cell"])
         if cif:
             #i.addENSE_CIF_ID('model', cif, 0.7)
             ### Typo in PHASER CODE!!!###
@@ -750,8 +861,6 @@ def run_phaser_module(data_file,
         i.setROOT(convert_unicode(name))
         # i.setMUTE(False)
         i.setMUTE(True)
-        # Delete the setup results
-        del(r)
         # launch the run
         r = phaser.runMR_AUTO(i)
         if r.Success():
@@ -772,10 +881,7 @@ def run_phaser_module(data_file,
             log.write(r.summary())
             log.close()
 
-    for i in  dir(r):
-        print i
-
-    if r.foundSolutions():
+    if data and r.foundSolutions():
         rfz = None
         tfz = None
         tncs = False
@@ -852,10 +958,15 @@ def run_phaser_module(data_file,
     # Print the result so it can be seen in the rapd._phaser.log if needed
     print phaser_result
 
-    # Key should be deleted once received, but set the key to expire in 24 hours just in case.
-    redis.setex(output_id, 86400, json.dumps(phaser_result))
-    # Do a little sleep to make sure results are in Redis for postprocess_phaser
-    time.sleep(0.1)
+    # Send results through Redis (computer cluster)
+    if db_settings:
+        redis = connect_to_redis(db_settings)
+        # Key should be deleted once received, but set the key to expire in 24 hours just in case.
+        redis.setex(output_id, 86400, json.dumps(phaser_result))
+        # Do a little sleep to make sure results are in Redis for postprocess_phaser
+        time.sleep(0.1)
+
+    return phaser_result
 
 @mp_job
 def run_phaser_shell(data_file,
@@ -865,6 +976,8 @@ def run_phaser_shell(data_file,
                      work_dir=False,
                      cif=False,
                      pdb=False,
+                     struct_file=False,
+                     prepared_data=False,
                      name=False,
                      ncopy=1,
                      cell_analysis=False,
@@ -882,6 +995,8 @@ def run_phaser_shell(data_file,
     work_dir - working directory
     cif - input search model path in mmCIF format (do not use with 'pdb')
     pdb -  input search model path in PDB format (do not use with 'cif')
+    struct_file - input search model path, mmCIF or PDB by its extension
+    prepared_data - only used by run_phaser_module
     name - root name for output files
     ncopy - number of molecules to search for
     cell_analysis - internal RAPD signal so all possible SG's are searched
@@ -909,6 +1024,10 @@ def run_phaser_shell(data_file,
         }
     file_type = xray_importer.get_rapd_file_type(data_file)
 
+    # Search model
+    if struct_file:
+        cif = struct_file
+
     # Handle cif to pdb
     cif = cifToPdb(cif)
 
@@ -1045,6 +1164,8 @@ def run_phaser(data_file,
                work_dir=False,
                cif=False,
                pdb=False,
+               struct_file=False,
+               prepared_data=False,
                name=False,
                ncopy=1,
                cell_analysis=False,
@@ -1378,12 +1499,10 @@ def run_phaser_module_OLD(data_file, inp=False):
 @cifToPdbWrapper
 def get_target_resolution_module(data_file, structure_file):
     """
-    Returns the phaser target resolution using the shell to call phaser
+    Returns the phaser target resolution using the phaser module
     """
 
-    print "get_target_resolution_module", data_file, structure_file
-
-    # Handle multiple reflection file types
+    # Handle multiple reflection file types - others are read by F and SIGF
     column_labels = {
         "rfree_mtz": ("F", "SIGF")
         }
@@ -1393,8 +1512,8 @@ def get_target_resolution_module(data_file, structure_file):
 
     # Run phaser using module
     i = phaser.InputMR_DAT()
-    i.setHKLI(*convert_unicode(data_file))
-    i.setLABI_F_SIGF(column_labels[file_type])
+    i.setHKLI(convert_unicode(data_file))
+    i.setLABI_F_SIGF(*column_labels.get(file_type, ("F", "SIGF")))
     i.setMUTE(True)
     r = phaser.runMR_DAT(i)
     if r.Success():
@@ -1404,9 +1523,9 @@ def get_target_resolution_module(data_file, structure_file):
         i0.setMUTE(True)
         i0.setREFL_DATA(r.getDATA())
         if structure_file[-3:] in ('cif'):
-            i0.addENSE_CIT_ID('model', convert_unicode(mmcif), 0.7)
+            i0.addENSE_CIT_ID('model', convert_unicode(structure_file), 0.7)
         else:
-            i0.addENSE_PDB_ID("model", convert_unicode(mmcif), 0.7)
+            i0.addENSE_PDB_ID("model", convert_unicode(structure_file), 0.7)
         r1 = phaser.runMR_ELLG(i0)
         if r1.Success():
             # If it worked use the recommended resolution
@@ -1423,7 +1542,7 @@ def get_target_resolution_shell(data_file, structure_file):
 
     # print "get_target_resolution_shell", data_file, structure_file
 
-    # Handle multiple reflection file types
+    # Handle multiple reflection file types - others are read by F and SIGF
     column_labels = {
         "rfree_mtz": "F=F SIGF=SIGF"
         }
@@ -1434,7 +1553,7 @@ def get_target_resolution_shell(data_file, structure_file):
         "phaser << EOF",
         "MODE MR_ELLG",
         "HKLIn %s" % data_file,
-        "LABIn %s" % column_labels[file_type],
+        "LABIn %s" % column_labels.get(file_type, "F=F SIGF=SIGF"),
         "ENSEMBLE test PDB %s ID 70" % structure_file,
         "EOF"
     ]
@@ -1465,12 +1584,16 @@ def get_target_resolution_shell(data_file, structure_file):
     
     return resolution
 
-@moduleOrShellWrapper
 def get_target_resolution(data_file, structure_file):
     """
-    Returns the phaser target resolution
+    Returns the phaser target resolution, 0.0 if Phaser cannot work it out.
+    The phaser module is used if it can be imported, otherwise the shell.
     """
 
+    if phaser:
+        return get_target_resolution_module(data_file, structure_file)
+    return get_target_resolution_shell(data_file, structure_file)
+
 if __name__ == "__main__":
 
     target_resolution = get_target_resolution("thaum1_01s-01d_1_free.mtz", "5fgx.cif")
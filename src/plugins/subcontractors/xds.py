@@ -32,12 +32,12 @@ __status__ = "Development"
 # import json
 # import logging
 # import multiprocessing
-# import os
+import os
 # import pprint
 # import pymongo
-# import re
+import re
 # import redis
-# import shutil
+import shutil
 # import subprocess
 # import sys
 # import time
@@ -56,6 +56,30 @@ VERSIONS = {
 # "eiger2cbf": ("160415",)
 }
 
+# Files made by XYCORR, INIT, COLSPOT, IDXREF and DEFPIX that a later wedge
+# of the same run can use as they are
+CARRIED_FILES = ("X-CORRECTIONS.cbf",
+                 "Y-CORRECTIONS.cbf",
+                 "BKGINIT.cbf",
+                 "BLANK.cbf",
+                 "GAIN.cbf",
+                 "BKGPIX.cbf",
+                 "ABS.cbf",
+                 "SPOT.XDS",
+                 "IDXREF.LP")
+
+# Files a wedge must have for the next to carry on from it
+SEED_FILES = ("BKGPIX.cbf", "ABS.cbf", "INTEGRATE.HKL")
+
+# The steps of XDS, in the order they run
+STAGES = ("XYCORR", "INIT", "COLSPOT", "IDXREF", "DEFPIX", "INTEGRATE", "CORRECT")
+
+# Lines of XDS.LOG that mark a failed run
+LOG_ERRORS = ("! ERROR !", "forrtl: severe")
+
+# The time a step took, from the end of its .LP file
+WALL_TIME_PATTERN = re.compile(r"elapsed wall-clock time\s+([\d.]+)\s*sec")
+
 def get_avg_mosaicity_from_integratelp():
     """
     Parse the INTEGRATE.LP file and extract information
@@ -84,3 +108,109 @@ def get_isa_from_correctlp():
     isa = float(isa_line.strip().split()[-1])
 
     return isa
+
+def can_seed(directory):
+    """
+    Return True if the wedge processed in directory has the geometry,
+    background and integrated reflections for a later wedge to carry on from
+    """
+
+    if not directory or not os.path.isdir(directory):
+        return False
+    if not (os.path.exists(os.path.join(directory, "GXPARM.XDS")) or
+            os.path.exists(os.path.join(directory, "XPARM.XDS"))):
+        return False
+    return all(os.path.exists(os.path.join(directory, name)) for name in SEED_FILES)
+
+def seed_wedge(previous, directory):
+    """
+    Copy what a new wedge reuses from the wedge processed in previous into
+    directory. The geometry refined by CORRECT (GXPARM.XDS) becomes the
+    XPARM.XDS of the new wedge.
+    """
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for name in CARRIED_FILES:
+        source = os.path.join(previous, name)
+        if os.path.exists(source):
+            shutil.copy2(source, os.path.join(directory, name))
+
+    if os.path.exists(os.path.join(previous, "GXPARM.XDS")):
+        shutil.copy2(os.path.join(previous, "GXPARM.XDS"), os.path.join(directory, "XPARM.XDS"))
+    else:
+        shutil.copy2(os.path.join(previous, "XPARM.XDS"), os.path.join(directory, "XPARM.XDS"))
+
+def get_integrated_range(integrate_hkl):
+    """Return the (first, last) frames of the DATA_RANGE in an INTEGRATE.HKL header"""
+
+    with open(integrate_hkl, "r") as hkl_file:
+        for line in hkl_file:
+            if not line.startswith("!"):
+                break
+            if line.startswith("!DATA_RANGE="):
+                first, last = line.split("=", 1)[1].split()[:2]
+                return int(first), int(last)
+    return None
+
+def merge_integrate_hkl(older, newer, output):
+    """
+    Write the reflections of INTEGRATE.HKL files older and newer, integrated
+    over consecutive frame ranges, to output as one INTEGRATE.HKL for CORRECT.
+    The header is that of older, with the DATA_RANGE covering both.
+
+    Reflections that span the frame where the ranges meet are in neither
+    file, as INTEGRATE only writes reflections recorded within its range.
+    """
+
+    first = get_integrated_range(older)[0]
+    last = get_integrated_range(newer)[1]
+
+    with open(output, "w") as output_file:
+        with open(older, "r") as older_file:
+            for line in older_file:
+                if line.startswith("!DATA_RANGE="):
+                    line = "!DATA_RANGE=%6d%6d\n" % (first, last)
+                elif line.startswith("!END_OF_DATA"):
+                    break
+                output_file.write(line)
+        with open(newer, "r") as newer_file:
+            for line in newer_file:
+                if line.startswith("!END_OF_DATA"):
+                    break
+                if not line.startswith("!"):
+                    output_file.write(line)
+        output_file.write("!END_OF_DATA\n")
+
+    return first, last
+
+def get_log_errors(directory):
+    """
+    Return the lines of XDS.LOG in directory reporting errors, or a list
+    with a line saying there is no XDS.LOG
+    """
+
+    log_file = os.path.join(directory, "XDS.LOG")
+    if not os.path.exists(log_file):
+        return ["%s not found" % log_file]
+    with open(log_file, "r") as log:
+        return [line.strip() for line in log if any(error in line for error in LOG_ERRORS)]
+
+def get_stage_times(directory):
+    """
+    Return a dict of the wall-clock seconds each step of XDS took in
+    directory, read from the .LP files. Steps without a finished .LP file
+    are left out.
+    """
+
+    times = {}
+    for stage in STAGES:
+        lp_file = os.path.join(directory, "%s.LP" % stage)
+        if not os.path.exists(lp_file):
+            continue
+        with open(lp_file, "r") as lp:
+            matches = WALL_TIME_PATTERN.findall(lp.read())
+        if matches:
+            times[stage] = float(matches[-1])
+    return times
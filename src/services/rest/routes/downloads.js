@@ -1,5 +1,6 @@
 var fs = require("fs");
 var stream = require("stream");
+var zlib = require("zlib");
 var express = require("express");
 var router = express.Router();
 var mongoose = require("../models/mongoose");
@@ -13,6 +14,53 @@ Grid.mongo = mongoose.mongo;
 // const Session  = require('../models/session');
 // const Result   = require('../models/result');
 
+// Archives used to be stored base64 encoded - newer files are stored as
+// they are, with metadata.encoding set
+const isBase64 = function(file) {
+  return file.metadata && file.metadata.file_type === "archive_files" && !file.metadata.encoding;
+};
+
+// Decode a base64 stream, keeping back characters that do not make a whole group
+const base64Decoder = function() {
+  let remainder = "";
+  return new stream.Transform({
+    transform(chunk, encoding, callback) {
+      const text = remainder + chunk.toString("ascii").replace(/\s/g, "");
+      const length = text.length - (text.length % 4);
+      remainder = text.slice(length);
+      callback(null, Buffer.from(text.slice(0, length), "base64"));
+    },
+    flush(callback) {
+      callback(null, Buffer.from(remainder, "base64"));
+    }
+  });
+};
+
+// Stream a file out of GridFS as raw bytes
+const sendFile = function(gridfs, file, req, res) {
+  if (!file) {
+    res.status(404).send("File not found");
+    return;
+  }
+  var readstream = gridfs.createReadStream({
+    _id: file._id
+  });
+  req.on("error", function(err) {
+    console.error(err);
+    res.send(500, err);
+  });
+  readstream.on("error", function(err) {
+    console.error(err);
+    res.send(500, err);
+  });
+  res.set("Content-Type", "application/octet-stream");
+  if (isBase64(file)) {
+    readstream.pipe(base64Decoder()).pipe(res);
+  } else {
+    readstream.pipe(res);
+  }
+};
+
 // on routes that end in /results
 // ----------------------------------------------------
 router
@@ -25,19 +73,12 @@ router
     // console.log(mongoose.ctrl_conn.db);
     var gridfs = Grid(mongoose.ctrl_conn.db);
 
-    var readstream = gridfs.createReadStream({
-      _id: req.params.id
-    });
-    req.on("error", function(err) {
-      console.error(err);
-      res.send(500, err);
-    });
-    readstream.on("error", function(err) {
-      console.error(err);
-      res.send(500, err);
+    gridfs.files.findOne({ _id: mongoose.Types.ObjectId(req.params.id) }, function(
+      err,
+      file
+    ) {
+      sendFile(gridfs, file, req, res);
     });
-    console.log("Success");
-    readstream.pipe(res);
   });
 
 router
@@ -53,23 +94,39 @@ router
       err,
       file
     ) {
-      console.log(file);
-      var readstream = gridfs.createReadStream({
-        _id: file._id
-      });
-      req.on("error", function(err) {
-        console.error(err);
-        res.send(500, err);
-      });
-      readstream.on("error", function(err) {
-        console.error(err);
-        res.send(500, err);
-      });
-      console.log("Success");
-      readstream.pipe(res);
+      sendFile(gridfs, file, req, res);
     });
   });
 
+router
+  .route("/artifact/:hash")
+
+  // Get the text of a log or other artifact - stored gzipped
+  .get(function(req, res) {
+    console.log("artifact", req.params.hash);
+
+    var gridfs = Grid(mongoose.ctrl_conn.db);
+
+    gridfs.files.findOne(
+      { "metadata.hash": req.params.hash, "metadata.file_type": "artifact" },
+      function(err, file) {
+        if (err || file === null) {
+          res.status(404).send("Artifact not found");
+          return;
+        }
+        var readstream = gridfs.createReadStream({
+          _id: file._id
+        });
+        readstream.on("error", function(err) {
+          console.error(err);
+          res.send(500, err);
+        });
+        res.set("Content-Type", "text/plain");
+        readstream.pipe(zlib.createGunzip()).pipe(res);
+      }
+    );
+  });
+
 // Working on getting PDBs from PDBQuery results
 router
   .route("/get_pdb_by_hash/:hash")
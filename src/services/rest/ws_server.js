@@ -53,6 +53,9 @@ let ws_connections = {};
 let activeSessions = [];
 let subscribedResults = {};
 
+// Last detailed result sent for each result_id, so deltas can be applied to it
+let cachedResults = {};
+
 // Subscribe to redis updates
 try {
   var sub = new Redis(config.redis_connection);
@@ -191,6 +194,30 @@ const getNewDetailedResult = function(message) {
     console.log("Echo...");
     deferred.resolve({});
 
+  // A delta only has the changes - apply them to the result it was made from
+  } else if (message.delta) {
+    const result_id = message.process.result_id;
+    const cached = cachedResults[result_id];
+    if (cached && cached.sequence === message.delta.base) {
+      applyDelta(cached, message);
+      deferred.resolve(cached);
+
+    // Nothing to apply to - start from the database. Control may not have
+    // saved this delta yet, so only apply it if the stored result is at its base
+    } else {
+      getDetailedResult(message.plugin.data_type,
+                        message.plugin.type,
+                        result_id,
+                        false).then((response) => {
+        const stored = response.results._doc || response.results;
+        if (stored.sequence === message.delta.base) {
+          applyDelta(stored, message);
+        }
+        cacheResult(result_id, stored);
+        deferred.resolve(stored);
+      });
+    }
+
   // Do something for not ECHO
   } else {
     // Create a detailed result
@@ -209,12 +236,59 @@ const getNewDetailedResult = function(message) {
       message.image2 = results[1];
       message.results.analysis = results[2];
       message.results.pdbquery = results[3];
+      cacheResult(message.process.result_id, message);
       deferred.resolve(message);
     });
   }
   return deferred.promise;
 }
 
+// Keep a detailed result to apply deltas to, until its process is done
+const cacheResult = function(result_id, result) {
+  if (result.process && (result.process.status >= 100 || result.process.status < 0)) {
+    delete cachedResults[result_id];
+  } else {
+    cachedResults[result_id] = result;
+  }
+}
+
+// Set the dotted path in doc to value, making objects on the way
+const setPath = function(doc, path, value) {
+  const keys = path.split(".");
+  keys.slice(0, -1).forEach((key) => {
+    if (typeof doc[key] !== "object" || doc[key] === null) {
+      doc[key] = {};
+    }
+    doc = doc[key];
+  });
+  doc[keys[keys.length-1]] = value;
+}
+
+// Remove the dotted path from doc, if it is there
+const unsetPath = function(doc, path) {
+  const keys = path.split(".");
+  for (let i = 0; i < keys.length-1; i++) {
+    doc = doc[keys[i]];
+    if (typeof doc !== "object" || doc === null) {
+      return;
+    }
+  }
+  delete doc[keys[keys.length-1]];
+}
+
+// Apply a delta message to a detailed result in place, as utils/result_delta.py
+const applyDelta = function(result, message) {
+  message.delta.unset.forEach((path) => {
+    unsetPath(result, path);
+  });
+  Object.keys(message.delta.set).forEach((path) => {
+    setPath(result, path, message.delta.set[path]);
+  });
+  result.process = message.process;
+  result.plugin = message.plugin;
+  result.sequence = message.delta.sequence;
+}
+
 const parseMessage = function(channel, message) {
   // console.log('parseMessage');
 
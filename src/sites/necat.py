@@ -458,6 +458,9 @@ IMAGE_MONITOR_SETTINGS = {
     "REDIS_HOST":           REDIS_HOST,
     "REDIS_PORT":           REDIS_PORT,
     "REDIS_DB":             REDIS_DB,
+    # Block on all image lists at once and hand off images in batches
+    "BLOCKING_INTAKE":      True,
+    "BATCH_SIZE":           100,
 }
 
 RUN_MONITOR_SETTINGS = {
@@ -0,0 +1,107 @@
+"""Tests for control.header_reader"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2009-2018 Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-21"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# RAPD imports
+from control.header_reader import HeaderReader
+
+class TestHeaderReader(unittest.TestCase):
+    """Test reading headers in the pool"""
+
+    def setUp(self):
+        """Write some images"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.images = []
+        for number in range(1, 7):
+            image = os.path.join(self.tmp_dir, "snap_1_%03d.cbf" % number)
+            with open(image, "w") as output:
+                output.write("image")
+            self.images.append(image)
+        self.reader = HeaderReader(nproc=4)
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        self.reader.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def slow_reader(self, fullname):
+        """Read the earlier images slower, so they finish last"""
+
+        time.sleep(0.02 * (len(self.images) - self.images.index(fullname)))
+        return {"fullname":fullname}
+
+    def read_all(self, **kwargs):
+        """Submit all the images and return the order of their callbacks"""
+
+        called = []
+        finished = threading.Event()
+
+        def callback(header):
+            called.append(header["fullname"])
+            if len(called) == len(self.images):
+                finished.set()
+
+        for image in self.images:
+            self.reader.submit(image, self.slow_reader, callback, **kwargs)
+        finished.wait(5)
+        return called
+
+    def test_ordered(self):
+        """Reads with an order_key finish in the order submitted"""
+
+        self.assertEqual(self.read_all(order_key="NECAT_E"), self.images)
+
+    def test_unordered(self):
+        """Other reads finish as they are read"""
+
+        called = self.read_all()
+        self.assertEqual(sorted(called), self.images)
+        self.assertNotEqual(called, self.images)
+
+    def test_cached(self):
+        """A second read of an unchanged image comes from the cache"""
+
+        calls = []
+        def reader(fullname):
+            calls.append(fullname)
+            return {"fullname":fullname}
+
+        self.assertEqual(self.reader.read(self.images[0], reader)["fullname"], self.images[0])
+        self.reader.read(self.images[0], reader)
+        self.assertEqual(calls, [self.images[0]])
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,105 @@
+"""Tests for control.result_writer"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-28"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import threading
+import unittest
+
+# RAPD imports
+from control.result_writer import ResultWriter
+
+def make_result(result_id, status, files=False):
+    """Return a plugin result dict"""
+    results = {"status":status}
+    if files:
+        results["archive_files"] = [{"path":"/tmp/%s.tar.bz2" % status, "hash":"abc"}]
+    return {"process":{"result_id":result_id, "status":status},
+            "results":results}
+
+class TestResultWriter(unittest.TestCase):
+    """Test the coalescing result writer"""
+
+    def setUp(self):
+        """Set up the test fixture - saves are held until released"""
+
+        self.saved = []
+        self.release = threading.Event()
+        self.writer = ResultWriter(save=self.save, nproc=2)
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        self.release.set()
+        self.writer.stop(timeout=5)
+
+    def save(self, results):
+        self.release.wait(5)
+        self.saved.extend(results)
+
+    def statuses(self, result_id):
+        return [result["process"]["status"] for result in self.saved \
+                if result["process"]["result_id"] == result_id]
+
+    def test_latest_wins(self):
+        """Waiting results for a key are replaced by the newest"""
+
+        self.writer.submit(make_result("a", 1))
+        for status in range(2, 10):
+            self.writer.submit(make_result("a", status))
+        self.release.set()
+        self.assertTrue(self.writer.flush(timeout=5))
+        # The first may have been taken before the rest arrived
+        self.assertEqual(self.statuses("a")[-1], 9)
+        self.assertTrue(len(self.statuses("a")) <= 2)
+        self.assertTrue(self.writer.status()["coalesced"] >= 7)
+
+    def test_files_not_replaced(self):
+        """A waiting result with files is saved, and in order"""
+
+        self.writer.submit(make_result("b", 1))
+        self.writer.submit(make_result("b", 2, files=True))
+        self.writer.submit(make_result("b", 3))
+        self.writer.submit(make_result("b", 4))
+        self.release.set()
+        self.assertTrue(self.writer.flush(timeout=5))
+        statuses = self.statuses("b")
+        self.assertTrue(2 in statuses)
+        self.assertEqual(statuses, sorted(statuses))
+        self.assertEqual(statuses[-1], 4)
+
+    def test_keys_kept_apart(self):
+        """Results for different keys are all saved"""
+
+        for result_id in ("c", "d", "e"):
+            self.writer.submit(make_result(result_id, 1))
+        self.release.set()
+        self.assertTrue(self.writer.flush(timeout=5))
+        self.assertEqual(sorted(result["process"]["result_id"] for result in self.saved),
+                         ["c", "d", "e"])
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,146 @@
+"""Tests for control.run_index"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-12"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import unittest
+
+# RAPD imports
+from control.run_index import RunIndex
+
+def make_run(run_id, start=1, number=100, prefix="thaum1", run_number=1):
+    """Return a run dict"""
+    return {"_id":run_id,
+            "site_tag":"NECAT_E",
+            "directory":"/data/user",
+            "image_prefix":prefix,
+            "run_number":run_number,
+            "start_image_number":start,
+            "number_images":number}
+
+class TestRunIndex(unittest.TestCase):
+    """Test the in-memory run index"""
+
+    def setUp(self):
+        """Set up the test fixture"""
+
+        self.index = RunIndex(window=60)
+
+    def find(self, image_number, prefix="thaum1", run_number=1):
+        return self.index.find("NECAT_E", "/data/user", prefix, run_number, image_number)
+
+    def test_interval_lookup(self):
+        """Images are only found inside the run's image numbers"""
+
+        self.index.add(make_run("a", start=11, number=10))
+        self.assertEqual(self.find(11)["_id"], "a")
+        self.assertEqual(self.find(20)["_id"], "a")
+        self.assertEqual(self.find(10), None)
+        self.assertEqual(self.find(21), None)
+        self.assertEqual(self.find(15, prefix="other"), None)
+
+    def test_most_recent_wins(self):
+        """A recollected run shadows the earlier one"""
+
+        self.index.add(make_run("a"))
+        self.index.add(make_run("b"))
+        self.assertEqual(self.find(50)["_id"], "b")
+        self.index.remove("b")
+        self.assertEqual(self.find(50)["_id"], "a")
+
+    def test_dict_access(self):
+        """Model's dict-style access still works"""
+
+        self.index["a"] = make_run("a")
+        self.assertTrue("a" in self.index)
+        self.assertEqual(self.index["a"]["image_prefix"], "thaum1")
+        self.assertEqual(len(self.index), 1)
+
+    def test_eviction(self):
+        """Runs older than the window and beyond max_runs are dropped"""
+
+        self.index.add(make_run("a"))
+        self.index.used["a"] -= 61 * 60
+        self.assertEqual(self.find(1), None)
+        self.assertEqual(len(self.index), 0)
+
+        index = RunIndex(max_runs=2)
+        for run_id in ("a", "b", "c"):
+            index.add(make_run(run_id, run_number=run_id))
+        self.assertFalse("a" in index)
+        self.assertTrue("c" in index)
+
+    def test_recently_used_kept(self):
+        """A run found again is kept over runs added after it"""
+
+        index = RunIndex(max_runs=2)
+        index.add(make_run("a", run_number=1))
+        index.add(make_run("b", run_number=2))
+        self.assertEqual(index.find("NECAT_E", "/data/user", "thaum1", 1, 50)["_id"], "a")
+        index.add(make_run("c", run_number=3))
+        self.assertTrue("a" in index)
+        self.assertFalse("b" in index)
+
+        # Use refreshes the window too
+        self.index.add(make_run("a"))
+        self.index.used["a"] -= 59 * 60
+        self.assertEqual(self.index["a"]["_id"], "a")
+        self.index.evict(now=self.index.used["a"] + 2 * 60)
+        self.assertTrue("a" in self.index)
+
+    def test_miss_cache(self):
+        """Misses are remembered until a run for the key is added"""
+
+        key = ("NECAT_E", "/data/user", "thaum1", 1)
+        self.assertFalse(self.index.is_miss(*key, image_number=900))
+        self.index.add_miss(*key, image_number=900)
+        self.assertTrue(self.index.is_miss(*key, image_number=900))
+        # Other images of the key are still looked up
+        self.assertFalse(self.index.is_miss(*key, image_number=5))
+        self.index.add(make_run("a"))
+        self.assertFalse(self.index.is_miss(*key, image_number=900))
+
+    def test_miss_expiry(self):
+        """Misses are forgotten after miss_ttl"""
+
+        key = ("NECAT_E", "/data/user", "thaum1", 1)
+        self.index.add_miss(*key, image_number=900)
+        self.index.misses[key][900] -= self.index.miss_ttl + 1
+        self.index.evict()
+        self.assertEqual(self.index.misses, {})
+
+    def test_find_run(self):
+        """Runs are matched on key and image range"""
+
+        self.index.add(make_run("a", start=1, number=100))
+        run_data = make_run(None, start=1, number=100)
+        del run_data["_id"]
+        self.assertEqual(self.index.find_run(run_data)["_id"], "a")
+        run_data["number_images"] = 50
+        self.assertEqual(self.index.find_run(run_data), None)
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
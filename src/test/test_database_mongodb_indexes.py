@@ -0,0 +1,159 @@
+"""
+Unit tests for database.mongodb_indexes
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-05"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+import unittest
+
+import database.mongodb_indexes as mongodb_indexes
+
+# explain() output of a find using an index, then fetching documents
+EXPLAIN_FETCH = {
+    "queryPlanner":{
+        "namespace":"rapd.runs",
+        "winningPlan":{
+            "stage":"FETCH",
+            "inputStage":{"stage":"IXSCAN", "indexName":"run_lookup"}}},
+    "executionStats":{"nReturned":1,
+                      "totalKeysExamined":1,
+                      "totalDocsExamined":1,
+                      "executionTimeMillis":0}}
+
+# explain() output of a collection scan with a sort
+EXPLAIN_SCAN = {
+    "queryPlanner":{
+        "namespace":"rapd.runs",
+        "winningPlan":{
+            "stage":"SORT",
+            "inputStage":{"stage":"COLLSCAN"}}},
+    "executionStats":{"nReturned":1,
+                      "totalKeysExamined":0,
+                      "totalDocsExamined":5000,
+                      "executionTimeMillis":250}}
+
+class TestIndexes(unittest.TestCase):
+    """Tests for choosing the indexes wanted"""
+
+    def test_collection_indexes(self):
+        """Collections get their own indexes, plugin results the result indexes"""
+
+        self.assertEqual(mongodb_indexes.get_collection_indexes("runs"),
+                         mongodb_indexes.INDEXES["runs"])
+        self.assertEqual(mongodb_indexes.get_collection_indexes("mx_integrate_results"),
+                         mongodb_indexes.RESULT_INDEXES)
+        self.assertEqual(mongodb_indexes.get_collection_indexes("results"),
+                         mongodb_indexes.INDEXES["results"])
+        self.assertEqual(mongodb_indexes.get_collection_indexes("users"), [])
+
+    def test_missing_matched_on_keys(self):
+        """An index is present when its keys are, whatever its name"""
+
+        indexes = mongodb_indexes.INDEXES["fs.files"]
+        information = {
+            "_id_":{"key":[("_id", 1)]},
+            "old_name":{"key":[("metadata.hash", 1.0), ("metadata.file_type", 1.0)]},
+            }
+        missing = mongodb_indexes.missing_indexes(information, indexes)
+        self.assertEqual([name for name, __ in missing], ["files_result"])
+
+    def test_prefix_is_missing(self):
+        """An index on some of the keys does not count"""
+
+        information = {"hash":{"key":[("metadata.hash", 1)]}}
+        missing = mongodb_indexes.missing_indexes(information,
+                                                  mongodb_indexes.INDEXES["fs.files"])
+        self.assertEqual(len(missing), 2)
+
+class TestExplain(unittest.TestCase):
+    """Tests for summarizing query plans"""
+
+    def test_index_fetch(self):
+        """A fetch through an index is not covered, and not a problem"""
+
+        summary = mongodb_indexes.summarize_explain(EXPLAIN_FETCH)
+        self.assertEqual(summary["stages"], ["FETCH", "IXSCAN"])
+        self.assertEqual(summary["index"], "run_lookup")
+        self.assertFalse(summary["covered"])
+        self.assertEqual(summary["problems"], [])
+
+    def test_covered(self):
+        """A plan without a fetch is covered"""
+
+        explain = {"queryPlanner":{"winningPlan":{
+            "stage":"PROJECTION",
+            "inputStage":{"stage":"IXSCAN", "indexName":"session_data_root_dir"}}}}
+        summary = mongodb_indexes.summarize_explain(explain)
+        self.assertTrue(summary["covered"])
+        self.assertEqual(summary["index"], "session_data_root_dir")
+
+    def test_scan(self):
+        """Scans and sorts in memory are problems"""
+
+        summary = mongodb_indexes.summarize_explain(EXPLAIN_SCAN)
+        self.assertIsNone(summary["index"])
+        self.assertEqual(len(summary["problems"]), 3)
+
+class TestProfile(unittest.TestCase):
+    """Tests for reading system.profile"""
+
+    def test_query_shape(self):
+        """Values are replaced, operators kept"""
+
+        shape = mongodb_indexes.query_shape({"directory":"/raw/a",
+                                             "start_image_number":{"$lte":10},
+                                             "metadata.file_type":{"$in":["a", "b"]}})
+        self.assertEqual(shape, {"directory":1,
+                                 "start_image_number":{"$lte":1},
+                                 "metadata.file_type":{"$in":[1]}})
+
+    def test_find_command(self):
+        """Finds are read from the command of newer servers"""
+
+        entry = {"op":"query",
+                 "ns":"rapd.runs",
+                 "command":{"find":"runs",
+                            "filter":{"directory":"/raw/a"},
+                            "sort":{"file_ctime":-1}}}
+        self.assertEqual(mongodb_indexes.get_profiled_find(entry),
+                         ("runs", {"directory":"/raw/a"}, {"file_ctime":-1}, None))
+
+    def test_legacy_query(self):
+        """Finds are read from the query of older servers"""
+
+        entry = {"op":"query",
+                 "ns":"rapd.fs.files",
+                 "query":{"$query":{"metadata.hash":"abc"}, "$orderby":{"_id":1}}}
+        self.assertEqual(mongodb_indexes.get_profiled_find(entry),
+                         ("fs.files", {"metadata.hash":"abc"}, {"_id":1}, None))
+
+    def test_not_find(self):
+        """Other operations are left out"""
+
+        entry = {"op":"update", "ns":"rapd.results", "command":{"q":{}, "u":{}}}
+        self.assertIsNone(mongodb_indexes.get_profiled_find(entry))
+
+if __name__ == "__main__":
+    unittest.main()
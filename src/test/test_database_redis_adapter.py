@@ -0,0 +1,108 @@
+"""Tests for the retrying and metrics of database.redis_adapter"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-06"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import unittest
+
+import redis.exceptions
+
+# RAPD imports
+import database.redis_adapter as redis_adapter
+
+class FlakyDatabase(redis_adapter.Database):
+    """A Database whose server fails a number of times, without connecting"""
+
+    def __init__(self, failures):
+        self.logger = False
+        self.failures = failures
+        self.calls = 0
+
+    @redis_adapter.connectionErrorWrapper
+    def get(self, key):
+        """Fail until failures calls have been made"""
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise redis.exceptions.ConnectionError("down")
+        return key
+
+class TestBackoff(unittest.TestCase):
+    """Tests for the delay between retries"""
+
+    def test_bounds(self):
+        """Delays grow from BACKOFF_BASE and stop at BACKOFF_MAX"""
+        for attempt in range(50):
+            delay = redis_adapter.backoff_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(redis_adapter.BACKOFF_MAX,
+                                            redis_adapter.BACKOFF_BASE * 2 ** attempt))
+
+class TestWrapper(unittest.TestCase):
+    """Tests for connectionErrorWrapper"""
+
+    def setUp(self):
+        self.backoff_base = redis_adapter.BACKOFF_BASE
+        self.retry_time = redis_adapter.RETRY_TIME
+        redis_adapter.BACKOFF_BASE = 0.001
+        redis_adapter.METRICS.reset()
+
+    def tearDown(self):
+        redis_adapter.BACKOFF_BASE = self.backoff_base
+        redis_adapter.RETRY_TIME = self.retry_time
+
+    def test_retry(self):
+        """A command is retried until the server answers"""
+        database = FlakyDatabase(failures=3)
+        self.assertEqual(database.get("foo"), "foo")
+        self.assertEqual(database.calls, 4)
+        metrics = redis_adapter.get_metrics()
+        self.assertEqual(metrics["errors"], 3)
+        self.assertEqual(metrics["reconnects"], 1)
+        self.assertEqual(metrics["commands"]["get"]["calls"], 1)
+
+    def test_give_up(self):
+        """A server that does not answer raises ConnectionError"""
+        redis_adapter.RETRY_TIME = 0.05
+        database = FlakyDatabase(failures=10**6)
+        self.assertRaises(redis_adapter.Database.ConnectionError, database.get, "foo")
+        # Still caught by handlers of the redis exception
+        self.assertRaises(redis.exceptions.ConnectionError, database.get, "foo")
+
+class TestMetrics(unittest.TestCase):
+    """Tests for Metrics"""
+
+    def test_blocking(self):
+        """Blocking commands are counted, but their time is not latency"""
+        metrics = redis_adapter.Metrics()
+        metrics.record("brpop", 5.0, blocking=True)
+        metrics.record("get", 0.002)
+        metrics.record("get", 0.004)
+        result = metrics.get()
+        self.assertEqual(result["commands"]["brpop"], {"calls":1, "mean_ms":0, "max_ms":0})
+        self.assertAlmostEqual(result["commands"]["get"]["mean_ms"], 3.0)
+        self.assertAlmostEqual(result["commands"]["get"]["max_ms"], 4.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+"""Tests for detectors.dectris.cbf_header"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-18"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+import detectors.dectris.cbf_header as cbf_header
+import detectors.dectris.dectris_eiger16m as dectris_eiger16m
+import detectors.dectris.dectris_pilatus6m as dectris_pilatus6m
+
+PILATUS_HEADER = "\r\n".join((
+    "###CBF: VERSION 1.5, CBFlib v0.7.8 - PILATUS detectors",
+    "",
+    "data_thaum1_PAIR_0_0001",
+    "",
+    "_array_data.header_convention \"PILATUS_1.2\"",
+    "_array_data.header_contents",
+    ";",
+    "# Detector: PILATUS 6M-F, S/N 60-0112-F",
+    "# 2016-08-03T16:25:14.123",
+    "# Pixel_size 172e-6 m x 172e-6 m",
+    "# Silicon sensor, thickness 0.000320 m",
+    "# Exposure_time 0.1970000 s",
+    "# Exposure_period 0.2000000 s",
+    "# Tau = 383.8e-09 s",
+    "# Count_cutoff 1048500 counts",
+    "# Threshold_setting: 6331 eV",
+    "# Gain_setting: mid gain (vrf = -0.200)",
+    "# N_excluded_pixels = 321",
+    "# Excluded_pixels: badpix_mask.tif",
+    "# Flat_field: FF_p60-0112-F_E12662_T6331_vrf_m0p20.tif",
+    "# Trim_file: p6m0112_E12662_T6331_vrf_m0p20.bin",
+    "# Wavelength 0.9792 A",
+    "# Detector_distance 0.30000 m",
+    "# Beam_xy (1231.00, 1264.00) pixels",
+    "# Filter_transmission 0.1000",
+    "# Start_angle 0.0000 deg.",
+    "# Angle_increment 1.0000 deg.",
+    "# Detector_2theta 0.0000 deg.",
+    ";",
+    "",
+    "_array_data.data",
+    ";",
+    "--CIF-BINARY-FORMAT-SECTION--",
+    "Content-Type: application/octet-stream;",
+    "     conversions=\"x-CBF_BYTE_OFFSET\"",
+    "X-Binary-Size-Fastest-Dimension: 2463",
+    "X-Binary-Size-Second-Dimension: 2527",
+    "X-Binary-Size-Padding: 4095",
+    "",
+    ))
+
+EIGER_HEADER = "\r\n".join((
+    "###CBF: VERSION 1.5, CBFlib v0.7.8 - Eiger detectors",
+    "_array_data.header_contents",
+    ";",
+    "# Detector: Dectris Eiger 16M, S/N E-32-0100",
+    "# Pixel_size 75e-6 m x 75e-6 m",
+    "# Silicon sensor, thickness 0.000450 m",
+    "# Exposure_time 0.0100000 s",
+    "# Exposure_period 0.0100000 s",
+    "# Count_cutoff 19405 counts",
+    "# Wavelength 0.9792 A",
+    "# Detector_distance 300.00 m",
+    "# Beam_xy (2069.00, 2165.50) pixels",
+    "# Start_angle 12.5000 deg.",
+    "# Angle_increment 0.2000 deg.",
+    ";",
+    "X-Binary-Size-Padding: 4095",
+    "",
+    ))
+
+class TestHeaderParser(unittest.TestCase):
+    """The shared parser gives the same fields as the legacy one"""
+
+    def test_pilatus(self):
+        """All Pilatus 6M fields"""
+
+        fields = dectris_pilatus6m.HEADER_ITEMS
+        shared = cbf_header.HeaderParser(fields).parse(PILATUS_HEADER)
+        self.assertEqual(shared, cbf_header.legacy_parse(PILATUS_HEADER, fields))
+        self.assertEqual(shared["gain"], "mid gain (vrf = -0.200)")
+        self.assertEqual(shared["date"], "2016-08-03T16:25:14.123")
+        self.assertEqual(shared["size2"], 2527)
+
+    def test_eiger(self):
+        """All Eiger 16M fields"""
+
+        fields = dectris_eiger16m.HEADER_ITEMS
+        shared = cbf_header.HeaderParser(fields).parse(EIGER_HEADER)
+        self.assertEqual(shared, cbf_header.legacy_parse(EIGER_HEADER, fields))
+        self.assertEqual(shared["detector_sn"], "E-32-0100")
+        self.assertEqual(shared["beam_y"], 2165.5)
+
+    def test_missing(self):
+        """Fields not in the header are None"""
+
+        shared = cbf_header.HeaderParser(dectris_pilatus6m.HEADER_ITEMS).parse(EIGER_HEADER)
+        self.assertEqual(shared["tau"], None)
+
+class TestReadHeaderBlock(unittest.TestCase):
+    """Only the header is read from the file"""
+
+    def setUp(self):
+        """Set up the test fixture"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmp_dir, "thaum1_PAIR_0_0001.cbf")
+        with open(self.image, "wb") as image:
+            image.write(PILATUS_HEADER)
+            image.write("\x0c\x1a\x04\xd5" + "\x00\xff" * 20000)
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_block(self):
+        """The block ends with the padding line"""
+
+        self.assertEqual(cbf_header.read_header_block(self.image), PILATUS_HEADER)
+
+    def test_read_header(self):
+        """Detector read_header works on the file"""
+
+        header = dectris_pilatus6m.read_header(self.image)
+        self.assertEqual(header["image_number"], 1)
+        self.assertEqual(header["wavelength"], 0.9792)
+        self.assertEqual(header["distance"], 300.0)
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
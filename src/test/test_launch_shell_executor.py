@@ -0,0 +1,118 @@
+"""Tests for launch.shell_executor"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-22"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import threading
+import time
+import unittest
+
+# RAPD imports
+from launch.shell_executor import ShellExecutor
+
+class TestShellExecutor(unittest.TestCase):
+    """Test the limits and ordering of the shell executor"""
+
+    def setUp(self):
+        """Set up the test fixture"""
+
+        self.started = []
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        self.release.set()
+        self.executor.stop()
+
+    def run_job(self, message, started):
+        if message.get("fail"):
+            raise IOError("Unable to launch %s" % message["id"])
+        started()
+        with self.lock:
+            self.started.append(message["id"])
+        self.release.wait(5)
+
+    def wait_started(self, count):
+        for __ in range(100):
+            with self.lock:
+                if len(self.started) >= count:
+                    return
+            time.sleep(0.01)
+
+    def test_limits(self):
+        """No more than the limit of a command run at once"""
+
+        self.executor = ShellExecutor(self.run_job, pool_size=3, job_limits={"MR":1})
+        for job_id in range(3):
+            self.executor.submit({"command":"MR", "id":job_id})
+        self.executor.submit({"command":"INDEX", "id":"snap"})
+        self.wait_started(2)
+        time.sleep(0.05)
+        self.assertEqual(sorted(self.started), [0, "snap"])
+        self.assertEqual(self.executor.status()["running"], {"MR":1, "INDEX":1})
+        self.assertEqual(self.executor.status()["waiting"], {"MR":2})
+
+    def test_priority(self):
+        """Snaps start ahead of waiting MR jobs"""
+
+        self.executor = ShellExecutor(self.run_job, pool_size=1, job_limits={})
+        self.executor.submit({"command":"MR", "id":"first"})
+        self.wait_started(1)
+        self.executor.submit({"command":"MR", "id":"mr"})
+        self.executor.submit({"command":"INDEX", "id":"snap"})
+        self.release.set()
+        self.wait_started(3)
+        self.assertEqual(self.started, ["first", "snap", "mr"])
+
+    def test_full(self):
+        """The queue reports full at max_queued"""
+
+        self.executor = ShellExecutor(self.run_job, pool_size=1, max_queued=2)
+        for job_id in range(3):
+            self.executor.submit({"command":"INTEGRATE", "id":job_id})
+        self.wait_started(1)
+        self.assertTrue(self.executor.full())
+        self.assertFalse(self.executor.wait_for_room(0.01))
+        self.assertTrue(self.executor.status()["saturated"])
+
+    def test_launch_failed(self):
+        """on_error is called for a job that fails to launch, on_start for one that launches"""
+
+        self.executor = ShellExecutor(self.run_job, pool_size=1)
+        calls = []
+        self.executor.submit({"command":"INDEX", "id":"bad", "fail":True},
+                             on_start=lambda: calls.append("start bad"),
+                             on_error=lambda: calls.append("error bad"))
+        self.executor.submit({"command":"INDEX", "id":"good"},
+                             on_start=lambda: calls.append("start good"),
+                             on_error=lambda: calls.append("error good"))
+        self.wait_started(1)
+        self.assertEqual(calls, ["error bad", "start good"])
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,114 @@
+"""Tests for plugins.index.strategy_scheduler"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-20"
+__maintainer__ = "Jon Schuermann"
+__email__ = "schuerjp@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import unittest
+
+# RAPD imports
+import plugins.index.strategy_scheduler as strategy_scheduler
+
+MOSFLM = strategy_scheduler.MOSFLM_ITERATION
+
+def best_gives(*kinds):
+    """Return a best_ok for a job where BEST gave strategies of kinds"""
+    return lambda kind: kind in kinds
+
+class TestStrategyScheduler(unittest.TestCase):
+    """Tests for StrategyScheduler"""
+
+    def setUp(self):
+        self.scheduler = strategy_scheduler.StrategyScheduler()
+        self.started = range(0, MOSFLM + 1)
+
+    def test_out_of_order(self):
+        """A later BEST iteration finishing first gives the strategy"""
+        self.assertEqual(self.scheduler.job_finished(2, best_gives("", "_anom")),
+                         [("best", ""), ("best", "_anom")])
+        self.assertTrue(self.scheduler.is_done())
+        self.assertEqual(self.scheduler.get_unneeded(self.started), [0, 1, 3, MOSFLM])
+
+        # Jobs still reporting are ignored
+        self.assertEqual(self.scheduler.job_finished(0, best_gives("")), [])
+        self.assertEqual(self.scheduler.job_finished(2, best_gives("")), [])
+
+    def test_kinds_apart(self):
+        """Each kind of strategy takes the first BEST iteration to give one"""
+        self.assertEqual(self.scheduler.job_finished(1, best_gives("")), [("best", "")])
+        self.assertFalse(self.scheduler.is_done())
+        self.assertEqual(self.scheduler.get_unneeded(self.started), [])
+        self.assertEqual(self.scheduler.job_finished(3, best_gives("", "_anom")),
+                         [("best", "_anom")])
+        self.assertTrue(self.scheduler.is_done())
+
+    def test_all_best_failed(self):
+        """Mosflm is taken once every BEST iteration has failed, whenever it finishes"""
+        self.assertEqual(self.scheduler.job_finished(MOSFLM, best_gives()), [])
+        for iteration in (3, 0, 2):
+            self.assertEqual(self.scheduler.job_finished(iteration, best_gives()), [])
+            self.assertFalse(self.scheduler.is_done())
+        self.assertEqual(self.scheduler.job_finished(1, best_gives()),
+                         [("best_failed", ""), ("mosflm", ""),
+                          ("best_failed", "_anom"), ("mosflm", "_anom")])
+        self.assertTrue(self.scheduler.is_done())
+
+        # Mosflm finishing last
+        scheduler = strategy_scheduler.StrategyScheduler()
+        for iteration in range(0, MOSFLM):
+            scheduler.job_finished(iteration, best_gives("_anom") if iteration == 1 else best_gives())
+        self.assertTrue(scheduler.best_exhausted(""))
+        self.assertEqual(scheduler.get_unneeded(self.started), [])
+        self.assertEqual(scheduler.job_finished(MOSFLM, best_gives()), [("mosflm", "")])
+        self.assertTrue(scheduler.is_done())
+
+    def test_timed_out(self):
+        """A job out of time fails BEST, and Mosflm out of time gives nothing"""
+        scheduler = strategy_scheduler.StrategyScheduler(first_iteration=3)
+        self.assertEqual(scheduler.job_finished(MOSFLM, best_gives(), timed_out=True), [])
+        self.assertEqual(scheduler.job_finished(3, best_gives("", "_anom"), timed_out=True),
+                         [("best_failed", ""), ("best_failed", "_anom")])
+        self.assertTrue(scheduler.is_done())
+
+    def test_mosflm_only(self):
+        """Starting at the Mosflm iteration takes its strategy at once"""
+        scheduler = strategy_scheduler.StrategyScheduler(first_iteration=MOSFLM)
+        self.assertEqual(scheduler.next_iteration([]), MOSFLM)
+        self.assertEqual(scheduler.job_finished(MOSFLM, best_gives()),
+                         [("mosflm", ""), ("mosflm", "_anom")])
+
+    def test_one_at_a_time(self):
+        """Run singly, the next needed iteration starts when the last finishes"""
+        self.assertEqual(self.scheduler.next_iteration([]), 0)
+        self.assertEqual(self.scheduler.next_iteration([0]), None)
+        self.scheduler.job_finished(0, best_gives())
+        self.assertEqual(self.scheduler.next_iteration([0]), 1)
+        self.scheduler.job_finished(1, best_gives(""))
+        self.assertEqual(self.scheduler.next_iteration([0, 1]), 2)
+        self.scheduler.job_finished(2, best_gives("_anom"))
+        self.assertEqual(self.scheduler.next_iteration([0, 1, 2]), None)
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,119 @@
+"""Tests for plugins.integrate.wedge_scheduler"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-10"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import unittest
+
+# RAPD imports
+import plugins.integrate.wedge_scheduler as wedge_scheduler
+
+def arrive(scheduler, first, last, period, start=0.0):
+    """Have frames first to last arrive every period seconds"""
+
+    for frame in range(first, last + 1):
+        scheduler.frame_arrived(frame, start + (frame - first) * period)
+    return start + (last - first) * period
+
+class TestScheduler(unittest.TestCase):
+    """Tests for choosing wedges"""
+
+    def test_first_wedge(self):
+        """The first wedge waits for its degrees of data"""
+
+        scheduler = wedge_scheduler.WedgeScheduler(1, 3600, 0.1, frame_time=1.0)
+        now = arrive(scheduler, 1, 99, 1.0)
+        self.assertFalse(scheduler.should_launch(99, now))
+        now = arrive(scheduler, 100, 100, 1.0, now + 1.0)
+        self.assertTrue(scheduler.should_launch(100, now))
+
+    def test_fast_detector(self):
+        """At a high frame rate wedges are far apart"""
+
+        scheduler = wedge_scheduler.WedgeScheduler(1, 36000, 0.1)
+        now = arrive(scheduler, 1, 200, 0.01)
+        scheduler.wedge_started(200, now)
+        # Expected to take SETUP_TIME and more, at 100 frames a second
+        self.assertGreater(scheduler.checkpoint, 200 + 100 * wedge_scheduler.SETUP_TIME)
+
+    def test_slow_detector(self):
+        """At a low frame rate wedges are as close as allowed"""
+
+        scheduler = wedge_scheduler.WedgeScheduler(1, 3600, 0.1)
+        now = arrive(scheduler, 1, 100, 60.0)
+        scheduler.wedge_started(100, now)
+        self.assertEqual(scheduler.checkpoint, 100 + scheduler.min_step)
+
+    def test_waits_for_running(self):
+        """A running wedge is waited for until it is stale"""
+
+        scheduler = wedge_scheduler.WedgeScheduler(1, 3600, 0.1, frame_time=60.0)
+        scheduler.wedge_started(100, 0.0)
+        expected = scheduler.running["expected"]
+        self.assertFalse(scheduler.should_launch(scheduler.checkpoint, 1.0))
+        self.assertTrue(scheduler.should_launch(scheduler.checkpoint,
+                                                expected * wedge_scheduler.STALE_FACTOR + 1.0))
+
+    def test_too_late(self):
+        """A wedge that would finish after the last frame is not started"""
+
+        scheduler = wedge_scheduler.WedgeScheduler(1, 120, 0.1, frame_time=0.01)
+        self.assertFalse(scheduler.should_launch(100, 0.0))
+
+    def test_timings(self):
+        """The model follows the times of XDS steps"""
+
+        scheduler = wedge_scheduler.WedgeScheduler(1, 3600, 0.1, frame_time=1.0)
+        scheduler.wedge_started(100, 0.0)
+        scheduler.wedge_finished({"XYCORR":1.0,
+                                  "INIT":1.0,
+                                  "COLSPOT":2.0,
+                                  "IDXREF":2.0,
+                                  "DEFPIX":0.0,
+                                  "INTEGRATE":100.0,
+                                  "CORRECT":10.0}, now=120.0)
+        self.assertEqual(scheduler.completed, 100)
+        self.assertAlmostEqual(scheduler.setup_time, (wedge_scheduler.SETUP_TIME + 6.0) / 2)
+        self.assertAlmostEqual(scheduler.integrate_time, (wedge_scheduler.INTEGRATE_TIME + 1.0) / 2)
+
+        # Carried on - only the new frames are integrated
+        scheduler.wedge_started(200, 120.0)
+        self.assertEqual(scheduler.running["previous"], 100)
+        integrate_time = scheduler.integrate_time
+        scheduler.wedge_finished({"INTEGRATE":100.0 * integrate_time, "CORRECT":1.0}, now=200.0)
+        self.assertAlmostEqual(scheduler.integrate_time, integrate_time)
+        self.assertEqual(scheduler.completed, 200)
+
+    def test_failed(self):
+        """A failed wedge is not carried on from"""
+
+        scheduler = wedge_scheduler.WedgeScheduler(1, 3600, 0.1, frame_time=1.0)
+        scheduler.wedge_started(100, 0.0)
+        scheduler.wedge_finished(succeeded=False)
+        self.assertIsNone(scheduler.completed)
+        self.assertIsNone(scheduler.running)
+
+if __name__ == "__main__":
+    unittest.main()
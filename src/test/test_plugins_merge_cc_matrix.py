@@ -0,0 +1,100 @@
+"""Tests for plugins.merge.cc_matrix"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-17"
+__maintainer__ = "Kay Perry"
+__email__ = "kperry@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import unittest
+
+import numpy
+
+# RAPD imports
+import plugins.merge.cc_matrix as cc_matrix
+
+class TestIndexSpace(unittest.TestCase):
+    """Tests for build_index_space"""
+
+    def test_merge(self):
+        """Observations of a reflection are averaged, and only shared reflections kept"""
+        datasets = [([(1, 0, 0), (1, 0, 0), (0, 1, 0), (5, 5, 5)], [1.0, 3.0, 4.0, 9.0]),
+                    ([(0, 1, 0), (1, 0, 0), (-3, 2, 1)], [5.0, 6.0, 7.0])]
+        values, mask = cc_matrix.build_index_space(datasets)
+        self.assertEqual(values.shape, (2, 2))
+        self.assertEqual(values.dtype, numpy.float32)
+        self.assertTrue(mask.all())
+        # Columns are ordered by packed index - (0, 1, 0) before (1, 0, 0)
+        self.assertEqual(values.tolist(), [[4.0, 2.0], [5.0, 6.0]])
+
+class TestCorrelationMatrix(unittest.TestCase):
+    """Tests for correlation_matrix"""
+
+    def test_pairs(self):
+        """Each pair is correlated over the reflections it has in common"""
+        random = numpy.random.RandomState(0)
+        nsets, nrefl = 7, 200
+        values = random.normal(size=(nsets, nrefl))
+        mask = random.uniform(size=(nsets, nrefl)) < 0.6
+        # Too few reflections in common with the others
+        mask[6] = False
+        mask[6, :2] = True
+        # Blocks of data sets and of reflections that do not divide evenly
+        cc_matrix.BLOCK_SIZE, block_size = 3, cc_matrix.BLOCK_SIZE
+        cc_matrix.COLUMN_BLOCK, column_block = 64, cc_matrix.COLUMN_BLOCK
+        try:
+            ccs = cc_matrix.correlation_matrix(values, mask, threads=2)
+        finally:
+            cc_matrix.BLOCK_SIZE = block_size
+            cc_matrix.COLUMN_BLOCK = column_block
+
+        for first in range(nsets):
+            for second in range(nsets):
+                common = mask[first] & mask[second]
+                if first == second:
+                    expected = 1
+                elif common.sum() < cc_matrix.MIN_COMMON:
+                    expected = 0
+                else:
+                    expected = numpy.corrcoef(values[first, common], values[second, common])[0, 1]
+                self.assertAlmostEqual(ccs[first, second], expected)
+
+class TestCellMatrix(unittest.TestCase):
+    """Tests for cell_matrix and similar_symmetry_matrix"""
+
+    def test_cells(self):
+        """Correlation by the variation in cell lengths"""
+        cells = [(100, 100, 100, 90, 90, 90),
+                 (110, 100, 100, 90, 90, 90),
+                 (100.5, 100, 100, 90, 90, 120)]
+        ccs = cc_matrix.cell_matrix(cells)
+        self.assertAlmostEqual(ccs[0, 1], 1 - 0.1 / 3)
+        self.assertAlmostEqual(ccs[1, 0], ccs[0, 1])
+        self.assertEqual(cc_matrix.cell_matrix(cells, strict=True)[0, 2], 0)
+
+        similar = cc_matrix.similar_symmetry_matrix(cells[:2] + [cells[0]], [19, 19, 4])
+        self.assertEqual(similar.tolist(), [[True, False, False],
+                                            [False, True, False],
+                                            [False, False, True]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""Tests for plugins.pdbquery.mr_scheduler"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-16"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import unittest
+
+# RAPD imports
+import plugins.pdbquery.mr_scheduler as mr_scheduler
+
+SOLVED = {"solution": True, "tfz": "12.3", "gain": "350"}
+WEAK = {"solution": True, "tfz": "6.1", "gain": "80"}
+
+class TestIsDefinitive(unittest.TestCase):
+    """Tests for is_definitive"""
+
+    def test_results(self):
+        """Only solutions with both a high TFZ and LLG gain"""
+        self.assertTrue(mr_scheduler.is_definitive(SOLVED))
+        self.assertFalse(mr_scheduler.is_definitive(WEAK))
+        self.assertFalse(mr_scheduler.is_definitive({"solution": True, "tfz": "NC", "gain": 300}))
+        self.assertFalse(mr_scheduler.is_definitive({"solution": False, "message": "Timed out"}))
+
+class TestMRScheduler(unittest.TestCase):
+    """Tests for MRScheduler"""
+
+    def setUp(self):
+        self.scheduler = mr_scheduler.MRScheduler(max_running=2)
+        for name, source, distance in (("1ctm", "common_contaminants", None),
+                                       ("2abc", "search_results", 0.05),
+                                       ("1abc", "search_results", 0.01),
+                                       ("3abc", "custom_structures", None)):
+            self.scheduler.add(name,
+                               {"name": name},
+                               mr_scheduler.get_priority(source, distance, 3.0))
+
+    def test_order(self):
+        """Best candidates first, no more than max_running at once"""
+        self.assertEqual([name for name, __ in self.scheduler.next_jobs()], ["3abc", "1abc"])
+        self.assertEqual(self.scheduler.next_jobs(), [])
+        self.assertFalse(self.scheduler.job_finished("3abc", WEAK))
+        self.assertEqual([name for name, __ in self.scheduler.next_jobs()], ["2abc"])
+
+    def test_definitive(self):
+        """A definitive solution stops the rest"""
+        self.scheduler.next_jobs()
+        self.assertEqual(self.scheduler.get_unneeded(), ([], []))
+        self.assertTrue(self.scheduler.job_finished("1abc", SOLVED))
+        self.assertEqual(self.scheduler.next_jobs(), [])
+        not_started, running = self.scheduler.get_unneeded()
+        self.assertEqual([name for name, __ in not_started], ["2abc", "1ctm"])
+        self.assertEqual(running, ["3abc"])
+        self.assertFalse(self.scheduler.is_done())
+        self.scheduler.job_stopped("3abc")
+        self.assertTrue(self.scheduler.is_done())
+
+    def test_run_all(self):
+        """Without stop_on_solution every job is run"""
+        self.scheduler.stop_on_solution = False
+        self.scheduler.next_jobs()
+        self.scheduler.job_finished("1abc", SOLVED)
+        self.assertEqual(len(self.scheduler.next_jobs()), 1)
+        self.assertFalse(self.scheduler.is_done())
+
+if __name__ == "__main__":
+    unittest.main()
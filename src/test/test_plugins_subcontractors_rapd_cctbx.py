@@ -0,0 +1,91 @@
+"""Tests for the model description in plugins.subcontractors.rapd_cctbx"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-21"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+import utils.global_vars as rglobals
+
+# cctbx and Phaser are needed to describe a model against data
+try:
+    import plugins.subcontractors.rapd_cctbx as rapd_cctbx
+    import plugins.subcontractors.rapd_phaser as rapd_phaser
+except ImportError:
+    rapd_cctbx = False
+    rapd_phaser = False
+
+# Data and a model of it, shipped with the REST service
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "services", "rest")
+DATA_FILE = os.path.join(DATA_DIR, "P41212.1.mtz")
+STRUCT_FILE = os.path.join(DATA_DIR, "P41212.1.pdb")
+
+@unittest.skipIf(not (rapd_phaser and rapd_phaser.phaser), "cctbx and phaser are not installed")
+class TestGetPdbInfo(unittest.TestCase):
+    """get_pdb_info gives Phaser a target resolution for each model"""
+
+    def setUp(self):
+        """Work on a copy of the model, with a model cache of the test's own"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.struct_file = os.path.join(self.tmp_dir, os.path.basename(STRUCT_FILE))
+        shutil.copy(STRUCT_FILE, self.struct_file)
+        self.model_cache = rglobals.MODEL_CACHE
+        rglobals.MODEL_CACHE = os.path.join(self.tmp_dir, "models")
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        os.chdir(self.cwd)
+        rglobals.MODEL_CACHE = self.model_cache
+        shutil.rmtree(self.tmp_dir)
+
+    def test_target_resolution(self):
+        """The eLLG target resolution is worked out for a real model"""
+
+        resolution = rapd_phaser.get_target_resolution(DATA_FILE, self.struct_file)
+        self.assertTrue(isinstance(resolution, float))
+        self.assertGreater(resolution, 0)
+
+    def test_res(self):
+        """Every model described has a target resolution"""
+
+        pdb_info = rapd_cctbx.get_pdb_info(self.struct_file,
+                                           DATA_FILE,
+                                           rapd_cctbx.get_res(DATA_FILE),
+                                           matthews=False,
+                                           chains=False)
+        self.assertTrue(isinstance(pdb_info["all"]["res"], float))
+        self.assertGreater(pdb_info["all"]["res"], 0)
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,142 @@
+"""Tests for carrying XDS wedges on in plugins.subcontractors.xds"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-09"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+import plugins.subcontractors.xds as xds
+
+HEADER = """!FORMAT=XDS_ASCII    MERGE=FALSE    FRIEDEL'S_LAW=TRUE
+!OUTPUT_FILE=INTEGRATE.HKL
+!DATA_RANGE=%6d%6d
+!END_OF_HEADER
+"""
+
+CLEAN_LOG = """ ***** CORRECT *****
+     a        b          ISa
+ 1.012E+00  3.118E-03   17.84
+ elapsed wall-clock time       2.1 sec
+"""
+
+SPOT_SIZE_LOG = """ ***** INTEGRATE *****
+ !!! ERROR !!! AUTOMATIC DETERMINATION OF SPOT SIZE PARAMETERS HAS FAILED
+ elapsed wall-clock time       0.4 sec
+"""
+
+def write_hkl(path, first, last, records):
+    """Write an INTEGRATE.HKL with records for frames first to last"""
+
+    with open(path, "w") as hkl_file:
+        hkl_file.write(HEADER % (first, last))
+        for record in records:
+            hkl_file.write(record)
+        hkl_file.write("!END_OF_DATA\n")
+
+class TestIntegrateHkl(unittest.TestCase):
+    """Tests for reading and merging INTEGRATE.HKL"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_integrated_range(self):
+        """The range is read from the header"""
+
+        path = os.path.join(self.directory, "INTEGRATE.HKL")
+        write_hkl(path, 1, 50, [])
+        self.assertEqual(xds.get_integrated_range(path), (1, 50))
+
+    def test_merge(self):
+        """Both sets of reflections are kept under one header"""
+
+        older = os.path.join(self.directory, "older.HKL")
+        newer = os.path.join(self.directory, "newer.HKL")
+        output = os.path.join(self.directory, "INTEGRATE.HKL")
+        write_hkl(older, 1, 50, ["   1   2   3 10.0\n"])
+        write_hkl(newer, 51, 100, ["   4   5   6 20.0\n", "   7   8   9 30.0\n"])
+
+        self.assertEqual(xds.merge_integrate_hkl(older, newer, output), (1, 100))
+        self.assertEqual(xds.get_integrated_range(output), (1, 100))
+        with open(output, "r") as hkl_file:
+            lines = hkl_file.readlines()
+        self.assertEqual(len([line for line in lines if not line.startswith("!")]), 3)
+        self.assertEqual(lines[-1], "!END_OF_DATA\n")
+        self.assertEqual(len([line for line in lines if line.startswith("!END_OF_HEADER")]), 1)
+
+    def test_seed(self):
+        """A wedge needs its geometry and reflections to be carried on from"""
+
+        previous = os.path.join(self.directory, "wedge_1_50")
+        os.mkdir(previous)
+        self.assertFalse(xds.can_seed(previous))
+        for name in xds.SEED_FILES + ("GXPARM.XDS",):
+            open(os.path.join(previous, name), "w").close()
+        self.assertTrue(xds.can_seed(previous))
+
+        directory = os.path.join(self.directory, "wedge_1_100")
+        xds.seed_wedge(previous, directory)
+        self.assertTrue(os.path.exists(os.path.join(directory, "XPARM.XDS")))
+        self.assertTrue(os.path.exists(os.path.join(directory, "BKGPIX.cbf")))
+        self.assertFalse(os.path.exists(os.path.join(directory, "INTEGRATE.HKL")))
+
+class TestLogErrors(unittest.TestCase):
+    """Tests for get_log_errors, which decides if a wedge carried on from another worked"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_log(self, text):
+        """Write XDS.LOG"""
+        with open(os.path.join(self.directory, "XDS.LOG"), "w") as log:
+            log.write(text)
+
+    def test_clean(self):
+        """A run without errors"""
+        self.write_log(CLEAN_LOG)
+        self.assertEqual(xds.get_log_errors(self.directory), [])
+
+    def test_spot_size(self):
+        """INTEGRATE of a few frames failing to work out the spot size"""
+        self.write_log(SPOT_SIZE_LOG)
+        errors = xds.get_log_errors(self.directory)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue("SPOT SIZE PARAMETERS HAS FAILED" in errors[0])
+
+    def test_missing(self):
+        """No XDS.LOG is an error"""
+        self.assertEqual(len(xds.get_log_errors(self.directory)), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Tests for utils.artifacts"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-02"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+import utils.archive as archive
+import utils.artifacts as artifacts
+
+LOG_LINES = [" CORRECT.LP\n", "\n"] + [" %4d   0.9   99.1\n" % i for i in range(500)]
+
+class TestArtifacts(unittest.TestCase):
+    """Logs are stored once, compressed, under their hash"""
+
+    def setUp(self):
+        """Set up the test fixture"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = os.path.join(self.tmp_dir, "artifacts")
+        self.log = os.path.join(self.tmp_dir, "CORRECT.LP")
+        with open(self.log, "w") as log_file:
+            log_file.writelines(LOG_LINES)
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_store_file(self):
+        """The reference has the file's hash and the text reads back"""
+
+        reference = artifacts.store_file(self.log, self.store, "xds_correct")
+        self.assertEqual(reference["artifact"], archive.get_hash(self.log))
+        self.assertEqual(reference["lines"], len(LOG_LINES))
+        self.assertEqual(reference["size"], os.path.getsize(self.log))
+        self.assertTrue(os.path.getsize(reference["path"]) < reference["size"])
+        self.assertEqual(artifacts.read_lines(reference["path"]), LOG_LINES)
+
+    def test_deduplicated(self):
+        """The same text is stored once, from a file or from lines"""
+
+        from_file = artifacts.store_file(self.log, self.store)
+        from_lines = artifacts.store_lines(LOG_LINES, self.store, "xds_correct")
+        self.assertEqual(from_file["artifact"], from_lines["artifact"])
+        self.assertEqual(os.listdir(self.store), [os.path.basename(from_file["path"])])
+
+    def test_find_references(self):
+        """References are found anywhere in a result"""
+
+        reference = artifacts.store_lines(LOG_LINES, self.store, "aimless")
+        result = {"results":{"logs":{"aimless":reference}, "plots":[{"x":[1, 2]}]},
+                  "delta":{"set":{"results.logs.pointless":reference}}}
+        self.assertEqual(len(list(artifacts.find_references(result))), 2)
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,111 @@
+"""Tests for utils.cell_index"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-11"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+import utils.cell_index as cell_index
+
+CRYSTAL_IDX = """ Crystallographic data from PDB entries
+IDCODE     A          B         C        ALPHA   BETA   GAMMA   SPACE GROUP  Z
+------     ---------  --------  -------  ------  -----  ------  -----------  --
+1LYZ      79.100   79.100   37.900  90.00  90.00  90.00 P 43 21 2     8
+2ABC      40.000   60.000   80.000  90.00  90.00  90.00 P 21 21 21    4
+3NMR       1.000    1.000    1.000  90.00  90.00  90.00 P 1           1
+4BIG     200.000  210.000  220.000  90.00  90.00  90.00 P 21 21 21    4
+"""
+
+ENTRIES_IDX = """IDCODE\tHEADER\tACCESSION DATE\tCOMPOUND\tSOURCE
+------\t------\t--------------\t--------\t------
+1LYZ\tHYDROLASE\t01/01/75\tLYSOZYME\tGALLUS GALLUS
+2ABC\tTRANSFERASE\t01/01/90\tSOME KINASE\tHOMO SAPIENS
+"""
+
+class TestCellIndex(unittest.TestCase):
+    """Tests for building and searching the index"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.crystal_idx = os.path.join(self.directory, "crystal.idx")
+        self.entries_idx = os.path.join(self.directory, "entries.idx")
+        with open(self.crystal_idx, "w") as index_file:
+            index_file.write(CRYSTAL_IDX)
+        with open(self.entries_idx, "w") as index_file:
+            index_file.write(ENTRIES_IDX)
+        self.index = cell_index.CellIndex.build(self.crystal_idx,
+                                                self.entries_idx,
+                                                reduce_cells=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_build(self):
+        """Entries without a crystal are left out"""
+
+        self.assertEqual(list(self.index.codes), ["1LYZ", "2ABC", "4BIG"])
+        self.assertEqual(list(self.index.spacegroups), ["P 43 21 2", "P 21 21 21", "P 21 21 21"])
+        self.assertEqual(list(self.index.descriptions), ["LYSOZYME", "SOME KINASE", ""])
+
+    def test_permuted(self):
+        """A cell is found whatever the order of its axes"""
+
+        hits = self.index.nearest((80.0, 40.0, 60.0, 90.0, 90.0, 90.0))
+        self.assertEqual(self.index.codes[hits[0][0]], "2ABC")
+        self.assertAlmostEqual(hits[0][1], 0.0, 6)
+
+    def test_ranked(self):
+        """Hits are closest first, within the distance and limit"""
+
+        cell = (40.4, 60.6, 80.8, 90.0, 90.0, 90.0)
+        hits = self.index.cell_search(cell)
+        self.assertEqual(hits.keys(), ["2ABC"])
+        self.assertAlmostEqual(hits["2ABC"]["cell_distance"], 0.02, 2)
+        self.assertEqual(hits["2ABC"]["description"], "SOME KINASE")
+        self.assertEqual(self.index.cell_search(cell, max_distance=0.01), {})
+
+        hits = self.index.nearest((78.0, 80.0, 40.0, 90.0, 90.0, 90.0), max_distance=1.0)
+        self.assertEqual([self.index.codes[position] for position, __ in hits], ["1LYZ", "2ABC"])
+        self.assertEqual(len(self.index.nearest((78.0, 80.0, 40.0, 90.0, 90.0, 90.0),
+                                                limit=1,
+                                                max_distance=1.0)), 1)
+
+    def test_save_load(self):
+        """An index is the same saved and loaded"""
+
+        path = os.path.join(self.directory, "cells.npz")
+        self.index.save(path)
+        loaded = cell_index.get_cell_index(path)
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(list(loaded.codes), list(self.index.codes))
+        self.assertIs(cell_index.get_cell_index(path), loaded)
+        self.assertFalse(cell_index.get_cell_index(os.path.join(self.directory, "none.npz")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Tests for utils.codec"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-03"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import datetime
+import unittest
+
+from bson.objectid import ObjectId
+
+# RAPD imports
+import utils.codec as codec
+
+def make_message():
+    """Return a message with the bson types RAPD sends"""
+    return {"process":{"result_id":ObjectId(), "status":50},
+            "timestamp":datetime.datetime(2018, 7, 3, 12, 30, 15, 123000),
+            "results":{"logs":{"aimless":["line 1\n", "line 2\n"]},
+                       "summary":{"completeness":[99.9, 99.8]},
+                       "sg":{"$rapd":"not extended json", "a":1, "b":2, "c":3}}}
+
+class TestCodec(unittest.TestCase):
+    """The codec reads and writes what the legacy json did"""
+
+    def test_legacy_compatible(self):
+        """Each side reads what the other writes"""
+
+        message = make_message()
+        self.assertEqual(codec.loads(codec.legacy_dumps(message)),
+                         codec.legacy_loads(codec.legacy_dumps(message)))
+        self.assertEqual(codec.legacy_loads(codec.dumps(message)),
+                         codec.loads(codec.legacy_dumps(message)))
+
+    def test_round_trip(self):
+        """ObjectIds and datetimes come back"""
+
+        message = make_message()
+        decoded = codec.loads(codec.dumps(message))
+        self.assertEqual(decoded["process"]["result_id"], message["process"]["result_id"])
+        self.assertEqual(decoded["timestamp"].replace(tzinfo=None), message["timestamp"])
+        self.assertEqual(decoded["results"]["sg"], message["results"]["sg"])
+
+    def test_wire_formats(self):
+        """Every wire format unpacks to the same message"""
+
+        message = make_message()
+        expected = codec.loads(codec.dumps(message))
+        for wire_format in ("json", "bson", "msgpack"):
+            packed = codec.pack(message, wire_format=wire_format)
+            self.assertEqual(codec.unpack(packed), expected, wire_format)
+
+    def test_pack_falls_back(self):
+        """Messages bson cannot hold are sent as JSON"""
+
+        message = {1:"integer key"}
+        packed = codec.pack(message, wire_format="bson")
+        self.assertEqual(packed, codec.dumps(message))
+        self.assertEqual(codec.unpack(packed), {"1":"integer key"})
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -31,15 +31,17 @@ import argparse
 # import json
 # import logging
 # import multiprocessing
-# import os
+import os
 # import pprint
 # import pymongo
 # import re
 # import redis
-# import shutil
+import shutil
+import stat
 import subprocess
 # import sys
-# import time
+import tempfile
+import time
 import unittest
 
 # RAPD imports
@@ -96,6 +98,149 @@ class TestDependencies(unittest.TestCase):
 
         assert found == True
 
+# Stands in for eiger2cbf - writes empty CBF files for the frames asked for
+FAKE_EIGER2CBF = """#!/bin/sh
+case "$2" in
+    *:*)
+        i=${2%:*}
+        while [ $i -le ${2#*:} ]; do
+            touch "$(printf '%s%06d.cbf' "$3" $i)"
+            i=$((i+1))
+        done;;
+    *)
+        touch "$3";;
+esac
+"""
+
+class TestScheduler(unittest.TestCase):
+    """Test splitting and converting ranges of frames in chunks"""
+
+    def setUp(self):
+        """Put a fake eiger2cbf on the PATH"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        executable = os.path.join(self.tmp_dir, "eiger2cbf")
+        with open(executable, "w") as script:
+            script.write(FAKE_EIGER2CBF)
+        os.chmod(executable, stat.S_IRWXU)
+        self.path = os.environ.get("PATH", "")
+        os.environ["PATH"] = self.tmp_dir + os.pathsep + self.path
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.tmp_dir)
+
+    def make_converter(self, nproc, chunk_size=False, callback=False):
+        """Return a converter writing to the temporary directory"""
+
+        return convert_hdf5_cbf.hdf5_to_cbf_converter(master_file="/data/thaum1_master.h5",
+                                                      output_dir=self.tmp_dir,
+                                                      prefix="thaum1",
+                                                      image_range="1-100",
+                                                      nproc=nproc,
+                                                      chunk_size=chunk_size,
+                                                      callback=callback)
+
+    def get_bounds(self, chunks):
+        """Return the first and last frame of each chunk"""
+
+        return [(chunk[1], chunk[2]) for chunk in chunks]
+
+    def test_split_remainder(self):
+        """The last chunk takes what is left, from any first frame"""
+
+        converter = self.make_converter(nproc=2, chunk_size=4)
+        chunks = converter.split_range(3, 12)
+        self.assertEqual(self.get_bounds(chunks), [(3, 6), (7, 10), (11, 12)])
+        self.assertEqual(chunks[0][0], "/data/thaum1_master.h5")
+        self.assertEqual(chunks[0][3], os.path.join(self.tmp_dir, "thaum1"))
+
+    def test_split_over_processors(self):
+        """Without a chunk size frames are spread over the processors"""
+
+        converter = self.make_converter(nproc=3)
+        self.assertEqual(self.get_bounds(converter.split_range(1, 100)),
+                         [(1, 34), (35, 68), (69, 100)])
+
+        # No chunk is larger than CHUNK_SIZE
+        converter = self.make_converter(nproc=1)
+        bounds = self.get_bounds(converter.split_range(11, 130))
+        self.assertEqual(bounds[0], (11, 10 + convert_hdf5_cbf.CHUNK_SIZE))
+        self.assertEqual(bounds[-1][1], 130)
+        self.assertTrue(all(end - start < convert_hdf5_cbf.CHUNK_SIZE for start, end in bounds))
+
+        # Fewer frames than processors
+        converter = self.make_converter(nproc=8)
+        self.assertEqual(self.get_bounds(converter.split_range(5, 7)), [(5, 5), (6, 6), (7, 7)])
+
+    def test_convert_ranges(self):
+        """Each chunk goes to the callback, and all frames are output"""
+
+        root = os.path.join(self.tmp_dir, "thaum1")
+        expected = convert_hdf5_cbf.image_names(root, 2, 8) + \
+                   convert_hdf5_cbf.image_names(root, 11, 12)
+
+        for nproc in (1, 2):
+            for image in expected:
+                if os.path.exists(image):
+                    os.remove(image)
+
+            chunks = []
+            converter = self.make_converter(nproc=nproc, chunk_size=3, callback=chunks.append)
+            converter.convert_ranges([(2, 8), (11, 12)])
+
+            self.assertEqual(converter.output_images, expected)
+            self.assertEqual(len(chunks), 4)
+            self.assertEqual(sorted(sum(chunks, [])), expected)
+
+class TestAvailableImages(unittest.TestCase):
+    """Test counting the frames written during a collection"""
+
+    def setUp(self):
+        """Set up the test fixture"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.master_file = os.path.join(self.tmp_dir, "thaum1_master.h5")
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        shutil.rmtree(self.tmp_dir)
+
+    def write_data_file(self, index, age=60):
+        """Write a data file last changed age seconds ago"""
+
+        data_file = os.path.join(self.tmp_dir, "thaum1_data_%06d.h5" % index)
+        with open(data_file, "w") as output:
+            output.write("data")
+        then = time.time() - age
+        os.utime(data_file, (then, then))
+
+    def test_count(self):
+        """Frames are counted over the data files in sequence"""
+
+        self.assertEqual(convert_hdf5_cbf.count_available_images(self.master_file, 100), 0)
+        for index in (1, 2, 3):
+            self.write_data_file(index)
+        self.assertEqual(convert_hdf5_cbf.count_available_images(self.master_file, 100), 300)
+
+        # A gap ends the count
+        self.write_data_file(5)
+        self.assertEqual(convert_hdf5_cbf.count_available_images(self.master_file, 100), 300)
+
+    def test_newest_settles(self):
+        """The newest data file counts only once it has stopped changing"""
+
+        self.write_data_file(1)
+        self.write_data_file(2, age=0)
+        self.assertEqual(convert_hdf5_cbf.count_available_images(self.master_file, 100), 100)
+
+        # A file followed by another has been written
+        self.write_data_file(3, age=0)
+        self.assertEqual(convert_hdf5_cbf.count_available_images(self.master_file, 100), 200)
+
 def get_commandline():
     """
     Grabs the commandline
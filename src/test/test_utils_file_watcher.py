@@ -0,0 +1,105 @@
+"""Tests for utils.file_watcher"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-27"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# RAPD imports
+import utils.file_watcher as file_watcher
+
+class TestFileWatcher(unittest.TestCase):
+    """Test waiting for files"""
+
+    def setUp(self):
+        """Set up the test fixture"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmp_dir, "thaum1_1_000010.cbf")
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        shutil.rmtree(self.tmp_dir)
+
+    def write_image(self):
+        with open(self.image, "w") as image:
+            image.write("image")
+
+    def test_appears(self):
+        """A file written while waiting is found before the recheck"""
+
+        threading.Timer(0.1, self.write_image).start()
+        start = time.time()
+        self.assertTrue(file_watcher.wait_for_file(self.image, 5, recheck_interval=2))
+        if file_watcher.LIBC:
+            self.assertTrue(time.time() - start < 1.0)
+
+    def test_present_and_timeout(self):
+        """Files already there are found, missing ones time out"""
+
+        self.assertFalse(file_watcher.wait_for_file(self.image, 0.2))
+        self.write_image()
+        self.assertTrue(file_watcher.wait_for_file(self.image, 0.2))
+
+class TestFileSystem(unittest.TestCase):
+    """Test telling network file systems apart"""
+
+    def setUp(self):
+        """Write a mounts file"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.mounts_file = os.path.join(self.tmp_dir, "mounts")
+        with open(self.mounts_file, "w") as mounts:
+            mounts.write("/dev/sda1 / ext4 rw 0 0\n"
+                         "server:/data /data nfs4 rw 0 0\n"
+                         "gpfs1 /data/gpfs gpfs rw 0 0\n"
+                         "/dev/sdb1 /datasets ext4 rw 0 0\n")
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_mounts(self):
+        """The longest mount point holding a path gives its file system"""
+
+        for path, file_system in (("/home/user", "ext4"),
+                                  ("/data", "nfs4"),
+                                  ("/data/images/run1", "nfs4"),
+                                  ("/data/gpfs/run1", "gpfs"),
+                                  ("/datasets/run1", "ext4")):
+            self.assertEqual(file_watcher.get_file_system(path, self.mounts_file), file_system)
+        self.assertTrue(file_watcher.is_network_file_system("/data/gpfs/run1", self.mounts_file))
+        self.assertFalse(file_watcher.is_network_file_system("/datasets/run1", self.mounts_file))
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
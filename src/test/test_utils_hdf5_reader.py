@@ -0,0 +1,110 @@
+"""Tests for utils.hdf5_reader"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-20"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+import utils.hdf5_reader as hdf5_reader
+
+def write_master_file(file_name):
+    """Write a small NeXus master file with its data linked to a missing file"""
+
+    h5py = hdf5_reader.h5py
+    with h5py.File(file_name, "w") as h5_file:
+        detector = h5_file.create_group("/entry/instrument/detector")
+        detector["x_pixel_size"] = 7.5e-05
+        detector["detector_distance"] = 0.2
+        detector["detectorSpecific/nimages"] = 900
+        detector["detectorSpecific/x_pixels_in_detector"] = 4150
+        h5_file["/entry/instrument/beam/incident_wavelength"] = 0.979
+        h5_file["/entry/sample/goniometer/omega_range_average"] = 0.2
+
+        # Found in an earlier group - the later one is not used
+        h5_file["/entry/instrument/monochromator/detector_distance"] = 0.5
+
+        # The data file is not written - reading the header must not need it
+        h5_file["/entry/data/data_000001"] = h5py.ExternalLink("thaum1_data_000001.h5",
+                                                               "/entry/data/data")
+
+@unittest.skipIf(not hdf5_reader.h5py, "h5py is not installed")
+class TestReadHeader(unittest.TestCase):
+    """Test the targeted header lookup"""
+
+    def setUp(self):
+        """Write the master file"""
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.master_file = os.path.join(self.tmp_dir, "thaum1_master.h5")
+        write_master_file(self.master_file)
+
+    def tearDown(self):
+        """Tear down the test fixture"""
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_groups(self):
+        """Items are found across the NeXus groups, in HEADER_GROUPS order"""
+
+        header = hdf5_reader.read_header(self.master_file,
+                                         ("x_pixel_size",
+                                          "nimages",
+                                          "x_pixels_in_detector",
+                                          "incident_wavelength",
+                                          "omega_range_average",
+                                          "detector_distance"))
+        self.assertAlmostEqual(header["x_pixel_size"], 7.5e-05)
+        self.assertEqual(header["nimages"], 900)
+        self.assertEqual(header["x_pixels_in_detector"], 4150)
+        self.assertAlmostEqual(header["incident_wavelength"], 0.979)
+        self.assertAlmostEqual(header["omega_range_average"], 0.2)
+        self.assertAlmostEqual(header["detector_distance"], 0.2)
+
+    def test_missing(self):
+        """Items that are not there are left out, groups are not returned"""
+
+        header = hdf5_reader.read_header(self.master_file, ("count_time", "detectorSpecific"))
+        self.assertEqual(header, {})
+
+class TestXdsInput(unittest.TestCase):
+    """Test the XDS keywords for reading HDF5 directly"""
+
+    def test_lines(self):
+        """The keywords make the XDS.INP lines the integrate plugin writes"""
+
+        keywords = hdf5_reader.xds_input("thaum1_master.h5", "/opt/xds/dectris-neggia.so")
+        lines = ["%s%s" % ("=".join(keyword), "\n") for keyword in keywords]
+        self.assertEqual(lines,
+                         ["NAME_TEMPLATE_OF_DATA_FRAMES=%s\n" % \
+                          os.path.join(os.getcwd(), "thaum1_master.h5"),
+                          "LIB=/opt/xds/dectris-neggia.so\n"])
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,88 @@
+"""Tests for retrying jobs in utils.launch_tools"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-18"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import fnmatch
+import unittest
+
+# RAPD imports
+import utils.launch_tools as launch_tools
+
+class TestRetry(unittest.TestCase):
+    """Tests for get_retry"""
+
+    def test_attempts(self):
+        """A job is retried until it has failed max_attempts times"""
+        message = {"command":"INDEX"}
+        first = launch_tools.get_retry(message, 3)
+        self.assertEqual(first, {"command":"INDEX", "launch_attempts":1})
+        # The original is left alone
+        self.assertEqual(message, {"command":"INDEX"})
+        second = launch_tools.get_retry(first, 3)
+        self.assertEqual(second["launch_attempts"], 2)
+        self.assertFalse(launch_tools.get_retry(second, 3))
+
+    def test_no_retries(self):
+        """With one attempt a failed job is dropped"""
+        self.assertFalse(launch_tools.get_retry({"command":"INDEX"}, 1))
+
+class FakeRedis(object):
+    """The list calls of database.redis_adapter the recovery makes"""
+
+    def __init__(self, lists):
+        self.lists = lists
+
+    def keys(self, template):
+        return [key for key in self.lists if fnmatch.fnmatch(key, template)]
+
+    def rpoplpush_all(self, list1, list2):
+        moved = self.lists.pop(list1, [])
+        self.lists[list2] = moved + self.lists.get(list2, [])
+        return len(moved)
+
+class TestRecover(unittest.TestCase):
+    """Tests for recovering jobs taken but not launched"""
+
+    def setUp(self):
+        self.redis = FakeRedis({
+            launch_tools.get_processing_list("JOBS", "10.0.0.1_"):["a"],
+            launch_tools.get_processing_list("JOBS", "10.0.0.2_"):["b"],
+            launch_tools.get_processing_list("OTHER_JOBS", "10.0.0.3_"):["c"]})
+
+    def test_own(self):
+        """A launcher recovers its own jobs, not those of others on the job list"""
+        self.assertEqual(launch_tools.recover_jobs(self.redis, "JOBS", "10.0.0.1_"), 1)
+        self.assertEqual(self.redis.lists["JOBS"], ["a"])
+        self.assertEqual(self.redis.lists["JOBS:processing:10.0.0.2_"], ["b"])
+
+    def test_all(self):
+        """Every launcher's jobs of a job list are recovered"""
+        self.assertEqual(launch_tools.recover_all_jobs(self.redis, "JOBS", "RAPD_JOBS"), 2)
+        self.assertEqual(sorted(self.redis.lists["RAPD_JOBS"]), ["a", "b"])
+        self.assertEqual(self.redis.lists["OTHER_JOBS:processing:10.0.0.3_"], ["c"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""Tests for utils.model_cache"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-13"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+import utils.model_cache as model_cache
+
+class TestMatthews(unittest.TestCase):
+    """Tests for matthews"""
+
+    def test_models(self):
+        """Each model gets the number of molecules closest to the solvent content"""
+        # Vm of one 11000 Da molecule is 5.47
+        volume = 4 * 11000 * 5.47
+        nmol, solvent = model_cache.matthews([11000, 22000, 0, 10**7], volume, 4)
+        self.assertEqual(list(nmol), [2, 1, 1, 1])
+        self.assertAlmostEqual(solvent[0], 0.55)
+        self.assertAlmostEqual(solvent[1], 0.55)
+        self.assertEqual(solvent[2], 0)
+        # Too big to fit
+        self.assertLess(solvent[3], 0)
+
+class TestModelCache(unittest.TestCase):
+    """Tests for ModelCache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = model_cache.ModelCache(os.path.join(self.directory, "cache"))
+        self.struct_file = os.path.join(self.directory, "1abc.cif")
+        with open(self.struct_file, "w") as struct_file:
+            struct_file.write("data_1ABC\n")
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def analyze(self, struct_file, directory):
+        """Split the model into one chain"""
+        self.calls += 1
+        shutil.copyfile(struct_file, os.path.join(directory, "A.cif"))
+        return {"spacegroup":"P1", "chains":[{"id":"A", "np":10, "na":0, "file":"A.cif"}]}
+
+    def test_get(self):
+        """Models are analyzed once, also under another name"""
+        self.assertFalse(self.cache.lookup(self.struct_file))
+        analysis = self.cache.get(self.struct_file, self.analyze)
+        self.assertEqual(analysis["spacegroup"], "P1")
+
+        copy = os.path.join(self.directory, "model.cif")
+        shutil.copyfile(self.struct_file, copy)
+        self.assertEqual(self.cache.get(copy, self.analyze), analysis)
+        self.assertEqual(self.calls, 1)
+
+        chain_file = os.path.join(self.directory, "model_A.cif")
+        self.cache.copy_file(copy, "A.cif", chain_file)
+        with open(chain_file, "r") as input_file:
+            self.assertEqual(input_file.read(), "data_1ABC\n")
+
+    def test_failed(self):
+        """A failed analysis leaves nothing in the cache"""
+        def analyze(struct_file, directory):
+            raise RuntimeError("Bad model")
+        self.assertRaises(RuntimeError, self.cache.get, self.struct_file, analyze)
+        self.assertEqual([name for name in os.listdir(self.cache.directory) \
+                          if not name.endswith(".lock")], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""Tests for utils.result_delta"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-29"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import copy
+import unittest
+
+# RAPD imports
+import utils.result_delta as result_delta
+
+def make_results(status=1):
+    """Return a plugin results dict"""
+    return {"process":{"result_id":"abc", "status":status},
+            "plugin":{"type":"INTEGRATE"},
+            "preferences":{"xdsinp":[1, 2, 3]},
+            "results":{"archive_files":[],
+                       "data_produced":[],
+                       "logs":{"xds_integrate":["line 1"]},
+                       "summary":{"completeness":50.0}}}
+
+class TestResultSender(unittest.TestCase):
+    """Plugins send deltas between snapshots"""
+
+    def setUp(self):
+        """Set up the test fixture"""
+
+        self.sender = result_delta.ResultSender()
+        self.results = make_results()
+
+    def test_first_is_snapshot(self):
+        """The first message is the whole result"""
+
+        message = self.sender.prepare(self.results)
+        self.assertFalse(result_delta.is_delta(message))
+        self.assertEqual(message["sequence"], 1)
+        self.assertEqual(message["results"], self.results["results"])
+
+    def test_delta(self):
+        """Only changed paths are sent"""
+
+        self.sender.prepare(self.results)
+        self.results["results"]["summary"]["completeness"] = 99.0
+        self.results["results"]["logs"]["aimless"] = ["aimless"]
+        message = self.sender.prepare(self.results)
+        self.assertTrue(result_delta.is_delta(message))
+        self.assertEqual(message["delta"]["base"], 1)
+        self.assertEqual(message["delta"]["sequence"], 2)
+        self.assertEqual(message["delta"]["set"],
+                         {"results.summary.completeness":99.0,
+                          "results.logs.aimless":["aimless"]})
+        self.assertEqual(message["process"], self.results["process"])
+
+        # Nothing changed since
+        message = self.sender.prepare(self.results)
+        self.assertEqual(message["delta"]["set"], {})
+
+    def test_snapshot_on_transition(self):
+        """A change of status or files sends the whole result"""
+
+        self.sender.prepare(self.results)
+        self.results["process"]["status"] = 99
+        self.assertFalse(result_delta.is_delta(self.sender.prepare(self.results)))
+        self.results["results"]["archive_files"].append({"path":"/tmp/a.tar.bz2"})
+        self.assertFalse(result_delta.is_delta(self.sender.prepare(self.results)))
+
+    def test_periodic_snapshot(self):
+        """A snapshot follows every snapshot_interval deltas"""
+
+        sender = result_delta.ResultSender(snapshot_interval=2)
+        kinds = []
+        for completeness in (50.0, 60.0, 70.0, 80.0, 90.0, 95.0):
+            self.results["results"]["summary"]["completeness"] = completeness
+            kinds.append(result_delta.is_delta(sender.prepare(self.results)))
+        self.assertEqual(kinds, [False, True, True, False, True, True])
+
+    def test_applied_deltas_match(self):
+        """Applying the messages gives the plugin's results"""
+
+        document = copy.deepcopy(self.sender.prepare(self.results))
+        for completeness in (60.0, 70.0):
+            self.results["results"]["summary"]["completeness"] = completeness
+            self.results["results"]["logs"]["xds_integrate"].append(str(completeness))
+            self.results.pop("preferences", None)
+            result_delta.apply_delta(document, self.sender.prepare(self.results))
+        del document["sequence"]
+        self.assertEqual(document, self.results)
+
+class TestCoalesce(unittest.TestCase):
+    """Waiting messages fold together"""
+
+    def make_delta(self, base, set_paths, unset_paths=()):
+        return {"process":{"result_id":"abc", "status":1},
+                "plugin":{"type":"INTEGRATE"},
+                "delta":{"sequence":base+1,
+                         "base":base,
+                         "set":set_paths,
+                         "unset":list(unset_paths)}}
+
+    def test_merge_deltas(self):
+        """Merged paths stay apart and keep the later values"""
+
+        older = self.make_delta(1, {"results.logs":{"a":1}, "results.x":1}, ["results.y"])
+        newer = self.make_delta(2, {"results.logs.b":2, "results.y.z":3}, ["results.x"])
+        merged = result_delta.merge_deltas(older, newer)
+        self.assertEqual(merged["delta"]["base"], 1)
+        self.assertEqual(merged["delta"]["sequence"], 3)
+        self.assertEqual(merged["delta"]["set"],
+                         {"results.logs":{"a":1, "b":2}, "results.y":{"z":3}})
+        self.assertEqual(merged["delta"]["unset"], ["results.x"])
+
+    def test_merge_matches_sequential(self):
+        """A merged delta has the effect of both in turn"""
+
+        document = make_results()
+        document["sequence"] = 1
+        older = self.make_delta(1, {"results.summary":{"completeness":60.0}},
+                                ["preferences"])
+        newer = self.make_delta(2, {"results.summary.completeness":70.0,
+                                    "preferences.xdsinp":[4]})
+
+        sequential = copy.deepcopy(document)
+        result_delta.apply_delta(sequential, older)
+        result_delta.apply_delta(sequential, newer)
+
+        merged = copy.deepcopy(document)
+        result_delta.apply_delta(merged, result_delta.merge_deltas(older, newer))
+        self.assertEqual(merged, sequential)
+
+    def test_delta_onto_snapshot(self):
+        """A delta folds into a waiting snapshot"""
+
+        snapshot = make_results()
+        snapshot["sequence"] = 1
+        folded = result_delta.coalesce(snapshot, self.make_delta(1, {"results.x":1}))
+        self.assertFalse(result_delta.is_delta(folded))
+        self.assertEqual(folded["results"]["x"], 1)
+        self.assertEqual(folded["sequence"], 2)
+        self.assertFalse("x" in snapshot["results"])
+
+if __name__ == "__main__":
+
+    unittest.main(verbosity=2)
@@ -0,0 +1,143 @@
+"""Tests for utils.structure_cache"""
+
+"""
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-12"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# RAPD imports
+from utils.lock import FileLock
+import utils.structure_cache as structure_cache
+
+CIF = """data_1ABC
+#
+loop_
+_pdbx_audit_revision_history.ordinal
+_pdbx_audit_revision_history.data_content_type
+_pdbx_audit_revision_history.major_revision
+_pdbx_audit_revision_history.minor_revision
+_pdbx_audit_revision_history.revision_date
+1 'Structure model' 1 0 2008-01-01
+2 'Structure model' 1 1 2011-07-13
+3 'Structure model' 2 0 2017-10-04
+#
+"""
+
+SINGLE_REVISION = """data_1ABC
+#
+_pdbx_audit_revision_history.ordinal             1
+_pdbx_audit_revision_history.data_content_type   'Structure model'
+_pdbx_audit_revision_history.major_revision      1
+_pdbx_audit_revision_history.minor_revision      0
+#
+"""
+
+class Fetcher(object):
+    """Returns CIF for any code, counting the calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, pdb_code):
+        self.calls.append(pdb_code)
+        return CIF.replace("1ABC", pdb_code.upper())
+
+class TestRevision(unittest.TestCase):
+    """Tests for get_revision"""
+
+    def test_loop(self):
+        """The latest of a loop of revisions"""
+        self.assertEqual(structure_cache.get_revision(CIF.splitlines()), "2.0")
+
+    def test_single(self):
+        """A single revision"""
+        self.assertEqual(structure_cache.get_revision(SINGLE_REVISION.splitlines()), "1.0")
+
+    def test_none(self):
+        """No revision history"""
+        self.assertEqual(structure_cache.get_revision(["data_1ABC", "#"]), None)
+
+class TestStructureCache(unittest.TestCase):
+    """Tests for StructureCache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = structure_cache.StructureCache(os.path.join(self.directory, "cache"),
+                                                    max_bytes=0)
+        self.fetcher = Fetcher()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get(self):
+        """Files are fetched once, kept compressed and read uncompressed"""
+        for name in ("first.cif", "second.cif"):
+            destination = os.path.join(self.directory, name)
+            self.assertEqual(self.cache.get("1abc", self.fetcher, destination), destination)
+            with open(destination, "r") as cif_file:
+                self.assertEqual(cif_file.read(), CIF)
+        self.assertEqual(self.fetcher.calls, ["1abc"])
+        path = self.cache.get_path("1ABC")
+        with open(path, "rb") as cache_file:
+            self.assertTrue(cache_file.read().startswith(structure_cache.GZIP_MAGIC))
+        self.assertEqual(self.cache.get_info(path)["revision"], "2.0")
+
+    def test_revision(self):
+        """An entry without the revision wanted is fetched again"""
+        self.cache.fetch("1abc", self.fetcher)
+        self.cache.fetch("1abc", self.fetcher, revision="2.0")
+        self.cache.fetch("1abc", self.fetcher, revision="3.0")
+        self.assertEqual(len(self.fetcher.calls), 2)
+
+    def test_failed(self):
+        """A failed fetch is not cached"""
+        destination = os.path.join(self.directory, "1abc.cif")
+        self.assertFalse(self.cache.get("1abc", lambda pdb_code: False, destination))
+        self.assertFalse(os.path.exists(destination))
+
+    def test_prefetch(self):
+        """Prefetching fetches each code once"""
+        codes = ["1abc", "2abc", "3abc", "1abc"]
+        paths = self.cache.prefetch(codes, self.fetcher, threads=3)
+        self.assertEqual(sorted(paths), ["1abc", "2abc", "3abc"])
+        self.assertTrue(all(os.path.exists(path) for path in paths.values()))
+        self.assertEqual(sorted(self.fetcher.calls), ["1abc", "2abc", "3abc"])
+
+    def test_evict(self):
+        """The least recently used entries go first, unless locked"""
+        for age, pdb_code in enumerate(("1abc", "2abc", "3abc", "4abc")):
+            path = self.cache.fetch(pdb_code, self.fetcher)
+            os.utime(path, (1000 * age, 1000 * age))
+        self.cache.max_bytes = 2 * os.path.getsize(path)
+        with FileLock(self.cache.get_path("1abc") + ".lock"):
+            removed = self.cache.evict()
+        self.assertEqual(removed, [self.cache.get_path("2abc"), self.cache.get_path("3abc")])
+        self.assertTrue(os.path.exists(self.cache.get_path("1abc")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,18 @@
 import { Component,
          Input,
+         OnChanges,
          OnInit } from '@angular/core';
 
+import { RestService } from '../../services/rest.service';
+
 @Component({
   selector: 'app-log-card',
   templateUrl: './log-card.component.html',
   styleUrls: ['./log-card.component.css']
 })
-export class LogCardComponent implements OnInit {
+export class LogCardComponent implements OnInit, OnChanges {
 
+  // The lines of the log, or a reference to it in the artifact store
   @Input()
   log: any = [];
 
@@ -17,18 +21,45 @@ export class LogCardComponent implements OnInit {
 
   log_collapsed: boolean = true;
 
-  constructor() { }
+  // The lines shown - fetched when a referenced log is first expanded
+  lines: any = [];
+
+  constructor(private restService: RestService) { }
 
   ngOnInit() {
 
   }
 
+  ngOnChanges() {
+    if (this.log && this.log.artifact) {
+      this.lines = [];
+      if (! this.log_collapsed) {
+        this.fetchLog();
+      }
+    } else {
+      this.lines = this.log;
+    }
+  }
+
+  fetchLog() {
+    const artifact = this.log.artifact;
+    this.restService.getArtifact(artifact).subscribe(text => {
+      // Still the log asked for
+      if (this.log && this.log.artifact === artifact && typeof text === 'string') {
+        this.lines = text.split('\n');
+      }
+    });
+  }
+
   toggleCollapse() {
 
     console.log('toggleCollapse', this.log_collapsed);
 
     if (this.log_collapsed) {
       this.log_collapsed = false;
+      if (this.log && this.log.artifact && this.lines.length === 0) {
+        this.fetchLog();
+      }
     } else {
       this.log_collapsed = true;
     }
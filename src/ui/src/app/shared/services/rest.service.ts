@@ -77,20 +77,9 @@ export class RestService {
 
     this.authHttp
       .get(this.globalsService.site.restApiUrl + "/download_by_id/" + id, {
-        responseType: "text",
+        responseType: "blob",
       })
-      .subscribe(res => {
-        // Convert base64 string to byte array
-        const byteCharacters = atob(<any>res);
-        const byteNumbers = new Array(byteCharacters.length);
-        for (let i = 0; i < byteCharacters.length; i++) {
-          byteNumbers[i] = byteCharacters.charCodeAt(i);
-        }
-        const byteArray = new Uint8Array(byteNumbers);
-        // Convert byte array to Blob
-        const blob = new Blob([byteArray], {
-          type: "application/octet-stream",
-        });
+      .subscribe(blob => {
         // Create ObjectURL
         const url = window.URL.createObjectURL(blob);
         // Create DOM element with download attribute
@@ -116,20 +105,9 @@ export class RestService {
 
     this.authHttp
       .get(this.globalsService.site.restApiUrl + "/download_by_hash/" + hash, {
-        responseType: "text",
+        responseType: "blob",
       })
-      .subscribe(res => {
-        // Convert base64 string to byte array
-        const byteCharacters = atob(res);
-        const byteNumbers = new Array(byteCharacters.length);
-        for (let i = 0; i < byteCharacters.length; i++) {
-          byteNumbers[i] = byteCharacters.charCodeAt(i);
-        }
-        const byteArray = new Uint8Array(byteNumbers);
-        // Convert byte array to Blob
-        const blob = new Blob([byteArray], {
-          type: "application/octet-stream",
-        });
+      .subscribe(blob => {
         // Create ObjectURL
         const url = window.URL.createObjectURL(blob);
         // Create DOM element with download attribute
@@ -147,6 +125,15 @@ export class RestService {
       });
   }
 
+  // Get the text of a log or other artifact by its hash
+  public getArtifact(hash: string): Observable<any> {
+    return this.authHttp
+      .get(this.globalsService.site.restApiUrl + "/artifact/" + hash, {
+        responseType: "text",
+      })
+      .catch(error => this.handleError(error));
+  }
+
   //
   // UglyMol Methods
   //
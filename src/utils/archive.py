@@ -181,9 +181,17 @@ def create_manifest(directory, write=True):
     # Return the dict
     return records
 
-def get_hash(filename):
-    """Returns a hash for a file"""
-    return hashlib.sha1(open(filename, "r").read()).hexdigest()
+def get_hash(filename, block_size=1048576):
+    """Returns a hash for a file, read a block at a time"""
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as input_file:
+        for block in iter(lambda: input_file.read(block_size), ""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def get_data_hash(data):
+    """Returns a hash for a string, the same as get_hash for a file of it"""
+    return hashlib.sha1(data).hexdigest()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+"""
+Content-addressed store for logs and other large text produced by plugins -
+results carry a small reference, and the text is fetched when it is wanted
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-02"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import errno
+import gzip
+import io
+import os
+import shutil
+import tempfile
+
+# RAPD imports
+import utils.archive as archive
+
+# Marks a dict as a reference to an artifact
+ARTIFACT_KEY = "artifact"
+
+# How artifacts are compressed
+COMPRESSION = "gzip"
+
+# The file_type of artifacts in the database
+FILE_TYPE = "artifact"
+
+def artifact_path(directory, artifact_hash):
+    """Return where the artifact with artifact_hash lives in directory"""
+
+    return os.path.join(directory, "%s.gz" % artifact_hash)
+
+def make_reference(artifact_hash, path, description, size, lines):
+    """Return the reference to an artifact that goes in results"""
+
+    return {ARTIFACT_KEY:artifact_hash,
+            "compression":COMPRESSION,
+            "description":description,
+            "path":path,
+            "size":size,
+            "lines":lines}
+
+def write_compressed(source, path):
+    """Write the file object source to path, compressed, as one rename"""
+
+    directory = os.path.dirname(path)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(handle)
+    try:
+        with gzip.open(temp_path, "wb") as output_file:
+            shutil.copyfileobj(source, output_file)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+def make_directory(directory):
+    """Make the artifact directory, which other processes may be making too"""
+
+    try:
+        os.makedirs(directory)
+    except OSError as error:
+        if error.errno != errno.EEXIST or not os.path.isdir(directory):
+            raise
+
+def store_file(file_name, directory, description=None):
+    """
+    Store file_name in the artifact directory and return the reference. A
+    file already stored is not written again.
+    """
+
+    make_directory(directory)
+
+    artifact_hash = archive.get_hash(file_name)
+    path = artifact_path(directory, artifact_hash)
+
+    lines = 0
+    with open(file_name, "rb") as input_file:
+        for __ in input_file:
+            lines += 1
+        if not os.path.exists(path):
+            input_file.seek(0)
+            write_compressed(input_file, path)
+
+    return make_reference(artifact_hash,
+                          path,
+                          description or os.path.basename(file_name),
+                          os.path.getsize(file_name),
+                          lines)
+
+def store_lines(lines, directory, description):
+    """
+    Store lines, as read by readlines(), in the artifact directory and
+    return the reference
+    """
+
+    make_directory(directory)
+
+    data = "".join(lines)
+    artifact_hash = archive.get_data_hash(data)
+    path = artifact_path(directory, artifact_hash)
+
+    if not os.path.exists(path):
+        write_compressed(io.BytesIO(data), path)
+
+    return make_reference(artifact_hash, path, description, len(data), len(lines))
+
+def is_reference(value):
+    """Return True if value is a reference to an artifact"""
+
+    return isinstance(value, dict) and ARTIFACT_KEY in value
+
+def find_references(value):
+    """Generate the artifact references anywhere in value"""
+
+    if is_reference(value):
+        yield value
+    elif isinstance(value, dict):
+        for sub_value in value.itervalues():
+            for reference in find_references(sub_value):
+                yield reference
+    elif isinstance(value, list):
+        for sub_value in value:
+            for reference in find_references(sub_value):
+                yield reference
+
+def read_lines(source):
+    """Return the lines of a compressed artifact, from a path or file object"""
+
+    if isinstance(source, basestring):
+        with gzip.open(source, "rb") as input_file:
+            return input_file.readlines()
+    return gzip.GzipFile(fileobj=source, mode="rb").readlines()
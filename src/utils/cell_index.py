@@ -0,0 +1,349 @@
+"""
+A local index of the unit cells in the PDB, for finding structures with a
+cell like that of a data set without asking a PDB server
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-11"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import argparse
+import itertools
+import logging
+import os
+import time
+
+import numpy
+
+try:
+    from cctbx import uctbx
+except ImportError:
+    uctbx = False
+
+# RAPD imports
+import utils.global_vars as rglobals
+
+# Orders of the axes of a cell - each angle goes with the axis it is opposite
+PERMUTATIONS = numpy.array([list(axes) + [axis + 3 for axis in axes] \
+                            for axes in itertools.permutations(range(3))])
+
+# Default distance for a cell to be similar. A cell scaled by 1+x is about
+# 2x away, so 0.25 is close to the widest window pdbquery searched
+# remotely - 25 widenings of 1%.
+MAX_DISTANCE = 0.25
+
+# Placeholder cells given for entries not from crystals
+PLACEHOLDER_CELL = (1.0, 1.0, 1.0, 90.0, 90.0, 90.0)
+
+# Loaded indexes by path, with the modification time they were loaded at
+_INDEXES = {}
+
+def g6(cells):
+    """
+    Return the G6 vectors (a^2, b^2, c^2, 2bc cos(alpha), 2ac cos(beta),
+    2ab cos(gamma)) of an N x 6 array of cells
+    """
+
+    cells = numpy.asarray(cells, dtype=numpy.float64).reshape(-1, 6)
+    a, b, c = cells[:, 0], cells[:, 1], cells[:, 2]
+    cosines = numpy.cos(numpy.radians(cells[:, 3:]))
+    return numpy.column_stack((a*a,
+                               b*b,
+                               c*c,
+                               2*b*c*cosines[:, 0],
+                               2*a*c*cosines[:, 1],
+                               2*a*b*cosines[:, 2]))
+
+def reduce_cell(cell):
+    """Return the Niggli reduced cell of cell, or cell if cctbx is not there"""
+
+    if not uctbx:
+        return tuple(cell)
+    try:
+        return uctbx.unit_cell(tuple(cell)).niggli_cell().parameters()
+    except RuntimeError:
+        return tuple(cell)
+
+def parse_crystal_idx(crystal_idx):
+    """
+    Return lists of codes, cells and spacegroups from crystal.idx in the
+    derived data of a PDB mirror
+    """
+
+    codes, cells, spacegroups = [], [], []
+    with open(crystal_idx, "r") as index_file:
+        for line in index_file:
+            fields = line.split()
+            if len(fields) < 9 or len(fields[0]) != 4:
+                continue
+            try:
+                cell = tuple(float(field) for field in fields[1:7])
+            except ValueError:
+                continue
+            if cell == PLACEHOLDER_CELL or min(cell) <= 0:
+                continue
+            codes.append(fields[0].upper())
+            cells.append(cell)
+            spacegroups.append(" ".join(fields[7:-1]))
+    return codes, cells, spacegroups
+
+def parse_entries_idx(entries_idx):
+    """Return a dict of the compound of each code in entries.idx of a PDB mirror"""
+
+    descriptions = {}
+    with open(entries_idx, "r") as index_file:
+        for line in index_file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4 or len(fields[0]) != 4:
+                continue
+            descriptions[fields[0].upper()] = fields[3].strip()
+    return descriptions
+
+class CellIndex(object):
+    """
+    The cells of PDB entries in NumPy arrays, with their spacegroup and
+    description. Cells are Niggli reduced when the index is built with
+    cctbx, and searches compare every order of the axes at once.
+    """
+
+    def __init__(self, codes, cells, spacegroups, descriptions, reduced=False):
+        """
+        Keyword arguments
+        codes -- PDB codes
+        cells -- N x 6 cells
+        spacegroups -- spacegroup of each entry
+        descriptions -- description of each entry
+        reduced -- the cells are Niggli reduced
+        """
+
+        self.codes = numpy.asarray(codes)
+        self.cells = numpy.asarray(cells, dtype=numpy.float32).reshape(-1, 6)
+        self.spacegroups = numpy.asarray(spacegroups)
+        self.descriptions = numpy.asarray(descriptions)
+        self.reduced = bool(reduced)
+        self.g6 = g6(self.cells)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, crystal_idx, entries_idx=None, reduce_cells=True, logger=None):
+        """Return a CellIndex of the entries in crystal.idx and entries.idx"""
+
+        logger = logger or logging.getLogger("RAPDLogger")
+
+        codes, cells, spacegroups = parse_crystal_idx(crystal_idx)
+        descriptions = {}
+        if entries_idx:
+            descriptions = parse_entries_idx(entries_idx)
+
+        reduced = bool(reduce_cells and uctbx)
+        if reduced:
+            cells = [reduce_cell(cell) for cell in cells]
+        logger.info("Indexed %d cells from %s%s",
+                    len(codes),
+                    crystal_idx,
+                    " (Niggli reduced)" if reduced else "")
+
+        return cls(codes,
+                   cells,
+                   spacegroups,
+                   [descriptions.get(code, "") for code in codes],
+                   reduced)
+
+    @classmethod
+    def load(cls, path):
+        """Return the CellIndex saved at path"""
+
+        with numpy.load(path) as data:
+            return cls(data["codes"],
+                       data["cells"],
+                       data["spacegroups"],
+                       data["descriptions"],
+                       bool(data["reduced"]))
+
+    def save(self, path):
+        """Save the index to path, replacing any there atomically"""
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = "%s.%d.tmp.npz" % (path, os.getpid())
+        numpy.savez_compressed(temp_path,
+                               codes=self.codes,
+                               cells=self.cells,
+                               spacegroups=self.spacegroups,
+                               descriptions=self.descriptions,
+                               reduced=numpy.array(self.reduced))
+        os.rename(temp_path, path)
+
+    def get_distances(self, cell):
+        """
+        Return the distance of each cell in the index from cell - the
+        distance between G6 vectors relative to that of cell, in the order
+        of its axes that is closest
+        """
+
+        if self.reduced:
+            cell = reduce_cell(cell)
+        queries = g6(numpy.asarray(cell, dtype=numpy.float64)[PERMUTATIONS])
+        distances = None
+        for query in queries:
+            differences = self.g6 - query
+            squared = numpy.einsum("ij,ij->i", differences, differences)
+            if distances is None:
+                distances = squared
+            else:
+                numpy.minimum(distances, squared, out=distances)
+        return numpy.sqrt(distances) / numpy.sqrt(numpy.dot(queries[0], queries[0]))
+
+    def nearest(self, cell, limit=None, max_distance=MAX_DISTANCE):
+        """
+        Return a list of (position, distance) of the entries with a cell
+        within max_distance of cell, closest first, at most limit of them
+        """
+
+        distances = self.get_distances(cell)
+        close = numpy.flatnonzero(distances <= max_distance)
+        close = close[numpy.argsort(distances[close], kind="mergesort")]
+        if limit:
+            close = close[:limit]
+        return [(position, float(distances[position])) for position in close]
+
+    def get_entry(self, position, distance=None):
+        """Return the description of an entry as a PDB repository cell_search does"""
+
+        entry = {"description":str(self.descriptions[position]),
+                 "spacegroup":str(self.spacegroups[position]),
+                 "cell":[round(float(value), 3) for value in self.cells[position]]}
+        if distance is not None:
+            entry["cell_distance"] = round(distance, 4)
+        return entry
+
+    def cell_search(self, cell, limit=None, max_distance=MAX_DISTANCE):
+        """
+        Return a dict of the entries with a cell like cell, as the
+        cell_search of the PDB repositories in plugins.get_cif returns
+        """
+
+        return dict((str(self.codes[position]), self.get_entry(position, distance)) \
+                    for position, distance in self.nearest(cell, limit, max_distance))
+
+def get_cell_index(path=None):
+    """
+    Return the CellIndex at path (default global_vars.CELL_INDEX), or False
+    if there is none. Indexes are kept in memory until their file changes.
+    """
+
+    path = path or getattr(rglobals, "CELL_INDEX", False)
+    if not path or not os.path.exists(path):
+        return False
+
+    mtime = os.path.getmtime(path)
+    if path not in _INDEXES or _INDEXES[path][0] != mtime:
+        _INDEXES[path] = (mtime, CellIndex.load(path))
+    return _INDEXES[path][1]
+
+def get_commandline():
+    """
+    Grabs the commandline
+    """
+
+    # Parse the commandline arguments
+    commandline_description = "Build or query the local index of PDB unit cells"
+    parser = argparse.ArgumentParser(description=commandline_description)
+
+    parser.add_argument("-o", "--output",
+                        action="store",
+                        dest="index",
+                        default=getattr(rglobals, "CELL_INDEX", False),
+                        help="The index file (default %(default)s)")
+
+    parser.add_argument("-b", "--build",
+                        action="store",
+                        dest="crystal_idx",
+                        default=False,
+                        help="Rebuild the index from crystal.idx of a PDB mirror")
+
+    parser.add_argument("-e", "--entries",
+                        action="store",
+                        dest="entries_idx",
+                        default=None,
+                        help="entries.idx of the PDB mirror, for descriptions")
+
+    parser.add_argument("--no-reduce",
+                        action="store_false",
+                        dest="reduce_cells",
+                        help="Do not Niggli reduce the cells")
+
+    parser.add_argument("-l", "--limit",
+                        action="store",
+                        dest="limit",
+                        default=20,
+                        type=int,
+                        help="Most entries to print for a cell")
+
+    parser.add_argument(action="store",
+                        dest="cell",
+                        nargs="*",
+                        type=float,
+                        help="A cell to look up - a b c alpha beta gamma")
+
+    return parser.parse_args()
+
+def main(args):
+    """
+    The main process docstring
+    This function is called when this module is invoked from
+    the commandline
+    """
+
+    if args.crystal_idx:
+        start = time.time()
+        index = CellIndex.build(args.crystal_idx, args.entries_idx, args.reduce_cells)
+        index.save(args.index)
+        print "Saved %d cells to %s in %.1f s" % (len(index), args.index, time.time() - start)
+
+    if args.cell:
+        if len(args.cell) != 6:
+            raise SystemExit("A cell is six numbers - a b c alpha beta gamma")
+        index = get_cell_index(args.index)
+        if not index:
+            raise SystemExit("No cell index at %s" % args.index)
+        start = time.time()
+        hits = index.nearest(args.cell, limit=args.limit)
+        print "%d entries in %.1f ms" % (len(hits), (time.time() - start) * 1000)
+        for position, distance in hits:
+            print "  %s %7.4f  %-12s %s" % (index.codes[position],
+                                            distance,
+                                            index.spacegroups[position],
+                                            index.descriptions[position])
+
+if __name__ == "__main__":
+
+    # Get the commandline args
+    commandline_args = get_commandline()
+
+    # Execute code
+    main(args=commandline_args)
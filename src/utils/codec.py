@@ -0,0 +1,312 @@
+"""
+Encoding of RAPD messages - JSON with the bson extensions for files and the
+web side, and an optional binary framing for Redis lists only RAPD reads
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-03"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import argparse
+import datetime
+import json as system_json
+import os
+import struct
+import time
+
+import bson
+from bson.codec_options import CodecOptions
+from bson import json_util
+from bson.objectid import ObjectId
+from bson.tz_util import utc
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = False
+
+# simplejson is only faster than json with its compiled speedups
+try:
+    from simplejson import _speedups
+except ImportError:
+    _speedups = False
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = False
+
+# Environmental variables choosing the JSON backend ("simplejson" or "json")
+# and the format of internal Redis messages ("json", "bson" or "msgpack")
+BACKEND_VAR = "RAPD_JSON_BACKEND"
+WIRE_FORMAT_VAR = "RAPD_WIRE_FORMAT"
+
+# Binary messages start with a marker, which JSON text never does
+BSON_MARKER = "\x00RB1"
+MSGPACK_MARKER = "\x00RM1"
+
+# msgpack extension types
+MSGPACK_OBJECTID = 1
+MSGPACK_DATETIME = 2
+
+# bson extended JSON documents have at most this many keys ($ref, $id, $db)
+EXTENDED_KEYS = 3
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+# Decode BSON datetimes as json_util does
+BSON_OPTIONS = CodecOptions(tz_aware=True)
+
+def default(obj):
+    """
+    Encode the objects JSON cannot. ObjectIds, most of what RAPD sends, are
+    done here - anything else is left to bson.
+    """
+
+    if isinstance(obj, ObjectId):
+        return {"$oid":str(obj)}
+    return json_util.default(obj)
+
+def object_hook(dct):
+    """
+    Decode bson extended JSON. Only small dicts with a $ key are handed to
+    bson, so ordinary dicts cost a length check.
+    """
+
+    if len(dct) <= EXTENDED_KEYS:
+        for key in dct:
+            if key[:1] == "$":
+                return json_util.object_hook(dct)
+    return dct
+
+def get_backend(name=None):
+    """
+    Return the name of the JSON backend to use - simplejson if it has its
+    compiled speedups or is asked for by name, otherwise json
+    """
+
+    name = name or os.environ.get(BACKEND_VAR)
+    if name == "json" or not simplejson:
+        return "json"
+    if name == "simplejson" or _speedups:
+        return "simplejson"
+    return "json"
+
+def get_wire_format(name=None):
+    """Return the format for internal Redis messages that can be used"""
+
+    name = name or os.environ.get(WIRE_FORMAT_VAR, "json")
+    if name == "msgpack" and not msgpack:
+        return "json"
+    if name not in ("bson", "msgpack"):
+        return "json"
+    return name
+
+BACKEND = get_backend()
+WIRE_FORMAT = get_wire_format()
+
+if BACKEND == "simplejson":
+    def dumps(obj):
+        """Encode obj as JSON"""
+        return simplejson.dumps(obj, default=default, namedtuple_as_object=False)
+
+    def loads(text):
+        """Decode JSON text"""
+        return simplejson.loads(text, object_hook=object_hook)
+
+else:
+    def dumps(obj):
+        """Encode obj as JSON"""
+        return system_json.dumps(obj, default=default)
+
+    def loads(text):
+        """Decode JSON text"""
+        return system_json.loads(text, object_hook=object_hook)
+
+def msgpack_default(obj):
+    """Encode the bson types RAPD messages carry as msgpack extensions"""
+
+    if isinstance(obj, ObjectId):
+        return msgpack.ExtType(MSGPACK_OBJECTID, obj.binary)
+    if isinstance(obj, datetime.datetime):
+        if obj.utcoffset() is not None:
+            obj = obj - obj.utcoffset()
+        millis = int((obj.replace(tzinfo=utc) - EPOCH).total_seconds() * 1000)
+        return msgpack.ExtType(MSGPACK_DATETIME, struct.pack(">q", millis))
+    raise TypeError("Cannot encode %r" % obj)
+
+def msgpack_ext_hook(code, data):
+    """Decode the msgpack extensions of msgpack_default"""
+
+    if code == MSGPACK_OBJECTID:
+        return ObjectId(data)
+    if code == MSGPACK_DATETIME:
+        millis = struct.unpack(">q", data)[0]
+        return EPOCH + datetime.timedelta(milliseconds=millis)
+    return msgpack.ExtType(code, data)
+
+def pack(obj, encoded=None, wire_format=None):
+    """
+    Encode obj for a Redis list only RAPD reads. Falls back to JSON for
+    anything the binary format cannot hold, such as non-string keys.
+
+    Keyword arguments
+    obj -- the message
+    encoded -- obj already encoded as JSON, used if the format is JSON
+    wire_format -- "json", "bson" or "msgpack" (default WIRE_FORMAT)
+    """
+
+    wire_format = wire_format or WIRE_FORMAT
+
+    try:
+        if wire_format == "bson":
+            return BSON_MARKER + bson.BSON.encode(obj)
+        if wire_format == "msgpack":
+            return MSGPACK_MARKER + msgpack.packb(obj,
+                                                  default=msgpack_default,
+                                                  use_bin_type=True)
+    # Whatever the binary encoder does not take
+    except Exception:
+        pass
+
+    if encoded is not None:
+        return encoded
+    return dumps(obj)
+
+def unpack(data):
+    """Decode a message written by pack, in any format"""
+
+    if data.startswith(BSON_MARKER):
+        return bson.BSON(data[len(BSON_MARKER):]).decode(codec_options=BSON_OPTIONS)
+    if data.startswith(MSGPACK_MARKER):
+        return msgpack.unpackb(data[len(MSGPACK_MARKER):],
+                               ext_hook=msgpack_ext_hook,
+                               raw=False)
+    return loads(data)
+
+def legacy_dumps(obj):
+    """The encoding this module replaces, for comparison"""
+
+    return system_json.dumps(obj, default=json_util.default)
+
+def legacy_loads(text):
+    """The decoding this module replaces, for comparison"""
+
+    return system_json.loads(text, object_hook=json_util.object_hook)
+
+def sample_payload(lines=20000):
+    """Return a message like an integration result, with logs and plots"""
+
+    return {
+        "_id":ObjectId(),
+        "command":"INTEGRATE",
+        "process":{"result_id":ObjectId(),
+                   "session_id":ObjectId(),
+                   "status":50,
+                   "type":"plugin"},
+        "plugin":{"data_type":"MX", "type":"INTEGRATE", "id":"bd11", "version":"2.0.0"},
+        "timestamp":datetime.datetime.utcnow(),
+        "results":{
+            "logs":{"xds_correct":[" %6d  %8.3f  %8.3f  %6.1f%%\n" % (i, i*0.01, i*0.02, 99.5) \
+                                   for i in xrange(lines)]},
+            "plots":{"I/sigma, Mean Mn(I)/sd(Mn(I))":{
+                "data":[{"parameters":{"linecolor":"3"},
+                         "series":[{"xs":[i*0.01 for i in xrange(200)],
+                                    "ys":[i*0.1 for i in xrange(200)]}]}]}},
+            "summary":{"completeness":[99.9, 99.8, 100.0],
+                       "isigi":[21.2, 55.1, 2.1],
+                       "rmerge_anom":[0.05, 0.03, 0.6]},
+            },
+        }
+
+def benchmark(payloads, repeats):
+    """Print the time to encode and decode payloads with each codec"""
+
+    codecs = [("legacy json", legacy_dumps, legacy_loads),
+              ("%s (rapd)" % BACKEND, dumps, loads),
+              ("bson wire", lambda obj: pack(obj, wire_format="bson"), unpack)]
+    if msgpack:
+        codecs.append(("msgpack wire", lambda obj: pack(obj, wire_format="msgpack"), unpack))
+
+    for name, payload in payloads:
+        print "\n%s" % name
+        for codec_name, encode, decode in codecs:
+            start = time.time()
+            for __ in xrange(repeats):
+                encoded = encode(payload)
+            encode_time = (time.time() - start) / repeats
+            start = time.time()
+            for __ in xrange(repeats):
+                decode(encoded)
+            decode_time = (time.time() - start) / repeats
+            print "  %-16s %9d bytes  encode %8.2f ms  decode %8.2f ms" % \
+                (codec_name, len(encoded), encode_time*1000, decode_time*1000)
+
+def get_commandline():
+    """
+    Grabs the commandline
+    """
+
+    # Parse the commandline arguments
+    commandline_description = "Benchmark the encoding of RAPD messages"
+    parser = argparse.ArgumentParser(description=commandline_description)
+
+    parser.add_argument("-r", "--repeats",
+                        action="store",
+                        dest="repeats",
+                        default=20,
+                        type=int,
+                        help="Times each payload is encoded and decoded")
+
+    parser.add_argument(action="store",
+                        dest="files",
+                        nargs="*",
+                        help="Command files (.rapd) or result JSON files to use as payloads")
+
+    return parser.parse_args()
+
+def main(args):
+    """
+    The main process docstring
+    This function is called when this module is invoked from
+    the commandline
+    """
+
+    payloads = []
+    for file_name in args.files:
+        with open(file_name, "r") as input_file:
+            payloads.append((file_name, legacy_loads(input_file.read())))
+    if not payloads:
+        payloads.append(("sample integration result", sample_payload()))
+
+    print "JSON backend %s, wire format %s" % (BACKEND, WIRE_FORMAT)
+    benchmark(payloads, args.repeats)
+
+if __name__ == "__main__":
+
+    # Get the commandline args
+    commandline_args = get_commandline()
+
+    # Execute code
+    main(args=commandline_args)
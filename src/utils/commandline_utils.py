@@ -354,9 +354,14 @@ def analyze_data_sources(sources,
                          end_image=False,
                          hdf5_image_range=False,
                          hdf5_wedge_range=False,
-                         timeout=1):
+                         timeout=1,
+                         convert_hdf5=True):
     """
     Return information on files or directory from input
+
+    With convert_hdf5 False, an HDF5 data set to be integrated only has its
+    first and last frames converted to CBF, for their headers - the frames
+    are read from the HDF5 files by XDS.
     """
     # print "analyze_data_sources", sources
 
@@ -451,7 +456,9 @@ def analyze_data_sources(sources,
             #if not start_image:
             #    start_image = 1
             
-            if start_image and end_image:
+            if not convert_hdf5:
+                image_range = '%s,%s'%(start_image or 1, end_image or 'end')
+            elif start_image and end_image:
                 image_range = '%s-%s'%(start_image, end_image)
             elif start_image and not end_image:
                 image_range = '%s-end'%start_image
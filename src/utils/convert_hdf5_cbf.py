@@ -26,17 +26,34 @@ __status__ = "Development"
 
 # Standard imports
 import argparse
-from itertools import groupby
+from itertools import groupby, imap
 import multiprocessing
 from operator import itemgetter
 import os
 import subprocess
 import sys
 import shlex
-# import time
+import time
+
+# h5py is only needed to follow a collection without frames_per_data_file
+try:
+    import h5py
+except ImportError:
+    h5py = None
 
 # RAPD imports
 
+# Largest number of frames handed to one eiger2cbf call by the scheduler
+CHUNK_SIZE = 50
+
+# Seconds between checks for new data files when following a collection
+FOLLOW_INTERVAL = 1.0
+
+# Seconds without a new data file before following a collection gives up
+FOLLOW_TIMEOUT = 120.0
+
+# Seconds a data file must be unchanged to be taken as written
+SETTLE_TIME = 2.0
 
 VERSIONS = {
     "eiger2cbf": ("160415",)
@@ -61,6 +78,72 @@ def run_process(input_args, output=False):
         job = subprocess.Popen(shlex.split(command))
         job.wait()
 
+def image_names(output_root, start, end):
+    """Return the CBF file names eiger2cbf writes for frames start to end"""
+    return ["%s_%06d.cbf" % (output_root, i) for i in range(int(start), int(end)+1)]
+
+def convert_chunk(input_args):
+    """
+    Convert frames start to end with one eiger2cbf call and return the CBF
+    files that were written. Run in the scheduler's pool.
+    """
+
+    master_file, start, end, output_root, verbose = input_args
+
+    if start == end:
+        command = "eiger2cbf %s %d %s_%06d.cbf" % (master_file, start, output_root, start)
+    else:
+        command = "eiger2cbf %s %d:%d %s_" % (master_file, start, end, output_root)
+    run_process((command, verbose))
+
+    return [image for image in image_names(output_root, start, end) if os.path.exists(image)]
+
+def count_frames(data_file):
+    """Return the number of frames in an Eiger data file, or False if it cannot be read yet"""
+
+    if h5py is None:
+        return False
+    try:
+        with h5py.File(data_file, "r") as h5:
+            return h5["entry/data/data"].shape[0]
+    except (IOError, KeyError):
+        return False
+
+def count_available_images(master_file, frames_per_data_file=False):
+    """
+    Return the number of frames at the start of a data set whose data files
+    have been written
+
+    master_file -- master file of the data set
+    frames_per_data_file -- frames in each data file; read from the files
+                            with h5py if False
+    """
+
+    root = master_file.replace("_master.h5", "")
+    available = 0
+    index = 1
+    while True:
+        data_file = "%s_data_%06d.h5" % (root, index)
+        if not os.path.exists(data_file):
+            break
+
+        if frames_per_data_file:
+            # The newest file is only taken once it has stopped changing
+            next_file = "%s_data_%06d.h5" % (root, index + 1)
+            if not os.path.exists(next_file) and \
+               (time.time() - os.path.getmtime(data_file)) < SETTLE_TIME:
+                break
+            frames = frames_per_data_file
+        else:
+            frames = count_frames(data_file)
+            if not frames:
+                break
+
+        available += frames
+        index += 1
+
+    return available
+
 class hdf5_to_cbf_converter(object):
 
     output_images = []
@@ -79,6 +162,10 @@ class hdf5_to_cbf_converter(object):
                  nproc=False,
                  overwrite=False,
                  verbose=False,
+                 chunk_size=False,
+                 callback=False,
+                 follow=False,
+                 frames_per_data_file=False,
                  #logger=False
                  ):
         """
@@ -92,6 +179,10 @@ class hdf5_to_cbf_converter(object):
         wedge_range -- separation in oscillation axis between 2 images
         nproc -- number of processors to use
         overwrite -- overwrite files already present
+        chunk_size -- frames per eiger2cbf call (default spread over nproc, at most CHUNK_SIZE)
+        callback -- called with each list of CBF files as it is finished
+        follow -- convert frames as the data files are written during collection
+        frames_per_data_file -- frames in each data file when following (default read with h5py)
         returns header
         """
 
@@ -112,6 +203,10 @@ class hdf5_to_cbf_converter(object):
             self.user_overwrite = overwrite
             self.overwrite = True
         self.verbose = verbose
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.follow = follow
+        self.frames_per_data_file = frames_per_data_file
         #self.logger = logger
 
         # Clear out output images on init
@@ -121,7 +216,10 @@ class hdf5_to_cbf_converter(object):
         """Coordinates the running of the conversion process"""
 
         self.preprocess()
-        self.process()
+        if self.follow:
+            self.follow_collection()
+        else:
+            self.process()
 
     def preprocess(self):
         """Set up the conversion"""
@@ -143,7 +241,7 @@ class hdf5_to_cbf_converter(object):
 
         # Multiprocessing
         if not self.nproc:
-            self.nproc = multiprocessing.cpu_count() - 1
+            self.nproc = max(1, multiprocessing.cpu_count() - 1)
 
         # Calculate total number of images in dataset
         self.total_nimages = self.get_number_of_images()
@@ -159,10 +257,17 @@ class hdf5_to_cbf_converter(object):
         # Check for already present files
         self.check_for_output_images()
         
-        # Convert images
+        # Convert images - single images have their own handling, the
+        # ranges are scheduled together
+        ranges = []
         for range_to_make in self.ranges_to_make:
-            self.convert_images(start_image=range_to_make[0],
-                                end_image=range_to_make[-1])
+            if range_to_make[0] == range_to_make[-1]:
+                self.convert_images(start_image=range_to_make[0],
+                                    end_image=range_to_make[-1])
+            else:
+                ranges.append((range_to_make[0], range_to_make[-1]))
+        if ranges:
+            self.convert_ranges(ranges)
 
         # Add previously converted images to output
         for range_not_to_make in self.ranges_not_to_make:
@@ -200,55 +305,106 @@ class hdf5_to_cbf_converter(object):
                 run_process((command, self.verbose))
 
             self.output_images.append(img)
+            if self.callback:
+                self.callback([img])
 
         else:
-            # One processor
-            if self.nproc == 1:
-                command = "%s %d:%d %s_" % (command0, start_image, end_image, os.path.join(self.output_dir, self.prefix))
-                run_process((command, self.verbose))
+            self.convert_ranges([(start_image, end_image)])
+        self.output_images.sort()
 
-            # Multiple processors
-            else:
-                #if active:
-                print "Employing multiple threads"
-
-                # Construct commands to run in parallel
-                number_of_images = end_image - start_image + 1
-                commands = []
-                iteration = 0
-
-                # In case the command may have single image to convert, run this...
-                if number_of_images < 2 * self.nproc:
-                    while iteration < number_of_images:
-                        img = "%s_%06d.cbf" % (os.path.join(self.output_dir, self.prefix), start_image)
-                        commands.append(("%s %d %s" % (command0, start_image, img), self.verbose))
-                        iteration += 1
-                        start_image += 1
-
-                # IF more than 1 image per processor
-                else:
-                    batch = int(number_of_images / self.nproc)
-                    final_batch = batch + (number_of_images % self.nproc)
-
-                    start = start_image
-                    stop = 0
-                    while iteration < self.nproc:
-                        if iteration == (self.nproc - 1) :
-                            batch = final_batch
-                        stop = start + batch -1
-                        commands.append(("%s %d:%d %s_" % (command0, start, stop, os.path.join(self.output_dir, self.prefix)), self.verbose))
-                        iteration += 1
-                        start = stop + 1
-
-                # Run in pool
-                pool = multiprocessing.Pool(processes=self.nproc)
-                pool.map_async(run_process, commands)
+    def split_range(self, start_image, end_image):
+        """Split a range of frames into chunks for the scheduler"""
+
+        number_of_images = end_image - start_image + 1
+
+        # Spread over the processors, in chunks small enough to stream results
+        if self.chunk_size:
+            chunk_size = self.chunk_size
+        else:
+            chunk_size = max(1, min(CHUNK_SIZE, -(-number_of_images // self.nproc)))
+
+        chunks = []
+        output_root = os.path.join(self.output_dir, self.prefix)
+        for start in range(start_image, end_image + 1, chunk_size):
+            stop = min(start + chunk_size - 1, end_image)
+            chunks.append((self.master_file, start, stop, output_root, self.verbose))
+        return chunks
+
+    def convert_ranges(self, ranges):
+        """
+        Convert ranges of frames in chunks across nproc workers, passing each
+        chunk's CBF files to the callback as soon as it is finished
+        """
+
+        chunks = []
+        for start_image, end_image in ranges:
+            chunks.extend(self.split_range(start_image, end_image))
+
+        if self.verbose:
+            print "Converting %d chunks on %d processors" % (len(chunks), self.nproc)
+
+        # One processor
+        if self.nproc == 1 or len(chunks) == 1:
+            pool = None
+            results = imap(convert_chunk, chunks)
+        # Multiple processors - results in order of completion
+        else:
+            pool = multiprocessing.Pool(processes=min(self.nproc, len(chunks)))
+            results = pool.imap_unordered(convert_chunk, chunks)
+
+        try:
+            for images in results:
+                self.output_images.extend(images)
+                if self.callback:
+                    self.callback(images)
+        finally:
+            if pool:
                 pool.close()
                 pool.join()
 
-            self.output_images.extend(self.make_image_list(start_image, end_image))
         self.output_images.sort()
 
+    def follow_collection(self):
+        """
+        Convert frames as their data files are written, until all the
+        requested frames are converted or no new data arrives for
+        FOLLOW_TIMEOUT seconds
+        """
+
+        self.calculate_expected_files()
+        self.check_for_output_images()
+
+        # Frame numbers still to convert
+        pending = sorted(n for r in self.ranges_to_make for n in r)
+        for range_not_to_make in self.ranges_not_to_make:
+            self.output_images.extend(self.make_image_list(range_not_to_make[0], range_not_to_make[-1]))
+
+        last_progress = time.time()
+        while pending:
+
+            available = count_available_images(self.master_file, self.frames_per_data_file)
+            ready = [n for n in pending if n <= available]
+
+            if ready:
+                # Group into contiguous ranges
+                ranges = []
+                for k, g in groupby(enumerate(ready), lambda (i, x):i - x):
+                    group = map(itemgetter(1), g)
+                    ranges.append((group[0], group[-1]))
+                self.convert_ranges(ranges)
+
+                pending = [n for n in pending if n > available]
+                last_progress = time.time()
+
+            elif (time.time() - last_progress) > FOLLOW_TIMEOUT:
+                if self.verbose:
+                    print "No new data in %d seconds - stopping with %d frames unconverted" % \
+                        (FOLLOW_TIMEOUT, len(pending))
+                break
+
+            else:
+                time.sleep(FOLLOW_INTERVAL)
+
     def make_image_list(self, start, end):
         """Passback list with image file names"""
         l = []
@@ -408,6 +564,20 @@ def get_commandline():
                         default=multiprocessing.cpu_count() - 1,
                         help="Number of processors to be used")
 
+    # Follow a collection in progress
+    parser.add_argument("--follow",
+                        action="store_true",
+                        dest="follow",
+                        help="Convert frames as their data files are written during collection")
+
+    # Frames per data file when following
+    parser.add_argument("--frames_per_data_file",
+                        action="store",
+                        dest="frames_per_data_file",
+                        type=int,
+                        default=False,
+                        help="Frames in each data file when following (default read with h5py)")
+
     # Image numbers to convert
     parser.add_argument("-n", "--image_range",
                         action="store",
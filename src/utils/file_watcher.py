@@ -0,0 +1,192 @@
+"""
+Wait for files to appear, woken by inotify on Linux instead of polling
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-27"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# inotify events that mean a file has appeared
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event without the name
+EVENT_HEADER = struct.Struct("iIII")
+
+# Seconds between looks at the file system while watching. inotify does not
+# see files written from other hosts on network file systems, so this is no
+# slower than polling.
+RECHECK_INTERVAL = 1.0
+
+# Seconds between looks when there is no inotify
+POLL_INTERVAL = 1.0
+
+# File systems written from other hosts, where inotify sees nothing
+NETWORK_FILE_SYSTEMS = ("nfs", "nfs4", "gpfs", "lustre", "cifs", "smbfs", "smb3",
+                        "panfs", "beegfs", "glusterfs", "fuse.glusterfs", "ceph",
+                        "fuse.ceph", "fuse.sshfs", "afs", "ocfs2", "gfs2")
+
+MOUNTS_FILE = "/proc/mounts"
+
+def load_libc():
+    """Return libc if it has inotify, otherwise False"""
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return False
+    return libc
+
+LIBC = load_libc()
+
+def get_file_system(path, mounts_file=MOUNTS_FILE):
+    """Return the type of the file system path is on, or None if unknown"""
+
+    path = os.path.realpath(path)
+    best = None
+    try:
+        with open(mounts_file, "r") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Spaces in mount points are escaped as \040
+                mount_point = fields[1].replace("\\040", " ")
+                if path == mount_point or \
+                   path.startswith(mount_point.rstrip("/") + "/"):
+                    if best is None or len(mount_point) >= len(best[0]):
+                        best = (mount_point, fields[2])
+    except IOError:
+        return None
+    return best[1] if best else None
+
+def is_network_file_system(path, mounts_file=MOUNTS_FILE):
+    """Return True if path is on a file system inotify cannot watch"""
+
+    return get_file_system(path, mounts_file) in NETWORK_FILE_SYSTEMS
+
+class FileWatcher(object):
+    """
+    Watch a directory for files to appear
+
+    Uses inotify where there is one and the directory exists on a local
+    file system, and polls otherwise. Either way the file system is looked
+    at every recheck_interval seconds, so files are still found where
+    inotify misses them.
+    """
+
+    def __init__(self, directory, recheck_interval=RECHECK_INTERVAL):
+        """
+        Keyword arguments
+        directory -- directory to watch
+        recheck_interval -- most seconds between looks at the file system
+        """
+
+        self.directory = directory
+        self.recheck_interval = recheck_interval
+        self.fd = -1
+
+        if LIBC and not is_network_file_system(directory):
+            fd = LIBC.inotify_init()
+            if fd >= 0:
+                if LIBC.inotify_add_watch(fd, directory, WATCH_MASK) >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+
+        # No inotify - poll
+        if self.fd < 0:
+            self.recheck_interval = min(recheck_interval, POLL_INTERVAL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Stop watching"""
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for files to appear in the directory.
+        Returns the names of the files seen, which is empty when polling.
+        """
+
+        if self.fd < 0:
+            time.sleep(timeout)
+            return []
+
+        ready, __, __ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 65536)
+        names = []
+        offset = 0
+        while offset < len(data):
+            __, __, __, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.append(data[offset:offset+length].rstrip("\0"))
+            offset += length
+        return names
+
+    def wait_for(self, filename, timeout):
+        """
+        Wait up to timeout seconds for filename to exist.
+        Returns True if it does, False if timed out.
+        """
+
+        deadline = time.time() + timeout
+        while True:
+            if os.path.isfile(filename):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self.wait(min(remaining, self.recheck_interval))
+
+def wait_for_file(filename, timeout, recheck_interval=RECHECK_INTERVAL):
+    """
+    Wait up to timeout seconds for filename to exist.
+    Returns True if it does, False if timed out.
+    """
+
+    with FileWatcher(os.path.dirname(os.path.abspath(filename)), recheck_interval) as watcher:
+        return watcher.wait_for(filename, timeout)
@@ -51,7 +51,13 @@ __status__ = "Development"
 
 # Caches for data
 CIF_CACHE = "/tmp/rapd_cache/cif_files"
+# Most bytes of structure files kept in CIF_CACHE
+CIF_CACHE_SIZE = 2 * 1024**3
+# Analyses of search models, with the models split into chains
+MODEL_CACHE = "/tmp/rapd_cache/models"
 TEST_CACHE = "/tmp/rapd_cache/test_data"
+# Local index of PDB unit cells - build with python -m utils.cell_index
+CELL_INDEX = "/tmp/rapd_cache/cell_index.npz"
 
 # NE-CAT PDBQ Server
 # tries in order
@@ -0,0 +1,256 @@
+"""
+Direct access to Eiger HDF5 (NeXus) data sets - targeted header lookup, lazy
+frame reads and XDS input - so the data need not be converted to CBF
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-20"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import argparse
+import os
+import re
+import time
+
+try:
+    import h5py
+except ImportError:
+    h5py = False
+
+# Groups of the master file that hold header items, in the order they are
+# looked in. Nothing under /entry/data is touched, as those are links to the
+# data files.
+HEADER_GROUPS = (
+    "/entry/instrument/detector",
+    "/entry/instrument/detector/detectorSpecific",
+    "/entry/instrument/detector/goniometer",
+    "/entry/sample/goniometer",
+    "/entry/instrument/beam",
+    "/entry/sample/beam",
+    "/entry/instrument/monochromator",
+    )
+
+# Links to the data files in the master file
+DATA_GROUP = "/entry/data"
+DATA_LINK = re.compile(r"^data_\d{6}$")
+
+# Environmental variable with the path of the XDS HDF5 plugin (e.g. dectris-neggia.so)
+XDS_PLUGIN_VAR = "RAPD_XDS_HDF5_LIB"
+
+def read_header(file_name, keys):
+    """
+    Return a dict of the header items in keys from an HDF5 master file
+
+    Each item is looked up by path in HEADER_GROUPS, so only the datasets
+    asked for are read and the data files are never opened. Items that are
+    not found are left out.
+    """
+
+    header = {}
+
+    with h5py.File(file_name, "r") as h5_file:
+        for key in keys:
+            for group in HEADER_GROUPS:
+                item = h5_file.get("%s/%s" % (group, key))
+                if isinstance(item, h5py.Dataset):
+                    header[key] = item[()]
+                    break
+
+    return header
+
+def get_xds_plugin(site=False):
+    """
+    Return the path of the XDS HDF5 plugin library, or False if there is none.
+    The environmental variable wins over XDS_HDF5_LIB in the site.
+    """
+
+    plugin = os.environ.get(XDS_PLUGIN_VAR, False)
+    if not plugin and site:
+        plugin = getattr(site, "XDS_HDF5_LIB", False)
+
+    if plugin and os.path.isfile(plugin):
+        return plugin
+    return False
+
+def xds_input(master_file, plugin):
+    """
+    Return the XDS keywords that have XDS read the frames straight from the
+    HDF5 data set, as (keyword, value) tuples like the detector XDSINP
+    """
+
+    return [("NAME_TEMPLATE_OF_DATA_FRAMES", os.path.abspath(master_file)),
+            ("LIB", plugin)]
+
+class HDF5Frames(object):
+    """
+    Lazy, frame at a time access to the images of an HDF5 data set
+
+    Only the master file is opened up front. A data file is opened the first
+    time one of its frames is needed, and each read is a single frame - with
+    the one frame chunks the Eiger writes, a single chunk from disk. Frame
+    numbers start at 1, as the image numbers of the collection do.
+    """
+
+    def __init__(self, master_file):
+        """
+        Keyword arguments
+        master_file -- the _master.h5 file of the data set
+        """
+
+        if not h5py:
+            raise ImportError("h5py is needed to read HDF5 data")
+
+        self.master_file = master_file
+        self.h5_file = h5py.File(master_file, "r")
+
+        # Data file links in order, and (first, last, dataset) of those opened
+        self.links = sorted(name for name in self.h5_file[DATA_GROUP].keys() \
+                            if DATA_LINK.match(name))
+        self.ranges = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        """Number of frames in the data set"""
+
+        specific = "/entry/instrument/detector/detectorSpecific/"
+        nimages = self.h5_file.get(specific + "nimages")
+        ntrigger = self.h5_file.get(specific + "ntrigger")
+        if nimages is not None:
+            return int(nimages[()]) * (int(ntrigger[()]) if ntrigger is not None else 1)
+
+        # Have to open all the data files
+        while self.open_next():
+            pass
+        return self.ranges[-1][1] if self.ranges else 0
+
+    def __getitem__(self, frame):
+        return self.frame(frame)
+
+    def close(self):
+        """Close the master file, and with it the data files"""
+
+        if self.h5_file:
+            self.h5_file.close()
+            self.h5_file = False
+            self.ranges = []
+
+    def open_next(self):
+        """
+        Open the next data file in the master file and note its frames.
+        Returns False when all are open or the next is not yet written.
+        """
+
+        if len(self.ranges) == len(self.links):
+            return False
+
+        try:
+            dataset = self.h5_file["%s/%s" % (DATA_GROUP, self.links[len(self.ranges)])]
+        except KeyError:
+            # External link to a file that is not there yet
+            return False
+
+        # The Eiger records the frame numbers of each file
+        first = dataset.attrs.get("image_nr_low")
+        last = dataset.attrs.get("image_nr_high")
+        if first is None or last is None:
+            first = self.ranges[-1][1] + 1 if self.ranges else 1
+            last = first + dataset.shape[0] - 1
+
+        self.ranges.append((int(first), int(last), dataset))
+        return True
+
+    def locate(self, frame):
+        """Return the dataset holding frame and the offset of frame in it"""
+
+        while True:
+            for first, last, dataset in self.ranges:
+                if first <= frame <= last:
+                    return dataset, frame - first
+            if not self.open_next():
+                raise IndexError("Frame %d not in %s" % (frame, self.master_file))
+
+    def frame(self, frame):
+        """Return frame as a numpy array"""
+
+        dataset, offset = self.locate(frame)
+        return dataset[offset]
+
+    def frames(self, start=1, end=False):
+        """Generate (frame number, numpy array) from start to end (default the last)"""
+
+        if not end:
+            end = len(self)
+
+        for frame in xrange(start, end+1):
+            yield frame, self.frame(frame)
+
+def get_commandline():
+    """
+    Grabs the commandline
+    """
+
+    # Parse the commandline arguments
+    commandline_description = "Read the header and frames of an HDF5 data set"
+    parser = argparse.ArgumentParser(description=commandline_description)
+
+    parser.add_argument(action="store",
+                        dest="master_file",
+                        help="HDF5 master file")
+
+    return parser.parse_args()
+
+def main(args):
+    """
+    The main process docstring
+    This function is called when this module is invoked from
+    the commandline
+    """
+
+    import detectors.detector_utils as detector_utils
+
+    start = time.time()
+    header = read_header(args.master_file, detector_utils.parameters_to_get)
+    print "Header read in %.3f s" % (time.time() - start)
+    for key in sorted(header.keys()):
+        print "%30s::%s" % (key, header[key])
+
+    with HDF5Frames(args.master_file) as frames:
+        start = time.time()
+        image = frames[1]
+        print "\n%d frames, frame 1 %s read in %.3f s" % (len(frames),
+                                                          image.shape,
+                                                          time.time() - start)
+
+if __name__ == "__main__":
+
+    # Get the commandline args
+    commandline_args = get_commandline()
+
+    # Execute code
+    main(args=commandline_args)
@@ -88,7 +88,7 @@ def write_command_script(target_file, command_line, shell="/bin/tcsh"):
 
     return target_file
 
-def get_site_tag(message, default_site):
+def get_site_tag(message, default_site=False):
     """Find and return the site_tag from the image header"""
     # Find site_tag from SNAP
     site_tag = False
@@ -103,6 +103,68 @@ def get_site_tag(message, default_site):
 
     return site_tag
 
+def get_retry(message, max_attempts):
+    """
+    Return message marked with one more failed launch, to go back on the
+    job list, or False if it has failed max_attempts times
+    """
+    attempts = message.get("launch_attempts", 0) + 1
+    if attempts >= max_attempts:
+        return False
+    retry = message.copy()
+    retry["launch_attempts"] = attempts
+    return retry
+
+def get_processing_list(job_list, launcher_id):
+    """
+    Return the name of the list holding the jobs launcher_id has taken off
+    job_list and not yet launched. Each launcher has its own.
+    """
+    return "%s:processing:%s" % (job_list, launcher_id)
+
+def recover_jobs(redis_db, job_list, launcher_id, target_list=False):
+    """
+    Move jobs left on the processing list of launcher_id, by an earlier
+    instance that stopped before launching them, onto target_list (default
+    job_list). Returns the number of jobs moved.
+    """
+    if not target_list:
+        target_list = job_list
+
+    return redis_db.rpoplpush_all(get_processing_list(job_list, launcher_id), target_list)
+
+def recover_all_jobs(redis_db, job_list, target_list=False):
+    """
+    Move the jobs left on the processing lists of every launcher of
+    job_list onto target_list (default job_list) - only for when all of
+    them have stopped. Returns the number of jobs moved.
+    """
+    if not target_list:
+        target_list = job_list
+
+    moved = 0
+    for processing_list in redis_db.keys(get_processing_list(job_list, "*")):
+        moved += redis_db.rpoplpush_all(processing_list, target_list)
+    return moved
+
+def prepare_command(message, settings):
+    """
+    Adjust message to the launcher in settings and write it to a command file
+    in the launch_dir. Returns the message, the site tag to launch it with
+    and the command file.
+    """
+    message = fix_command(message)
+
+    # Put the command into a file
+    command_file = write_command_file(os.path.join(settings["launch_dir"], 'command_files'),
+                                      message["command"],
+                                      message)
+
+    # Set the site tag from input
+    site_tag = get_site_tag(message).split('_')[0]
+
+    return message, site_tag, command_file
+
 def fix_command(message):
     """
     Adjust the command passed in in install-specific ways
@@ -29,6 +29,7 @@ __status__ = "Development"
 # Standard imports
 import fcntl
 import os
+import threading
 
 def lock_file(file_path):
     """
@@ -66,3 +67,82 @@ def close_lock_file():
     """Close the _file_handle handle."""
     _file_handle.close()
 
+class FileLock(object):
+    """
+    Exclusive lock on file_path, held against the other threads of this
+    process as well as other processes - fcntl locks alone are shared by
+    all the threads of a process. Used as a context manager:
+
+        with FileLock(path):
+            ...
+    """
+
+    # Lock for each path locked in this process
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, file_path, blocking=True):
+        """
+        Keyword arguments
+        file_path -- file to lock, created with its directory if needed
+        blocking -- wait for the lock (default True)
+        """
+
+        self.file_path = os.path.abspath(file_path)
+        self.blocking = blocking
+        self.file_handle = None
+
+        with FileLock._thread_locks_lock:
+            self.thread_lock = FileLock._thread_locks.setdefault(self.file_path,
+                                                                 threading.Lock())
+
+    def acquire(self):
+        """Take the lock, returning False if it is held and not blocking"""
+
+        if not self.thread_lock.acquire(self.blocking):
+            return False
+
+        try:
+            directory = os.path.dirname(self.file_path)
+            if not os.path.exists(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Made by someone else in the meantime
+                    if not os.path.isdir(directory):
+                        raise
+            self.file_handle = open(self.file_path, "a")
+            flags = fcntl.LOCK_EX
+            if not self.blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.lockf(self.file_handle, flags)
+        except IOError:
+            self.close()
+            return False
+        except:
+            self.close()
+            raise
+        return True
+
+    def release(self):
+        """Give up the lock"""
+
+        if self.file_handle:
+            fcntl.lockf(self.file_handle, fcntl.LOCK_UN)
+        self.close()
+
+    def close(self):
+        """Close the file and release the thread lock"""
+
+        if self.file_handle:
+            self.file_handle.close()
+            self.file_handle = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        if not self.acquire():
+            raise IOError("%s is locked" % self.file_path)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
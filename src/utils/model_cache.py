@@ -0,0 +1,186 @@
+"""
+A cache of the analysis of search models - their chains, residue counts and
+spacegroup - which depends only on the model, so it is done once rather than
+for every data set the model is tried against
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-13"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy
+
+# RAPD imports
+import utils.global_vars as rglobals
+from utils.lock import FileLock
+from utils.text import json
+
+# Bumped when the analysis changes, so older entries are not used
+VERSION = 1
+
+# Average mass of a residue in Da
+PROTEIN_RESIDUE_MW = 110
+NUCLEIC_RESIDUE_MW = 330
+
+# Matthews - solvent content is 1 - VM_FACTOR / Vm
+VM_FACTOR = 1.23
+
+# Solvent content the number of molecules is chosen to come closest to
+SOLVENT_CONTENT = 0.55
+
+# Bytes read at a time when hashing models
+BLOCK_SIZE = 1024**2
+
+# Keys of models by path, size and modification time
+_KEYS = {}
+
+# Caches by directory
+_CACHES = {}
+
+def get_model_key(struct_file):
+    """Return a key for the contents of struct_file"""
+
+    stat = os.stat(struct_file)
+    signature = (os.path.abspath(struct_file), stat.st_size, stat.st_mtime)
+    if signature not in _KEYS:
+        digest = hashlib.sha1()
+        with open(struct_file, "rb") as model_file:
+            for block in iter(lambda: model_file.read(BLOCK_SIZE), ""):
+                digest.update(block)
+        _KEYS[signature] = "%s_%d" % (digest.hexdigest(), VERSION)
+    return _KEYS[signature]
+
+def matthews(mw, volume, nsymops, solvent_content=SOLVENT_CONTENT):
+    """
+    Return arrays of the number of molecules in the asymmetric unit and the
+    solvent content for models of mass mw in Da, at once for all of them.
+    The number of molecules is the one with the solvent content closest to
+    solvent_content, and at least 1.
+
+    Keyword arguments
+    mw -- masses of the models
+    volume -- volume of the unit cell
+    nsymops -- symmetry operators of the spacegroup
+    solvent_content -- solvent content aimed for
+    """
+
+    mw = numpy.asarray(mw, dtype=numpy.float64)
+    known = mw > 0
+    # Vm of one molecule in the asymmetric unit
+    vm_one = float(volume) / (nsymops * numpy.where(known, mw, 1))
+
+    # Solvent content falls linearly with the molecules, so the closest is
+    # the rounded solution of 1 - VM_FACTOR * nmol / vm_one = solvent_content
+    nmol = numpy.where(known,
+                       numpy.maximum(numpy.rint(vm_one * (1 - solvent_content) / VM_FACTOR), 1),
+                       1)
+    solvent = numpy.where(known, 1 - VM_FACTOR * nmol / vm_one, 0)
+
+    return nmol.astype(int), numpy.round(solvent, 2)
+
+class ModelCache(object):
+    """
+    Analyses of search models by their contents, in a directory shared by
+    a site. Each entry is a directory with analysis.json and any files the
+    analysis made, such as the model split into chains.
+    """
+
+    def __init__(self, directory=None, logger=None):
+        """
+        Keyword arguments
+        directory -- directory of the cache (default global_vars.MODEL_CACHE)
+        logger -- logger instance
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+        self.directory = directory or rglobals.MODEL_CACHE
+
+    def get_entry(self, struct_file):
+        """Return the directory of the entry of struct_file"""
+
+        return os.path.join(self.directory, get_model_key(struct_file))
+
+    def lookup(self, struct_file):
+        """Return the analysis of struct_file, or False if it has not been made"""
+
+        try:
+            with open(os.path.join(self.get_entry(struct_file), "analysis.json")) as json_file:
+                return json.loads(json_file.read())
+        except (IOError, OSError, ValueError):
+            return False
+
+    def get(self, struct_file, analyze):
+        """
+        Return the analysis of struct_file, made by calling
+        analyze(struct_file, directory) if it is not in the cache. analyze
+        returns a dict and writes any files it makes to directory, naming
+        them in the dict relative to it.
+        """
+
+        analysis = self.lookup(struct_file)
+        if analysis:
+            return analysis
+
+        entry = self.get_entry(struct_file)
+        with FileLock(entry + ".lock"):
+            # Made while waiting for the lock
+            analysis = self.lookup(struct_file)
+            if analysis:
+                return analysis
+
+            self.logger.debug("Analyzing %s for the model cache", struct_file)
+            # Made aside and moved in, so a failed analysis leaves nothing
+            temp_dir = tempfile.mkdtemp(prefix=os.path.basename(entry), dir=self.directory)
+            try:
+                analysis = analyze(struct_file, temp_dir)
+                with open(os.path.join(temp_dir, "analysis.json"), "w") as json_file:
+                    json_file.write(json.dumps(analysis))
+                if os.path.exists(entry):
+                    shutil.rmtree(entry)
+                os.rename(temp_dir, entry)
+            finally:
+                if os.path.exists(temp_dir):
+                    shutil.rmtree(temp_dir)
+
+        return analysis
+
+    def copy_file(self, struct_file, file_name, destination):
+        """Copy file_name of the entry of struct_file to destination"""
+
+        shutil.copyfile(os.path.join(self.get_entry(struct_file), file_name), destination)
+        return destination
+
+def get_cache(logger=None):
+    """Return the ModelCache of the site"""
+
+    directory = rglobals.MODEL_CACHE
+    if directory not in _CACHES:
+        _CACHES[directory] = ModelCache(directory, logger=logger)
+    return _CACHES[directory]
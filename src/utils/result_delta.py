@@ -0,0 +1,245 @@
+"""
+Versioned delta protocol for plugin results - plugins send the parts of their
+results that changed since the last message, and full snapshots only when
+the state of the process changes
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-06-29"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import copy
+
+# Keys sent whole in every message, as they route and describe it
+ROUTING_KEYS = ("process", "plugin")
+
+# Result entries with files to upload - a change to these is sent as a snapshot
+FILE_PATHS = ("results.archive_files", "results.data_produced", "results.for_display")
+
+# Most deltas sent in a row - a delta dropped for a stale base is made good
+# by the next snapshot at the latest
+SNAPSHOT_INTERVAL = 10
+
+# A snapshot is the results dict as plugins have always sent it, with a
+# "sequence" number added. A delta is
+#     {"process":..., "plugin":...,
+#      "delta":{"sequence":n, "base":m, "set":{path:value}, "unset":[path]}}
+# where paths are dotted, as in MongoDB, and base is the sequence of the
+# message the delta is relative to. A delta only applies to a document at
+# sequence base.
+
+def is_delta(message):
+    """Return True if message is a delta"""
+
+    return "delta" in message
+
+def diff(old, new, prefix=""):
+    """
+    Return (set, unset) - a dict of dotted paths to the values that differ
+    in new and a list of the paths that are gone from new. Dicts are
+    descended into, anything else is replaced whole.
+    """
+
+    set_paths = {}
+    unset_paths = []
+
+    for key, value in new.iteritems():
+        path = prefix + key
+        if key not in old:
+            set_paths[path] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict) and \
+             not any("." in sub_key or sub_key.startswith("$") for sub_key in value):
+            sub_set, sub_unset = diff(old[key], value, path+".")
+            set_paths.update(sub_set)
+            unset_paths.extend(sub_unset)
+        elif value != old[key]:
+            set_paths[path] = value
+
+    for key in old:
+        if key not in new:
+            unset_paths.append(prefix + key)
+
+    return set_paths, unset_paths
+
+def is_under(path, parent):
+    """Return True if path is parent or below it"""
+
+    return path == parent or path.startswith(parent+".")
+
+def set_path(document, path, value):
+    """Set the dotted path in document to value, making dicts on the way"""
+
+    keys = path.split(".")
+    for key in keys[:-1]:
+        if not isinstance(document.get(key), dict):
+            document[key] = {}
+        document = document[key]
+    document[keys[-1]] = value
+
+def unset_path(document, path):
+    """Remove the dotted path from document, if it is there"""
+
+    keys = path.split(".")
+    for key in keys[:-1]:
+        document = document.get(key)
+        if not isinstance(document, dict):
+            return
+    document.pop(keys[-1], None)
+
+def apply_delta(document, delta):
+    """Apply a delta message to a snapshot document in place"""
+
+    for path in delta["delta"]["unset"]:
+        unset_path(document, path)
+    for path, value in delta["delta"]["set"].iteritems():
+        set_path(document, path, value)
+    for key in ROUTING_KEYS:
+        document[key] = delta[key]
+    document["sequence"] = delta["delta"]["sequence"]
+
+def merge_deltas(older, newer):
+    """
+    Return one delta message with the effect of older then newer. The paths
+    of the result are kept apart, so it is a valid MongoDB update.
+    """
+
+    set_paths = dict(older["delta"]["set"])
+    unset_paths = list(older["delta"]["unset"])
+
+    for path in newer["delta"]["unset"]:
+        for old_path in set_paths.keys():
+            if is_under(old_path, path):
+                del set_paths[old_path]
+        unset_paths = [old_path for old_path in unset_paths if not is_under(old_path, path)]
+        unset_paths.append(path)
+
+    for path, value in newer["delta"]["set"].iteritems():
+        for old_path in set_paths.keys():
+            if is_under(old_path, path):
+                del set_paths[old_path]
+        unset_paths = [old_path for old_path in unset_paths if not is_under(old_path, path)]
+
+        # Below a path already set - set inside its value
+        for old_path in set_paths:
+            if is_under(path, old_path):
+                parent = copy.deepcopy(set_paths[old_path]) \
+                         if isinstance(set_paths[old_path], dict) else {}
+                set_path(parent, path[len(old_path)+1:], value)
+                set_paths[old_path] = parent
+                break
+        else:
+            # Below a path unset - the parent becomes a new dict
+            for old_path in unset_paths:
+                if is_under(path, old_path):
+                    unset_paths.remove(old_path)
+                    parent = {}
+                    set_path(parent, path[len(old_path)+1:], value)
+                    set_paths[old_path] = parent
+                    break
+            else:
+                set_paths[path] = value
+
+    merged = dict((key, newer[key]) for key in ROUTING_KEYS)
+    merged["delta"] = {"sequence":newer["delta"]["sequence"],
+                       "base":older["delta"]["base"],
+                       "set":set_paths,
+                       "unset":unset_paths}
+    return merged
+
+def coalesce(older, newer):
+    """
+    Return one message with the effect of older then newer, both for the
+    same result
+    """
+
+    if not is_delta(newer):
+        return newer
+
+    if is_delta(older):
+        return merge_deltas(older, newer)
+
+    snapshot = copy.deepcopy(older)
+    apply_delta(snapshot, newer)
+    return snapshot
+
+class ResultSender(object):
+    """
+    Turns the results of a plugin into the messages to send for them
+
+    The first message is a snapshot, as is any message where the process
+    status has changed or files have been added to the results, and one
+    after every snapshot_interval deltas. Others are deltas from the message
+    before.
+    """
+
+    def __init__(self, snapshot_interval=SNAPSHOT_INTERVAL):
+
+        self.snapshot_interval = snapshot_interval
+        self.sequence = 0
+        self.deltas = 0
+        self.sent = None
+
+    def snapshot(self, results):
+        """Return a snapshot message for results and remember it"""
+
+        self.sequence += 1
+        self.deltas = 0
+        self.sent = copy.deepcopy(results)
+        message = copy.copy(results)
+        message["sequence"] = self.sequence
+        return message
+
+    def prepare(self, results):
+        """Return the message to send for results"""
+
+        if self.sent is None or \
+           self.deltas >= self.snapshot_interval or \
+           results.get("process", {}).get("status") != self.sent.get("process", {}).get("status"):
+            return self.snapshot(results)
+
+        old = dict((key, value) for key, value in self.sent.iteritems() if key not in ROUTING_KEYS)
+        new = dict((key, value) for key, value in results.iteritems() if key not in ROUTING_KEYS)
+        set_paths, unset_paths = diff(old, new)
+
+        for path in set_paths.keys() + unset_paths:
+            if any(is_under(path, file_path) or is_under(file_path, path) for file_path in FILE_PATHS):
+                return self.snapshot(results)
+
+        self.sequence += 1
+        self.deltas += 1
+        message = dict((key, results.get(key)) for key in ROUTING_KEYS)
+        message["delta"] = {"sequence":self.sequence,
+                            "base":self.sequence - 1,
+                            "set":set_paths,
+                            "unset":unset_paths}
+
+        # Remember what was sent - only the changed values are copied
+        for path in unset_paths:
+            unset_path(self.sent, path)
+        for path, value in set_paths.iteritems():
+            set_path(self.sent, path, copy.deepcopy(value))
+        for key in ROUTING_KEYS:
+            self.sent[key] = copy.deepcopy(results.get(key))
+
+        return message
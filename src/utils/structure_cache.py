@@ -0,0 +1,320 @@
+"""
+A cache of structure files from the PDB shared by the jobs of a site, so
+each is fetched once rather than into the directory of every job
+"""
+
+__license__ = """
+This file is part of RAPD
+
+Copyright (C) 2018, Cornell University
+All rights reserved.
+
+RAPD is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, version 3.
+
+RAPD is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+__created__ = "2018-07-12"
+__maintainer__ = "Frank Murphy"
+__email__ = "fmurphy@anl.gov"
+__status__ = "Development"
+
+# Standard imports
+import gzip
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import shlex
+import shutil
+from StringIO import StringIO
+import threading
+import time
+
+# RAPD imports
+import utils.global_vars as rglobals
+from utils.lock import FileLock
+from utils.text import json
+
+# Seconds before an entry is fetched again, to pick up new revisions
+MAX_AGE = 30 * 24 * 3600
+
+# Downloads made at once when prefetching
+PREFETCH_THREADS = 8
+
+# Start of gzip data
+GZIP_MAGIC = "\x1f\x8b"
+
+# The revision history of an mmCIF file
+REVISION_CATEGORY = "_pdbx_audit_revision_history."
+
+# Caches by directory
+_CACHES = {}
+
+def get_revision(lines):
+    """
+    Return the latest revision ("major.minor") in the lines of an mmCIF
+    file, or None if it has no revision history
+    """
+
+    fields = []
+    values = {}
+    rows = []
+    in_category = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith(REVISION_CATEGORY):
+            in_category = True
+            parts = stripped.split(None, 1)
+            name = parts[0][len(REVISION_CATEGORY):]
+            # A single revision has its value on the line, a loop of them not
+            if len(parts) > 1:
+                values[name] = parts[1].strip("'\"")
+            else:
+                fields.append(name)
+        elif in_category:
+            if stripped in ("", "#", "loop_") or stripped.startswith("_"):
+                break
+            try:
+                rows.append(shlex.split(stripped))
+            except ValueError:
+                continue
+
+    if values:
+        records = [values]
+    else:
+        records = [dict(zip(fields, row)) for row in rows if len(row) == len(fields)]
+
+    latest = None
+    for record in records:
+        try:
+            revision = (int(record["major_revision"]), int(record["minor_revision"]))
+        except (KeyError, ValueError):
+            continue
+        if latest is None or revision > latest:
+            latest = revision
+
+    if latest is None:
+        return None
+    return "%d.%d" % latest
+
+class StructureCache(object):
+    """
+    Structure files by PDB code, kept gzipped in a directory shared by a
+    site and laid out like the divided PDB (ab/1abc.cif.gz). Each entry
+    records the revision it holds. Entries are fetched under a lock, so
+    jobs wanting the same file share one download, and the least recently
+    used are removed when the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=None, max_age=MAX_AGE, logger=None):
+        """
+        Keyword arguments
+        directory -- directory of the cache (default global_vars.CIF_CACHE)
+        max_bytes -- most bytes kept (default global_vars.CIF_CACHE_SIZE)
+        max_age -- seconds before an entry is fetched again
+        logger -- logger instance
+        """
+
+        self.logger = logger or logging.getLogger("RAPDLogger")
+        self.directory = directory or rglobals.CIF_CACHE
+        if max_bytes is None:
+            max_bytes = getattr(rglobals, "CIF_CACHE_SIZE", 0)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def get_path(self, pdb_code, kind="cif"):
+        """Return the path of the gzipped file of pdb_code in the cache"""
+
+        pdb_code = pdb_code.lower()
+        return os.path.join(self.directory, pdb_code[1:3], "%s.%s.gz" % (pdb_code, kind))
+
+    def get_info(self, path):
+        """Return the information saved with the entry at path, or False"""
+
+        try:
+            with open(path + ".json", "r") as info_file:
+                return json.loads(info_file.read())
+        except (IOError, ValueError):
+            return False
+
+    def is_current(self, path, revision=None):
+        """
+        Return True if the entry at path can be used - it is there, not
+        too old, and holds revision if one is given
+        """
+
+        if not os.path.exists(path):
+            return False
+        info = self.get_info(path)
+        if not info:
+            return False
+        if revision is not None:
+            return info.get("revision") == revision
+        return time.time() - info.get("fetched", 0) < self.max_age
+
+    def fetch(self, pdb_code, fetcher, kind="cif", revision=None):
+        """
+        Make sure the cache holds pdb_code, calling fetcher(pdb_code) for
+        its contents if not. Returns the path of the entry, or False if it
+        could not be fetched.
+
+        Keyword arguments
+        pdb_code -- PDB code
+        fetcher -- function returning the file for a PDB code, gzipped or
+                   not, or False
+        kind -- "cif" or "pdb"
+        revision -- revision wanted, if known
+        """
+
+        path = self.get_path(pdb_code, kind)
+        with FileLock(path + ".lock"):
+            if self.is_current(path, revision):
+                return path
+
+            self.logger.debug("Fetching %s.%s for the structure cache", pdb_code, kind)
+            try:
+                data = fetcher(pdb_code)
+            except Exception as error:
+                self.logger.exception(error)
+                data = False
+            if not data:
+                # An older revision is better than nothing
+                if os.path.exists(path):
+                    return path
+                return False
+
+            self.store(path, data, kind)
+
+        self.evict()
+        return path
+
+    def store(self, path, data, kind):
+        """Write data gzipped to path, with what is known about it"""
+
+        if not data.startswith(GZIP_MAGIC):
+            compressed = StringIO()
+            with gzip.GzipFile(fileobj=compressed, mode="wb") as gzip_file:
+                gzip_file.write(data)
+            data = compressed.getvalue()
+
+        revision = None
+        if kind == "cif":
+            revision = get_revision(gzip.GzipFile(fileobj=StringIO(data)))
+
+        # Several threads of a process may store at once
+        temp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+        with open(temp_path, "wb") as cache_file:
+            cache_file.write(data)
+        os.rename(temp_path, path)
+        with open(temp_path, "w") as info_file:
+            info_file.write(json.dumps({"revision":revision,
+                                        "fetched":time.time(),
+                                        "size":len(data)}))
+        os.rename(temp_path, path + ".json")
+
+    def get(self, pdb_code, fetcher, destination, kind="cif", revision=None):
+        """
+        Write the file of pdb_code, uncompressed, to destination. Returns
+        destination, or False if the file could not be had.
+        """
+
+        path = self.fetch(pdb_code, fetcher, kind, revision)
+        if not path:
+            return False
+
+        with FileLock(path + ".lock"):
+            # Gone between fetching and reading
+            if not os.path.exists(path):
+                return False
+            temp_path = "%s.%d.%d.tmp" % (destination,
+                                          os.getpid(),
+                                          threading.current_thread().ident)
+            with gzip.open(path, "rb") as gzip_file:
+                with open(temp_path, "wb") as output_file:
+                    shutil.copyfileobj(gzip_file, output_file)
+            os.rename(temp_path, destination)
+            # Recently used
+            os.utime(path, None)
+
+        return destination
+
+    def prefetch(self, pdb_codes, fetcher, kind="cif", threads=PREFETCH_THREADS):
+        """
+        Fetch the files of pdb_codes that are not cached, several at once.
+        Returns a dict of the path of each code, False for those not fetched.
+        """
+
+        pdb_codes = list(set(pdb_codes))
+        if not pdb_codes:
+            return {}
+
+        pool = ThreadPool(min(threads, len(pdb_codes)))
+        try:
+            paths = pool.map(lambda pdb_code: self.fetch(pdb_code, fetcher, kind), pdb_codes)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(pdb_codes, paths))
+
+    def get_entries(self):
+        """Return a list of (last used, size, path) of the entries in the cache"""
+
+        entries = []
+        for directory, __, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if not file_name.endswith(".gz"):
+                    continue
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries while the cache is too big"""
+
+        if not self.max_bytes:
+            return []
+
+        entries = self.get_entries()
+        total = sum(size for __, size, __ in entries)
+        if total <= self.max_bytes:
+            return []
+
+        removed = []
+        for __, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # Skip entries being fetched or read
+            lock = FileLock(path + ".lock", blocking=False)
+            if not lock.acquire():
+                continue
+            try:
+                for remove_path in (path, path + ".json"):
+                    if os.path.exists(remove_path):
+                        os.unlink(remove_path)
+            finally:
+                lock.release()
+            total -= size
+            removed.append(path)
+
+        self.logger.debug("Removed %d files from the structure cache", len(removed))
+        return removed
+
+def get_cache(logger=None):
+    """Return the StructureCache of the site"""
+
+    directory = rglobals.CIF_CACHE
+    if directory not in _CACHES:
+        _CACHES[directory] = StructureCache(directory, logger=logger)
+    return _CACHES[directory]
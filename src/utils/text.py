@@ -1,9 +1,9 @@
-from bson import json_util
 from bson.objectid import ObjectId
-import json as system_json
 import sys
 from collections import OrderedDict
 
+import utils.codec as codec
+
 black = "\033[30m"
 red = "\033[31m"
 green = "\033[32m"
@@ -41,13 +41,22 @@ class json(object):
     @staticmethod
     def dumps(input):
         """Just like json.dumps"""
-        return system_json.dumps(input, default=json_util.default)
+        return codec.dumps(input)
 
     @staticmethod
     def loads(input):
         """Just like json.loads"""
-        # return system_json.loads(input, object_hook=json_util.object_hook, object_pairs_hook=OrderedDict)
-        return system_json.loads(input, object_hook=json_util.object_hook)
+        return codec.loads(input)
+
+    @staticmethod
+    def pack(input, encoded=None):
+        """Encode for Redis lists only RAPD reads - may be binary"""
+        return codec.pack(input, encoded)
+
+    @staticmethod
+    def unpack(input):
+        """Decode what pack or dumps made"""
+        return codec.unpack(input)
 
 if __name__ == "__main__":
 